@@ -0,0 +1,93 @@
+'''
+    Benchmark of booking many trips one request at a time (`POST /api/book`)
+    vs in batches (`POST /api/book/batch`), and of the total pickup distance
+    in the sequential and optimal batch modes.
+
+    Requests are sent to the application in-process (FastAPI TestClient), so the numbers
+    include request validation and serialization, but not the network.
+    Run it with:
+        python -m benchmarks.batch_booking --cars 1000 --trips 2000 --batch-size 50
+'''
+import argparse
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+import main as service
+from models.time import Time
+from models.taxi_park import create_taxi_park
+
+
+def random_point(world_size):
+    return {'x': random.randint(-world_size, world_size), 'y': random.randint(-world_size, world_size)}
+
+
+def fresh_world(cars, world_size, seed):
+    '''
+        Replaces the global state of the application with N cars spread across the world
+    '''
+
+    random.seed(seed)
+
+    service.time = Time()
+    service.taxi_park = create_taxi_park(service.time)
+    service.taxi_park.populate_with_n_cars(cars)
+
+    # spreading the cars, so they don't all start at the origin
+    client = TestClient(service.app)
+    trips = [{'source': random_point(world_size), 'destination': random_point(world_size)} for _ in range(cars)]
+    client.post('/api/book/batch', json={'trips': trips})
+    service.time.tick(10 * world_size)
+
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--trips', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--world-size', type=int, default=10000, help="points are placed within [-size, size]")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed + 1)
+    trips = [
+        {'source': random_point(args.world_size), 'destination': random_point(args.world_size)}
+        for _ in range(args.trips)
+    ]
+    batches = [trips[i:i + args.batch_size] for i in range(0, len(trips), args.batch_size)]
+
+    def pickup_time(result, trip):
+        return result['total_time'] - (
+            abs(trip['source']['x'] - trip['destination']['x']) + abs(trip['source']['y'] - trip['destination']['y'])
+        )
+
+    print(f"{'mode':>10} {'trips/s':>10} {'booked':>8} {'mean pickup':>12}")
+
+    runs = [('serial', None), ('sequential', False), ('optimal', True)]
+    for (name, optimal) in runs:
+        client = fresh_world(args.cars, args.world_size, args.seed)
+
+        results = []
+        started = time.perf_counter()
+        for batch in batches:
+            if optimal is None:
+                results.extend(client.post('/api/book', json=trip).json() for trip in batch)
+            else:
+                response = client.post('/api/book/batch', json={'trips': batch, 'optimal': optimal})
+                results.extend(response.json()['results'])
+
+            # time passes between the batches, so some cars get free again
+            service.time.tick(args.world_size // 10)
+        elapsed = time.perf_counter() - started
+
+        booked = [(result, trip) for (result, trip) in zip(results, trips) if 'car_id' in result]
+        mean_pickup = sum(pickup_time(result, trip) for (result, trip) in booked) / max(len(booked), 1)
+
+        print(f"{name:>10} {len(trips) / elapsed:>10.0f} {len(booked):>8} {mean_pickup:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+    Load test of `POST /api/book` with the regular (pydantic) and the fast path.
+
+    Starts the service with uvicorn for every mode, sends bookings one after another
+    over a single keep-alive connection and reports requests per second.
+    Run it with:
+        python -m benchmarks.book_rps --requests 5000
+'''
+import argparse
+import http.client
+import json
+import random
+import time
+
+from .common import running_service
+
+
+def run(fast_book, args):
+    with running_service(args.port, FAST_BOOK=str(fast_book).lower(), NUM_CARS=args.cars):
+        random.seed(args.seed)
+        bodies = [
+            json.dumps({
+                'source': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+                'destination': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+            })
+            for _ in range(args.requests)
+        ]
+        headers = {'Content-Type': 'application/json'}
+
+        connection = http.client.HTTPConnection('127.0.0.1', args.port)
+        booking_time = 0
+        for (i, body) in enumerate(bodies):
+            started = time.perf_counter()
+            connection.request('POST', '/api/book', body=body, headers=headers)
+            connection.getresponse().read()
+            booking_time += time.perf_counter() - started
+
+            # letting some time pass, so cars keep getting free
+            if i % args.tick_every == 0:
+                connection.request('POST', '/api/tick')
+                connection.getresponse().read()
+
+        return args.requests / booking_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--cars', type=int, default=3)
+    parser.add_argument('--tick-every', type=int, default=5, help="send a tick after every N bookings")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'req/s':>8}")
+    for fast_book in (False, True):
+        print(f"{'fast' if fast_book else 'regular':>8} {run(fast_book, args):>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+    Helpers shared by the benchmarks: car placement, statistics, results and running the service.
+'''
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from models.time import Time
+from models.car import Car
+from models.data import Location
+from models.taxi_park import TaxiPark, create_taxi_park
+from models.spatial_index import GridIndex, create_index
+
+
+def uniform(n, world_size):
+    return [(random.randint(-world_size, world_size), random.randint(-world_size, world_size)) for _ in range(n)]
+
+
+def clustered(n, world_size, clusters=10):
+    '''
+        Points around a few "city centers" (normally distributed with a tenth of the world size spread)
+    '''
+
+    centers = uniform(clusters, world_size)
+    spread = max(1, world_size // 10)
+
+    points = []
+    for _ in range(n):
+        (x, y) = random.choice(centers)
+        points.append((
+            min(max(int(random.gauss(x, spread)), -world_size), world_size),
+            min(max(int(random.gauss(y, spread)), -world_size), world_size),
+        ))
+
+    return points
+
+
+def origin(n, world_size):
+    # as it is right after `/api/reset`
+    return [(0, 0)] * n
+
+
+DISTRIBUTIONS = {
+    'uniform': uniform,
+    'clustered': clustered,
+    'origin': origin,
+}
+
+
+def build_park(
+    n, distribution='uniform', world_size=10 ** 6, fleet_store='objects', index=None, seed=42, metric=None,
+    future_dispatch=None, vehicles=None, pool_rides=None,
+):
+    '''
+        Creates a taxi park with N cars (IDs from 1 to N) placed according to the distribution
+        (with the given vehicle classes, one per car, or all of them sedans)
+    '''
+
+    random.seed(seed)
+
+    time = Time()
+    if fleet_store == 'objects' and index == 'grid':
+        # picking the cell size, so there is about one car per cell when cars are spread uniformly
+        cell_size = max(1, int(2 * world_size / max(n, 1) ** 0.5))
+        taxi_park = TaxiPark(
+            time, index=GridIndex(cell_size, metric=metric), future_dispatch=future_dispatch, pool_rides=pool_rides,
+        )
+    elif fleet_store == 'objects':
+        taxi_park = TaxiPark(
+            time, index=create_index(index, metric=metric), future_dispatch=future_dispatch, pool_rides=pool_rides,
+        )
+    else:
+        taxi_park = create_taxi_park(time, fleet_store, metric=metric, future_dispatch=future_dispatch)
+
+    for (car_id, (x, y)) in enumerate(DISTRIBUTIONS[distribution](n, world_size), start=1):
+        taxi_park.add_car(Car(car_id, location=Location(x=x, y=y), vehicle=vehicles and vehicles[car_id - 1]))
+
+    return taxi_park
+
+
+def percentile(values, q):
+    '''
+        Returns q-th percentile (0 <= q <= 100) of the values (nearest rank method)
+    '''
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def latency_stats(latencies):
+    '''
+        Summary of latencies given in seconds (reported in microseconds)
+    '''
+
+    return {
+        'count': len(latencies),
+        'mean_us': sum(latencies) / len(latencies) * 10 ** 6 if latencies else None,
+        'p50_us': percentile(latencies, 50) * 10 ** 6 if latencies else None,
+        'p99_us': percentile(latencies, 99) * 10 ** 6 if latencies else None,
+    }
+
+
+def write_results(path, benchmark, params, results):
+    '''
+        Writes results of a benchmark run as JSON, together with parameters of the run
+        and information about the environment, so different runs can be compared later
+    '''
+
+    report = {
+        'benchmark': benchmark,
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def wait_until_ready(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/api')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError("Service hasn't started in time")
+
+
+@contextlib.contextmanager
+def running_service(port, workers=1, **env):
+    '''
+        Runs the service with uvicorn in a separate process for the duration of the block
+        Params:
+        - port (int): port to listen on
+        - workers (int): number of uvicorn worker processes
+        - env: settings to override, e.g. NUM_CARS=1000
+    '''
+
+    env = dict(os.environ, **{name: str(value) for (name, value) in env.items()})
+    server = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning',
+            '--workers', str(workers),
+        ],
+        env=env,
+    )
+
+    try:
+        wait_until_ready(port)
+        yield
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@contextlib.contextmanager
+def running_fleet_server(socket_path, cars, timeout=10):
+    '''
+        Runs the shared fleet state process (see fleet_server.py) for the duration of the block
+    '''
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = subprocess.Popen([sys.executable, '-m', 'fleet_server', '--socket', socket_path, '--cars', str(cars)])
+
+    try:
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(socket_path):
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fleet state process hasn't started in time")
+            time.sleep(0.1)
+
+        yield
+    finally:
+        server.terminate()
+        server.wait()
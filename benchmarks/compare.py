@@ -0,0 +1,77 @@
+'''
+    Compares two JSON reports written by `benchmarks.park` or `benchmarks.workload`
+    (e.g. before and after a change) and reports latencies which got worse by more than a threshold.
+    Exits with code 1 when a regression is found, so it can be used in CI.
+    Run it with:
+        python -m benchmarks.compare before.json after.json --threshold 10
+'''
+import argparse
+import json
+import sys
+
+
+# fields of the `benchmarks.park` results which identify a single measurement
+PARK_KEY = ('cars', 'distribution', 'fleet_store', 'index', 'operation')
+
+
+def latencies(report):
+    '''
+        Flattens results of a report into {name of the measurement: stats}
+    '''
+
+    if report['benchmark'] == 'park':
+        return {
+            ' '.join(str(result[field]) for field in PARK_KEY): result
+            for result in report['results']
+        }
+
+    if report['benchmark'] == 'workload':
+        return report['results']['endpoints']
+
+    raise ValueError(f"Don't know how to compare results of '{report['benchmark']}' benchmark")
+
+
+def compare(before, after, threshold, metric='p99_us'):
+    '''
+        Returns list of tuples (name, before, after, change in %, whether it is a regression)
+        for every measurement present in both reports
+    '''
+
+    (before, after) = (latencies(before), latencies(after))
+
+    changes = []
+    for (name, stats) in after.items():
+        if name not in before or not before[name][metric] or stats[metric] is None:
+            continue
+
+        change = (stats[metric] / before[name][metric] - 1) * 100
+        changes.append((name, before[name][metric], stats[metric], change, change > threshold))
+
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--metric', default='p99_us', choices=['mean_us', 'p50_us', 'p99_us'])
+    parser.add_argument('--threshold', type=float, default=10, help="allowed slowdown, in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    changes = compare(before, after, args.threshold, args.metric)
+
+    print(f"{'measurement':<50} {'before':>10} {'after':>10} {'change':>8}")
+    for (name, old, new, change, regressed) in changes:
+        print(f"{name:<50} {old:>10.1f} {new:>10.1f} {change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+    if any(regressed for (*_, regressed) in changes):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
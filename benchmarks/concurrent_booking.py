@@ -0,0 +1,171 @@
+'''
+    Stress test of booking from many threads at once: optimistic claim-and-retry (ConcurrentTaxiPark)
+    vs a single global lock around `TaxiPark.book_closest`.
+
+    Fires the bookings from a thread pool (with ticks from a separate thread, so cars keep getting free),
+    checks that no car has been given two overlapping trips and reports bookings per second
+    and how many claims had to be retried.
+    Run it with:
+        python -m benchmarks.concurrent_booking --cars 10000 --bookings 20000 --threads 1 8 32
+'''
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from models.time import Time
+from models.car import Car
+from models.data import Location
+from models.taxi_park import TaxiPark
+from models.concurrent_taxi_park import ConcurrentTaxiPark
+from models.spatial_index import create_index
+from .common import write_results
+
+
+class LockedTaxiPark(TaxiPark):
+    '''
+        Baseline: every booking and tick holds a single global lock
+    '''
+
+    def __init__(self, time, index=None):
+        self._global_lock = threading.RLock()
+        super().__init__(time, index=index)
+
+    def release_finished(self, current_time):
+        with self._global_lock:
+            return super().release_finished(current_time)
+
+    def book_closest(self, src, dst):
+        with self._global_lock:
+            return super().book_closest(src, dst)
+
+
+class RecordingCar(Car):
+    '''
+        Car which logs every trip it takes as (car_id, started, finished)
+    '''
+
+    def __init__(self, car_id, location, trips):
+        super().__init__(car_id, location=location)
+        self.trips = trips
+
+    def book(self, src, dst, current_time, dist_to_client):
+        trip_time = super().book(src, dst, current_time, dist_to_client)
+        self.trips.append((self.car_id, current_time, current_time + trip_time))
+
+        return trip_time
+
+
+def build_park(kind, n, world_size, index, trips):
+    random.seed(42)
+
+    park_class = ConcurrentTaxiPark if kind == 'optimistic' else LockedTaxiPark
+    taxi_park = park_class(Time(), index=create_index(index))
+    for car_id in range(1, n + 1):
+        location = Location(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        taxi_park.add_car(RecordingCar(car_id, location, trips))
+
+    return taxi_park
+
+
+def double_bookings(trips):
+    '''
+        Returns number of cars which were given trips overlapping in time
+    '''
+
+    by_car = defaultdict(list)
+    for (car_id, started, finished) in trips:
+        by_car[car_id].append((started, finished))
+
+    overlapping = 0
+    for intervals in by_car.values():
+        intervals.sort()
+        if any(nxt[0] < prev[1] for (prev, nxt) in zip(intervals, intervals[1:])):
+            overlapping += 1
+
+    return overlapping
+
+
+def run(kind, threads, args):
+    booked_trips = []
+    taxi_park = build_park(kind, args.cars, args.world_size, args.index, booked_trips)
+
+    random.seed(args.seed)
+    trips = [
+        (
+            Location(
+                x=random.randint(-args.world_size, args.world_size),
+                y=random.randint(-args.world_size, args.world_size),
+            ),
+            Location(
+                x=random.randint(-args.world_size, args.world_size),
+                y=random.randint(-args.world_size, args.world_size),
+            ),
+        )
+        for _ in range(args.bookings)
+    ]
+
+    stop = threading.Event()
+
+    def ticker():
+        while not stop.is_set():
+            taxi_park.time.tick(args.world_size // 10)
+            time.sleep(0.001)
+
+    ticking = threading.Thread(target=ticker)
+    ticking.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda trip: taxi_park.book_closest(*trip), trips))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    ticking.join()
+
+    return {
+        'kind': kind,
+        'threads': threads,
+        'bookings_per_s': args.bookings / elapsed,
+        'booked': len(booked_trips),
+        'double_booked_cars': double_bookings(booked_trips),
+        'retries': getattr(taxi_park, 'retries', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--index', default='grid', help="spatial index to use")
+    parser.add_argument('--world-size', type=int, default=10000, help="points are placed within [-size, size]")
+    parser.add_argument('--switch-interval', type=float, default=10 ** -5, help="how often threads switch (in seconds)")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # switching threads often makes races much more likely
+    sys.setswitchinterval(args.switch_interval)
+
+    results = []
+    print(f"{'kind':>10} {'threads':>8} {'bookings/s':>11} {'booked':>8} {'retries':>8} {'double booked':>14}")
+    for threads in args.threads:
+        for kind in ('locked', 'optimistic'):
+            result = run(kind, threads, args)
+            results.append(result)
+
+            print(
+                f"{kind:>10} {threads:>8} {result['bookings_per_s']:>11.0f} {result['booked']:>8} "
+                f"{result['retries']:>8} {result['double_booked_cars']:>14}"
+            )
+
+    if args.output:
+        write_results(args.output, 'concurrent_booking', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
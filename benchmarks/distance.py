@@ -0,0 +1,118 @@
+'''
+    Cost of the distance metrics (see models/distance.py):
+    - scoring all cars from a point one by one with `.distance` (a Python call per car)
+      vs at once with the batched `.scores` kernel
+    - latency of `find_closest` of every fleet store / spatial index with every metric
+    Run it with:
+        python -m benchmarks.distance --sizes 1000 100000 --metrics manhattan euclidean
+'''
+import argparse
+import random
+import time as timer
+
+import numpy as np
+
+from models.data import Point
+from models.distance import METRICS, Weighted, create_metric
+from .common import build_park, latency_stats, write_results
+
+
+STORES = {
+    'linear': {'fleet_store': 'objects', 'index': 'linear'},
+    'grid': {'fleet_store': 'objects', 'index': 'grid'},
+    'arrays': {'fleet_store': 'arrays'},
+    'sharded': {'fleet_store': 'sharded'},
+}
+
+
+def metric_by_name(name):
+    # weighted metric gets some uneven weights, so it's not just the manhattan one
+    return Weighted(1, 3) if name == 'weighted' else create_metric(name)
+
+
+def score_cars(metric, n, queries, world_size):
+    '''
+        Returns mean time (in seconds) of scoring N cars from a point per-object and with the kernel
+    '''
+
+    xs = np.random.randint(-world_size, world_size + 1, n, dtype=np.int64)
+    ys = np.random.randint(-world_size, world_size + 1, n, dtype=np.int64)
+    points = [Point(x, y) for (x, y) in zip(xs.tolist(), ys.tolist())]
+    sources = [
+        Point(random.randint(-world_size, world_size), random.randint(-world_size, world_size))
+        for _ in range(queries)
+    ]
+
+    started = timer.perf_counter()
+    for src in sources:
+        [metric.distance(point, src) for point in points]
+    per_object = (timer.perf_counter() - started) / queries
+
+    started = timer.perf_counter()
+    for src in sources:
+        metric.scores(xs, ys, src)
+    batched = (timer.perf_counter() - started) / queries
+
+    return (per_object, batched)
+
+
+def find_closest(metric, n, store, queries, world_size, seed):
+    taxi_park = build_park(n, world_size=world_size, seed=seed, metric=metric, **STORES[store])
+    sources = [
+        Point(random.randint(-world_size, world_size), random.randint(-world_size, world_size))
+        for _ in range(queries)
+    ]
+
+    latencies = []
+    for src in sources:
+        started = timer.perf_counter()
+        taxi_park.find_closest(src)
+        latencies.append(timer.perf_counter() - started)
+
+    return latency_stats(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--metrics', nargs='+', default=list(METRICS), choices=list(METRICS))
+    parser.add_argument('--stores', nargs='+', default=list(STORES), choices=list(STORES))
+    parser.add_argument('--queries', type=int, default=100, help="number of points to measure distances from")
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="cars are placed within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    results = []
+
+    print(f"{'cars':>8} {'metric':>10} {'per-object, ms':>15} {'batched, ms':>12} {'speedup':>8}")
+    for n in args.sizes:
+        for name in args.metrics:
+            (per_object, batched) = score_cars(metric_by_name(name), n, args.queries, args.world_size)
+            results.append({
+                'cars': n, 'metric': name, 'operation': 'scores',
+                'per_object_ms': per_object * 1000, 'batched_ms': batched * 1000,
+            })
+            print(f"{n:>8} {name:>10} {per_object * 1000:>15.3f} {batched * 1000:>12.3f} {per_object / batched:>7.0f}x")
+
+    print()
+    print(f"{'cars':>8} {'metric':>10} {'store':>8} {'mean, us':>9} {'p50, us':>9} {'p99, us':>9}")
+    for n in args.sizes:
+        for name in args.metrics:
+            for store in args.stores:
+                stats = find_closest(metric_by_name(name), n, store, args.queries, args.world_size, args.seed)
+                results.append({'cars': n, 'metric': name, 'operation': 'find_closest', 'store': store, **stats})
+                print(
+                    f"{n:>8} {name:>10} {store:>8} {stats['mean_us']:>9.1f} "
+                    f"{stats['p50_us']:>9.1f} {stats['p99_us']:>9.1f}"
+                )
+
+    if args.output:
+        write_results(args.output, 'distance', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+    Cost of skipping a long stretch of time: N ticks of 1 unit vs a single tick of N units
+    (`POST /api/tick?units=N`) vs ticks until the next car gets free (`POST /api/tick?until_free=true`).
+
+    All cars are booked first, so the same cars get free during the skipped interval in every mode;
+    only the number of calls differs.
+    Run it with:
+        python -m benchmarks.fast_forward --cars 10000 --units 100000
+'''
+import argparse
+import random
+import time
+
+from models.data import Location
+from .common import build_park, write_results
+
+
+def book_everything(taxi_park, world_size, seed):
+    random.seed(seed)
+    for _ in range(len(taxi_park.cars)):
+        src = Location.construct(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        dst = Location.construct(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        taxi_park.book_closest(src, dst)
+
+
+def skip(taxi_park, mode, units):
+    '''
+        Skips `units` units of time in the given mode, returns (number of calls, released cars)
+    '''
+
+    target = taxi_park.time.time + units
+    (calls, released) = (0, 0)
+
+    if mode == 'unit-ticks':
+        for _ in range(units):
+            released += len(taxi_park.fast_forward(1))
+            calls += 1
+    elif mode == 'one-tick':
+        released += len(taxi_park.fast_forward(units))
+        calls += 1
+    else:
+        while True:
+            next_release = taxi_park.next_release_time()
+            if next_release is None or next_release > target:
+                break
+            released += len(taxi_park.fast_forward(until_free=True))
+            calls += 1
+
+    return (calls, released)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--units', type=int, default=100000, help="how many units of time to skip")
+    parser.add_argument('--fleet-store', default='objects', choices=['objects', 'arrays', 'sharded'])
+    parser.add_argument('--world-size', type=int, default=10000, help="cars and trips are placed within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = []
+
+    print(f"{'mode':>12} {'calls':>10} {'released':>10} {'elapsed, ms':>12}")
+    for mode in ('unit-ticks', 'one-tick', 'until-free'):
+        index = 'grid' if args.fleet_store == 'objects' else None
+        taxi_park = build_park(args.cars, 'uniform', args.world_size, args.fleet_store, index, args.seed)
+        book_everything(taxi_park, args.world_size, args.seed + 1)
+
+        started = time.perf_counter()
+        (calls, released) = skip(taxi_park, mode, args.units)
+        elapsed = time.perf_counter() - started
+
+        results.append({'mode': mode, 'calls': calls, 'released': released, 'elapsed_ms': elapsed * 1000})
+        print(f"{mode:>12} {calls:>10} {released:>10} {elapsed * 1000:>12.1f}")
+
+    if args.output:
+        write_results(args.output, 'fast_forward', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+'''
+    Memory and latency comparison of the fleet storage engines:
+    list of Car objects (TaxiPark) vs NumPy struct of arrays (ArrayTaxiPark).
+
+    Measures memory allocated for N cars placed uniformly at random, average time of `find_closest`
+    for random customer locations, average time of booking a given car (without the search,
+    so it's the cost of the car model itself) and time of resetting the whole fleet.
+    Run it with:
+        python -m benchmarks.fleet_store --sizes 1000 100000 1000000
+'''
+import argparse
+import random
+import timeit
+import tracemalloc
+
+from models.time import Time
+from models.car import Car
+from models.data import Location, Point
+from models.taxi_park import TaxiPark
+from models.array_taxi_park import ArrayTaxiPark
+from models.spatial_index import LinearIndex
+
+
+def build_park(fleet_store, n, world_size, seed):
+    random.seed(seed)
+
+    if fleet_store == 'arrays':
+        taxi_park = ArrayTaxiPark(Time(), capacity=n)
+    else:
+        taxi_park = TaxiPark(Time(), index=LinearIndex())
+
+    for car_id in range(1, n + 1):
+        location = Location(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        taxi_park.add_car(Car(car_id, location=location))
+
+    return taxi_park
+
+
+def measure_memory(fleet_store, n, world_size, seed):
+    '''
+        Returns memory (in bytes) held by the taxi park with N cars
+    '''
+
+    tracemalloc.start()
+    taxi_park = build_park(fleet_store, n, world_size, seed)
+    (memory, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (taxi_park, memory)
+
+
+def measure_lookup(taxi_park, queries, world_size, seed):
+    '''
+        Returns average time (in microseconds) of a single closest car lookup
+    '''
+
+    random.seed(seed + 1)
+    points = [
+        Location(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        for _ in range(queries)
+    ]
+
+    total = timeit.timeit(lambda: [taxi_park.find_closest(src) for src in points], number=1)
+    return total / queries * 10 ** 6
+
+
+def measure_book(taxi_park, world_size, seed):
+    '''
+        Returns average time (in microseconds) of booking a trip on every car of the park
+        (with the points the fast path passes to the park)
+    '''
+
+    random.seed(seed + 2)
+    trips = [
+        (
+            Point(random.randint(-world_size, world_size), random.randint(-world_size, world_size)),
+            Point(random.randint(-world_size, world_size), random.randint(-world_size, world_size)),
+        )
+        for _ in taxi_park.cars
+    ]
+
+    cars = list(taxi_park.cars)
+    total = timeit.timeit(lambda: [taxi_park.book(car, src, dst) for (car, (src, dst)) in zip(cars, trips)], number=1)
+    return total / len(cars) * 10 ** 6
+
+
+def measure_reset(taxi_park):
+    '''
+        Returns time (in milliseconds) of resetting the whole park
+    '''
+
+    return timeit.timeit(taxi_park.reset, number=1) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=20, help="number of lookups to average over")
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="cars are placed within [-size, size]")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'cars':>10} {'store':>8} {'bytes/car':>10} {'lookup, us':>12} {'book, us':>10} {'reset, ms':>10}")
+    for n in args.sizes:
+        for fleet_store in ('objects', 'arrays'):
+            (taxi_park, memory) = measure_memory(fleet_store, n, args.world_size, args.seed)
+            lookup_time = measure_lookup(taxi_park, args.queries, args.world_size, args.seed)
+            book_time = measure_book(taxi_park, args.world_size, args.seed)
+            reset_time = measure_reset(taxi_park)
+
+            print(
+                f"{n:>10} {fleet_store:>8} {memory / n:>10.0f} {lookup_time:>12.1f} "
+                f"{book_time:>10.2f} {reset_time:>10.0f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+    Closest free car vs future-availability dispatch (busy cars compete as well, see models/taxi_park.py)
+    at a demand peak: a stream of bookings with more customers per unit of time than the fleet can serve.
+    Reports how many bookings failed ("no free cars"), how long customers waited for their cars
+    on average (the part of `total_time` before the ride) and the latency of a booking.
+    Run it with:
+        python -m benchmarks.future_dispatch --cars 1000 --bookings 20000 --per-tick 5
+'''
+import argparse
+import random
+import time as timer
+
+from models.data import Point
+from .common import build_park, latency_stats, write_results
+
+
+def run(args, fleet_store, index, future_dispatch):
+    # the same cars (by the seed) for both modes
+    taxi_park = build_park(
+        args.cars, 'clustered', args.world_size, fleet_store, index, args.seed, future_dispatch=future_dispatch,
+    )
+
+    random.seed(args.seed + 1)
+    trips = []
+    for _ in range(args.bookings):
+        (x, y) = (random.randint(-args.world_size, args.world_size), random.randint(-args.world_size, args.world_size))
+        length = args.trip_length
+        trips.append((Point(x, y), Point(x + random.randint(-length, length), y + random.randint(-length, length))))
+
+    (failed, waited, latencies) = (0, 0, [])
+    for (i, (src, dst)) in enumerate(trips, start=1):
+        started = timer.perf_counter()
+        booking = taxi_park.book_closest(src, dst)
+        latencies.append(timer.perf_counter() - started)
+
+        if booking:
+            waited += booking[1] - taxi_park.metric.distance(src, dst)
+        else:
+            failed += 1
+
+        if i % args.per_tick == 0:
+            taxi_park.fast_forward(1)
+
+    booked = args.bookings - failed
+    return {
+        'fleet_store': fleet_store,
+        'index': index,
+        'dispatch': 'future' if future_dispatch else 'free',
+        'failed': failed,
+        'mean_wait': waited / booked if booked else None,
+        **latency_stats(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--per-tick', type=int, default=5, help="bookings per unit of time")
+    parser.add_argument('--world-size', type=int, default=1000, help="customers and cars are within [-size, size]")
+    parser.add_argument(
+        '--trip-length', type=int, default=100, help="destinations are within this many units along each axis",
+    )
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    configurations = [('objects', 'grid'), ('objects', 'linear'), ('arrays', None)]
+    if args.cars > 10000:
+        configurations.remove(('objects', 'linear'))
+
+    results = []
+
+    print(f"{'store':>8} {'index':>7} {'dispatch':>9} {'failed':>7} {'mean wait':>10} {'p50, us':>9} {'p99, us':>9}")
+    for (fleet_store, index) in configurations:
+        for future_dispatch in (False, True):
+            result = run(args, fleet_store, index, future_dispatch)
+            results.append(result)
+
+            mean_wait = '-' if result['mean_wait'] is None else f"{result['mean_wait']:.1f}"
+            print(
+                f"{fleet_store:>8} {index or '-':>7} {result['dispatch']:>9} {result['failed']:>7} {mean_wait:>10} "
+                f"{result['p50_us']:>9.1f} {result['p99_us']:>9.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, 'future_dispatch', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+    In-process micro-benchmark of the taxi park: `find_closest`, `find_nearest` (k nearest cars,
+    reported as e.g. `find_nearest_10`) and `book_closest` over different fleet sizes, spatial distributions of cars,
+    fleet stores and spatial indexes.
+
+    Distributions:
+    - uniform: cars are spread uniformly across the world
+    - clustered: cars are gathered around a few "city centers"
+    - origin: all cars are at (0, 0), as right after `/api/reset`
+
+    Reports mean, p50 and p99 latency of every operation and optionally writes them as JSON,
+    so results of different runs (e.g. before and after a change) can be compared.
+    Run it with:
+        python -m benchmarks.park --sizes 1000 100000 --k 1 10 100 --output park.json
+'''
+import argparse
+import random
+import time
+
+from models.data import Location
+from models.spatial_index import INDEXES
+from .common import DISTRIBUTIONS, build_park, latency_stats, write_results
+
+
+def random_location(world_size):
+    return Location.construct(
+        x=random.randint(-world_size, world_size),
+        y=random.randint(-world_size, world_size),
+    )
+
+
+def measure_find_closest(taxi_park, queries, world_size):
+    '''
+        Returns latencies (in seconds) of closest car lookups for random customer locations
+    '''
+
+    points = [random_location(world_size) for _ in range(queries)]
+
+    latencies = []
+    for src in points:
+        started = time.perf_counter()
+        taxi_park.find_closest(src)
+        latencies.append(time.perf_counter() - started)
+
+    return latencies
+
+
+def measure_find_nearest(taxi_park, queries, world_size, k):
+    '''
+        Returns latencies (in seconds) of lookups of the k nearest cars for random customer locations
+    '''
+
+    points = [random_location(world_size) for _ in range(queries)]
+
+    latencies = []
+    for src in points:
+        started = time.perf_counter()
+        taxi_park.find_nearest(src, k)
+        latencies.append(time.perf_counter() - started)
+
+    return latencies
+
+
+def measure_book_closest(taxi_park, queries, world_size, tick_every):
+    '''
+        Returns latencies (in seconds) of bookings of random trips.
+        Time goes on between the bookings (but isn't measured), so booked cars keep getting free
+    '''
+
+    trips = [(random_location(world_size), random_location(world_size)) for _ in range(queries)]
+
+    latencies = []
+    for (i, (src, dst)) in enumerate(trips, start=1):
+        started = time.perf_counter()
+        taxi_park.book_closest(src, dst)
+        latencies.append(time.perf_counter() - started)
+
+        if i % tick_every == 0:
+            taxi_park.time.tick(world_size // 10)
+
+    return latencies
+
+
+def configurations(args):
+    '''
+        Yields (fleet store, index) pairs to benchmark
+    '''
+
+    for index in args.indexes:
+        yield ('objects', index)
+
+    if args.arrays:
+        yield ('arrays', None)
+
+    if args.sharded:
+        yield ('sharded', None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--distributions', nargs='+', default=list(DISTRIBUTIONS), choices=list(DISTRIBUTIONS))
+    parser.add_argument('--indexes', nargs='+', default=list(INDEXES), choices=list(INDEXES))
+    parser.add_argument('--arrays', action='store_true', help="benchmark NumPy fleet store as well")
+    parser.add_argument('--sharded', action='store_true', help="benchmark sharded fleet store as well")
+    parser.add_argument('--k', type=int, nargs='+', default=[10], help="numbers of the nearest cars to look up")
+    parser.add_argument('--queries', type=int, default=1000, help="number of operations of every kind")
+    parser.add_argument('--tick-every', type=int, default=10, help="advance time after every N bookings")
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="cars are placed within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = []
+
+    print(f"{'cars':>10} {'distribution':>12} {'store':>8} {'index':>8} {'operation':>16} {'p50, us':>10} {'p99, us':>10}")
+    for n in args.sizes:
+        for distribution in args.distributions:
+            for (fleet_store, index) in configurations(args):
+                taxi_park = build_park(n, distribution, args.world_size, fleet_store, index, args.seed)
+
+                # full scan is way too slow on big fleets, so we don't need that many queries to see the difference
+                queries = args.queries if index != 'linear' else max(1, min(args.queries, 10 ** 7 // max(n, 1)))
+
+                random.seed(args.seed + 1)  # so customers don't appear exactly at the cars' locations
+                measurements = {'find_closest': measure_find_closest(taxi_park, queries, args.world_size)}
+                for k in args.k:
+                    measurements[f'find_nearest_{k}'] = measure_find_nearest(taxi_park, queries, args.world_size, k)
+                measurements['book_closest'] = measure_book_closest(taxi_park, queries, args.world_size, args.tick_every)
+
+                for (operation, latencies) in measurements.items():
+                    stats = latency_stats(latencies)
+                    results.append({
+                        'cars': n,
+                        'distribution': distribution,
+                        'fleet_store': fleet_store,
+                        'index': index,
+                        'operation': operation,
+                        **stats,
+                    })
+
+                    print(
+                        f"{n:>10} {distribution:>12} {fleet_store:>8} {index or '-':>8} {operation:>16} "
+                        f"{stats['p50_us']:>10.1f} {stats['p99_us']:>10.1f}"
+                    )
+
+    if args.output:
+        write_results(args.output, 'park', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+    Own car for every customer vs ride pooling (busy cars pick up customers on their way, see models/pooling.py)
+    at a demand peak: a stream of bookings with more customers per unit of time than the fleet can serve alone.
+    Reports how many bookings failed ("no free cars"), how many were pooled, how long customers took
+    to get to their destinations on average (waiting included), how much driving time of the fleet
+    a served customer costs (busy cars summed over the units of time) and the latency of a booking.
+    Run it with:
+        python -m benchmarks.pooling --cars 1000 --bookings 20000 --per-tick 5 --detours 5 10 20
+'''
+import argparse
+import random
+import time as timer
+
+from models.data import Point
+from settings import settings
+from .common import build_park, clustered, latency_stats, write_results
+
+
+def run(args, index, max_detour):
+    settings.pool_max_detour = max_detour or 0
+
+    # the same cars (by the seed) for every mode
+    taxi_park = build_park(
+        args.cars, 'clustered', args.world_size, 'objects', index, args.seed, pool_rides=max_detour is not None,
+    )
+
+    # customers come from around the same "city centers" as the cars (by the seed)
+    random.seed(args.seed)
+    sources = clustered(args.bookings, args.world_size)
+    trips = []
+    for (x, y) in sources:
+        length = args.trip_length
+        trips.append((Point(x, y), Point(x + random.randint(-length, length), y + random.randint(-length, length))))
+
+    (failed, total_time, busy_time, latencies) = (0, 0, 0, [])
+    pooled = 0
+    for (i, (src, dst)) in enumerate(trips, start=1):
+        busy = taxi_park.busy_count
+
+        started = timer.perf_counter()
+        booking = taxi_park.book_closest(src, dst)
+        latencies.append(timer.perf_counter() - started)
+
+        if booking:
+            total_time += booking[1]
+            # a car which was busy already and still is took the customer on its way
+            pooled += taxi_park.busy_count == busy
+        else:
+            failed += 1
+
+        if i % args.per_tick == 0:
+            busy_time += taxi_park.busy_count
+            taxi_park.fast_forward(1)
+
+    # the cars still on their way finish their trips
+    while taxi_park.busy_count:
+        busy_time += taxi_park.busy_count
+        taxi_park.fast_forward(1)
+
+    served = args.bookings - failed
+    return {
+        'index': index,
+        'pooling': '-' if max_detour is None else f'detour {max_detour}',
+        'failed': failed,
+        'pooled': pooled,
+        'mean_total_time': total_time / served if served else None,
+        'car_time_per_trip': busy_time / served if served else None,
+        **latency_stats(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--per-tick', type=int, default=5, help="bookings per unit of time")
+    parser.add_argument('--detours', type=int, nargs='+', default=[5, 10, 20], help="values of `pool_max_detour` to try")
+    parser.add_argument('--indexes', nargs='+', default=['grid'], choices=['grid', 'linear'])
+    parser.add_argument('--world-size', type=int, default=1000, help="customers and cars are within [-size, size]")
+    parser.add_argument(
+        '--trip-length', type=int, default=100, help="destinations are within this many units along each axis",
+    )
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = []
+
+    print(
+        f"{'index':>7} {'pooling':>10} {'failed':>7} {'pooled':>7} {'mean time':>10} {'car time':>9} "
+        f"{'p50, us':>9} {'p99, us':>9}"
+    )
+    for index in args.indexes:
+        for max_detour in [None, *args.detours]:
+            result = run(args, index, max_detour)
+            results.append(result)
+
+            mean_time = '-' if result['mean_total_time'] is None else f"{result['mean_total_time']:.1f}"
+            car_time = '-' if result['car_time_per_trip'] is None else f"{result['car_time_per_trip']:.1f}"
+            print(
+                f"{index:>7} {result['pooling']:>10} {result['failed']:>7} {result['pooled']:>7} {mean_time:>10} "
+                f"{car_time:>9} {result['p50_us']:>9.1f} {result['p99_us']:>9.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, 'pooling', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
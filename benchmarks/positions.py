@@ -0,0 +1,96 @@
+'''
+    Positions of the cars along their trips (see models/journey.py): where a single car is right now
+    (computed on demand from its trip) and where the whole fleet is (one vectorized pass over the columns
+    of the trips with `fleet_store = "arrays"`, car by car with the others), for a fleet with a share of busy cars.
+    Also reports a tick, which doesn't depend on how many cars are on the way (nothing moves them on ticks),
+    and booking latency (which records the trip).
+    Run it with:
+        python -m benchmarks.positions --sizes 10000 100000 --busy 0.5
+'''
+import argparse
+import random
+import time as timer
+
+from models.data import Point
+from .common import build_park, latency_stats, write_results
+
+
+STORES = ['objects', 'arrays', 'sharded']
+
+
+def run(args, fleet_store, n):
+    taxi_park = build_park(n, 'uniform', args.world_size, fleet_store, 'grid', args.seed)
+
+    random.seed(args.seed + 1)
+    size = args.world_size
+    bookings = []
+    for _ in range(int(n * args.busy)):
+        src = Point(random.randint(-size, size), random.randint(-size, size))
+        dst = Point(random.randint(-size, size), random.randint(-size, size))
+
+        started = timer.perf_counter()
+        taxi_park.book_closest(src, dst)
+        bookings.append(timer.perf_counter() - started)
+
+    # the cars are somewhere on the way to their customers or destinations
+    taxi_park.fast_forward(args.world_size)
+
+    cars = taxi_park.cars
+    sample = [cars[random.randrange(len(cars))] for _ in range(args.queries)]
+    latencies = []
+    for car in sample:
+        started = timer.perf_counter()
+        taxi_park.position(car)
+        latencies.append(timer.perf_counter() - started)
+
+    started = timer.perf_counter()
+    taxi_park.positions()
+    fleet_ms = (timer.perf_counter() - started) * 1000
+
+    started = timer.perf_counter()
+    taxi_park.fast_forward(1)
+    tick_ms = (timer.perf_counter() - started) * 1000
+
+    return {
+        'fleet_store': fleet_store,
+        'cars': n,
+        'busy': taxi_park.busy_count,
+        'fleet_ms': fleet_ms,
+        'tick_ms': tick_ms,
+        'booking_mean_us': latency_stats(bookings)['mean_us'],
+        **latency_stats(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--busy', type=float, default=0.5, help="share of the fleet booked before the measurements")
+    parser.add_argument('--stores', nargs='+', default=STORES, choices=STORES)
+    parser.add_argument('--queries', type=int, default=10000, help="positions of single cars to look up")
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="customers and cars are within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = []
+
+    print(
+        f"{'store':>8} {'cars':>8} {'busy':>8} {'car p50, us':>12} {'car p99, us':>12} "
+        f"{'fleet, ms':>10} {'tick, ms':>9} {'booking, us':>12}"
+    )
+    for n in args.sizes:
+        for fleet_store in args.stores:
+            result = run(args, fleet_store, n)
+            results.append(result)
+            print(
+                f"{fleet_store:>8} {n:>8} {result['busy']:>8} {result['p50_us']:>12.1f} {result['p99_us']:>12.1f} "
+                f"{result['fleet_ms']:>10.1f} {result['tick_ms']:>9.2f} {result['booking_mean_us']:>12.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, 'positions', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+'''
+    Idle cars waiting where they dropped off their last customers vs moved toward the demand
+    (see models/rebalancing.py) every few units of time, on a replayed workload (`simulate.simulate`).
+    By default customers come from a few "city centers" and go anywhere in the world, so cars drift away
+    from where they are needed; any log recorded by `benchmarks.workload` can be replayed instead with `--log`.
+    Reports pickup distance (how far the booked car was from the customer), failed bookings ("no free cars"),
+    how many cars were moved and how far (driving without customers), and how long planning took.
+    Run it with:
+        python -m benchmarks.rebalancing --cars 1000 --bookings 20000 --rate 0.3 --intervals 1 10 60
+        python -m benchmarks.rebalancing --log workload.jsonl --cars 1000 --intervals 10
+'''
+import argparse
+import random
+import time as timer
+
+from models.data import Point
+from models.demand import DemandMap
+from models.rebalancing import Rebalancer
+from simulate import read_log, simulate
+from .common import build_park, clustered, percentile, write_results
+
+
+class TimedRebalancer(Rebalancer):
+    '''
+        Rebalancer which keeps track of how long planning takes and how far the cars are moved
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seconds = 0.0
+        self.runs = 0
+        self.distance = 0
+
+    def plan(self, taxi_park):
+        started = timer.perf_counter()
+        moves = super().plan(taxi_park)
+        self.seconds += timer.perf_counter() - started
+        self.runs += 1
+
+        return moves
+
+    def apply(self, taxi_park, moves):
+        moved = super().apply(taxi_park, moves)
+        self.distance += sum(move.distance for move in moved)
+
+        return moved
+
+
+def generate(args):
+    '''
+        Events of the default workload: bookings from around a few centers to anywhere, `rate` per unit of time
+    '''
+
+    random.seed(args.seed + 1)
+    size = args.world_size
+    sources = clustered(args.bookings, size, clusters=args.clusters)
+
+    (events, time) = ([], 0)
+    for (i, (x, y)) in enumerate(sources, start=1):
+        events.append(('book', x, y, random.randint(-size, size), random.randint(-size, size)))
+
+        # time of the next booking
+        units = int(i / args.rate) - time
+        if units:
+            events.append(('tick', units))
+            time += units
+
+    return events
+
+
+def run(args, events, interval):
+    # the same cars (by the seed) for every interval
+    taxi_park = build_park(args.cars, 'uniform', args.world_size, args.fleet_store, 'grid', args.seed)
+
+    rebalancer = None
+    if interval:
+        demand = DemandMap(args.tile_size, args.half_life, args.max_tiles)
+        rebalancer = TimedRebalancer(demand, interval=interval, max_moves=args.max_moves)
+
+    distance = taxi_park.metric.distance
+    pickups = []
+    failed = 0
+    for (event_no, _, car_id, total_time) in simulate(taxi_park, events, rebalancer=rebalancer):
+        if car_id is None:
+            failed += 1
+            continue
+
+        (_, sx, sy, dx, dy) = events[event_no - 1]
+        pickups.append(total_time - distance(Point(sx, sy), Point(dx, dy)))
+
+    return {
+        'interval': interval,
+        'failed': failed,
+        'mean_pickup': sum(pickups) / len(pickups) if pickups else None,
+        'p90_pickup': percentile(pickups, 90) if pickups else None,
+        'moves': rebalancer.moved if rebalancer else 0,
+        'move_distance': rebalancer.distance if rebalancer else 0,
+        'plan_ms': rebalancer.seconds / rebalancer.runs * 1000 if rebalancer and rebalancer.runs else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0.3, help="bookings per unit of time")
+    parser.add_argument('--clusters', type=int, default=3, help="number of centers customers come from")
+    parser.add_argument('--log', help="path of the event log to replay instead (JSONL or binary)")
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1, 10, 60], help="units of time between rebalancing")
+    parser.add_argument('--max-moves', type=int, default=20, help="the most cars moved at once")
+    parser.add_argument('--tile-size', type=int, default=100, help="size of a tile of the heatmap")
+    parser.add_argument('--half-life', type=int, default=600, help="half-life of a pickup in the heatmap")
+    parser.add_argument('--max-tiles', type=int, default=4096, help="the most tiles of the heatmap")
+    parser.add_argument('--fleet-store', default='objects', choices=['objects', 'arrays', 'sharded'])
+    parser.add_argument('--world-size', type=int, default=1000, help="customers and cars are within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # bookings are looked up by the event number, so the log is kept in memory
+    events = list(read_log(args.log)) if args.log else generate(args)
+
+    results = []
+
+    print(
+        f"{'interval':>9} {'failed':>7} {'mean pickup':>12} {'p90 pickup':>11} {'moves':>7} "
+        f"{'move dist':>10} {'plan, ms':>9}"
+    )
+    for interval in [0, *args.intervals]:
+        result = run(args, events, interval)
+        results.append(result)
+
+        mean_pickup = '-' if result['mean_pickup'] is None else f"{result['mean_pickup']:.1f}"
+        p90_pickup = '-' if result['p90_pickup'] is None else f"{result['p90_pickup']:.0f}"
+        print(
+            f"{interval or '-':>9} {result['failed']:>7} {mean_pickup:>12} {p90_pickup:>11} {result['moves']:>7} "
+            f"{result['move_distance']:>10} {result['plan_ms']:>9.2f}"
+        )
+
+    if args.output:
+        write_results(args.output, 'rebalancing', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
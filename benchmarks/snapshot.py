@@ -0,0 +1,84 @@
+'''
+    Warm vs cold start of the fleet: how long it takes to get a fleet of N cars (with some of them
+    busy) back after a restart by restoring it from a snapshot, compared with populating a new one
+    (which loses the state anyway), and how long taking the snapshot takes.
+    Run it with:
+        python -m benchmarks.snapshot --sizes 100000 1000000 --stores objects arrays sharded
+'''
+import argparse
+import os
+import random
+import tempfile
+import time as timer
+
+from models.time import Time
+from models.data import Point
+from models.taxi_park import create_taxi_park
+from models import snapshot
+
+from .common import build_park, write_results
+
+
+def run(n, fleet_store, path, busy_share, seed):
+    taxi_park = build_park(n, fleet_store=fleet_store, seed=seed)
+
+    random.seed(seed + 1)
+    for car in random.sample(list(taxi_park.cars), int(n * busy_share)):
+        taxi_park.book(car, Point(0, 0), Point(random.randint(-1000, 1000), random.randint(-1000, 1000)))
+
+    started = timer.perf_counter()
+    snapshot.save(taxi_park, path)
+    save_time = timer.perf_counter() - started
+
+    started = timer.perf_counter()
+    create_taxi_park(Time(), fleet_store).populate_with_n_cars(n)
+    populate_time = timer.perf_counter() - started
+
+    started = timer.perf_counter()
+    (restored, _) = snapshot.restore(path, fleet_store)
+    restore_time = timer.perf_counter() - started
+
+    assert restored.busy_count == taxi_park.busy_count
+
+    return {
+        'cars': n,
+        'store': fleet_store,
+        'mb': os.path.getsize(path) / 2 ** 20,
+        'save_ms': save_time * 1000,
+        'populate_ms': populate_time * 1000,
+        'restore_ms': restore_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument(
+        '--stores', nargs='+', default=['objects', 'arrays', 'sharded'], choices=['objects', 'arrays', 'sharded'],
+    )
+    parser.add_argument('--busy-share', type=float, default=0.1, help="share of the cars which are busy in the snapshot")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    args = parser.parse_args()
+
+    results = []
+
+    print(f"{'cars':>10} {'store':>8} {'MB':>6} {'save, ms':>9} {'populate, ms':>13} {'restore, ms':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fleet.snap')
+        for n in args.sizes:
+            for fleet_store in args.stores:
+                result = run(n, fleet_store, path, args.busy_share, args.seed)
+                results.append(result)
+
+                print(
+                    f"{n:>10} {fleet_store:>8} {result['mb']:>6.1f} {result['save_ms']:>9.0f} "
+                    f"{result['populate_ms']:>13.0f} {result['restore_ms']:>12.0f}"
+                )
+
+    if args.output:
+        write_results(args.output, 'snapshot', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
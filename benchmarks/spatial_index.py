@@ -0,0 +1,78 @@
+'''
+    Benchmark of the closest car search with different spatial indexes.
+
+    Places N cars uniformly at random on a square part of the grid and measures
+    how long `TaxiPark.find_closest` takes for random customer locations.
+    Run it with:
+        python -m benchmarks.spatial_index --sizes 10 1000 100000 1000000
+'''
+import argparse
+import random
+import timeit
+
+from models.time import Time
+from models.car import Car
+from models.data import Location
+from models.taxi_park import TaxiPark
+from models.spatial_index import INDEXES, GridIndex
+
+
+def build_park(index_name, n, world_size, seed, cell_size=None):
+    random.seed(seed)
+
+    if index_name == 'grid':
+        # by default picking the cell size, so there is about one car per cell
+        cell_size = cell_size or max(1, int(2 * world_size / n ** 0.5))
+        index = GridIndex(cell_size)
+    else:
+        index = INDEXES[index_name]()
+
+    taxi_park = TaxiPark(Time(), index=index)
+    for car_id in range(1, n + 1):
+        location = Location(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        taxi_park.add_car(Car(car_id, location=location))
+
+    return taxi_park
+
+
+def measure(taxi_park, queries, world_size, seed):
+    '''
+        Returns average time (in microseconds) of a single closest car lookup
+    '''
+
+    random.seed(seed + 1)  # so customers don't appear exactly at the cars' locations
+    points = [
+        Location(x=random.randint(-world_size, world_size), y=random.randint(-world_size, world_size))
+        for _ in range(queries)
+    ]
+
+    total = timeit.timeit(lambda: [taxi_park.find_closest(src) for src in points], number=1)
+    return total / queries * 10 ** 6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000, 1000000])
+    parser.add_argument('--indexes', nargs='+', default=list(INDEXES), choices=list(INDEXES))
+    parser.add_argument('--queries', type=int, default=1000, help="number of lookups to average over")
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="cars are placed within [-size, size]")
+    parser.add_argument(
+        '--cell-size', type=int, default=None, help="cell size of the grid index (~1 car per cell by default)",
+    )
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'cars':>10} {'index':>8} {'lookup, us':>12}")
+    for n in args.sizes:
+        for index_name in args.indexes:
+            taxi_park = build_park(index_name, n, args.world_size, args.seed, args.cell_size)
+
+            # full scan is way too slow on big fleets, so we don't need that many queries to see the difference
+            queries = args.queries if index_name != 'linear' else max(1, min(args.queries, 10 ** 7 // max(n, 1)))
+            lookup_time = measure(taxi_park, queries, args.world_size, args.seed)
+
+            print(f"{n:>10} {index_name:>8} {lookup_time:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
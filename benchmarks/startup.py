@@ -0,0 +1,118 @@
+'''
+    Cold start of the service: how long `import main` takes in a fresh interpreter
+    (and how much of it is FastAPI itself), and how long it takes a newly started uvicorn
+    with NUM_CARS cars to serve its first booking, per fleet store.
+    Exits with code 1 when any of them is over its budget, so it can be used in CI.
+    Run it with:
+        python -m benchmarks.startup --sizes 1000 1000000 --import-budget-ms 400 --booking-budget-ms 3000
+'''
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time as timer
+
+from .common import write_results
+
+
+STORES = {
+    'linear': {'FLEET_STORE': 'objects', 'SPATIAL_INDEX': 'linear'},
+    'grid': {'FLEET_STORE': 'objects', 'SPATIAL_INDEX': 'grid'},
+    'arrays': {'FLEET_STORE': 'arrays'},
+    'sharded': {'FLEET_STORE': 'sharded'},
+}
+
+IMPORT_TIME = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def import_time(module, repeats):
+    '''
+        Returns median time (in seconds) of importing the module in a fresh interpreter
+    '''
+
+    times = [
+        float(subprocess.check_output([sys.executable, '-c', IMPORT_TIME.format(module=module)]))
+        for _ in range(repeats)
+    ]
+    return statistics.median(times)
+
+
+def time_to_first_booking(cars, store, port, timeout=60):
+    '''
+        Starts uvicorn and sends it a booking every few milliseconds until one succeeds
+        Returns:
+        - elapsed (float): seconds from starting the process to the first booking
+    '''
+
+    env = dict(os.environ, NUM_CARS=str(cars), **STORES[store])
+    body = json.dumps({'source': {'x': 5, 'y': 5}, 'destination': {'x': 9, 'y': 9}})
+    headers = {'Content-Type': 'application/json'}
+
+    started = timer.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'], env=env,
+    )
+
+    try:
+        while timer.perf_counter() - started < timeout:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+                connection.request('POST', '/api/book', body=body, headers=headers)
+                response = connection.getresponse()
+                if response.status == 200 and b'car_id' in response.read():
+                    return timer.perf_counter() - started
+            except OSError:
+                pass
+            timer.sleep(0.005)
+
+        raise RuntimeError("Service hasn't booked a car in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 1000000])
+    parser.add_argument('--stores', nargs='+', default=list(STORES), choices=list(STORES))
+    parser.add_argument('--repeats', type=int, default=5, help="fresh interpreters to measure import time in")
+    parser.add_argument('--import-budget-ms', type=float, default=400, help="allowed time of `import main`")
+    parser.add_argument('--booking-budget-ms', type=float, default=3000, help="allowed time to the first booking")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    args = parser.parse_args()
+
+    over_budget = []
+
+    framework = import_time('fastapi', args.repeats)
+    service = import_time('main', args.repeats)
+    print(f"import fastapi: {framework * 1000:.1f} ms, import main: {service * 1000:.1f} ms")
+    if service * 1000 > args.import_budget_ms:
+        over_budget.append(f"import main takes {service * 1000:.1f} ms")
+
+    results = {'import_fastapi_ms': framework * 1000, 'import_main_ms': service * 1000, 'first_booking': []}
+
+    print(f"{'cars':>8} {'store':>8} {'first booking, ms':>18}")
+    for n in args.sizes:
+        for store in args.stores:
+            elapsed = time_to_first_booking(n, store, args.port)
+            results['first_booking'].append({'cars': n, 'store': store, 'first_booking_ms': elapsed * 1000})
+            print(f"{n:>8} {store:>8} {elapsed * 1000:>18.1f}")
+
+            if elapsed * 1000 > args.booking_budget_ms:
+                over_budget.append(f"first booking with {n} cars ({store}) takes {elapsed * 1000:.1f} ms")
+
+    if args.output:
+        write_results(args.output, 'startup', vars(args), results)
+
+    for message in over_budget:
+        print(f"over budget: {message}")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+    Search for the closest car with selective requirements (see models/vehicle.py): a mixed fleet where
+    only a small share of the cars (accessible vehicles) can take the customer. Compares latency of
+    the unfiltered search, the filtered one (free cars of every vehicle class are kept in indexes of
+    their own) and scanning the index of the whole fleet while discarding ineligible cars one by one.
+    Run it with:
+        python -m benchmarks.vehicle_filter --cars 100000 --eligible 0.01 --vans 0.1
+'''
+import argparse
+import random
+import time as timer
+
+from models.data import Point
+from models.vehicle import SEDAN, Requirements, Vehicle
+from .common import build_park, latency_stats, write_results
+
+
+CONFIGURATIONS = [('objects', 'grid'), ('objects', 'linear'), ('sharded', None), ('arrays', None)]
+
+REQUIREMENTS = Requirements(vehicle_type='accessible')
+
+
+def scan_and_discard(taxi_park):
+    '''
+        Returns search for the closest eligible car through the index of all free cars of the park
+        (what the search had to do without indexes of vehicle classes), None if the store has no such index
+    '''
+
+    current_time = taxi_park.time.time
+
+    def is_available(car):
+        return REQUIREMENTS.admits(car.vehicle) and car.free_now(current_time)
+
+    if hasattr(taxi_park, 'index'):
+        return lambda src: taxi_park.index.nearest(src, is_available)
+    if hasattr(taxi_park, '_shards'):
+        return lambda src: taxi_park._closest_in(taxi_park._shards, src, is_available, None)[0]
+
+
+def run(args, fleet_store, index):
+    # the same classes (by the seed) for every store: a few accessible vehicles and vans, the rest are sedans
+    random.seed(args.seed + 1)
+    classes = [(args.eligible, Vehicle.of('accessible')), (args.eligible + args.vans, Vehicle.of('van'))]
+    vehicles = []
+    for _ in range(args.cars):
+        share = random.random()
+        vehicles.append(next((vehicle for (threshold, vehicle) in classes if share < threshold), SEDAN))
+
+    taxi_park = build_park(args.cars, 'uniform', args.world_size, fleet_store, index, args.seed, vehicles=vehicles)
+
+    random.seed(args.seed + 2)
+    sources = [
+        Point(random.randint(-args.world_size, args.world_size), random.randint(-args.world_size, args.world_size))
+        for _ in range(args.queries)
+    ]
+
+    searches = {
+        'unfiltered': taxi_park.find_closest,
+        'filtered': lambda src: taxi_park.find_closest(src, REQUIREMENTS),
+        'scan': scan_and_discard(taxi_park),
+    }
+
+    results = []
+    for (search, find) in searches.items():
+        if find is None:
+            continue
+
+        latencies = []
+        for src in sources:
+            started = timer.perf_counter()
+            find(src)
+            latencies.append(timer.perf_counter() - started)
+
+        results.append({'fleet_store': fleet_store, 'index': index, 'search': search, **latency_stats(latencies)})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=100000)
+    parser.add_argument('--eligible', type=float, default=0.01, help="share of the fleet meeting the requirements")
+    parser.add_argument('--vans', type=float, default=0.1, help="share of vans (which don't meet them either)")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--world-size', type=int, default=10 ** 6, help="customers and cars are within [-size, size]")
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    configurations = list(CONFIGURATIONS)
+    if args.cars > 100000:
+        configurations.remove(('objects', 'linear'))
+
+    results = []
+
+    print(f"{'store':>8} {'index':>7} {'search':>11} {'mean, us':>10} {'p50, us':>10} {'p99, us':>10}")
+    for (fleet_store, index) in configurations:
+        for result in run(args, fleet_store, index):
+            results.append(result)
+            print(
+                f"{fleet_store:>8} {index or '-':>7} {result['search']:>11} "
+                f"{result['mean_us']:>10.1f} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, 'vehicle_filter', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+    Cost of durability: throughput and latency of `POST /api/book` (with a tick after every few bookings)
+    without the write-ahead log vs with it at different group-commit windows (see models/wal.py).
+
+    Group commit only pays off with concurrent requests (a single client always waits for its own fsync),
+    so the service is loaded by several client processes, each with its own keep-alive connection.
+    Run it with:
+        python -m benchmarks.wal --windows 0 0.0005 0.002 0.01 --clients 16
+'''
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from .common import percentile, running_service, write_results
+
+
+def client(args):
+    '''
+        Sends bookings one after another, returns latencies of all requests (in seconds)
+    '''
+
+    (port, requests, tick_every, seed) = args
+    random.seed(seed)
+
+    headers = {'Content-Type': 'application/json'}
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    latencies = []
+    for i in range(1, requests + 1):
+        body = json.dumps({
+            'source': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+            'destination': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+        })
+
+        started = time.perf_counter()
+        connection.request('POST', '/api/book', body=body, headers=headers)
+        connection.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+
+        if i % tick_every == 0:
+            started = time.perf_counter()
+            connection.request('POST', '/api/tick')
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - started)
+
+    return latencies
+
+
+def load(args):
+    '''
+        Loads the running service with concurrent clients, returns (requests per second, latencies)
+    '''
+
+    jobs = [(args.port, args.requests, args.tick_every, args.seed + i) for i in range(args.clients)]
+    with multiprocessing.Pool(args.clients) as pool:
+        # letting the service warm up before measuring
+        pool.map(client, [(args.port, 10, args.tick_every, 0)] * args.clients)
+
+        started = time.perf_counter()
+        latencies = [latency for result in pool.map(client, jobs) for latency in result]
+        return (len(latencies) / (time.perf_counter() - started), latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--windows', type=float, nargs='+', default=[0, 0.0005, 0.002, 0.01], help="commit windows, in seconds",
+    )
+    parser.add_argument('--clients', type=int, default=16, help="number of concurrent client processes")
+    parser.add_argument('--requests', type=int, default=1000, help="bookings sent by every client")
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--tick-every', type=int, default=5, help="send a tick after every N bookings")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    configurations = (
+        [('off', None, True)] + [('fsync', window, True) for window in args.windows] + [('no fsync', 0, False)]
+    )
+
+    results = []
+
+    print(f"{'wal':>9} {'window, ms':>11} {'req/s':>8} {'p50, ms':>8} {'p99, ms':>8}")
+    for (name, window, fsync) in configurations:
+        env = {'NUM_CARS': args.cars, 'FAST_BOOK': 'true'}
+        if window is not None:
+            path = os.path.join(directory, f'{len(results)}.wal')
+            env.update(WAL_PATH=path, WAL_COMMIT_WINDOW=window, WAL_FSYNC=str(fsync).lower())
+
+        with running_service(args.port, **env):
+            (rps, latencies) = load(args)
+
+        result = {
+            'wal': name,
+            'window_ms': None if window is None else window * 1000,
+            'rps': rps,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+        results.append(result)
+
+        window_ms = '-' if window is None else f"{window * 1000:.1f}"
+        print(f"{name:>9} {window_ms:>11} {rps:>8.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+    if args.output:
+        write_results(args.output, 'wal', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+    Throughput of `POST /api/book` with the fleet state shared between 1..N uvicorn workers
+    (`FLEET_BACKEND=shared`, see fleet_server.py), compared to a single worker keeping the state locally.
+
+    Every configuration is loaded by the same number of concurrent clients (separate processes,
+    each with its own keep-alive connection) sending bookings with a tick after every few of them.
+    Run it with:
+        python -m benchmarks.workers --workers 1 2 4 --clients 8 --requests 2000
+'''
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from .common import running_fleet_server, running_service, write_results
+
+
+def client(args):
+    '''
+        Sends bookings one after another, returns how many requests were sent
+    '''
+
+    (port, requests, tick_every, seed) = args
+    random.seed(seed)
+
+    headers = {'Content-Type': 'application/json'}
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for i in range(1, requests + 1):
+        body = json.dumps({
+            'source': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+            'destination': {'x': random.randint(-100, 100), 'y': random.randint(-100, 100)},
+        })
+        connection.request('POST', '/api/book', body=body, headers=headers)
+        connection.getresponse().read()
+
+        if i % tick_every == 0:
+            connection.request('POST', '/api/tick')
+            connection.getresponse().read()
+
+    return requests + requests // tick_every
+
+
+def load(args):
+    '''
+        Loads the running service with concurrent clients, returns requests per second
+    '''
+
+    jobs = [(args.port, args.requests, args.tick_every, args.seed + i) for i in range(args.clients)]
+    with multiprocessing.Pool(args.clients) as pool:
+        # letting all the workers start up before measuring
+        pool.map(client, [(args.port, 10, args.tick_every, 0)] * args.clients)
+
+        started = time.perf_counter()
+        sent = sum(pool.map(client, jobs))
+        return sent / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8, help="number of concurrent client processes")
+    parser.add_argument('--requests', type=int, default=2000, help="bookings sent by every client")
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--tick-every', type=int, default=5, help="send a tick after every N bookings")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = []
+
+    print(f"{'backend':>8} {'workers':>8} {'req/s':>8}")
+    with running_service(args.port, NUM_CARS=args.cars):
+        rps = load(args)
+        results.append({'backend': 'local', 'workers': 1, 'rps': rps})
+        print(f"{'local':>8} {1:>8} {rps:>8.0f}")
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'fleet.sock')
+    for workers in args.workers:
+        with running_fleet_server(socket_path, args.cars):
+            with running_service(args.port, workers, FLEET_BACKEND='shared', FLEET_SOCKET=socket_path):
+                rps = load(args)
+
+        results.append({'backend': 'shared', 'workers': workers, 'rps': rps})
+        print(f"{'shared':>8} {workers:>8} {rps:>8.0f}")
+
+    if args.output:
+        write_results(args.output, 'workers', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
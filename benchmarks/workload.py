@@ -0,0 +1,175 @@
+'''
+    Workload generator: replays a stream of bookings, ticks and resets against
+    the service started locally with uvicorn and reports latency (p50/p99) of every endpoint
+    and the overall number of requests per second.
+
+    The stream is either synthetic (generated from the command line options) or recorded
+    earlier into a JSONL file, one event per line:
+        {"op": "book", "source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}}
+        {"op": "tick"}
+        {"op": "reset"}
+
+    Run it with:
+        python -m benchmarks.workload --events 10000 --record workload.jsonl --output run.json
+        python -m benchmarks.workload --replay workload.jsonl --cars 1000 --output run.json
+'''
+import argparse
+import http.client
+import json
+import random
+import time
+from collections import defaultdict
+
+from .common import DISTRIBUTIONS, latency_stats, running_service, write_results
+
+
+# how every kind of event is sent to the service: (HTTP method, path)
+ENDPOINTS = {
+    'book': ('POST', '/api/book'),
+    'tick': ('POST', '/api/tick'),
+    'reset': ('PUT', '/api/reset'),
+}
+
+
+def generate(n, world_size, distribution='uniform', tick_every=5, reset_every=0):
+    '''
+        Yields N synthetic events: bookings with customers placed according to the distribution,
+        a tick after every `tick_every` bookings and a reset after every `reset_every` events (if set)
+    '''
+
+    # customers of the whole stream are drawn at once, so clustered ones share the same centers
+    sources = DISTRIBUTIONS[distribution](n, world_size)
+    destinations = DISTRIBUTIONS[distribution](n, world_size)
+
+    booked = 0
+    for i in range(1, n + 1):
+        if reset_every and i % reset_every == 0:
+            yield {'op': 'reset'}
+        elif tick_every and booked and booked % tick_every == 0:
+            booked = 0
+            yield {'op': 'tick'}
+        else:
+            booked += 1
+            ((sx, sy), (dx, dy)) = (sources[i - 1], destinations[i - 1])
+            yield {'op': 'book', 'source': {'x': sx, 'y': sy}, 'destination': {'x': dx, 'y': dy}}
+
+
+def read_events(path):
+    '''
+        Yields events recorded in the JSONL file
+    '''
+
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_events(path, events):
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def to_request(event):
+    '''
+        Returns (method, path, body) of the HTTP request for the event
+    '''
+
+    if event['op'] not in ENDPOINTS:
+        raise ValueError(f"Unknown event '{event['op']}', choose one of: {', '.join(ENDPOINTS)}")
+
+    (method, path) = ENDPOINTS[event['op']]
+    body = None
+    if event['op'] == 'book':
+        body = json.dumps({'source': event['source'], 'destination': event['destination']})
+
+    return (method, path, body)
+
+
+def replay(events, port):
+    '''
+        Sends events one after another over a single keep-alive connection
+        Params:
+        - events (list): events to send
+        - port (int): port the service is listening on
+
+        Returns:
+        tuple(
+            - latencies (dict): operation -> list of latencies (in seconds)
+            - elapsed (float): wall time of the whole replay (in seconds)
+            - failed_bookings (int): how many bookings have found no free car
+        )
+    '''
+
+    requests = [(event['op'], *to_request(event)) for event in events]
+    headers = {'Content-Type': 'application/json'}
+
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = defaultdict(list)
+    failed_bookings = 0
+
+    started = time.perf_counter()
+    for (op, method, path, body) in requests:
+        sent = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        payload = response.read()
+        latencies[op].append(time.perf_counter() - sent)
+
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed with HTTP {response.status}: {payload!r}")
+        if op == 'book' and b'car_id' not in payload:
+            failed_bookings += 1
+    elapsed = time.perf_counter() - started
+
+    return (latencies, elapsed, failed_bookings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replay', help="JSONL file with recorded events (generates synthetic ones by default)")
+    parser.add_argument('--record', help="save the generated events into a JSONL file, so they can be replayed later")
+    parser.add_argument('--events', type=int, default=10000, help="number of synthetic events")
+    parser.add_argument('--distribution', default='uniform', choices=list(DISTRIBUTIONS), help="of synthetic customers")
+    parser.add_argument('--tick-every', type=int, default=5, help="send a tick after every N bookings")
+    parser.add_argument('--reset-every', type=int, default=0, help="send a reset after every N events")
+    parser.add_argument('--world-size', type=int, default=100, help="customers are placed within [-size, size]")
+    parser.add_argument('--cars', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('env', nargs='*', default=[], help="extra settings of the service, e.g. SPATIAL_INDEX=grid")
+    args = parser.parse_args()
+
+    if args.replay:
+        events = list(read_events(args.replay))
+    else:
+        random.seed(args.seed)
+        events = list(generate(args.events, args.world_size, args.distribution, args.tick_every, args.reset_every))
+        if args.record:
+            write_events(args.record, events)
+
+    env = dict(setting.split('=', 1) for setting in args.env)
+    with running_service(args.port, NUM_CARS=args.cars, **env):
+        (latencies, elapsed, failed_bookings) = replay(events, args.port)
+
+    results = {
+        'requests': len(events),
+        'elapsed_s': elapsed,
+        'rps': len(events) / elapsed,
+        'failed_bookings': failed_bookings,
+        'endpoints': {op: latency_stats(values) for (op, values) in latencies.items()},
+    }
+
+    print(f"{'endpoint':>8} {'count':>8} {'p50, us':>10} {'p99, us':>10}")
+    for (op, stats) in results['endpoints'].items():
+        print(f"{op:>8} {stats['count']:>8} {stats['p50_us']:>10.1f} {stats['p99_us']:>10.1f}")
+    print(f"total: {results['requests']} requests, {results['rps']:.0f} req/s, {failed_bookings} bookings without a car")
+
+    if args.output:
+        write_results(args.output, 'workload', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+    Cost of `GET /api/world` on a big fleet and how much it stalls bookings running alongside:
+    the whole world as one JSON document vs pages of `--page-size` cars vs NDJSON stream.
+
+    While the world is being fetched (by a separate thread, like a dashboard polling it),
+    bookings are sent one after another and their median and worst latency are reported.
+    Run it with:
+        python -m benchmarks.world --cars 500000
+'''
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from .common import percentile, running_service, write_results
+
+
+def fetch_world(port, mode, page_size):
+    '''
+        Fetches the whole world in the given mode, returns (number of cars, bytes received)
+    '''
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+
+    if mode == 'stream':
+        connection.request('GET', '/api/world?format=ndjson')
+        response = connection.getresponse()
+        (cars, received) = (0, 0)
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                return (cars, received)
+            cars += chunk.count(b'\n')
+            received += len(chunk)
+
+    if mode == 'full':
+        connection.request('GET', '/api/world')
+        body = connection.getresponse().read()
+        return (len(json.loads(body)['cars']), len(body))
+
+    (cars, received, cursor) = (0, 0, 0)
+    while cursor is not None:
+        connection.request('GET', f'/api/world?limit={page_size}&cursor={cursor}')
+        body = connection.getresponse().read()
+        payload = json.loads(body)
+        (cars, received, cursor) = (cars + len(payload['cars']), received + len(body), payload['next_cursor'])
+
+    return (cars, received)
+
+
+def book_while(port, running):
+    '''
+        Sends bookings until the event is cleared, returns their latencies (in seconds)
+    '''
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    body = json.dumps({'source': {'x': 1, 'y': 1}, 'destination': {'x': 2, 'y': 2}})
+    headers = {'Content-Type': 'application/json'}
+
+    latencies = []
+    while running.is_set():
+        started = time.perf_counter()
+        connection.request('POST', '/api/book', body=body, headers=headers)
+        connection.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+
+    return latencies
+
+
+def run(port, mode, page_size):
+    running = threading.Event()
+    running.set()
+
+    latencies = []
+    booking = threading.Thread(target=lambda: latencies.extend(book_while(port, running)))
+    booking.start()
+
+    started = time.perf_counter()
+    (cars, received) = fetch_world(port, mode, page_size)
+    elapsed = time.perf_counter() - started
+
+    running.clear()
+    booking.join()
+
+    return {
+        'mode': mode,
+        'cars': cars,
+        'mb': received / 2 ** 20,
+        'elapsed_s': elapsed,
+        'bookings': len(latencies),
+        'p50_booking_ms': percentile(latencies, 50) * 1000 if latencies else 0,
+        'max_booking_ms': max(latencies, default=0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=500000)
+    parser.add_argument('--page-size', type=int, default=10000)
+    parser.add_argument('--modes', nargs='+', default=['full', 'pages', 'stream'], choices=['full', 'pages', 'stream'])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', help="path of JSON file to write results to")
+    args = parser.parse_args()
+
+    results = []
+
+    print(
+        f"{'mode':>8} {'cars':>10} {'MB':>8} {'elapsed, s':>11} {'bookings':>9} "
+        f"{'p50 booking, ms':>16} {'max booking, ms':>16}"
+    )
+    with running_service(args.port, NUM_CARS=args.cars, SPATIAL_INDEX='grid'):
+        for mode in args.modes:
+            result = run(args.port, mode, args.page_size)
+            results.append(result)
+
+            print(
+                f"{mode:>8} {result['cars']:>10} {result['mb']:>8.1f} {result['elapsed_s']:>11.2f} "
+                f"{result['bookings']:>9} {result['p50_booking_ms']:>16.1f} {result['max_booking_ms']:>16.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, 'world', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
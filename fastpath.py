@@ -0,0 +1,108 @@
+'''
+    Fast path for the hottest endpoint (`POST /api/book`), enabled with `FAST_BOOK=true`.
+
+    Payload of a booking always has the same shape, so instead of validating it with pydantic
+    models we decode JSON straight into 4 integers (with orjson when it's installed),
+    check them against the grid boundaries ourselves and render the response from a template.
+    Optional requirements to the car (`passengers` and `vehicle_type`) are checked the same way as by Trip.
+    Payloads with values other than plain integers (e.g. `"3"` or `3.5`, which Trip casts) are rare,
+    so they are simply validated by the Trip model.
+'''
+try:
+    from orjson import loads
+except ImportError:  # orjson is optional, standard library is just slower
+    from json import loads
+
+from models.data import Point, Trip, GRID_MIN, GRID_MAX
+from models.vehicle import VEHICLE_TYPES, Requirements
+
+
+# response when there are no cars available, encoded once
+NO_FREE_CARS = b'{"status":"failed","message":"No free cars available right now, please wait..."}'
+
+
+def parse_coordinate(value):
+    # a plain integer has only to be within the grid (as for Location model)
+    if not GRID_MIN <= value <= GRID_MAX:
+        raise ValueError(f"coordinates must be within [{GRID_MIN}, {GRID_MAX}]")
+
+    return value
+
+
+def parse_requirements(payload):
+    # the same rules as for Trip model: at least 1 passenger and a known type of vehicle
+    (passengers, vehicle_type) = (payload.get('passengers'), payload.get('vehicle_type'))
+
+    if passengers is not None and passengers < 1:
+        raise ValueError("passengers must be a positive number")
+
+    if vehicle_type is not None and vehicle_type not in VEHICLE_TYPES:
+        raise ValueError(f"vehicle_type must be one of: {', '.join(VEHICLE_TYPES)}")
+
+    return Requirements.of(passengers, vehicle_type)
+
+
+def is_plain(values, passengers, vehicle_type):
+    # whether all values are of the types the fast path checks by itself
+    return (
+        all(type(value) is int for value in values)
+        and (passengers is None or type(passengers) is int)
+        and (vehicle_type is None or type(vehicle_type) is str)
+    )
+
+
+def parse_model(payload):
+    # pydantic errors are ValueErrors as well
+    trip = Trip.parse_obj(payload)
+    return (Point.of(trip.source), Point.of(trip.destination), trip.requirements())
+
+
+def parse_trip(body):
+    '''
+        Decodes booking payload into source and destination locations and requirements to the car
+        Params:
+        - body (bytes): raw request body, e.g. {"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}}
+          (optionally with "passengers" and "vehicle_type")
+
+        Returns:
+        tuple(
+            - src (Point): location of the customer
+            - dst (Point): destination of the customer
+            - requirements (Requirements): what the car has to meet (None if any car will do)
+        )
+
+        Raises:
+        - ValueError: if payload is not a valid trip
+    '''
+
+    try:
+        payload = loads(body)
+        (source, destination) = (payload['source'], payload['destination'])
+        values = (source['x'], source['y'], destination['x'], destination['y'])
+    except (ValueError, KeyError, TypeError) as e:  # JSON decoding errors are ValueErrors as well
+        raise ValueError("payload must contain source and destination with x and y coordinates") from e
+
+    # anything but plain integers (floats, numeric strings, booleans, ...) is left to the Trip model,
+    # so exactly the same payloads are accepted (and cast the same way) as without the fast path
+    if not is_plain(values, payload.get('passengers'), payload.get('vehicle_type')):
+        return parse_model(payload)
+
+    coordinates = [parse_coordinate(value) for value in values]
+
+    # values are already validated, so we skip validation of the model itself
+    src = Point(coordinates[0], coordinates[1])
+    dst = Point(coordinates[2], coordinates[3])
+
+    return (src, dst, parse_requirements(payload))
+
+
+def encode_booking(booking):
+    '''
+        Renders result of a booking as JSON (same as `main.booking_response` would produce)
+    '''
+
+    if not booking:
+        return NO_FREE_CARS
+
+    (car, total_time) = booking
+    return b'{"car_id":%d,"total_time":%d}' % (car.car_id, total_time)
@@ -0,0 +1,406 @@
+'''
+    Shared fleet state for running the service with several uvicorn workers (`FLEET_BACKEND=shared`).
+
+    A single state process owns the only Time and taxi park and executes commands of the workers
+    one at a time, so bookings and ticks are linearizable and give exactly the same results
+    as the serial service would. Workers only parse requests and render responses (which is where
+    most of the time goes) and forward every operation over a local Unix socket as a line of JSON:
+        ["book", 3, 1, 8, 6]  ->  ["ok", [1, 14]]
+        ["book", 3, 1, 8, 6, 5, null]  ->  ["ok", [7, 14]]  (with requirements: passengers and vehicle type)
+
+    Start the state process first and then the workers:
+        python -m fleet_server
+        FLEET_BACKEND=shared uvicorn main:app --workers 4
+'''
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import threading
+from collections import namedtuple
+
+try:
+    from orjson import loads, dumps
+except ImportError:  # orjson is optional, standard library is just slower
+    from json import loads, dumps as dumps_str
+
+    def dumps(value):
+        return dumps_str(value, separators=(',', ':')).encode()
+
+from settings import settings
+from models.time import Time
+from models.data import Point
+from models.taxi_park import create_taxi_park
+from models.vehicle import Requirements
+
+
+# car as it is known to the workers: the only thing they need to render a booking is its ID
+RemoteCar = namedtuple('RemoteCar', ['car_id'])
+
+# car found by the nearest cars query, which is rendered together with its location
+RemoteNearbyCar = namedtuple('RemoteNearbyCar', ['car_id', 'location'])
+
+
+class RemoteCarState(dict):
+    '''
+        State of a car as rendered by the state process (`Car.to_dict` with the position of the car)
+    '''
+
+    def to_dict(self):
+        return {key: value for (key, value) in self.items() if key != 'position'}
+
+    @property
+    def position(self):
+        return Point(self['position']['x'], self['position']['y'])
+
+
+class FleetState(object):
+    '''
+        The state process side: executes commands against the real Time and taxi park
+    '''
+
+    def __init__(self, num_cars=None, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            # imported here, so NumPy is loaded only when snapshots are actually used
+            from models.snapshot import restore
+            (self.taxi_park, self.time) = restore(snapshot_path)
+            return
+
+        self.time = Time()
+        self.taxi_park = create_taxi_park(self.time)
+        self.taxi_park.populate_with_n_cars(settings.num_cars if num_cars is None else num_cars)
+
+    @staticmethod
+    def _booking(booking):
+        if not booking:
+            return None
+
+        (car, total_time) = booking
+        return [car.car_id, total_time]
+
+    def book(self, sx, sy, dx, dy, passengers=None, vehicle_type=None):
+        # values are validated by the workers already
+        src = Point(sx, sy)
+        dst = Point(dx, dy)
+        return self._booking(self.taxi_park.book_closest(src, dst, Requirements.of(passengers, vehicle_type)))
+
+    def book_batch(self, trips, optimal):
+        trips = [
+            (Point(sx, sy), Point(dx, dy))
+            for (sx, sy, dx, dy) in trips
+        ]
+        return [self._booking(booking) for booking in self.taxi_park.book_batch(trips, optimal=optimal)]
+
+    def nearest(self, x, y, k, passengers=None, vehicle_type=None):
+        nearest = self.taxi_park.find_nearest(Point(x, y), k, Requirements.of(passengers, vehicle_type))
+        return [[car.car_id, car.location.x, car.location.y, dist] for (car, dist) in nearest]
+
+    def tick(self, units):
+        self.time.tick(units)
+        return self.time.time
+
+    def fast_forward(self, units, until_free):
+        # times before and after come with the released cars, so ticks of other workers can't get in between
+        started = self.time.time
+        released = [car.car_id for car in self.taxi_park.fast_forward(units, until_free=until_free)]
+        return [started, self.time.time, released]
+
+    def reset(self):
+        self.taxi_park.reset()
+
+    def current_time(self):
+        return self.time.time
+
+    def cars(self, start=0, stop=None):
+        # cars come with their positions, so the workers can render them (see `RemoteTaxiPark.position`)
+        return self.taxi_park.states(start, stop, positions=True)
+
+    def counts(self):
+        return [self.taxi_park.free_count, self.taxi_park.busy_count]
+
+    def snapshot(self):
+        if not self.snapshot_path:
+            raise ValueError("Snapshots are disabled, start the state process with --snapshot PATH")
+
+        from models.snapshot import save
+        return save(self.taxi_park, self.snapshot_path)
+
+    def execute(self, command):
+        '''
+            Executes a single command, e.g. ["tick", 1]
+            Returns: ["ok", result] or ["error", message]
+        '''
+
+        (op, *args) = command
+        if op not in COMMANDS:
+            return ['error', f"Unknown command '{op}'"]
+
+        try:
+            return ['ok', getattr(self, COMMANDS[op])(*args)]
+        except (TypeError, ValueError) as e:
+            return ['error', str(e)]
+
+
+# command -> method of FleetState executing it
+COMMANDS = {
+    'book': 'book',
+    'book_batch': 'book_batch',
+    'nearest': 'nearest',
+    'tick': 'tick',
+    'fast_forward': 'fast_forward',
+    'reset': 'reset',
+    'time': 'current_time',
+    'cars': 'cars',
+    'counts': 'counts',
+    'snapshot': 'snapshot',
+}
+
+
+async def serve(path, state):
+    '''
+        Serves commands of the workers on the Unix socket until cancelled.
+        Every command is executed without any awaits in between, so the event loop
+        executes them strictly one after another (in order of arrival).
+    '''
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                writer.write(dumps(state.execute(loads(line))) + b'\n')
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # lines with whole world can be huge, so we don't limit their size
+    server = await asyncio.start_unix_server(handle, path=path, limit=2 ** 31)
+
+    if state.snapshot_path and settings.snapshot_interval:
+        from models.snapshot import save_periodically
+        asyncio.create_task(save_periodically(state.snapshot, settings.snapshot_interval))
+
+    async with server:
+        await server.serve_forever()
+
+
+class FleetClient(object):
+    '''
+        The worker side: a blocking connection to the state process.
+        Calls are short and every worker holds its own connection, so a worker simply waits for
+        the answer (the same way it would spend this time searching for a car itself).
+        A call holds the lock until its answer is read, so calls from several threads of a worker
+        (e.g. with concurrent booking) don't mix up their commands and answers.
+    '''
+
+    def __init__(self, path=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path or settings.fleet_socket)
+        self._file = self._socket.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def call(self, *command):
+        with self._lock:
+            self._file.write(dumps(command) + b'\n')
+            self._file.flush()
+
+            (status, result) = loads(self._file.readline())
+        if status != 'ok':
+            raise RuntimeError(f"Fleet state process failed to execute {command[0]}: {result}")
+
+        return result
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class RemoteTime(object):
+    '''
+        Time of the state process, with the same interface as Time
+    '''
+
+    def __init__(self, client):
+        self._client = client
+
+    def tick(self, i=1):
+        # returns the time after the tick (unlike Time, nothing about the released cars)
+        return self._client.call('tick', i)
+
+    @property
+    def time(self):
+        return self._client.call('time')
+
+
+class RemoteCars(object):
+    '''
+        Cars of the state process as a read-only sequence (len, indexing, slicing, iteration),
+        fetched lazily and chunk by chunk, so the whole fleet doesn't have to be sent at once
+    '''
+
+    # how many cars are fetched at once while iterating
+    CHUNK_SIZE = 1000
+
+    def __init__(self, client):
+        self._client = client
+
+    def __len__(self):
+        return sum(self._client.call('counts'))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            (start, stop, step) = i.indices(len(self))
+            cars = [RemoteCarState(car) for car in self._client.call('cars', start, stop)]
+            return cars[::step]
+
+        if i < 0:
+            i += len(self)
+
+        cars = self._client.call('cars', i, i + 1) if i >= 0 else []
+        if not cars:
+            raise IndexError("car index out of range")
+
+        return RemoteCarState(cars[0])
+
+    def __iter__(self):
+        start = 0
+        while True:
+            cars = self._client.call('cars', start, start + self.CHUNK_SIZE)
+            yield from (RemoteCarState(car) for car in cars)
+
+            if len(cars) < self.CHUNK_SIZE:
+                return
+            start += self.CHUNK_SIZE
+
+
+class RemoteTaxiPark(object):
+    '''
+        Taxi park of the state process, with the part of TaxiPark interface used by the routes
+    '''
+
+    def __init__(self, client):
+        self._client = client
+
+    @staticmethod
+    def _booking(booking):
+        if not booking:
+            return None
+
+        (car_id, total_time) = booking
+        return (RemoteCar(car_id), total_time)
+
+    @staticmethod
+    def _requirements(requirements):
+        # requirements go as the last two arguments of a command (only when there are any)
+        return [] if requirements is None else [requirements.passengers, requirements.vehicle_type]
+
+    def book_closest(self, src, dst, requirements=None):
+        return self._booking(self._client.call('book', src.x, src.y, dst.x, dst.y, *self._requirements(requirements)))
+
+    def book_batch(self, trips, optimal=False):
+        trips = [[src.x, src.y, dst.x, dst.y] for (src, dst) in trips]
+        return [self._booking(booking) for booking in self._client.call('book_batch', trips, optimal)]
+
+    def find_nearest(self, src, k, requirements=None):
+        return [
+            (RemoteNearbyCar(car_id, Point(x, y)), dist)
+            for (car_id, x, y, dist) in self._client.call('nearest', src.x, src.y, k, *self._requirements(requirements))
+        ]
+
+    def fast_forward(self, units=1, until_free=False):
+        return self.advance(units, until_free)[2]
+
+    def advance(self, units=1, until_free=False):
+        '''
+            Advances time the same way as `.fast_forward` does, as a single command of the state process
+            Returns:
+            tuple(
+                - started (int): time before the tick
+                - current_time (int): time after the tick
+                - released (list of RemoteCar): cars which became free
+            )
+        '''
+
+        (started, current_time, released) = self._client.call('fast_forward', units, until_free)
+        return (started, current_time, [RemoteCar(car_id) for car_id in released])
+
+    def reset(self):
+        self._client.call('reset')
+
+    def snapshot(self):
+        return self._client.call('snapshot')
+
+    @property
+    def cars(self):
+        return RemoteCars(self._client)
+
+    @staticmethod
+    def position(car):
+        # positions are rendered by the state process together with the cars
+        return car.position
+
+    def states(self, start=0, stop=None, positions=False):
+        # cars come with their positions from the state process, which are dropped unless asked for
+        states = self._client.call('cars', start, stop)
+        if not positions:
+            for state in states:
+                del state['position']
+
+        return states
+
+    @property
+    def free_count(self):
+        return self._client.call('counts')[0]
+
+    @property
+    def busy_count(self):
+        return self._client.call('counts')[1]
+
+
+def connect(path=None):
+    '''
+        Connects to the state process
+        Returns:
+        tuple(
+            - taxi_park (RemoteTaxiPark)
+            - time (RemoteTime)
+        )
+    '''
+
+    client = FleetClient(path)
+    return (RemoteTaxiPark(client), RemoteTime(client))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=settings.fleet_socket, help="path of the Unix socket to listen on")
+    parser.add_argument('--cars', type=int, default=settings.num_cars)
+    parser.add_argument(
+        '--snapshot', default=settings.snapshot_path or None, metavar='PATH',
+        help="file to restore the fleet from on start (if it exists) and to snapshot it to",
+    )
+    args = parser.parse_args()
+
+    state = FleetState(args.cars, args.snapshot)
+
+    # stopping the process (e.g. by the container runtime) should leave the latest snapshot behind
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(serve(args.socket, state))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if state.snapshot_path:
+            state.snapshot()
+
+
+if __name__ == '__main__':
+    main()
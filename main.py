@@ -1,32 +1,161 @@
+import asyncio
+import os
 from datetime import datetime
+from math import ceil
+from time import perf_counter
+from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, StreamingResponse
 
 from settings import settings
 from models.time import Time
-from models.car import Car
-from models.taxi_park import TaxiPark
-from models.data import Trip
+from models.taxi_park import create_taxi_park
+from models.data import Point, Trip, BatchTrip, GRID_MIN, GRID_MAX
+from models.vehicle import VEHICLE_TYPES, Requirements
+from models import metrics
+from fastpath import parse_trip, encode_booking
+from world import MAX_PAGE_SIZE, STATUSES, dumps, page as world_page, stream as world_stream
 
 
 app = FastAPI()
+if settings.metrics:
+    app.add_middleware(metrics.RequestMetricsMiddleware)
 
 
 # the most convenient way to have shared access to some resource in our case is to
 # to have them as global variables and instantiate them on application startup 
 taxi_park = None
 time = None
+snapshots = None  # background task taking snapshots periodically
+wal = None  # write-ahead log of the operations (when enabled)
+wal_writer = None  # background task flushing the log
+rebalancer = None  # heatmap of demand and planner of moves of idle cars (local fleet backend only)
+
+# the most cars `/api/cars/nearest` returns at once
+MAX_NEAREST_CARS = 100
+
+# the most tiles `/api/demand` returns at once
+MAX_DEMAND_TILES = 1000
 
 
 @app.on_event("startup")
 def startup():
     global taxi_park
     global time
+    global wal
+    global rebalancer
+
+    restored = False
+
+    if settings.fleet_backend == 'shared':
+        # state is owned by a separate process shared by all workers (see fleet_server.py),
+        # which takes care of snapshots of it as well
+        from fleet_server import connect
+        (taxi_park, time) = connect()
+    elif settings.snapshot_path and os.path.exists(settings.snapshot_path):
+        # warm restart: the fleet is exactly as it was when the last snapshot was taken
+        # (imported here, so NumPy is loaded only when snapshots are actually used)
+        from models.snapshot import restore
+        (taxi_park, time) = restore(settings.snapshot_path)
+        restored = True
+    else:
+        time = Time()
+
+        taxi_park = create_taxi_park(time)
+        taxi_park.populate_with_n_cars(settings.num_cars)
+
+    if settings.wal_path:
+        wal = open_wal(restored)
+
+    if settings.fleet_backend != 'shared':
+        rebalancer = create_rebalancer()
+
+    metrics.watch_fleet(taxi_park)
+
 
-    time = Time()
+def create_rebalancer():
+    '''
+        Creates the heatmap of demand and the planner moving idle cars toward it
+    '''
+
+    if settings.rebalance_interval and (settings.wal_path or settings.concurrent_booking):
+        # moves aren't logged (so they wouldn't be replayed) and can't be made in the middle of concurrent bookings
+        raise ValueError("Periodic rebalancing is supported only without concurrent booking and write-ahead log")
+
+    from models.rebalancing import Rebalancer
+    return Rebalancer()
+
+
+def open_wal(restored):
+    '''
+        Replays the write-ahead log on top of the fleet (if the log starts from the same state)
+        and opens it for appending
+        Params:
+        - restored (bool): whether the fleet has been restored from the snapshot (or populated)
+    '''
 
-    taxi_park = TaxiPark(time)
-    taxi_park.populate_with_n_cars(settings.num_cars)
+    if settings.fleet_backend == 'shared' or settings.concurrent_booking:
+        # operations have to be logged in the same order as they are applied
+        raise ValueError("Write-ahead log is supported only by 'local' fleet backend without concurrent booking")
+
+    from models.wal import WriteAheadLog, fresh_base, snapshot_base, recover
+
+    base = snapshot_base(settings.snapshot_path) if restored else fresh_base(settings.num_cars, settings.fleet_mix)
+    (end, _) = recover(settings.wal_path, taxi_park, base)
+
+    return WriteAheadLog(settings.wal_path, base, end, settings.wal_commit_window, settings.wal_fsync)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    global snapshots
+    global wal_writer
+
+    if settings.fleet_backend != 'shared' and settings.snapshot_path and settings.snapshot_interval:
+        from models.snapshot import save_periodically
+        snapshots = asyncio.create_task(save_periodically(take_snapshot, settings.snapshot_interval))
+
+    if wal is not None:
+        wal_writer = asyncio.create_task(wal.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in (snapshots, wal_writer):
+        if task is not None:
+            task.cancel()
+
+    if settings.fleet_backend != 'shared' and settings.snapshot_path:
+        take_snapshot()
+
+    if wal is not None:
+        wal.close()
+
+
+def take_snapshot():
+    '''
+        Writes snapshot of the fleet into the file from settings
+        Returns:
+        - cars (int): number of cars in the snapshot
+    '''
+
+    if settings.fleet_backend == 'shared':
+        return taxi_park.snapshot()
+
+    if not settings.snapshot_path:
+        raise ValueError("Snapshots are disabled, set SNAPSHOT_PATH to enable them")
+
+    from models.snapshot import save
+    cars = save(taxi_park, settings.snapshot_path)
+
+    if wal is not None:
+        # everything logged so far is in the snapshot now
+        from models.wal import snapshot_base
+        wal.rotate(snapshot_base(settings.snapshot_path))
+
+    return cars
 
 
 # healthcheck endpoint, not in the requirements, but I believe it can be useful
@@ -40,13 +169,34 @@ async def healthcheck():
 
 
 @app.post("/api/tick")
-async def tick():
+async def tick(units: int = Query(1, ge=0), until_free: bool = False):
     '''
-        Endpoint to increase current time in the world by 1 unit
+        Endpoint to increase current time in the world by 1 unit (or by `units` units at once).
+        With `until_free=true` time skips exactly to the moment the next busy car finishes its trip
+        (and doesn't move when all cars are free). Either way the cost doesn't depend on how many
+        units are skipped, only on how many cars get free. Returns the new time
+        and IDs of the released cars, e.g. `POST /api/tick?units=1000`:
+        ```
+            {"time": 1000, "released": [3, 1]}
+        ```
     '''
 
-    time.tick()
-    return {'time': time.time}
+    if settings.fleet_backend == 'shared':
+        # a single command of the state process, so ticks of the other workers can't get in between
+        (started, current_time, released) = taxi_park.advance(units, until_free=until_free)
+    else:
+        started = time.time
+        released = taxi_park.fast_forward(units, until_free=until_free)
+        current_time = time.time
+
+    if wal is not None and current_time != started:
+        await wal.tick(current_time - started)
+
+    if rebalancer is not None:
+        # idle cars are moved toward the demand every `rebalance_interval` units (when it's set)
+        rebalancer.tick(taxi_park)
+
+    return {'time': current_time, 'released': [car.car_id for car in released]}
 
 
 @app.put("/api/reset")
@@ -57,10 +207,34 @@ async def reset():
     '''
 
     taxi_park.reset()
+    if wal is not None:
+        await wal.reset()
+    if rebalancer is not None:
+        rebalancer.reset()
+
     return {'status': 'OK'}
 
 
-@app.post("/api/book")
+@app.post("/api/snapshot")
+async def snapshot():
+    '''
+        Endpoint to take a snapshot of the fleet right now (into the file set by `SNAPSHOT_PATH`),
+        so the service can be restarted with the same state of the world. Returns how many cars
+        the snapshot has, current time and how long it took, e.g.:
+        ```
+            {"status": "OK", "cars": 3, "time": 12, "elapsed_ms": 0.4}
+        ```
+    '''
+
+    started = perf_counter()
+    try:
+        cars = take_snapshot()
+    except (ValueError, RuntimeError) as e:  # RuntimeError comes from the shared fleet state process
+        return JSONResponse({'detail': str(e)}, status_code=400)
+
+    return {'status': 'OK', 'cars': cars, 'time': time.time, 'elapsed_ms': (perf_counter() - started) * 1000}
+
+
 async def book(trip: Trip):
     '''
         Endpoint to book a trip for a customer. Finds the closest available (== without a customer)
@@ -80,9 +254,100 @@ async def book(trip: Trip):
               }
             }
         ```
+        Customers who need a bigger or a special car add `"passengers": 6` and/or `"vehicle_type": "van"`
+        (one of "sedan", "van" and "accessible"), and only the cars meeting that are searched for.
+    '''
+
+    booking = await book_closest(trip.source, trip.destination, trip.requirements())
+    return booking_response(booking)
+
+
+async def book_fast(request: Request):
+    '''
+        Fast path of the endpoint to book a trip for a customer (enabled with `FAST_BOOK=true`).
+        Accepts and returns exactly the same payloads, but skips pydantic models
+        on the way in and JSON encoder on the way out (see fastpath.py).
+    '''
+
+    try:
+        (src, dst, requirements) = parse_trip(await request.body())
+    except ValueError as e:
+        return JSONResponse({'detail': str(e)}, status_code=422)
+
+    booking = await book_closest(src, dst, requirements)
+    return Response(encode_booking(booking), media_type='application/json')
+
+
+async def book_closest(src, dst, requirements=None):
+    '''
+        Books the closest car (meeting the requirements, if any). With concurrent booking enabled the search
+        runs in a thread pool, so bookings don't block the event loop and each other (see models/concurrent_taxi_park.py)
+    '''
+
+    if rebalancer is not None:
+        # customers count as demand whether they get a car or not
+        rebalancer.record(src, time.time)
+
+    if settings.concurrent_booking:
+        return await run_in_threadpool(taxi_park.book_closest, src, dst, requirements)
+
+    booking = taxi_park.book_closest(src, dst, requirements)
+    if booking and wal is not None:
+        # failed bookings don't change anything, so there is nothing to log
+        await wal.book(src, dst, requirements)
+
+    return booking
+
+
+# fast path is quicker, but isn't described in the Swagger docs as nicely as the regular one
+app.post("/api/book")(book_fast if settings.fast_book else book)
+
+
+@app.post("/api/book/batch")
+async def book_many(batch: BatchTrip):
+    '''
+        Endpoint to book several trips at once. Returns result of the booking for every trip
+        (in the same format as `/api/book` does) and how long processing of the batch took.
+        By default trips are booked one by one in the given order. With `"optimal": true`
+        cars are assigned so the total pickup distance across the whole batch is minimal.
+        Example of request body would be:
+        ```
+            {
+              "trips": [
+                {"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}},
+                {"source": {"x": 1, "y": 0}, "destination": {"x": 1, "y": 1}}
+              ],
+              "optimal": false
+            }
+        ```
+    '''
+
+    if any(trip.requirements() for trip in batch.trips):
+        # cars of a batch are assigned amongst all free cars, whatever they are
+        return JSONResponse({'detail': "Requirements to the car are supported by /api/book only"}, status_code=422)
+
+    started = perf_counter()
+
+    trips = [(trip.source, trip.destination) for trip in batch.trips]
+    if rebalancer is not None:
+        for (src, _) in trips:
+            rebalancer.record(src, time.time)
+
+    bookings = taxi_park.book_batch(trips, optimal=batch.optimal)
+    if wal is not None:
+        await wal.batch(trips, batch.optimal)
+
+    return {
+        'results': [booking_response(booking) for booking in bookings],
+        'elapsed_ms': (perf_counter() - started) * 1000,
+    }
+
+
+def booking_response(booking):
+    '''
+        Renders result of a booking as a response payload
     '''
 
-    booking = taxi_park.book_closest(trip.source, trip.destination)
     if booking:
         (car, total_time) = booking
         return {'car_id': car.car_id, 'total_time': total_time}
@@ -91,11 +356,169 @@ async def book(trip: Trip):
     return {"status": "failed", "message": "No free cars available right now, please wait..."}
 
 
+@app.get("/api/cars/nearest")
+async def nearest_cars(
+    x: int = Query(..., ge=GRID_MIN, le=GRID_MAX),
+    y: int = Query(..., ge=GRID_MIN, le=GRID_MAX),
+    k: int = Query(5, ge=1, le=MAX_NEAREST_CARS),
+    passengers: Optional[int] = Query(None, ge=1),
+    vehicle_type: Optional[str] = Query(None, regex=f"^({'|'.join(VEHICLE_TYPES)})$"),
+):
+    '''
+        Endpoint to list the k nearest free cars to the point (e.g. to show them to the customer
+        before booking), ordered by distance and then by ID. ETA is how many units of time the car
+        needs to get to the point. Nothing is booked. With `passengers` and/or `vehicle_type` only the cars
+        meeting them are listed (the same way as by `/api/book`). Example of `GET /api/cars/nearest?x=3&y=1&k=2`:
+        ```
+            {
+              "time": 0,
+              "cars": [
+                {"car_id": 1, "location": {"x": 0, "y": 0}, "distance": 4, "eta": 4},
+                {"car_id": 2, "location": {"x": 0, "y": 0}, "distance": 4, "eta": 4}
+              ]
+            }
+        ```
+    '''
+
+    nearest = taxi_park.find_nearest(Point(x, y), k, Requirements.of(passengers, vehicle_type))
+
+    return {
+        'time': time.time,
+        'cars': [
+            {
+                'car_id': car.car_id,
+                'location': car.location.dict(),
+                'distance': dist,
+                # time goes in whole units, so non-integral distances take a unit more (see Car.book)
+                'eta': ceil(dist) if type(dist) is float else dist,
+            }
+            for (car, dist) in nearest
+        ],
+    }
+
+
+@app.get("/api/demand")
+async def demand(limit: int = Query(100, ge=1, le=MAX_DEMAND_TILES)):
+    '''
+        Endpoint to display the heatmap of demand: tiles of the world (`DEMAND_TILE_SIZE` units each)
+        where customers have asked for cars lately, the busiest first. Weight is the number of pickups
+        in the tile, every one of them counting half as much every `DEMAND_HALF_LIFE` units of time.
+        Example of `GET /api/demand?limit=1`:
+        ```
+            {
+              "time": 12,
+              "tile_size": 1000,
+              "tiles": [{"x": 0, "y": 0, "center": {"x": 500, "y": 500}, "weight": 2.83}]
+            }
+        ```
+    '''
+
+    if rebalancer is None:
+        return JSONResponse({'detail': "Heatmap of demand is supported only by 'local' fleet backend"}, status_code=400)
+
+    demand_map = rebalancer.demand
+    return {
+        'time': time.time,
+        'tile_size': demand_map.tile_size,
+        'tiles': [
+            {'x': x, 'y': y, 'center': demand_map.center((x, y)).dict(), 'weight': weight}
+            for ((x, y), weight) in demand_map.top(limit, time.time)
+        ],
+    }
+
+
+@app.post("/api/rebalance")
+async def rebalance(apply: bool = False):
+    '''
+        Endpoint to plan moves of idle cars toward the tiles where demand is higher than the idle cars
+        around can serve (see models/rebalancing.py), up to `REBALANCE_MAX_MOVES` cars at once.
+        Nothing is moved unless `apply=true`: then the cars drive to the centers of the tiles
+        (busy, without customers) and are free again once they get there. Example of `POST /api/rebalance`:
+        ```
+            {
+              "time": 12,
+              "moves": [{"car_id": 2, "from": {"x": 0, "y": 0}, "to": {"x": 500, "y": 500}, "distance": 1000}],
+              "applied": false
+            }
+        ```
+    '''
+
+    if rebalancer is None:
+        return JSONResponse({'detail': "Rebalancing is supported only by 'local' fleet backend"}, status_code=400)
+    if apply and (wal is not None or settings.concurrent_booking):
+        return JSONResponse(
+            {'detail': "Moving cars is supported only without concurrent booking and write-ahead log"}, status_code=400,
+        )
+
+    moves = rebalancer.plan(taxi_park)
+    payload = [
+        {'car_id': move.car.car_id, 'from': move.car.location.dict(), 'to': move.target.dict(), 'distance': move.distance}
+        for move in moves
+    ]
+    if apply:
+        rebalancer.apply(taxi_park, moves)
+
+    return {'time': time.time, 'moves': payload, 'applied': apply}
+
+
 # debug endpoint, not in the requirements, but I believe it can be useful
 @app.get("/api/world")
-async def world():
+async def world(
+    cursor: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    status: Optional[str] = Query(None, regex=f"^({'|'.join(STATUSES)})$"),
+    x_min: Optional[int] = None,
+    y_min: Optional[int] = None,
+    x_max: Optional[int] = None,
+    y_max: Optional[int] = None,
+    format: str = Query('json', regex='^(json|ndjson)$'),
+    positions: bool = False,
+):
+    '''
+        Endpoint to display current state of the world, with cars' state, the current time
+        and how many cars are free/busy right now.
+        For big fleets cars can be:
+        - paginated: `?limit=1000` returns up to 1000 cars and `next_cursor` to pass as `?cursor=`
+          for the next page (null on the last page)
+        - filtered: by `status=free|busy` and by a bounding box (`x_min`, `y_min`, `x_max`, `y_max`, inclusive)
+        - streamed as NDJSON (one car per line): `?format=ndjson` (current time is in `X-World-Time` header),
+          which keeps memory bounded and lets other requests run while the fleet is being rendered
+        With `positions=true` every car has `position` as well: the point it's at right now on the way
+        of its trip (while `location` is where it gets free), and the bounding box filters cars by it
     '''
-        Endpoint to display current state of the world, with cars' state and the current time.
+
+    current_time = time.time
+    bbox = (x_min, y_min, x_max, y_max) if any(v is not None for v in (x_min, y_min, x_max, y_max)) else None
+    if format == 'ndjson':
+        return StreamingResponse(
+            world_stream(taxi_park, current_time, cursor, status, bbox, positions),
+            media_type='application/x-ndjson',
+            headers={'X-World-Time': str(current_time)},
+        )
+
+    (cars, next_cursor) = world_page(taxi_park, current_time, cursor, limit, status, bbox, positions)
+    payload = {
+        'cars': cars,
+        'time': current_time,
+        'free': taxi_park.free_count,
+        'busy': taxi_park.busy_count,
+    }
+    if limit is not None:
+        payload['next_cursor'] = next_cursor
+
+    # the payload is plain JSON already, so it's rendered without the (slow) generic encoder
+    return Response(dumps(payload), media_type='application/json')
+
+
+async def metrics_endpoint():
+    '''
+        Endpoint exposing metrics of the service (latencies of the routes, closest car search,
+        booking and tick, results of bookings and fleet utilisation) in Prometheus text format.
+        Available only when metrics are enabled in settings.
     '''
 
-    return {'cars': taxi_park.cars, 'time': time.time}
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+if settings.metrics:
+    app.get("/api/metrics", response_class=PlainTextResponse)(metrics_endpoint)
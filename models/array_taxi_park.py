@@ -0,0 +1,697 @@
+import heapq
+from math import ceil
+
+import numpy as np
+
+from .car import Car
+from .data import Point, ORIGIN
+from .distance import default as default_metric
+from .time import Time, fast_forward
+from .journey import Journey, positions
+from .dispatch import book_batch, nearest_rows
+from .vehicle import SEDAN, Vehicle, eligible, fleet_blocks
+from . import metrics
+from settings import settings
+
+
+# value of `booked_until` for the cars which have never been booked (i.e. `None` for Car)
+NEVER_BOOKED = np.iinfo(np.int64).min
+
+# columns with the trips of the cars
+TRIP_COLUMNS = ('_start_xs', '_start_ys', '_pickup_xs', '_pickup_ys', '_departures')
+
+
+class CarView(object):
+    '''
+        Lightweight view of a single car stored in ArrayTaxiPark.
+        Exposes the same API as Car, but all the data lives in the arrays of the park,
+        so creating a view is cheap and views don't have to be kept around.
+    '''
+
+    __slots__ = ('_park', '_row')
+
+    def __init__(self, park, row):
+        self._park = park
+        self._row = row
+
+    def __repr__(self):
+        return (
+            f"(ID={self.car_id}, Location={self.location}, "
+            f"Booked_till={self.booked_until})"
+        )
+
+    @property
+    def car_id(self):
+        return int(self._park._ids[self._row])
+
+    @property
+    def location(self):
+        # values are coming from our own arrays, so there is no need to validate them again
+        return Point(int(self._park._xs[self._row]), int(self._park._ys[self._row]))
+
+    @location.setter
+    def location(self, location):
+        self._park._xs[self._row] = location.x
+        self._park._ys[self._row] = location.y
+
+    @property
+    def vehicle(self):
+        return Vehicle.from_code(int(self._park._vehicles[self._row]))
+
+    @property
+    def booked_until(self):
+        booked_until = self._park._booked_until[self._row]
+        return None if booked_until == NEVER_BOOKED else int(booked_until)
+
+    @booked_until.setter
+    def booked_until(self, booked_until):
+        # only None is "never booked", a trip of no length booked at time 0 ends at 0 (as with Car)
+        self._park._booked_until[self._row] = NEVER_BOOKED if booked_until is None else booked_until
+
+    def distance(self, dst, metric=None):
+        return (metric or self._park.metric).distance(self.location, dst)
+
+    def free_now(self, current_time):
+        return bool(self._park._booked_until[self._row] <= current_time)
+
+    def book(self, src, dst, current_time, dist_to_client, metric=None):
+        # a busy car sets off only once it drops off its current customer (see Car.book)
+        wait = max(int(self._park._booked_until[self._row]) - current_time, 0)
+        trip_time = wait + dist_to_client + src.distance(dst, metric or self._park.metric)
+        if type(trip_time) is float:
+            trip_time = ceil(trip_time)  # time goes in whole units (see Car.book)
+
+        self._park._start_trip(self._row, src, current_time, current_time + wait)
+        self.booked_until = current_time + trip_time
+        self.location = dst
+
+        return trip_time
+
+    def reset(self):
+        self.location = ORIGIN
+        self.booked_until = None
+
+    def to_dict(self):
+        return {'car_id': self.car_id, 'location': self.location.dict(), 'booked_until': self.booked_until}
+
+
+class CarViews(object):
+    '''
+        Read-only sequence of CarView objects, so `ArrayTaxiPark.cars` can be used
+        the same way as the list of cars of TaxiPark (len, indexing, slicing, iteration)
+    '''
+
+    def __init__(self, park):
+        self._park = park
+
+    def __len__(self):
+        return self._park._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [CarView(self._park, row) for row in range(*i.indices(self._park._size))]
+
+        if i < 0:
+            i += self._park._size
+        if not 0 <= i < self._park._size:
+            raise IndexError("car index out of range")
+
+        return CarView(self._park, i)
+
+    def __iter__(self):
+        return (CarView(self._park, i) for i in range(self._park._size))
+
+
+class ArrayTaxiPark(object):
+    '''
+        Alternative storage engine of the taxi park (struct of arrays instead of a list of objects).
+        Car IDs, coordinates, `booked_until` and vehicle classes (`Vehicle.code`) of all cars are kept
+        in contiguous int64 NumPy arrays, which takes 40 bytes per car (instead of ~250 bytes for a Car object)
+        and allows to find the closest free car in a single vectorized pass over the fleet.
+        Busy cars don't have to be tracked for the search (it masks them out by `booked_until`),
+        but they are still kept in a min-heap of (booked_until, row), so a tick can tell
+        which cars have got free without looking through the whole fleet.
+
+        Distances to all cars are computed at once by the batched kernel of the metric (see `models.distance`).
+
+        With future dispatch (`settings.future_dispatch`) busy cars compete for bookings as well,
+        by `max(booked_until - now, 0) + distance` from their drop-off locations (see TaxiPark),
+        which is a single vectorized pass too.
+
+        Trips of the cars (the point a car sets off from, the pickup and when it sets off, see `models.journey`)
+        are kept in columns of their own as well, created on the first booking. So positions of all cars
+        are a single vectorized pass too (see `.positions`). The few trips cars are still on when they
+        are booked for the next ones (with future dispatch) are kept aside as Journey objects.
+
+        Rows of the cars of every vehicle class (see `models.vehicle`) are kept aside (classes of cars never
+        change, so they are only collected again after cars are added), and a search for a customer
+        with requirements scores only the rows of the classes meeting them.
+
+        Has the same interface as TaxiPark, with cars exposed as CarView objects.
+        Selected by `fleet_store = "arrays"` in settings.
+    '''
+
+    def __init__(self, time, capacity=16, metric=None, future_dispatch=None):
+        if not isinstance(time, Time):
+            raise TypeError("Please pass an instance of Time class to the class constructor")
+
+        self.time = time
+        self.metric = metric or default_metric
+        # whether busy cars can be booked as well (see `.find_soonest`)
+        self.future_dispatch = settings.future_dispatch if future_dispatch is None else future_dispatch
+
+        self._size = 0
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._xs = np.empty(capacity, dtype=np.int64)
+        self._ys = np.empty(capacity, dtype=np.int64)
+        self._booked_until = np.empty(capacity, dtype=np.int64)
+        self._vehicles = np.empty(capacity, dtype=np.int64)
+
+        # trips of the cars (None until the first booking) and row -> trip the car is still on
+        # when it's been booked for the next one (see `models.journey`)
+        self._start_xs = self._start_ys = self._pickup_xs = self._pickup_ys = self._departures = None
+        self._previous = {}
+
+        # Vehicle -> rows of its cars, and rows of the cars of the given classes (None until a filtered search)
+        self._classes = None
+        self._eligible_rows = {}
+
+        # heap of tuples (booked_until, row) for all busy cars (a single one per car, so it's the busy count as well)
+        self._busy = []
+
+        # while cars are added in order of increasing IDs (as `.populate_with_n_cars` does), the first
+        # car within the minimal distance is the one with the smallest ID, so we can skip an extra pass
+        self._ids_sorted = True
+
+        self.time.subscribe(self.release_finished)
+
+    @property
+    def cars(self):
+        return CarViews(self)
+
+    @property
+    def busy_count(self):
+        return len(self._busy)
+
+    @property
+    def free_count(self):
+        return self._size - len(self._busy)
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._ids):
+            return
+
+        # growing geometrically, so adding cars one by one is amortized O(1)
+        capacity = max(capacity, 2 * len(self._ids))
+        names = ['_ids', '_xs', '_ys', '_booked_until', '_vehicles']
+        if self._departures is not None:
+            names.extend(TRIP_COLUMNS)
+        for name in names:
+            array = getattr(self, name)
+            resized = np.empty(capacity, dtype=np.int64)
+            resized[:self._size] = array[:self._size]
+            setattr(self, name, resized)
+
+    def add_car(self, car):
+        '''
+            Adds a new car to our taxi park (copying its state into the arrays)
+            Params:
+            - car (Car): instance of a Car which will be added to the Taxi Park
+        '''
+
+        if not isinstance(car, Car):
+            raise TypeError("Please pass an instance of Car class to .add_car()")
+
+        self._reserve(self._size + 1)
+
+        row = self._size
+        if row and car.car_id <= self._ids[row - 1]:
+            self._ids_sorted = False
+
+        self._ids[row] = car.car_id
+        self._xs[row] = car.location.x
+        self._ys[row] = car.location.y
+        self._booked_until[row] = NEVER_BOOKED if car.booked_until is None else car.booked_until
+        self._vehicles[row] = car.vehicle.code
+        self._size += 1
+        self._classes = None
+        self._clear_trips(slice(row, row + 1))
+
+        if not car.free_now(self.time.time):
+            heapq.heappush(self._busy, (car.booked_until, row))
+
+    def populate_with_n_cars(self, n=0, mix=None):
+        '''
+            Creates N cars with consecutive IDs from 1 to N (inclusive) at the origin
+            Params:
+            - n (int): how many cars to create and add to the collections
+            - mix (dict): share of the cars of every vehicle type (`settings.fleet_mix` by default,
+              see `models.vehicle.fleet_blocks`)
+        '''
+
+        blocks = fleet_blocks(n, settings.fleet_mix if mix is None else mix)
+
+        self._reserve(self._size + n)
+
+        rows = slice(self._size, self._size + n)
+        if self._size and self._ids[self._size - 1] >= 1:
+            self._ids_sorted = False
+
+        self._ids[rows] = np.arange(1, n + 1)
+        self._xs[rows] = 0
+        self._ys[rows] = 0
+        self._booked_until[rows] = NEVER_BOOKED
+        self._vehicles[rows] = np.repeat([vehicle.code for (vehicle, _) in blocks], [count for (_, count) in blocks])
+        self._size += n
+        self._classes = None
+        self._clear_trips(rows)
+
+    def adopt(self, ids, xs, ys, booked_until, vehicles=None):
+        '''
+            Replaces all cars of the park with the given columns (e.g. memory-mapped from a snapshot)
+            without copying them. Only busy cars are looked at one by one (to build the busy heap)
+            Params:
+            - ids, xs, ys, booked_until (int64 arrays of the same length): state of the cars
+              (`booked_until` is NEVER_BOOKED for the cars which have never been booked)
+            - vehicles (int64 array): codes of vehicle classes of the cars (all of them are sedans by default)
+        '''
+
+        self._ids = ids
+        self._xs = xs
+        self._ys = ys
+        self._booked_until = booked_until
+        self._vehicles = vehicles if vehicles is not None else np.full(len(ids), SEDAN.code, dtype=np.int64)
+        self._size = len(ids)
+        self._classes = None
+        self._ids_sorted = bool(np.all(ids[1:] > ids[:-1]))
+        # trips aren't in the snapshots, so busy cars are at their drop-offs till they are booked again
+        self._start_xs = self._start_ys = self._pickup_xs = self._pickup_ys = self._departures = None
+        self._previous = {}
+
+        busy = np.flatnonzero(booked_until > self.time.time)
+        self._busy = list(zip(booked_until[busy].tolist(), busy.tolist()))
+        heapq.heapify(self._busy)
+
+    def release_finished(self, current_time):
+        '''
+            Cars are considered free as soon as `booked_until` is in the past, so the arrays stay as they are,
+            only the cars which have finished their trips by `current_time` are popped from the busy heap
+            Params:
+            - current_time (int): current time in the world
+
+            Returns:
+            - released (list): views of the cars which became free
+        '''
+
+        released = []
+        while self._busy and self._busy[0][0] <= current_time:
+            (_, row) = heapq.heappop(self._busy)
+            booked_until = int(self._booked_until[row])
+            if booked_until > current_time:
+                # the car has been booked for another trip meanwhile (future dispatch), so it's busy till its end
+                heapq.heappush(self._busy, (booked_until, row))
+                continue
+
+            self._previous.pop(row, None)
+            released.append(CarView(self, row))
+
+        return released
+
+    def next_release_time(self):
+        '''
+            Returns the earliest `booked_until` amongst the busy cars (or None if all cars are free)
+        '''
+
+        # cars booked for another trip meanwhile (future dispatch) are pushed to the end of it first
+        while self._busy and self._booked_until[self._busy[0][1]] != self._busy[0][0]:
+            row = self._busy[0][1]
+            heapq.heapreplace(self._busy, (int(self._booked_until[row]), row))
+
+        return self._busy[0][0] if self._busy else None
+
+    def fast_forward(self, units=1, until_free=False):
+        '''
+            Advances time by many units at once (see `models.time.fast_forward` for the details)
+        '''
+
+        return fast_forward(self, units, until_free=until_free)
+
+    def _clear_trips(self, rows):
+        # cars without trips "drive" from their location to their location
+        if self._departures is not None:
+            (self._start_xs[rows], self._start_ys[rows]) = (self._xs[rows], self._ys[rows])
+            (self._pickup_xs[rows], self._pickup_ys[rows]) = (self._xs[rows], self._ys[rows])
+            self._departures[rows] = 0
+
+    def _start_trip(self, row, src, current_time, departure):
+        '''
+            Records the trip the car is booked for (before it's moved to the destination)
+        '''
+
+        if self._departures is None:
+            for name in TRIP_COLUMNS:
+                setattr(self, name, np.empty(len(self._ids), dtype=np.int64))
+            self._clear_trips(slice(0, self._size))
+
+        if departure > current_time:
+            # the car is still on its current trip (see `models.journey`)
+            self._previous[row] = self._journey(row).trim(current_time)
+        else:
+            self._previous.pop(row, None)
+
+        (self._start_xs[row], self._start_ys[row]) = (self._xs[row], self._ys[row])
+        (self._pickup_xs[row], self._pickup_ys[row]) = (src.x, src.y)
+        self._departures[row] = departure
+
+    def _journey(self, row):
+        return Journey(
+            Point(int(self._start_xs[row]), int(self._start_ys[row])),
+            Point(int(self._pickup_xs[row]), int(self._pickup_ys[row])),
+            Point(int(self._xs[row]), int(self._ys[row])),
+            int(self._departures[row]),
+            self._previous.get(row),
+        )
+
+    def position(self, car):
+        '''
+            Returns where the car is right now: on the way of its trip while it's busy,
+            at its location once it's free (see `models.journey`)
+        '''
+
+        row = car._row
+        if self._departures is None or self._booked_until[row] <= self.time.time:
+            return car.location
+
+        return self._journey(row).position(self.time.time, self.metric)
+
+    def states(self, start=0, stop=None, positions=False):
+        '''
+            Returns states of the cars from `start` to `stop` (positions in `.cars`) as `CarView.to_dict` does,
+            with the positions of the cars as well if asked for
+        '''
+
+        states = []
+        for row in range(*slice(start, stop).indices(self._size)):
+            car = CarView(self, row)
+            state = car.to_dict()
+            if positions:
+                state['position'] = self.position(car).dict()
+            states.append(state)
+
+        return states
+
+    def positions(self):
+        '''
+            Returns IDs and current positions of all cars (in order of `.cars`) in one vectorized pass
+            over the columns of their trips (only the cars which haven't set off on the trips they are booked for
+            yet are looked at one by one)
+            Returns:
+            tuple(
+                - ids (int64 NumPy array)
+                - xs (int64 NumPy array)
+                - ys (int64 NumPy array)
+            )
+        '''
+
+        n = self._size
+        ids = self._ids[:n].copy()
+        if self._departures is None:
+            return (ids, self._xs[:n].copy(), self._ys[:n].copy())
+
+        current_time = self.time.time
+        (xs, ys) = positions(current_time, self.metric, *(getattr(self, name)[:n] for name in (
+            '_start_xs', '_start_ys', '_pickup_xs', '_pickup_ys', '_xs', '_ys', '_departures',
+        )))
+
+        for row in self._previous:
+            if current_time < self._departures[row]:
+                position = self._journey(row).position(current_time, self.metric)
+                (xs[row], ys[row]) = (position.x, position.y)
+
+        return (ids, xs, ys)
+
+    def _rows(self, requirements):
+        '''
+            Returns rows of the cars meeting the requirements in increasing order
+            (None when any car will do, so the search takes all the columns as they are)
+        '''
+
+        if requirements is None:
+            return None
+
+        if self._classes is None:
+            codes = self._vehicles[:self._size]
+            self._classes = {
+                Vehicle.from_code(code): np.flatnonzero(codes == code) for code in np.unique(codes).tolist()
+            }
+            self._eligible_rows = {}
+
+        vehicles = eligible(self._classes, requirements)
+        if vehicles is None:
+            return None
+
+        key = tuple(vehicles)
+        if key not in self._eligible_rows:
+            rows = [self._classes[vehicle] for vehicle in vehicles]
+            self._eligible_rows[key] = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+        return self._eligible_rows[key]
+
+    def _columns(self, rows, *names):
+        # the given columns of all cars (as views) or of the given rows only (as copies)
+        n = self._size
+        return [getattr(self, name)[:n] if rows is None else getattr(self, name)[rows] for name in names]
+
+    @metrics.timed(metrics.FIND_CLOSEST_SECONDS)
+    def find_closest(self, src, requirements=None):
+        '''
+            Finds the closest available car to the customer in one vectorized pass:
+            masks busy cars out, computes distances to all cars (with the batched kernel of the metric)
+            and takes the minimum (with the smallest ID amongst the cars at the minimal distance,
+            i.e. the same distance for integral metrics or closer than `settings.eps` for the others).
+            With requirements only the cars of the vehicle classes meeting them are looked at.
+            Params:
+            - src (Location): current location of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - closest_car (CarView): the closest car with the lowest ID,
+                - min_dist (int): distance between location of the customer and closest car
+            ) or None (if there are no available cars at the moment)
+        '''
+
+        rows = self._rows(requirements)
+        n = self._size if rows is None else len(rows)
+        if metrics.enabled:
+            metrics.CARS_SCANNED.observe(n)  # all (eligible) cars are looked at, free or not
+
+        if not n:
+            return
+
+        (xs, ys, booked_until) = self._columns(rows, '_xs', '_ys', '_booked_until')
+        free = booked_until <= self.time.time
+        if not free.any():  # if we didn't find any free cars at all
+            return
+
+        dist = self.metric.scores(xs, ys, src)
+        # busy cars are pushed out of the way (coordinates fit int32, so distances never get there)
+        dist[~free] = np.inf if dist.dtype.kind == 'f' else np.iinfo(dist.dtype).max
+
+        return self._best(dist, rows)
+
+    def _best(self, dist, rows=None):
+        '''
+            Returns (view, value) of the car with the smallest value (distance or ETA),
+            with the smallest ID amongst the cars with the same value
+            (values are of all cars or of the given rows)
+        '''
+
+        i = int(np.argmin(dist))
+        min_dist = dist[i].item()
+
+        # rows are in increasing order, so IDs of the rows are sorted whenever all IDs are
+        if not self.metric.integral or not self._ids_sorted:
+            ids = self._ids[:self._size] if rows is None else self._ids[rows]
+            same = dist < min_dist + self.metric.tolerance if not self.metric.integral else dist == min_dist
+            candidates = np.flatnonzero(same)
+            i = int(candidates[np.argmin(ids[candidates])])
+
+        return (CarView(self, i if rows is None else int(rows[i])), min_dist)
+
+    @metrics.timed(metrics.FIND_SOONEST_SECONDS)
+    def find_soonest(self, src, requirements=None):
+        '''
+            Finds the car which can get to the customer the soonest, busy cars included (future dispatch):
+            the one with the smallest `max(booked_until - now, 0) + distance` (and the lowest ID in case of a tie),
+            where a busy car sets off from the location it drops off its current customer at
+            Params:
+            - src (Location): current location of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - car (CarView): the car which gets to the customer first,
+                - eta (int): how long the customer waits for it
+            ) or None (if there are no cars at all)
+        '''
+
+        rows = self._rows(requirements)
+        n = self._size if rows is None else len(rows)
+        if metrics.enabled:
+            metrics.CARS_SCANNED.observe(n)
+
+        if not n:
+            return
+
+        (xs, ys, booked_until) = self._columns(rows, '_xs', '_ys', '_booked_until')
+        now = self.time.time
+        # cars which have never been booked are NEVER_BOOKED, so they wait 0 as well
+        wait = np.maximum(booked_until, now)
+        wait -= now
+
+        eta = self.metric.scores(xs, ys, src)
+        eta += wait
+
+        return self._best(eta, rows)
+
+    @metrics.timed(metrics.FIND_NEAREST_SECONDS)
+    def find_nearest(self, src, k, requirements=None):
+        '''
+            Finds up to k nearest available cars to the customer, ordered by (distance, car ID):
+            distances to all cars are computed in one vectorized pass (the same way as by `.find_closest`),
+            the k best are partitioned out in O(N) and only those get sorted (in O(k logk))
+            Params:
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - requirements (Requirements): what the cars have to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            - nearest (list): tuples (car, distance), fewer than k if there are not enough free cars
+        '''
+
+        if k < 1:
+            raise ValueError("Number of the nearest cars to find must be positive")
+
+        rows = self._rows(requirements)
+        (ids, xs, ys, booked_until) = self._columns(rows, '_ids', '_xs', '_ys', '_booked_until')
+        free = booked_until <= self.time.time
+        if not free.any():
+            return []
+
+        dist = self.metric.scores(xs, ys, src)
+        dist[~free] = np.inf if dist.dtype.kind == 'f' else np.iinfo(dist.dtype).max
+
+        best = nearest_rows(dist, ids, k)
+        best = best[free[best]]  # when there are fewer free cars than k, busy ones get in as well
+        best = best[np.lexsort((ids[best], dist[best]))]
+
+        found = best.tolist() if rows is None else rows[best].tolist()
+        return [(CarView(self, row), d) for (row, d) in zip(found, dist[best].tolist())]
+
+    def free_cars(self):
+        '''
+            Returns iterator over all cars which are available right now
+        '''
+
+        free = self._booked_until[:self._size] <= self.time.time
+        return (CarView(self, int(row)) for row in np.flatnonzero(free))
+
+    def idle_cars(self, k=0):
+        '''
+            Returns the cars available right now (see TaxiPark, all cars of the arrays are up to date)
+            Returns:
+            tuple(
+                - cars (list): free cars
+                - untouched (int): always 0
+            )
+        '''
+
+        return (list(self.free_cars()), 0)
+
+    def book(self, car, src, dst, dist_to_client=None):
+        '''
+            Books the trip on the given (free) car
+            Params:
+            - car (CarView): car which will take the trip
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - dist_to_client (int): distance between the car and the customer (if already known)
+
+            Returns:
+            - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+        '''
+
+        if dist_to_client is None:
+            dist_to_client = car.distance(src, self.metric)
+
+        # a busy car is in the heap already (it's pushed further on when it turns out there)
+        queued = not car.free_now(self.time.time)
+
+        total_time = car.book(src, dst, current_time=self.time.time, dist_to_client=dist_to_client, metric=self.metric)
+        # a zero-length trip is over already, so the car stays free (see TaxiPark.book)
+        if not queued and not car.free_now(self.time.time):
+            heapq.heappush(self._busy, (int(self._booked_until[car._row]), car._row))
+
+        return total_time
+
+    @metrics.timed(metrics.BOOK_CLOSEST_SECONDS)
+    def book_closest(self, src, dst, requirements=None):
+        '''
+            Books the trip on the closest taxi car to the client and drives to the destination
+            Params:
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - car (CarView): the car that accepted the trip
+                - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+            ) or None (if there are not available cars at the moment)
+        '''
+
+        if self.future_dispatch:
+            closest = self.find_soonest(src, requirements)
+        else:
+            closest = self.find_closest(src, requirements)
+
+        if not closest:
+            if metrics.enabled:
+                metrics.BOOKINGS_FAILED.inc()
+            return
+
+        car = closest[0]
+        # with future dispatch the second value is the ETA, while the booking needs the distance itself
+        total_time = self.book(car, src, dst, dist_to_client=None if self.future_dispatch else closest[1])
+
+        if metrics.enabled:
+            metrics.BOOKINGS_SUCCEEDED.inc()
+
+        return (car, total_time)
+
+    def book_batch(self, trips, optimal=False):
+        '''
+            Books a batch of trips at once (see `models.dispatch.book_batch` for the details)
+            Params:
+            - trips (list of tuples (src, dst)): source and destination locations of the customers
+            - optimal (bool): whether to minimize the total pickup distance across the batch
+
+            Returns:
+            - bookings (list): tuple (car, total_time) or None for every trip
+        '''
+
+        return book_batch(self, trips, optimal=optimal)
+
+    def reset(self):
+        '''
+            Resets all cars to the default state
+            i.e. to the position (0, 0) on a grid and without passangers
+        '''
+
+        self._xs[:self._size] = 0
+        self._ys[:self._size] = 0
+        self._booked_until[:self._size] = NEVER_BOOKED
+        self._busy = []
+        self._clear_trips(slice(0, self._size))
+        self._previous = {}
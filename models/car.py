@@ -1,4 +1,12 @@
-from .data import Location
+import threading
+from bisect import bisect_right
+from itertools import repeat
+from math import ceil
+
+from .data import Location, Point, ORIGIN
+from .distance import default as default_metric
+from .journey import Journey
+from .vehicle import SEDAN
 
 
 class Car(object):
@@ -6,15 +14,25 @@ class Car(object):
         Represents a single Car entity. We store information about car ID,
         current location (or location in which car will be free eventually after dropping a customer)
         and timestamp at which current taxi car would be free or since when has been free.
+
+        Cars are the bulk of the memory of the service, so they keep only these attributes
+        (in `__slots__`, without an instance dict) and location as a Point, not a pydantic model.
+        Generation is maintained by the taxi park the car belongs to (see `models.generation`).
+        Vehicle class (type and capacity, see `models.vehicle`) is shared by all cars of the class.
+        The trip a car is on is kept as well (as a journey), so it's known where exactly the car is (see `models.journey`).
     '''
 
-    def __init__(self, car_id, location=None):
+    __slots__ = ('car_id', 'location', 'booked_until', 'generation', 'vehicle', 'journey')
+
+    def __init__(self, car_id, location=None, vehicle=None):
         self.car_id = car_id
+        self.generation = 0
+        self.vehicle = vehicle or SEDAN
 
         self.reset()
 
-        if location and isinstance(location, Location):
-            self.location = location
+        if location and isinstance(location, (Location, Point)):
+            self.location = Point.of(location)
 
     def __repr__(self):
         return (
@@ -22,25 +40,34 @@ class Car(object):
             f"Booked_till={self.booked_until})"
         )
 
-    def distance(self, dst):
+    def distance(self, dst, metric=None):
         '''
             Calculates distance between current location and dst
             Params:
             - dst (Location): other point distance to which we want to find out
+            - metric (Metric): how to measure it (Manhattan by default, see models/distance.py)
 
             Returns:
-            - dist (int): Manhatten distance between the car and dst
+            - dist (int): distance between the car and dst
+        '''
+
+        return self.location.distance(dst, metric)
+
+    def to_dict(self):
+        '''
+            Returns state of the car as a dict (e.g. to be rendered as JSON)
         '''
 
-        return self.location.distance(dst)
+        return {'car_id': self.car_id, 'location': self.location.dict(), 'booked_until': self.booked_until}
 
     def reset(self):
         '''
             Resets the car to ~the big bang~ initial state
         '''
 
-        self.location = Location(x=0, y=0)  # puts the car to the origin (0, 0)
+        self.location = ORIGIN  # puts the car to the origin (0, 0)
         self.booked_until = None  # "frees up" the car
+        self.journey = None
 
     def free_now(self, current_time):
         '''
@@ -65,7 +92,24 @@ class Car(object):
         # otherwise car hasn't finished the trip to deliver a passanger
         return False
 
-    def book(self, src, dst, current_time, dist_to_client):
+    def position(self, current_time, metric=None):
+        '''
+            Finds out where the car actually is: somewhere on the way of its trip while it's busy,
+            at its location once it's free
+            Params:
+            - current_time (int): current time in the world
+            - metric (Metric): how distances are measured (Manhattan by default)
+
+            Returns:
+            - position (Point)
+        '''
+
+        if self.journey is None or self.free_now(current_time):
+            return self.location
+
+        return self.journey.position(current_time, metric or default_metric)
+
+    def book(self, src, dst, current_time, dist_to_client, metric=None):
         '''
             Books a ride for the car.
             Params:
@@ -74,22 +118,116 @@ class Car(object):
             - current_time (int): current time stamp in our world
             - dist_to_client (int): distance between initial location of the car
                 and source location of a customer (this parameter doesn't look good here,
-                but otherwise we would have to compute the same distance twice)
+                but otherwise we would have to compute the same distance twice).
+                For a busy car it's the distance from its current destination, and the trip
+                starts when the current one ends
+            - metric (Metric): how distances are measured (Manhattan by default)
 
             Returns:
-            - trip_time (int): total trip time, including taxi reaching the source location
-                of the customer and then reaching client's destination
+            - trip_time (int): total trip time, including taxi finishing its current trip (if any),
+                reaching the source location of the customer and then reaching client's destination
         '''
 
+        # a busy car (booked by future dispatch) sets off only once it drops off its current customer
+        wait = max(self.booked_until - current_time, 0) if self.booked_until else 0
         # how far we will have to travel after picking up passanger
-        dist_to_destination = src.distance(dst)
+        dist_to_destination = src.distance(dst, metric)
         # total trip time for the user (incl time waiting for the taxi and the ride itself)
-        trip_time = dist_to_client + dist_to_destination
+        trip_time = wait + dist_to_client + dist_to_destination
+        if type(trip_time) is float:
+            # time in our world goes in whole units, so the trip lasts till the end of the last one
+            trip_time = ceil(trip_time)
+
+        # the car sets off from where it is (or from where it drops off its current customer) and
+        # keeps the current trip, if any, to know its position till then
+        previous = self.journey.trim(current_time) if wait and self.journey is not None else None
+        start = self.location
 
         # we reserve this taxi car starting from now for total trip duration
         self.booked_until = current_time + trip_time
 
         # and we update location to the one to which we will reach at time `booked_until`
-        self.location = dst
+        # (without keeping the request's model around)
+        self.location = Point.of(dst)
+        self.journey = Journey(start, Point.of(src), self.location, current_time + wait, previous)
 
         return trip_time
+
+
+class CarList(object):
+    '''
+        List of all cars of a taxi park, which can be extended with a whole block of new cars at once
+        (with consecutive IDs, free and at the origin) without creating a Car object for each of them:
+        a block takes one slot per car, and the Car is created when somebody accesses it for the first time.
+        That's what lets a park of millions of cars start in milliseconds (see `.populate_with_n_cars`).
+
+        Cars of a block are created stamped with generation -1, i.e. untouched by the park
+        (see `models.generation`), so the park treats them as free cars at the origin which aren't
+        in its index yet, exactly as after a reset. Searches create only the cars they hand out.
+
+        Supports what the parks and their readers need from a list: len, indexing, slices,
+        iteration and append.
+    '''
+
+    # generation of created cars of the blocks (older than any generation of a park)
+    UNTOUCHED = -1
+
+    def __init__(self):
+        self._cars = []  # cars, or None in place of the ones which haven't been created yet
+        self._missing = 0  # how many cars haven't been created yet
+        # positions of the starts of the blocks and IDs of their first cars
+        self._starts = []
+        self._first_ids = []
+        # searches run in parallel under the read lock (see ConcurrentTaxiPark), and all of them
+        # have to get the same Car object for the same position
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cars)
+
+    def __iter__(self):
+        if not self._missing:
+            return iter(self._cars)
+
+        return (self[i] for i in range(len(self._cars)))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if not self._missing:
+                return self._cars[i]
+            return [self[j] for j in range(*i.indices(len(self._cars)))]
+
+        car = self._cars[i]
+        if car is None:
+            car = self._create(i if i >= 0 else i + len(self._cars))
+
+        return car
+
+    def _create(self, position):
+        with self._lock:
+            car = self._cars[position]
+            if car is None:
+                block = bisect_right(self._starts, position) - 1
+                car = Car(self._first_ids[block] + position - self._starts[block])
+                car.generation = self.UNTOUCHED
+                self._cars[position] = car
+                self._missing -= 1
+
+            return car
+
+    def append(self, car):
+        self._cars.append(car)
+
+    def extend_lazily(self, n, first_id):
+        '''
+            Appends a block of N free sedans at the origin with IDs from `first_id` on,
+            which are created only when accessed
+        '''
+
+        if n <= 0:
+            return
+
+        self._starts.append(len(self._cars))
+        self._first_ids.append(first_id)
+        self._cars.extend(repeat(None, n))
+        self._missing += n
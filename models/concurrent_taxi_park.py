@@ -0,0 +1,269 @@
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from .taxi_park import TaxiPark
+from . import metrics
+
+
+class ReadWriteLock(object):
+    '''
+        Lock which lets many readers in at once, but a writer only alone.
+        Waiting writers block new readers (so a stream of searches cannot starve bookings),
+        and the thread holding the write lock can enter both reading and writing again.
+    '''
+
+    def __init__(self):
+        lock = threading.Lock()
+        # readers and writers wait separately, so releasing the lock wakes up only those who can proceed
+        self._can_read = threading.Condition(lock)
+        self._can_write = threading.Condition(lock)
+        self._readers = 0
+        self._writer = None  # identifier of the thread holding the write lock
+        self._depth = 0  # how many times the writer has entered the lock
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        if self._writer == threading.get_ident():
+            yield
+            return
+
+        with self._can_read:
+            while self._writer is not None or self._waiting_writers:
+                self._can_read.wait()
+            self._readers += 1
+
+        try:
+            yield
+        finally:
+            with self._can_read:
+                self._readers -= 1
+                if not self._readers and self._waiting_writers:
+                    self._can_write.notify()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        with self._can_write:
+            if self._writer != me:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._can_write.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._depth += 1
+
+        try:
+            yield
+        finally:
+            with self._can_write:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    if self._waiting_writers:
+                        self._can_write.notify()
+                    else:
+                        self._can_read.notify_all()
+
+
+class ConcurrentTaxiPark(TaxiPark):
+    '''
+        Taxi park which can be booked from many threads at once (`concurrent_booking = True` in settings)
+        without double-assigning a car and without serializing bookings on a single lock.
+
+        Booking is optimistic:
+        - the closest car is searched under a shared (read) lock, so any number of searches run together
+        - the found car is then claimed under a short exclusive (write) lock, but only if the choice
+          is still valid: the car is still free in the index (or untouched since the last reset) and
+          no car which would have won the search (closer, or as close with a smaller ID) was added
+          to the index since the search started
+        - otherwise the search is retried
+        Removals of other cars never invalidate a choice, so concurrent bookings of different cars
+        don't conflict at all; only cars released nearby (by a tick) or a reset cause retries.
+        Every successful claim is equivalent to a search and a booking done atomically at the moment
+        of the claim, so results are the same as of some serial order of the requests.
+
+        After `max_retries` lost races the booking is done pessimistically under the exclusive lock.
+    '''
+
+    # how many recent additions to the index we remember to validate claims against
+    ADDED_LOG_SIZE = 1024
+
+    def __init__(self, time, index=None, max_retries=3, metric=None):
+        self._lock = ReadWriteLock()
+
+        # every change of the index increases the version. Cars added to the index are logged
+        # together with the version, so a claim can check what has been added since its search.
+        # Searches which started before `_log_start` (e.g. before a reset) cannot be validated.
+        self._version = 0
+        self._log_start = 0
+        self._added = deque(maxlen=self.ADDED_LOG_SIZE)
+
+        self.max_retries = max_retries
+        self.retries = 0  # how many claims have lost a race in total
+
+        # future dispatch isn't supported: claims are validated against the free cars only
+        super().__init__(time, index=index, metric=metric, future_dispatch=False, pool_rides=False)
+
+    def _log_added(self, car):
+        self._version += 1
+        if len(self._added) == self._added.maxlen:
+            self._log_start = self._added[0][0]
+        self._added.append((self._version, car))
+
+    def add_car(self, car):
+        with self._lock.writing():
+            super().add_car(car)
+            self._log_added(car)
+
+    def populate_with_n_cars(self, n=0, mix=None):
+        with self._lock.writing():
+            super().populate_with_n_cars(n, mix)
+
+            # cars of a lazily created block come from the untouched ones, not through `.add_car`,
+            # so searches which started before cannot be validated
+            self._version += 1
+            self._log_start = self._version
+            self._added.clear()
+
+    def release_finished(self, current_time):
+        with self._lock.writing():
+            released = super().release_finished(current_time)
+            for car in released:
+                self._log_added(car)
+
+            return released
+
+    def next_release_time(self):
+        with self._lock.reading():
+            return super().next_release_time()
+
+    def fast_forward(self, units=1, until_free=False):
+        # so no booking can sneak in between looking up the next release and the tick
+        with self._lock.writing():
+            return super().fast_forward(units, until_free=until_free)
+
+    def find_closest(self, src, requirements=None):
+        with self._lock.reading():
+            return super().find_closest(src, requirements)
+
+    def find_nearest(self, src, k, requirements=None):
+        with self._lock.reading():
+            nearest = self._nearest(src, k, requirements)
+            if not any(self._generation.is_untouched(car) for (car, _) in nearest):
+                return nearest
+
+        # untouched cars amongst the nearest ones get touched (see TaxiPark), which changes the index
+        with self._lock.writing():
+            return super().find_nearest(src, k, requirements)
+
+    @property
+    def cars(self):
+        # looking at the cars touches the untouched ones (see TaxiPark), which changes the index
+        with self._lock.writing():
+            return super().cars
+
+    def position(self, car):
+        with self._lock.reading():
+            return super().position(car)
+
+    def states(self, start=0, stop=None, positions=False):
+        # untouched cars are rendered without touching them, so the index isn't changed
+        with self._lock.reading():
+            return super().states(start, stop, positions)
+
+    def positions(self):
+        with self._lock.writing():
+            return super().positions()
+
+    def free_cars(self):
+        with self._lock.writing():
+            return iter(list(super().free_cars()))
+
+    def idle_cars(self, k=0):
+        with self._lock.writing():
+            return super().idle_cars(k)
+
+    def book(self, car, src, dst, dist_to_client=None):
+        with self._lock.writing():
+            return super().book(car, src, dst, dist_to_client=dist_to_client)
+
+    def _is_still_closest(self, src, car, dist, version, requirements=None):
+        '''
+            Checks (under the write lock) that the car found by a search which has seen
+            the given version of the index would still be found by the same search now
+            (cars which don't meet the requirements of the search couldn't have been found by it)
+        '''
+
+        if version < self._log_start:
+            return False
+
+        # a car untouched since the last reset is free (at the origin) until somebody books it
+        if not self._generation.is_untouched(car) and (car not in self.index or not car.free_now(self.time.time)):
+            return False
+
+        for (added_version, added) in reversed(self._added):
+            if added_version <= version:
+                break
+            if requirements is not None and not requirements.admits(added.vehicle):
+                continue
+            if self.metric.better(added.distance(src, self.metric), added.car_id, dist, car.car_id):
+                return False
+
+        return True
+
+    @metrics.timed(metrics.BOOK_CLOSEST_SECONDS)
+    def book_closest(self, src, dst, requirements=None):
+        '''
+            Books the trip on the closest taxi car to the client (see the class docstring on how)
+            Params:
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - car (Car): the car that accepted the trip
+                - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+            ) or None (if there are not available cars at the moment)
+        '''
+
+        for attempt in range(self.max_retries + 1):
+            # the last attempt holds the exclusive lock from the search on, so it cannot lose the race
+            exclusive = self._lock.writing() if attempt == self.max_retries else nullcontext()
+            with exclusive:
+                with self._lock.reading():
+                    version = self._version
+                    closest = super().find_closest(src, requirements)
+
+                # nobody could change the index during the search, so there were really no free cars
+                if not closest:
+                    if metrics.enabled:
+                        metrics.BOOKINGS_FAILED.inc()
+                    return
+
+                (car, dist) = closest
+                with self._lock.writing():
+                    if self._is_still_closest(src, car, dist, version, requirements):
+                        total_time = super().book(car, src, dst, dist_to_client=dist)
+
+                        if metrics.enabled:
+                            metrics.BOOKINGS_SUCCEEDED.inc()
+
+                        return (car, total_time)
+
+            self.retries += 1
+
+    def book_batch(self, trips, optimal=False):
+        # batches are rare and the optimal one needs a consistent view of all free cars
+        with self._lock.writing():
+            return super().book_batch(trips, optimal=optimal)
+
+    def reset(self):
+        with self._lock.writing():
+            super().reset()
+
+            self._version += 1
+            self._log_start = self._version
+            self._added.clear()
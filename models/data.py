@@ -1,20 +1,102 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, conint
+
+from .distance import default as default_metric
+from .vehicle import VEHICLE_TYPES, Requirements
+
+
+# the grid world spans 32 bit integers in both axes
+GRID_MIN = -2 ** 31
+GRID_MAX = 2 ** 31 - 1
+
+
+class Point(object):
+    '''
+        Lightweight point on a 2D grid used by the core model (locations of cars, customers coming
+        through the fast paths). Has the same interface as Location, but takes 48 bytes
+        and no validation, so values are expected to be validated already (e.g. by Location
+        at the API boundary). Points can't be changed once created, so they can be shared (e.g. ORIGIN by all cars).
+    '''
+
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        _set_x(self, x)
+        _set_y(self, y)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"can't set attribute '{name}' of a point, points are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"can't delete attribute '{name}' of a point, points are immutable")
+
+    def __reduce__(self):
+        # copied and pickled through the constructor, since attributes can't be set on an existing point
+        return (Point, (self.x, self.y))
+
+    def __repr__(self):
+        return f"Point(x={self.x}, y={self.y})"
+
+    def __str__(self):
+        return f"x={self.x} y={self.y}"
+
+    def __eq__(self, other):
+        # points are equal to Location models with the same coordinates as well (Location compares
+        # itself to anything but models as a dict, so dicts have to be supported for that)
+        if isinstance(other, dict):
+            return self.dict() == other
+        if not isinstance(other, (Point, Location)):
+            return NotImplemented
+
+        return self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    @classmethod
+    def of(cls, location):
+        '''
+            Returns the given location as a Point (the same object if it's already a Point)
+        '''
+
+        return location if type(location) is cls else cls(location.x, location.y)
+
+    def distance(self, dst, metric=None):
+        '''
+            Method to compute distance between two points on a grid
+            (Manhattan by default, see models/distance.py for the others)
+        '''
+
+        return (metric or default_metric).distance(self, dst)
+
+    def dict(self):
+        return {'x': self.x, 'y': self.y}
+
+
+# coordinates are set straight through the slots, bypassing `Point.__setattr__` (as fast as an assignment)
+(_set_x, _set_y) = (Point.x.__set__, Point.y.__set__)
+
+# every car starts (and gets back to after a reset) here
+ORIGIN = Point(0, 0)
 
 
 class Location(BaseModel):
     '''
         Model to represent point on a 2D grid, having integer pair of (x, y) coordinates
+        (each of them has to fit into 32 bit integer)
     '''
 
-    x: int
-    y: int
+    x: conint(ge=GRID_MIN, le=GRID_MAX)
+    y: conint(ge=GRID_MIN, le=GRID_MAX)
 
-    def distance(self, dst):
+    def distance(self, dst, metric=None):
         '''
-            Method to compute Manhatten distance between two points on a grid
+            Method to compute distance between two points on a grid
+            (Manhattan by default, see models/distance.py for the others)
         '''
 
-        return abs(self.x - dst.x) + abs(self.y - dst.y)
+        return (metric or default_metric).distance(self, dst)
 
 
 class Trip(BaseModel):
@@ -22,7 +104,31 @@ class Trip(BaseModel):
         Model to represent a customer's trip. Must contain:
         - source (with Location object of current coordinates of the customer)
         - destination (with Location object of desired coordinates to travel)
+        And might contain requirements to the car (see `models.vehicle`):
+        - passengers (how many seats the customer needs)
+        - vehicle_type (e.g. "van" or "accessible")
     '''
 
     source: Location
     destination: Location
+    passengers: Optional[conint(ge=1)] = None
+    vehicle_type: Optional[Literal[tuple(VEHICLE_TYPES)]] = None
+
+    def requirements(self):
+        '''
+            Returns requirements of the trip to the car (or None if any car will do)
+        '''
+
+        return Requirements.of(self.passengers, self.vehicle_type)
+
+
+class BatchTrip(BaseModel):
+    '''
+        Model to represent a batch of customers' trips to be booked at once. Contains:
+        - trips (list of Trip objects)
+        - optimal (whether to minimize the total pickup distance across the batch
+            instead of booking trips one by one in the given order)
+    '''
+
+    trips: List[Trip]
+    optimal: bool = False
@@ -0,0 +1,108 @@
+'''
+    Heatmap of demand: where customers have asked for cars lately.
+
+    Pickups are counted in square tiles of the plane, and old pickups fade away exponentially:
+    a pickup counts half as much every `half_life` units of time. Fading is lazy: a pickup is added with
+    the weight it will have relative to a base time (`2 ** ((now - base) / half_life)`), so recording one is O(1),
+    and weights are divided by the same factor of the current time only when they are read. The base moves
+    forward from time to time, so the weights never overflow.
+
+    Memory is bounded by `max_tiles` whatever the size of the world: once there are more tiles,
+    the lighter half of them is dropped (in O(max_tiles) once per max_tiles / 2 new tiles, so amortized O(1)).
+    A dropped tile loses at most as much weight as the lightest of the tiles kept, which are the ones
+    that matter for rebalancing (see `models.rebalancing`).
+'''
+import heapq
+
+from .data import Point
+
+
+# once weights grow this big relative to the base, the base moves to the current time
+MAX_SCALE = 2.0 ** 64
+
+
+class DemandMap(object):
+    '''
+        Decayed counts of pickups in square tiles of the plane
+    '''
+
+    def __init__(self, tile_size, half_life, max_tiles):
+        '''
+            Params:
+            - tile_size (int): size of a tile in grid units
+            - half_life (int): units of time after which a pickup counts half as much
+            - max_tiles (int): the most tiles kept at once
+        '''
+
+        if tile_size < 1 or half_life <= 0 or max_tiles < 2:
+            raise ValueError(
+                "Tile size and half-life of the demand map must be positive, and it has to keep 2 tiles at least"
+            )
+
+        self.tile_size = tile_size
+        self.half_life = half_life
+        self.max_tiles = max_tiles
+
+        self._weights = {}  # tile -> weight relative to the base time
+        self._base = 0
+
+    def __len__(self):
+        return len(self._weights)
+
+    def _scale(self, current_time):
+        return 2.0 ** ((current_time - self._base) / self.half_life)
+
+    def tile(self, point):
+        return (point.x // self.tile_size, point.y // self.tile_size)
+
+    def center(self, tile):
+        '''
+            Returns the point in the middle of the tile (where cars are sent to)
+        '''
+
+        return Point(tile[0] * self.tile_size + self.tile_size // 2, tile[1] * self.tile_size + self.tile_size // 2)
+
+    def record(self, point, current_time, weight=1):
+        '''
+            Counts a pickup at the point
+        '''
+
+        scale = self._scale(current_time)
+        if scale > MAX_SCALE:
+            self._rebase(current_time)
+            scale = 1.0
+
+        tile = self.tile(point)
+        self._weights[tile] = self._weights.get(tile, 0.0) + weight * scale
+
+        if len(self._weights) > self.max_tiles:
+            self._prune()
+
+    def _rebase(self, current_time):
+        scale = self._scale(current_time)
+        self._weights = {tile: weight / scale for (tile, weight) in self._weights.items()}
+        self._base = current_time
+
+    def _prune(self):
+        heaviest = heapq.nlargest(self.max_tiles // 2, self._weights.items(), key=lambda item: (item[1], item[0]))
+        self._weights = dict(heaviest)
+
+    def weights(self, current_time):
+        '''
+            Returns the current (faded) weights of all tiles as a dict tile -> weight
+        '''
+
+        scale = self._scale(current_time)
+        return {tile: weight / scale for (tile, weight) in self._weights.items()}
+
+    def top(self, k, current_time):
+        '''
+            Returns up to k tiles with the highest demand right now, as tuples (tile, weight)
+        '''
+
+        scale = self._scale(current_time)
+        heaviest = heapq.nlargest(k, self._weights.items(), key=lambda item: (item[1], item[0]))
+        return [(tile, weight / scale) for (tile, weight) in heaviest]
+
+    def clear(self):
+        self._weights = {}
@@ -0,0 +1,161 @@
+
+from . import metrics
+
+
+def hungarian(cost):
+    '''
+        Solves the assignment problem (Hungarian algorithm with potentials, O(N^2 * M)):
+        matches rows to columns of the cost matrix, so every row of the smaller dimension
+        gets exactly one column and the total cost is minimal.
+        Params:
+        - cost (list of lists of int): cost[i][j] is a cost of assigning row i to column j
+
+        Returns:
+        - assignment (list of tuples (row, column))
+    '''
+
+    if not cost or not cost[0]:
+        return []
+
+    # algorithm below expects no more rows than columns
+    transposed = len(cost) > len(cost[0])
+    if transposed:
+        cost = [list(column) for column in zip(*cost)]
+
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+
+    # potentials of rows and columns, row matched to every column and the way to restore
+    # augmenting path (all 1-based, column 0 is a fake one)
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    matched = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        matched[0] = i
+        j0 = 0
+        min_reduced = [inf] * (m + 1)
+        used = [False] * (m + 1)
+
+        # looking for an augmenting path from row i
+        while True:
+            used[j0] = True
+            i0 = matched[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+
+                reduced = row[j - 1] - u[i0] - v[j]
+                if reduced < min_reduced[j]:
+                    min_reduced[j] = reduced
+                    way[j] = j0
+                if min_reduced[j] < delta:
+                    delta = min_reduced[j]
+                    j1 = j
+
+            for j in range(m + 1):
+                if used[j]:
+                    u[matched[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_reduced[j] -= delta
+
+            j0 = j1
+            if not matched[j0]:
+                break
+
+        # flipping the augmenting path
+        while j0:
+            j1 = way[j0]
+            matched[j0] = matched[j1]
+            j0 = j1
+
+    assignment = [(matched[j] - 1, j - 1) for j in range(1, m + 1) if matched[j]]
+    if transposed:
+        assignment = [(j, i) for (i, j) in assignment]
+
+    return sorted(assignment)
+
+
+def nearest_rows(dist, ids, k):
+    '''
+        Returns rows of the k cars with the smallest (distance, ID) in O(N)
+        Params:
+        - dist (NumPy array): distances to the cars
+        - ids (NumPy array): IDs of the cars
+        - k (int): how many cars to take
+    '''
+
+    import numpy as np
+
+    if k >= len(dist):
+        return np.arange(len(dist))
+
+    # everything closer than the k-th distance is taken, cars right at it are taken by their IDs
+    kth = np.partition(dist, k - 1)[k - 1]
+    closer = np.flatnonzero(dist < kth)
+    tied = np.flatnonzero(dist == kth)
+
+    return np.concatenate([closer, tied[np.argsort(ids[tied], kind='stable')][:k - len(closer)]])
+
+
+def book_batch(taxi_park, trips, optimal=False):
+    '''
+        Books a batch of trips at once.
+        In the default (sequential) mode trips are booked one by one in the given order,
+        exactly as separate `.book_closest` calls would do.
+        In the optimal mode cars are assigned to the trips so the total distance cars have to drive
+        to pick up customers is minimal across the whole batch. Only the M nearest free cars of every
+        trip are considered (for a batch of M trips), since some optimal assignment never uses a car
+        further than that: at least one of the M nearest cars is always left for a swap.
+        If there are fewer free cars than trips, cars go to the trips which are the cheapest to serve.
+        Car IDs are expected to be unique.
+        Params:
+        - taxi_park (TaxiPark or ArrayTaxiPark): park to take the cars from
+        - trips (list of tuples (src, dst)): source and destination locations of the customers
+        - optimal (bool): whether to minimize the total pickup distance
+
+        Returns:
+        - bookings (list): tuple (car, total_time) or None (if no car is left) for every trip
+    '''
+
+    if not optimal:
+        return [taxi_park.book_closest(src, dst) for (src, dst) in trips]
+
+    # imported here, so NumPy is loaded only when it's actually used
+    import numpy as np
+
+    metric = taxi_park.metric
+    free_cars = list(taxi_park.free_cars())
+
+    # distances are computed by the batched kernel of the metric, a trip against all free cars at once
+    n = len(free_cars)
+    ids = np.fromiter((car.car_id for car in free_cars), np.int64, n)
+    xs = np.fromiter((car.location.x for car in free_cars), np.int64, n)
+    ys = np.fromiter((car.location.y for car in free_cars), np.int64, n)
+
+    candidates = set()
+    for (src, _) in trips:
+        candidates.update(nearest_rows(metric.scores(xs, ys, src), ids, len(trips)).tolist())
+
+    # sorting candidates by ID, so the result doesn't depend on the order cars are stored in
+    rows = sorted(candidates, key=lambda row: free_cars[row].car_id)
+    cars = [free_cars[row] for row in rows]
+    cost = [metric.scores(xs[rows], ys[rows], src).tolist() for (src, _) in trips]
+
+    bookings = [None] * len(trips)
+    for (i, j) in hungarian(cost):
+        (src, dst) = trips[i]
+        bookings[i] = (cars[j], taxi_park.book(cars[j], src, dst, dist_to_client=cost[i][j]))
+
+    if metrics.enabled:
+        booked = sum(1 for booking in bookings if booking)
+        metrics.BOOKINGS_SUCCEEDED.inc(booked)
+        metrics.BOOKINGS_FAILED.inc(len(bookings) - booked)
+
+    return bookings
@@ -0,0 +1,270 @@
+'''
+    Distance metrics of the world: how far a car is from a customer (and how long it takes to drive there).
+
+    Every metric is a function of absolute differences of the coordinates (dx, dy), never decreasing
+    in either of them, which is all the spatial indexes rely on to prune far cells and tiles.
+    Every metric has:
+    - `.distance(a, b)` - distance between two points (Location, Point or anything with x and y)
+    - `.scores(xs, ys, src)` - batched kernel: distances from the point to many cars at once,
+      given NumPy arrays of their coordinates (so dispatch policies don't pay for a Python call per car)
+    - `.measure(dx, dy)` and `.bound(d)` - distance for the given differences and the smallest
+      distance to any point which is at least `d` units away along one of the axes
+    - `.integral` - whether distances are exact integers. Ties of integral metrics are exact,
+      while for the others distances closer than `settings.eps` count as the same one
+    - `.progress(dx, dy, travelled)` and `.progresses(...)` (batched) - how far along each axis a car has got
+      after driving for `travelled` units of time, i.e. the route a car takes between two points
+      (see `models.journey`)
+'''
+import math
+
+from settings import settings
+
+
+class Metric(object):
+    '''
+        Base class of the metrics. Subclasses define `.measure` (for numbers) and `._kernel`
+        (the same formula for NumPy arrays of differences)
+    '''
+
+    name = None
+    integral = True
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+    def measure(self, dx, dy):
+        raise NotImplementedError
+
+    def _kernel(self, dx, dy):
+        raise NotImplementedError
+
+    def distance(self, a, b):
+        return self.measure(abs(a.x - b.x), abs(a.y - b.y))
+
+    def scores(self, xs, ys, src):
+        '''
+            Distances from the point to many cars at once
+            Params:
+            - xs, ys (int64 NumPy arrays): coordinates of the cars
+            - src (Location): point to measure distances from
+
+            Returns:
+            - dist (NumPy array): int64 for the integral metrics, float64 for the others
+        '''
+
+        import numpy as np
+
+        # differences are taken in int64 (coordinates fit int32, so they never overflow)
+        dx = xs - src.x
+        dy = ys - src.y
+        return self._kernel(np.abs(dx, out=dx), np.abs(dy, out=dy))
+
+    def distances(self, xs, ys, xs2, ys2):
+        '''
+            Distances between many pairs of points at once (e.g. legs of the trips of a whole fleet)
+            Params:
+            - xs, ys, xs2, ys2 (int64 NumPy arrays): coordinates of the first and of the second points of the pairs
+
+            Returns:
+            - dist (NumPy array): int64 for the integral metrics, float64 for the others
+        '''
+
+        import numpy as np
+
+        dx = xs - xs2
+        dy = ys - ys2
+        return self._kernel(np.abs(dx, out=dx), np.abs(dy, out=dy))
+
+    def progress(self, dx, dy, travelled):
+        '''
+            How far along each axis a car driving over differences (dx, dy) has got in `travelled` units of time
+            (never further than the differences themselves, and in whole units, i.e. to the last point of the grid passed)
+            Params:
+            - dx, dy (int): absolute differences of the coordinates of the start and the end
+            - travelled (int or float): how long the car has been driving (not negative)
+
+            Returns:
+            - tuple(int, int): units covered along x and along y
+        '''
+
+        raise NotImplementedError
+
+    def progresses(self, dx, dy, travelled):
+        '''
+            The same as `.progress` for NumPy arrays (int64 differences and travelled times of many cars),
+            returns a tuple of int64 arrays
+        '''
+
+        raise NotImplementedError
+
+    def bound(self, d):
+        return min(self.measure(d, 0), self.measure(0, d))
+
+    def better(self, dist, car_id, best_dist, best_id):
+        '''
+            Whether a car at `dist` with `car_id` beats the best car found so far
+            (is closer or as close, but with a smaller ID)
+        '''
+
+        if self.integral:
+            return (dist, car_id) < (best_dist, best_id)
+
+        if abs(dist - best_dist) < settings.eps:
+            return car_id < best_id
+
+        return dist < best_dist
+
+    @property
+    def tolerance(self):
+        # how much further than the best distance a car can be and still tie with it
+        return 0 if self.integral else settings.eps
+
+
+class Manhattan(Metric):
+    '''
+        Distance along the streets of a grid city: |dx| + |dy| (the default one).
+        Cars drive along x first and then along y
+    '''
+
+    name = 'manhattan'
+
+    def measure(self, dx, dy):
+        return dx + dy
+
+    def _kernel(self, dx, dy):
+        dx += dy
+        return dx
+
+    def distance(self, a, b):
+        # the most used metric avoids an extra call
+        return abs(a.x - b.x) + abs(a.y - b.y)
+
+    def progress(self, dx, dy, travelled):
+        along_x = min(math.floor(travelled), dx)
+        return (along_x, min(math.floor(travelled) - along_x, dy))
+
+    def progresses(self, dx, dy, travelled):
+        import numpy as np
+        along_x = np.minimum(travelled, dx)
+        return (along_x, np.clip(travelled - dx, 0, dy))
+
+
+class Chebyshev(Metric):
+    '''
+        Distance when moving diagonally costs the same as moving straight: max(|dx|, |dy|).
+        Cars drive diagonally until they are level with the end along one of the axes
+    '''
+
+    name = 'chebyshev'
+
+    def measure(self, dx, dy):
+        return max(dx, dy)
+
+    def _kernel(self, dx, dy):
+        import numpy as np
+        return np.maximum(dx, dy, out=dx)
+
+    def progress(self, dx, dy, travelled):
+        return (min(math.floor(travelled), dx), min(math.floor(travelled), dy))
+
+    def progresses(self, dx, dy, travelled):
+        import numpy as np
+        return (np.minimum(travelled, dx), np.minimum(travelled, dy))
+
+
+class Euclidean(Metric):
+    '''
+        Straight line distance: sqrt(dx^2 + dy^2). It's not integral, so the time of a trip
+        is rounded up to whole units. Cars drive along the straight line
+    '''
+
+    name = 'euclidean'
+    integral = False
+
+    def measure(self, dx, dy):
+        return math.hypot(dx, dy)
+
+    def _kernel(self, dx, dy):
+        import numpy as np
+        # in floats, since squares of the differences don't fit int64
+        return np.hypot(dx, dy)
+
+    def progress(self, dx, dy, travelled):
+        dist = math.hypot(dx, dy)
+        share = min(travelled / dist, 1) if dist else 0
+        return (math.floor(dx * share), math.floor(dy * share))
+
+    def progresses(self, dx, dy, travelled):
+        import numpy as np
+        dist = np.hypot(dx, dy)
+        share = np.minimum(np.divide(travelled, dist, out=np.zeros(len(dist)), where=dist > 0), 1)
+        return (np.floor(dx * share).astype(np.int64), np.floor(dy * share).astype(np.int64))
+
+
+class Weighted(Metric):
+    '''
+        Grid with road penalties: driving along x costs `wx` per unit and along y `wy` per unit
+        (e.g. avenues are quicker than streets): wx * |dx| + wy * |dy|.
+        Integral as long as both weights are integers. Cars drive along x first and then along y
+    '''
+
+    name = 'weighted'
+
+    def __init__(self, wx=1, wy=1):
+        if wx <= 0 or wy <= 0:
+            raise ValueError("Weights of the weighted metric must be positive")
+
+        self.wx = wx
+        self.wy = wy
+        self.integral = isinstance(wx, int) and isinstance(wy, int)
+
+    def __repr__(self):
+        return f"Weighted(wx={self.wx}, wy={self.wy})"
+
+    def measure(self, dx, dy):
+        return self.wx * dx + self.wy * dy
+
+    def _kernel(self, dx, dy):
+        return self.wx * dx + self.wy * dy
+
+    def progress(self, dx, dy, travelled):
+        along_x = min(math.floor(travelled / self.wx), dx)
+        return (along_x, min(math.floor(max(travelled - self.wx * dx, 0) / self.wy), dy))
+
+    def progresses(self, dx, dy, travelled):
+        import numpy as np
+        along_x = np.minimum(np.floor(travelled / self.wx).astype(np.int64), dx)
+        along_y = np.floor(np.maximum(travelled - self.wx * dx, 0) / self.wy).astype(np.int64)
+        return (along_x, np.minimum(along_y, dy))
+
+
+METRICS = {
+    'manhattan': Manhattan,
+    'chebyshev': Chebyshev,
+    'euclidean': Euclidean,
+    'weighted': Weighted,
+}
+
+
+def create_metric(name=None):
+    '''
+        Creates a metric by its name (taking the one from settings by default)
+        Params:
+        - name (str): one of the keys of METRICS
+
+        Returns:
+        - metric (Metric)
+    '''
+
+    name = name or settings.distance_metric
+    if name not in METRICS:
+        raise ValueError(f"Unknown distance metric '{name}', choose one of: {', '.join(METRICS)}")
+
+    if name == 'weighted':
+        return Weighted(*settings.distance_weights)
+
+    return METRICS[name]()
+
+
+# metric used when none is given explicitly (e.g. by `Location.distance`)
+default = create_metric()
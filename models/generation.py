@@ -0,0 +1,183 @@
+import heapq
+from itertools import islice
+
+from .data import ORIGIN
+
+
+class Generation(object):
+    '''
+        Lets a taxi park reset the whole fleet in O(1). Instead of resetting every car,
+        a reset starts a new generation of the park. Cars stamped with an older generation are
+        "untouched": they count as free and standing at the origin, and the park resets them
+        for real only when it touches them next time (books them, hands them out, etc.)
+
+        Untouched cars are all at the same point, so the best of them for any customer
+        is the one with the smallest ID. As long as cars are added in order of increasing IDs
+        (as `.populate_with_n_cars` does) it's the first untouched car of the list,
+        which is found by a pointer moving only forward (so it's amortized O(1) per booking).
+        Otherwise lazy resets are not possible and `.lazy` is False.
+
+        A new fleet populated in bulk starts out untouched as well: its cars are created
+        only when accessed (see `models.car.CarList`).
+
+        Once the fleet has cars of more than one vehicle class (see `models.vehicle`), cars of every class
+        are kept in a list of their own with a pointer of its own as well, so the best untouched car
+        which meets requirements of a customer is found in amortized O(1) too.
+    '''
+
+    def __init__(self, cars):
+        self.cars = cars  # list of all cars of the park (shared with the park)
+        self.number = 0
+        self.lazy = True  # whether car IDs are increasing along the list
+
+        # position in the list before which no car is untouched
+        self._first = 0
+
+        # Vehicle -> Generation of the cars of the class (only once the fleet has more than one class)
+        self._classes = None
+
+    @property
+    def mixed(self):
+        # whether the fleet has cars of more than one vehicle class
+        return self._classes is not None
+
+    @property
+    def vehicles(self):
+        '''
+            Returns vehicle classes of the cars of the fleet
+        '''
+
+        if self._classes is not None:
+            return list(self._classes)
+
+        return [self.cars[0].vehicle] if len(self.cars) else []
+
+    def _class(self, vehicle):
+        if vehicle not in self._classes:
+            generation = self._classes[vehicle] = Generation([])
+            generation.number = self.number
+
+        return self._classes[vehicle]
+
+    def add(self, car):
+        '''
+            Stamps the car which has just been appended to the list of cars with the current generation
+        '''
+
+        car.generation = self.number
+
+        if len(self.cars) > 1 and car.car_id <= self.cars[-2].car_id:
+            self.lazy = False
+
+        if self._classes is not None:
+            self._class(car.vehicle).cars.append(car)
+        elif car.vehicle != self.cars[0].vehicle:
+            # the first car of another class splits the fleet by classes (creating all cars of a lazy block)
+            self._classes = {}
+            for other in self.cars:
+                self._class(other.vehicle).cars.append(other)
+
+    def start(self):
+        '''
+            Starts a new generation, making all cars untouched
+        '''
+
+        self.number += 1
+        self._first = 0
+
+        for generation in (self._classes or {}).values():
+            generation.start()
+
+    def is_untouched(self, car):
+        return car.generation != self.number
+
+    def state(self, car):
+        '''
+            Returns state of the car (as `Car.to_dict`) without touching it: an untouched car is free at the origin
+        '''
+
+        if car.generation != self.number:
+            return {'car_id': car.car_id, 'location': ORIGIN.dict(), 'booked_until': None}
+
+        return car.to_dict()
+
+    def touch(self, car):
+        '''
+            Resets the car if it's untouched in the current generation
+            Returns:
+            - touched (bool): whether the car was untouched (and has been reset now)
+        '''
+
+        if car.generation == self.number:
+            return False
+
+        car.reset()
+        car.generation = self.number
+        return True
+
+    def first_untouched(self, vehicles=None):
+        '''
+            Returns the untouched car with the smallest ID (or None if all cars have been touched)
+            Params:
+            - vehicles (list of Vehicle): look only amongst the cars of these classes (None for all cars)
+        '''
+
+        if vehicles is not None:
+            firsts = [generation.first_untouched() for generation in self._generations(vehicles)]
+            return min((car for car in firsts if car is not None), key=lambda car: car.car_id, default=None)
+
+        (cars, number) = (self.cars, self.number)
+        while self._first < len(cars) and cars[self._first].generation == number:
+            self._first += 1
+
+        return cars[self._first] if self._first < len(cars) else None
+
+    def _generations(self, vehicles):
+        if self._classes is None:
+            # all cars are of the same class
+            return [self] if len(self.cars) and self.cars[0].vehicle in vehicles else []
+
+        return [self._classes[vehicle] for vehicle in vehicles if vehicle in self._classes]
+
+    def untouched(self, k, vehicles=None):
+        '''
+            Returns up to k untouched cars with the smallest IDs. Cars touched since the start
+            of the generation are skipped on the way, so it's O(k + number of touched cars) at most
+            Params:
+            - k (int): how many cars to return
+            - vehicles (list of Vehicle): look only amongst the cars of these classes (None for all cars)
+        '''
+
+        if vehicles is not None:
+            merged = heapq.merge(
+                *(generation.untouched(k) for generation in self._generations(vehicles)), key=lambda car: car.car_id,
+            )
+            return list(islice(merged, k))
+
+        if self.first_untouched() is None:
+            return []
+
+        (cars, number) = (self.cars, self.number)
+        found = []
+        for i in range(self._first, len(cars)):
+            if cars[i].generation != number:
+                found.append(cars[i])
+                if len(found) == k:
+                    break
+
+        return found
+
+    def touch_all(self):
+        '''
+            Touches all untouched cars
+            Returns:
+            - touched (list): cars which have been reset now
+        '''
+
+        touched = [car for car in self.cars[self._first:] if self.touch(car)]
+        self._first = len(self.cars)
+
+        for generation in (self._classes or {}).values():
+            generation._first = len(generation.cars)
+
+        return touched
@@ -0,0 +1,117 @@
+'''
+    Where a car actually is between a booking and the end of its trip.
+
+    A booking moves the car to the destination right away (`location` is where the car gets free),
+    while the trip itself is kept as its segments (a journey): the point the car sets off from, the pickup,
+    the drop-off and the time it sets off at. A car drives along the route of the metric of its park
+    (along x and then along y on a grid, see `Metric.progress`), so its position at any time is computed
+    in O(1) whenever somebody asks for it, and nothing is updated on ticks. Positions of a whole fleet
+    kept in arrays are computed in one vectorized pass (see `positions`).
+
+    With future dispatch a busy car can be booked for the next trip, which starts at the drop-off
+    of the current one when it ends. The next trip keeps the current one as `previous`,
+    so the position before the car sets off is found along the current trip.
+'''
+from .data import Point
+
+
+def along(a, b, travelled, metric):
+    '''
+        Returns the point a car driving from `a` to `b` has got to in `travelled` units of time
+        (`b` once it has arrived, `a` before it has set off)
+    '''
+
+    (dx, dy) = (b.x - a.x, b.y - a.y)
+    (along_x, along_y) = metric.progress(abs(dx), abs(dy), max(travelled, 0))
+    return Point(a.x + (along_x if dx >= 0 else -along_x), a.y + (along_y if dy >= 0 else -along_y))
+
+
+class Journey(object):
+    '''
+        Trip of a car: it sets off from `start` at `departure`, drives to the customer at `pickup`
+        and then to the destination at `dropoff` (`previous` is the trip the car is still on
+        when it's booked for this one, None for most trips)
+    '''
+
+    __slots__ = ('start', 'pickup', 'dropoff', 'departure', 'previous')
+
+    def __init__(self, start, pickup, dropoff, departure, previous=None):
+        self.start = start
+        self.pickup = pickup
+        self.dropoff = dropoff
+        self.departure = departure
+        self.previous = previous
+
+    def __repr__(self):
+        return f"Journey(start={self.start}, pickup={self.pickup}, dropoff={self.dropoff}, departure={self.departure})"
+
+    def position(self, current_time, metric):
+        '''
+            Returns the point the car is at on `current_time`
+            Params:
+            - current_time (int): current time in the world
+            - metric (Metric): how distances are measured (the one of the park)
+
+            Returns:
+            - position (Point)
+        '''
+
+        trip = self
+        while trip.previous is not None and current_time < trip.departure:
+            trip = trip.previous
+
+        travelled = current_time - trip.departure
+        to_pickup = metric.distance(trip.start, trip.pickup)
+        if travelled < to_pickup:
+            return along(trip.start, trip.pickup, travelled, metric)
+
+        return along(trip.pickup, trip.dropoff, travelled - to_pickup, metric)
+
+    def trim(self, current_time):
+        '''
+            Forgets the trips before the one the car is on at `current_time` (they are over already)
+            Returns:
+            - journey (Journey): the same one
+        '''
+
+        trip = self
+        while trip.previous is not None and current_time < trip.departure:
+            trip = trip.previous
+        trip.previous = None
+
+        return self
+
+
+def positions(current_time, metric, start_xs, start_ys, pickup_xs, pickup_ys, xs, ys, departures):
+    '''
+        Positions of many cars at once (all arguments but the first two are int64 NumPy arrays of the same length)
+        Params:
+        - current_time (int): current time in the world
+        - metric (Metric): how distances are measured (the one of the park)
+        - start_xs, start_ys: points the cars set off from
+        - pickup_xs, pickup_ys: pickups of their customers
+        - xs, ys: drop-offs (i.e. locations of the cars)
+        - departures: when the cars set off
+
+        Returns:
+        tuple(
+            - xs (int64 NumPy array): x coordinates of the cars
+            - ys (int64 NumPy array): y coordinates of the cars
+        )
+    '''
+
+    import numpy as np
+
+    travelled = np.maximum(current_time - departures, 0)
+    to_pickup = metric.distances(start_xs, start_ys, pickup_xs, pickup_ys)
+
+    # every car is either on the way to its customer or on the way to the destination (or there already)
+    first = travelled < to_pickup
+    (from_xs, from_ys) = (np.where(first, start_xs, pickup_xs), np.where(first, start_ys, pickup_ys))
+    (to_xs, to_ys) = (np.where(first, pickup_xs, xs), np.where(first, pickup_ys, ys))
+    travelled = np.where(first, travelled, travelled - to_pickup)
+
+    (dx, dy) = (to_xs - from_xs, to_ys - from_ys)
+    (along_x, along_y) = metric.progresses(np.abs(dx), np.abs(dy), travelled)
+
+    return (from_xs + np.sign(dx) * along_x, from_ys + np.sign(dy) * along_y)
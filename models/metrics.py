@@ -0,0 +1,319 @@
+'''
+    Minimal in-process metrics (counters, gauges and histograms) rendered
+    in Prometheus text format on `GET /api/metrics`.
+
+    Metrics are updated from the hot path, so they are kept as cheap as possible:
+    no labels validation and a single bisect per histogram observation. Updates take a lock only
+    with concurrent booking, when they come from the threads of the pool as well as from the event loop
+    (`+=` isn't atomic, so updates could get lost). Otherwise everything runs in the event loop thread,
+    and the lock (~0.4us per update) is skipped. With `metrics = False` in settings
+    `timed` leaves functions as they are and the rest of the code skips recording
+    (see `enabled`), so the switched off instrumentation costs nothing.
+'''
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+from settings import settings
+
+
+# whether metrics are recorded at all
+enabled = settings.metrics
+
+# guards updates of all values when they can come from several threads (see above), None otherwise
+_lock = threading.Lock() if settings.concurrent_booking else None
+
+# upper bounds of latency histograms buckets (in seconds), from 5us to 1s
+LATENCY_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+)
+
+# upper bounds of buckets for number of cars looked at during a search (powers of 4 up to ~1M)
+SCANNED_BUCKETS = tuple(4 ** i for i in range(11))
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+
+    return '{' + ','.join(f'{name}="{value}"' for (name, value) in zip(names, values)) + '}'
+
+
+class Metric(object):
+    '''
+        Base class of all metrics: a named family of values, one per combination of label values
+    '''
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+        if not self.labelnames:
+            self._children[()] = self._create()
+
+    def _create(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        '''
+            Returns the value for the given label values (created on first use)
+        '''
+
+        child = self._children.get(values)
+        if child is None:
+            # another thread might be creating the same value right now, only one of them is kept
+            child = self._children.setdefault(values, self._create())
+
+        return child
+
+    def samples(self):
+        '''
+            Yields tuples (name, labels, value) of all samples of the metric
+        '''
+
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for (name, labels, value) in self.samples():
+            lines.append(f'{name}{labels} {value}')
+
+        return '\n'.join(lines)
+
+
+class CounterValue(object):
+    __slots__ = ('value', )
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        if _lock is None:
+            self.value += amount
+            return
+
+        with _lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    '''
+        Value which only goes up (e.g. number of bookings)
+    '''
+
+    kind = 'counter'
+
+    def _create(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for (values, child) in self._children.items():
+            yield (f'{self.name}_total', format_labels(self.labelnames, values), child.value)
+
+
+class Gauge(Metric):
+    '''
+        Value which is computed by a function at the moment metrics are collected (e.g. fleet utilisation)
+    '''
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        self._function = None
+        super().__init__(name, documentation)
+
+    def _create(self):
+        return None
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            yield (self.name, '', self._function())
+
+
+class HistogramValue(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts of observations per bucket (not cumulative), the last one is for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        if _lock is None:
+            self.counts[bucket] += 1
+            self.sum += value
+            return
+
+        with _lock:
+            self.counts[bucket] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    '''
+        Distribution of observed values (e.g. latencies) over fixed buckets
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _create(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def samples(self):
+        for (values, child) in self._children.items():
+            total = 0
+            for (bound, count) in zip(self.buckets + ('+Inf', ), child.counts):
+                total += count
+                labels = format_labels(self.labelnames + ('le', ), values + (bound, ))
+                yield (f'{self.name}_bucket', labels, total)
+
+            labels = format_labels(self.labelnames, values)
+            yield (f'{self.name}_sum', labels, child.sum)
+            yield (f'{self.name}_count', labels, total)
+
+
+class Registry(object):
+    '''
+        Collection of metrics rendered together
+    '''
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''
+            Returns all metrics in Prometheus text exposition format
+        '''
+
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'taxi_request_seconds', 'Time spent processing HTTP requests', labelnames=('method', 'route'),
+))
+FIND_CLOSEST_SECONDS = REGISTRY.register(Histogram(
+    'taxi_find_closest_seconds', 'Time spent searching for the closest free car',
+))
+FIND_SOONEST_SECONDS = REGISTRY.register(Histogram(
+    'taxi_find_soonest_seconds',
+    'Time spent searching for the car which gets to the customer the soonest (future dispatch)',
+))
+FIND_NEAREST_SECONDS = REGISTRY.register(Histogram(
+    'taxi_find_nearest_seconds', 'Time spent searching for the k nearest free cars',
+))
+CARS_SCANNED = REGISTRY.register(Histogram(
+    'taxi_find_closest_scanned_cars', 'Number of candidate cars looked at during a search', buckets=SCANNED_BUCKETS,
+))
+BOOK_CLOSEST_SECONDS = REGISTRY.register(Histogram(
+    'taxi_book_closest_seconds', 'Time spent booking the closest car (including the search)',
+))
+BOOKINGS = REGISTRY.register(Counter(
+    'taxi_bookings', 'Number of booking attempts by their result', labelnames=('result', ),
+))
+POOLED_BOOKINGS = REGISTRY.register(Counter(
+    'taxi_pooled_bookings', 'Number of bookings which share a car with other customers (ride pooling)',
+))
+REBALANCING_MOVES = REGISTRY.register(Counter(
+    'taxi_rebalancing_moves', 'Number of idle cars moved toward the demand (trips without customers, not bookings)',
+))
+TICK_SECONDS = REGISTRY.register(Histogram(
+    'taxi_tick_seconds', 'Time spent advancing the time (including release of the cars)',
+))
+FREE_CARS = REGISTRY.register(Gauge('taxi_free_cars', 'Number of cars available right now'))
+BUSY_CARS = REGISTRY.register(Gauge(
+    'taxi_busy_cars', 'Number of cars serving customers (or moving toward the demand) right now',
+))
+FLEET_UTILISATION = REGISTRY.register(Gauge('taxi_fleet_utilisation', 'Share of busy cars in the fleet'))
+
+BOOKINGS_SUCCEEDED = BOOKINGS.labels('success')
+BOOKINGS_FAILED = BOOKINGS.labels('failed')
+
+
+def timed(histogram):
+    '''
+        Decorator recording how long every call of the function takes into the histogram
+        (returns the function untouched when metrics are switched off)
+    '''
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        observe = histogram.observe
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def watch_fleet(taxi_park):
+    '''
+        Makes fleet gauges report state of the given taxi park
+    '''
+
+    FREE_CARS.set_function(lambda: taxi_park.free_count)
+    BUSY_CARS.set_function(lambda: taxi_park.busy_count)
+
+    def utilisation():
+        (free, busy) = (taxi_park.free_count, taxi_park.busy_count)
+        return busy / (free + busy) if free + busy else 0
+
+    FLEET_UTILISATION.set_function(utilisation)
+
+
+class RequestMetricsMiddleware(object):
+    '''
+        ASGI middleware recording latency of every HTTP request per route.
+        Requests which didn't match any route are recorded under "other" route,
+        so random URLs cannot blow up the number of samples.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # router puts the matched endpoint into the scope, all our routes are plain paths
+            route = scope['path'] if 'endpoint' in scope else 'other'
+            REQUEST_SECONDS.labels(scope['method'], route).observe(perf_counter() - started)
@@ -0,0 +1,334 @@
+'''
+    Ride pooling: a busy car can take another customer on the way, as long as nobody
+    is delayed by more than `max_detour` units because of it.
+
+    A pooled car has a route: the ordered stops it still has to make (pickups and drop-offs
+    of its customers) with the time it arrives at each of them. A car can't turn around in the middle
+    of a leg, so a new customer is inserted only after the stop the car is driving to right now.
+    Every drop-off has a deadline fixed at booking: the quoted pickup of the customer plus the ride
+    straight to the destination plus `max_detour`. An insertion delays all the stops after it by its detour,
+    so with suffix minima of the slack (deadline minus arrival) of the drop-offs every pair of positions
+    of the pickup and the drop-off is checked in O(1), O(stops^2) per car.
+
+    Routes are kept in a spatial index (of the same kind as the one of free cars) by the point
+    the car can be diverted from: the stop it's driving to (or the one it's at right now),
+    so only the few busy cars around the customer are tried instead of all of them.
+    Routes move in the index as the cars pass their stops (see `RidePool.advance`).
+'''
+import heapq
+from collections import namedtuple
+from itertools import count
+from math import ceil, floor, inf
+
+from .journey import along
+
+
+# a stop of a route: passengers get in at a pickup (positive) or out at a drop-off (negative),
+# deadline is the latest arrival at a drop-off (None for pickups)
+Stop = namedtuple('Stop', ['location', 'passengers', 'deadline'])
+
+# the cheapest way to take the customer found in a route: added time of the route (cost),
+# positions of the pickup and the drop-off in the stops (the drop-off comes after `dropoff` old stops)
+# and when the car gets to the customer and to the destination
+Insertion = namedtuple('Insertion', ['cost', 'pickup', 'dropoff', 'pickup_time', 'dropoff_time'])
+
+
+class Route(object):
+    '''
+        Stops the car still has to make. The car is (or will be) at `origin` at `since`
+        with `onboard` passengers, and `arrivals` are the times it gets to every stop
+    '''
+
+    __slots__ = ('car', 'origin', 'since', 'onboard', 'stops', 'arrivals', 'location', 'scheduled')
+
+    def __init__(self, car, origin, since, onboard, stops, metric):
+        self.car = car
+        self.origin = origin
+        self.since = since
+        self.onboard = onboard
+        self.stops = stops
+        self.arrivals = []
+        # point the route is indexed at, and the time it's due to move in the index
+        self.location = origin
+        self.scheduled = None
+
+        self._arrive(0, metric)
+
+    @property
+    def car_id(self):
+        # routes are indexed like cars (see `models.spatial_index`)
+        return self.car.car_id
+
+    @property
+    def end(self):
+        return self.arrivals[-1] if self.arrivals else self.since
+
+    def _arrive(self, start, metric):
+        # recomputes arrival times at the stops from `start` on
+        del self.arrivals[start:]
+        (location, time) = (self.origin, self.since) if not start else (self.stops[start - 1].location, self.arrivals[-1])
+        for stop in self.stops[start:]:
+            time += metric.distance(location, stop.location)
+            location = stop.location
+            self.arrivals.append(time)
+
+    def advance(self, current_time):
+        '''
+            Drops the stops the car has reached by `current_time`
+        '''
+
+        while self.stops and self.arrivals[0] <= current_time:
+            stop = self.stops.pop(0)
+            self.origin = stop.location
+            self.since = self.arrivals.pop(0)
+            self.onboard += stop.passengers
+
+    def anchor(self, current_time):
+        '''
+            Returns the point the car can be diverted from at `current_time`
+            and the time this point changes (as whole units)
+        '''
+
+        if self.since >= current_time:
+            # the car is at the origin (or still on the way to it), so it can go anywhere from there
+            return (self.origin, floor(self.since) + 1)
+
+        return (self.stops[0].location, ceil(self.arrivals[0]))
+
+    def position(self, current_time, metric):
+        '''
+            Returns the point the car is at on `current_time` (once it's at the origin or past it)
+        '''
+
+        (location, time) = (self.origin, self.since)
+        for (stop, arrival) in zip(self.stops, self.arrivals):
+            if arrival > current_time:
+                return along(location, stop.location, current_time - time, metric)
+            (location, time) = (stop.location, arrival)
+
+        return location
+
+    def best_insertion(self, src, dst, passengers, current_time, max_pickup_time, max_detour, metric):
+        '''
+            Finds the cheapest way to take the customer with this car
+            Params:
+            - src, dst (Point): pickup and drop-off of the customer
+            - passengers (int): how many seats the customer needs
+            - current_time (int): current time in the world
+            - max_pickup_time (float): the latest time the customer can be picked up at
+            - max_detour (int): how much longer than straight to the destination the ride of the customer can be
+            - metric (Metric): how distances are measured
+
+            Returns:
+            - insertion (Insertion): the one with the smallest added time of the route (or None)
+        '''
+
+        (stops, arrivals, n) = (self.stops, self.arrivals, len(self.stops))
+        (distance, tolerance) = (metric.distance, metric.tolerance)
+        capacity = self.car.vehicle.capacity
+
+        # loads[k] - passengers on board after the first k stops (on the leg leaving them)
+        loads = [self.onboard]
+        for stop in stops:
+            loads.append(loads[-1] + stop.passengers)
+
+        # slack[k] - how long the stops from k on can be delayed without missing a deadline
+        slack = [inf] * (n + 1)
+        for k in range(n - 1, -1, -1):
+            deadline = stops[k].deadline
+            slack[k] = min(slack[k + 1], deadline - arrivals[k]) if deadline is not None else slack[k + 1]
+
+        direct = distance(src, dst)
+        best = None
+
+        # the leg to the next stop is under way, unless the car hasn't left the origin yet
+        first = 0 if self.since >= current_time else 1
+        for i in range(first, n + 1):
+            if loads[i] + passengers > capacity:
+                continue
+
+            (prev, prev_time) = (self.origin, self.since) if not i else (stops[i - 1].location, arrivals[i - 1])
+            to_pickup = distance(prev, src)
+            pickup_time = prev_time + to_pickup
+            if pickup_time > max_pickup_time + tolerance:
+                continue
+
+            # the drop-off right after the pickup
+            cost = to_pickup + direct
+            if i < n:
+                cost += distance(dst, stops[i].location) - distance(prev, stops[i].location)
+            if cost <= slack[i] + tolerance and (not best or cost < best.cost - tolerance):
+                best = Insertion(cost, i, i, pickup_time, pickup_time + direct)
+
+            if i == n:
+                continue
+
+            # the drop-off after some of the next stops, which are all delayed by the detour of the pickup
+            detour = to_pickup + distance(src, stops[i].location) - distance(prev, stops[i].location)
+            (seats, deadline_slack) = (loads[i], inf)
+            for j in range(i + 1, n + 1):
+                seats = max(seats, loads[j])
+                deadline = stops[j - 1].deadline
+                if deadline is not None:
+                    deadline_slack = min(deadline_slack, deadline - arrivals[j - 1])
+
+                # adding more stops to the ride only makes it longer and more crowded
+                if seats + passengers > capacity or detour > deadline_slack + tolerance:
+                    break
+
+                last = stops[j - 1].location
+                to_dropoff = distance(last, dst)
+                dropoff_time = arrivals[j - 1] + detour + to_dropoff
+                if dropoff_time - pickup_time > direct + max_detour + tolerance:
+                    break
+
+                cost = detour + to_dropoff
+                if j < n:
+                    cost += distance(dst, stops[j].location) - distance(last, stops[j].location)
+                if cost <= slack[j] + tolerance and (not best or cost < best.cost - tolerance):
+                    best = Insertion(cost, i, j, pickup_time, dropoff_time)
+
+        return best
+
+    def insert(self, insertion, pickup, dropoff, metric):
+        '''
+            Puts the stops of the customer into the route (at the positions found by `.best_insertion`)
+        '''
+
+        self.stops.insert(insertion.dropoff, dropoff)
+        self.stops.insert(insertion.pickup, pickup)
+        self._arrive(insertion.pickup, metric)
+
+
+class RidePool(object):
+    '''
+        Routes of all pooled cars of a taxi park, indexed by the points they can be diverted from
+    '''
+
+    def __init__(self, index, max_detour, candidates):
+        '''
+            Params:
+            - index (LinearIndex or GridIndex): empty spatial index to keep the routes in
+            - max_detour (int): how much longer than with a car of their own a customer may wait and ride
+            - candidates (int): how many routes closest to the customer are tried
+        '''
+
+        self.index = index
+        self.metric = index.metric
+        self.max_detour = max_detour
+        self.candidates = candidates
+
+        self._routes = {}  # car_id -> Route
+        # heap of tuples (time, sequence number, route): when the route has to move in the index
+        self._schedule = []
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def clear(self):
+        self.index.clear()
+        self._routes = {}
+        self._schedule = []
+
+    def _place(self, route, current_time):
+        # (re)indexes the route at the point it can be diverted from and schedules its next move
+        (location, time) = route.anchor(current_time)
+        if route.car_id not in self._routes:
+            route.location = location
+            self._routes[route.car_id] = route
+            self.index.add(route)
+        elif location != route.location:
+            route.location = location
+            self.index.move(route)
+
+        if route.scheduled != time:
+            route.scheduled = time
+            heapq.heappush(self._schedule, (time, next(self._sequence), route))
+
+    def start(self, car, src, dst, passengers, pickup_time, current_time):
+        '''
+            Starts the route of a free car which has just been booked (the car drives to the customer first)
+        '''
+
+        deadline = pickup_time + self.metric.distance(src, dst) + self.max_detour
+        route = Route(car, src, pickup_time, passengers, [Stop(dst, -passengers, deadline)], self.metric)
+        self._place(route, current_time)
+
+    def advance(self, current_time):
+        '''
+            Moves the routes whose cars have passed their stops by `current_time` in the index
+            (and forgets the finished ones). Called on every tick before the cars are released
+        '''
+
+        while self._schedule and self._schedule[0][0] <= current_time:
+            (time, _, route) = heapq.heappop(self._schedule)
+            if route.scheduled != time or self._routes.get(route.car_id) is not route:
+                continue
+
+            route.advance(current_time)
+            if not route.stops:
+                del self._routes[route.car_id]
+                self.index.remove(route)
+                continue
+
+            self._place(route, current_time)
+
+    def position(self, car, current_time):
+        '''
+            Returns the point the pooled car is at along its route (None if it has no route
+            or is still on the way to its first customer)
+        '''
+
+        route = self._routes.get(car.car_id)
+        if route is None or current_time < route.since:
+            return None
+
+        return route.position(current_time, self.metric)
+
+    def best_insertion(self, src, dst, passengers, current_time, max_pickup_time, is_eligible):
+        '''
+            Tries the routes closest to the customer
+            Params:
+            - src, dst (Point): pickup and drop-off of the customer
+            - passengers (int): how many seats the customer needs
+            - current_time (int): current time in the world
+            - max_pickup_time (float): the latest time the customer can be picked up at
+            - is_eligible (callable): whether a car meets the requirements of the customer
+
+            Returns:
+            tuple(
+                - route (Route)
+                - insertion (Insertion): the cheapest one (the smallest car ID in case of a tie)
+            ) or None
+        '''
+
+        def is_candidate(route):
+            return is_eligible(route.car)
+
+        best = None
+        for (route, _) in self.index.k_nearest(src, self.candidates, is_candidate):
+            insertion = route.best_insertion(
+                src, dst, passengers, current_time, max_pickup_time, self.max_detour, self.metric,
+            )
+            if insertion and (not best or self.metric.better(insertion.cost, route.car_id, best[1].cost, best[0].car_id)):
+                best = (route, insertion)
+
+        return best
+
+    def insert(self, route, insertion, src, dst, passengers, current_time):
+        '''
+            Puts the customer into the route of the busy car, which now ends later (and maybe elsewhere)
+            Returns:
+            - total_time (int): how long it takes the customer to get to the destination
+        '''
+
+        deadline = insertion.pickup_time + self.metric.distance(src, dst) + self.max_detour
+        route.insert(insertion, Stop(src, passengers, None), Stop(dst, -passengers, deadline), self.metric)
+        self._place(route, current_time)
+
+        car = route.car
+        car.booked_until = ceil(route.end)
+        car.location = route.stops[-1].location
+
+        return ceil(insertion.dropoff_time - current_time)
@@ -0,0 +1,217 @@
+'''
+    Rebalancing of idle cars: free cars wait wherever they dropped off their last customers,
+    which is rarely where the next customers are. From time to time idle cars are sent toward
+    the tiles where demand is higher than the idle cars around can serve (see `models.demand`).
+
+    Planning is a transport problem:
+    - idle cars are spread over the tiles in proportion to the current demand (largest remainders),
+      which gives the number of cars every tile should have
+    - tiles with fewer idle cars than that are underserved: every missing car is a slot to fill
+      (the most underserved tiles first, at most `max_moves` slots)
+    - cars in tiles without a target (with no or little demand) are the supply, and the slots
+      are matched with the supply at the smallest total distance by the Hungarian algorithm
+      (see `models.dispatch.hungarian`). Only a few candidates per slot closest to the slots are considered,
+      so planning takes O(idle cars + tiles + max_moves^3)
+
+    Cars already in tiles with demand are never moved: targets shift a little with every pickup,
+    and shuffling cars between busy tiles (or between far apart clusters of them) to follow that
+    costs several times more driving than it saves on pickups.
+
+    A move is booked as a trip without a customer (from the car's location to the center of the tile),
+    so the car is busy while it drives there and is found exactly where it is meanwhile (see `models.journey`).
+    Moves are not bookings: they are counted by a metric of their own and never by the booking ones.
+    Cars on the way count as idle cars of the tiles they drive to, so the same tiles aren't filled again
+    and again by the next plans while the cars sent before are still driving.
+'''
+from collections import defaultdict, namedtuple
+from math import floor
+
+from . import metrics
+from .data import ORIGIN
+from .demand import DemandMap
+from .dispatch import hungarian
+from settings import settings
+
+
+# how many of the closest cars above target are considered for every slot
+CANDIDATES_PER_SLOT = 4
+
+# a car to send to the center of an underserved tile, and how far it is
+Move = namedtuple('Move', ['car', 'target', 'distance'])
+
+
+def apportion(n, weights):
+    '''
+        Splits N cars between the tiles in proportion to their weights (largest remainders)
+        Params:
+        - n (int): number of cars
+        - weights (dict): tile -> weight
+
+        Returns:
+        - targets (dict): tile -> number of cars (only tiles with some cars)
+    '''
+
+    total = sum(weights.values())
+    if not n or total <= 0:
+        return {}
+
+    quotas = {tile: n * weight / total for (tile, weight) in weights.items()}
+    targets = {tile: floor(quota) for (tile, quota) in quotas.items()}
+
+    # the cars left go to the tiles with the largest remainders (ties by tile, so it's deterministic)
+    left = n - sum(targets.values())
+    remainders = sorted(quotas, key=lambda tile: (targets[tile] - quotas[tile], tile))
+    for tile in remainders[:left]:
+        targets[tile] += 1
+
+    return {tile: target for (tile, target) in targets.items() if target}
+
+
+class Rebalancer(object):
+    '''
+        Keeps the demand heatmap up to date with the pickups and moves idle cars toward it every `interval` units of time
+    '''
+
+    def __init__(self, demand=None, interval=None, max_moves=None):
+        '''
+            Params:
+            - demand (DemandMap): heatmap of pickups (configured by settings by default)
+            - interval (int): units of time between rebalancing (`settings.rebalance_interval` by default),
+              0 to rebalance only when asked to
+            - max_moves (int): the most cars moved at once (`settings.rebalance_max_moves` by default)
+        '''
+
+        if demand is None:
+            demand = DemandMap(settings.demand_tile_size, settings.demand_half_life, settings.demand_max_tiles)
+
+        self.demand = demand
+        self.interval = settings.rebalance_interval if interval is None else interval
+        self.max_moves = settings.rebalance_max_moves if max_moves is None else max_moves
+
+        self.moved = 0  # how many cars have been moved so far
+        self._next = None  # time of the next rebalancing
+        self._moving = {}  # car_id -> (car, target, arrival) of the cars on the way to their targets
+
+    def record(self, src, current_time):
+        '''
+            Counts a customer asking for a car at `src` (whether the booking succeeds or not)
+        '''
+
+        self.demand.record(src, current_time)
+
+    def plan(self, taxi_park):
+        '''
+            Proposes moves of idle cars toward underserved tiles (nothing is moved)
+            Params:
+            - taxi_park (TaxiPark, ArrayTaxiPark or ShardedTaxiPark): park to move the cars of
+
+            Returns:
+            - moves (list of Move): in order of the slots (the most underserved tiles first)
+        '''
+
+        current_time = taxi_park.time.time
+        weights = self.demand.weights(current_time)
+        if not self.max_moves or not weights:
+            return []
+
+        # cars untouched since a reset are all free at the origin, so only the few of them with the smallest IDs
+        # can ever be moved (the rest are only counted, see `TaxiPark.idle_cars`)
+        (idle, untouched) = taxi_park.idle_cars(CANDIDATES_PER_SLOT * self.max_moves)
+        if not idle and not untouched:
+            return []
+
+        cars = defaultdict(list)  # tile -> idle cars in it
+        for car in idle:
+            cars[self.demand.tile(car.location)].append(car)
+        counts = {tile: len(tile_cars) for (tile, tile_cars) in cars.items()}  # tile -> number of idle cars in it
+        if untouched:
+            origin = self.demand.tile(ORIGIN)
+            counts[origin] = counts.get(origin, 0) + untouched
+
+        # cars on the way are already where they go (booked by customers or arrived ones are forgotten)
+        self._moving = {
+            car_id: (car, target, arrival) for (car_id, (car, target, arrival)) in self._moving.items()
+            if self._on_way(car, target, arrival, current_time)
+        }
+        arriving = defaultdict(int)  # tile -> cars on the way to it
+        for (_, target, _) in self._moving.values():
+            arriving[self.demand.tile(target)] += 1
+
+        targets = apportion(len(idle) + untouched + len(self._moving), weights)
+
+        # every car missing from an underserved tile is a slot, the most underserved tiles go first
+        deficits = sorted(
+            ((target - counts.get(tile, 0) - arriving.get(tile, 0), tile) for (tile, target) in targets.items()),
+            key=lambda deficit: (-deficit[0], deficit[1]),
+        )
+        slots = [tile for (missing, tile) in deficits if missing > 0 for _ in range(missing)][:self.max_moves]
+        if not slots:
+            return []
+
+        surplus = [car for (tile, tile_cars) in cars.items() if tile not in targets for car in tile_cars]
+        if not surplus:
+            return []
+
+        metric = taxi_park.metric
+        centers = {tile: self.demand.center(tile) for tile in slots}
+        if len(surplus) > CANDIDATES_PER_SLOT * len(slots):
+            def closest(car):
+                return (min(metric.distance(car.location, center) for center in centers.values()), car.car_id)
+
+            surplus = sorted(surplus, key=closest)[:CANDIDATES_PER_SLOT * len(slots)]
+
+        cost = [[metric.distance(car.location, centers[tile]) for car in surplus] for tile in slots]
+        return [
+            Move(surplus[column], centers[slots[row]], cost[row][column])
+            for (row, column) in sorted(hungarian(cost))
+        ]
+
+    def apply(self, taxi_park, moves):
+        '''
+            Sends the cars to their targets (as trips without customers)
+            Returns:
+            - moved (list of Move): the moves made (cars which have been booked meanwhile stay where they are)
+        '''
+
+        current_time = taxi_park.time.time
+
+        moved = []
+        for move in moves:
+            if move.car.free_now(current_time):
+                taxi_park.book(move.car, move.car.location, move.target, dist_to_client=0)
+                self._moving[move.car.car_id] = (move.car, move.target, move.car.booked_until)
+                moved.append(move)
+
+        self.moved += len(moved)
+        if metrics.enabled and moved:
+            metrics.REBALANCING_MOVES.inc(len(moved))
+
+        return moved
+
+    @staticmethod
+    def _on_way(car, target, arrival, current_time):
+        # whether the car is still driving to the target (and hasn't been booked by a customer meanwhile)
+        return car.booked_until == arrival and arrival > current_time and car.location == target
+
+    def reset(self):
+        '''
+            Forgets the demand recorded so far and the cars on the way (when the world is reset)
+        '''
+
+        self.demand.clear()
+        self._next = None
+        self._moving = {}
+
+    def tick(self, taxi_park):
+        '''
+            Rebalances the idle cars if it's time to (called after every tick, see `interval`)
+            Returns:
+            - moved (list of Move): the moves made on this tick
+        '''
+
+        current_time = taxi_park.time.time
+        if not self.interval or (self._next is not None and current_time < self._next):
+            return []
+
+        self._next = current_time + self.interval
+        return self.apply(taxi_park, self.plan(taxi_park))
@@ -0,0 +1,657 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from .car import Car, CarList
+from .data import ORIGIN
+from .distance import default as default_metric
+from .time import Time, fast_forward
+from .spatial_index import TopK, create_index, ring
+from .generation import Generation
+from .vehicle import SEDAN, eligible, fleet_blocks
+from .dispatch import book_batch
+from . import metrics
+from settings import settings
+
+
+class Shard(object):
+    '''
+        Cars of a single tile of the plane: spatial index of the free ones
+        and a min-heap of the busy ones which will be free in this tile
+        (i.e. their destination is inside the tile)
+    '''
+
+    def __init__(self, metric):
+        self.index = create_index(metric=metric)
+        # heap of tuples (booked_until, sequence number, car), see TaxiPark
+        self.busy = []
+
+    def __len__(self):
+        return len(self.index) + len(self.busy)
+
+    def release_finished(self, current_time):
+        released = []
+        while self.busy and self.busy[0][0] <= current_time:
+            (_, _, car) = heapq.heappop(self.busy)
+            self.index.add(car)
+            released.append(car)
+
+        return released
+
+
+class ShardedTaxiPark(object):
+    '''
+        Taxi park for city-scale grids: the plane is split into square tiles of `tile_size` units
+        and every tile (shard) holds only the cars located in it, with its own spatial index
+        and heap of busy cars. Only tiles which have cars are kept around.
+
+        The closest car is searched ring by ring of tiles around the tile of the customer.
+        Every tile at ring `r` (r > 0) is at least `(r - 1) * tile_size + 1` units away from the customer
+        along one of the axes (so at least `metric.bound` of that, see `models.distance`),
+        so as soon as this lower bound exceeds the best found distance no tile further out can have
+        a closer car (or as close, but with smaller ID). Busy cars wait in the shard of their destination,
+        so a booked car moves to another shard right away and becomes available there after the trip.
+
+        Shards are independent, so releasing finished cars on a tick can be done by a pool of threads
+        (`shard_threads` in settings). The same search is used by the batch bookings, trip after trip,
+        since sequential batches have to give exactly the results of separate bookings.
+
+        Reset is O(1) the same way as for TaxiPark (see `models.generation`): all shards are dropped
+        and the first untouched car is the starting point of every search.
+
+        Once the fleet has cars of more than one vehicle class (see `models.vehicle`), free cars of every class
+        are kept in shards of their own as well, and a customer with requirements is searched for ring by ring
+        only amongst the shards of the classes meeting them. So a rare class doesn't make the search go
+        further out looking through all the cars which can't take the customer anyway.
+
+        Has the same interface as TaxiPark. Selected by `fleet_store = "sharded"` in settings.
+    '''
+
+    def __init__(self, time, tile_size=None, threads=None, metric=None):
+        if not isinstance(time, Time):
+            raise TypeError("Please pass an instance of Time class to the class constructor")
+
+        # how distances are measured, by the park and by the indexes of all shards
+        self.metric = metric or default_metric
+
+        self.tile_size = tile_size or settings.shard_tile_size
+        if self.tile_size < 1:
+            raise ValueError("Tile size of the sharded taxi park must be a positive integer")
+
+        threads = settings.shard_threads if threads is None else threads
+        self._executor = ThreadPoolExecutor(threads) if threads > 1 else None
+
+        self._cars = CarList()
+        self._generation = Generation(self._cars)
+        self.time = time
+
+        self._shards = {}  # (tile_x, tile_y) -> Shard
+        # Vehicle -> {(tile_x, tile_y) -> Shard} of free cars of the class
+        # (only once the fleet has cars of more than one class, see `.add_car`)
+        self._classes = None
+        self._tiles = {}  # car_id -> tile of the shard the car belongs to
+        self._busy_count = 0
+        self._sequence = count()
+
+        self.time.subscribe(self.release_finished)
+
+    @property
+    def cars(self):
+        # whoever looks at the cars has to see the untouched ones reset
+        self._touch_all()
+        return self._cars
+
+    @property
+    def busy_count(self):
+        return self._busy_count
+
+    @property
+    def free_count(self):
+        return len(self._cars) - self._busy_count
+
+    def _touch_all(self):
+        touched = self._generation.touch_all()
+        if not touched:
+            return
+
+        # untouched cars are free at the origin, so they all go to the same shard
+        tile = self._tile(0, 0)
+        for car in touched:
+            self._tiles[car.car_id] = tile
+            self._add_free(tile, car)
+
+    def _tile(self, x, y):
+        return (x // self.tile_size, y // self.tile_size)
+
+    def _shard(self, tile):
+        shard = self._shards.get(tile)
+        if shard is None:
+            shard = self._shards[tile] = Shard(self.metric)
+
+        return shard
+
+    def _tile_distance(self, tile, point):
+        '''
+            Distance from the point to the closest point of the tile
+        '''
+
+        (x0, y0) = (tile[0] * self.tile_size, tile[1] * self.tile_size)
+        (x1, y1) = (x0 + self.tile_size - 1, y0 + self.tile_size - 1)
+
+        return self.metric.measure(max(x0 - point.x, 0, point.x - x1), max(y0 - point.y, 0, point.y - y1))
+
+    def _forget_if_empty(self, tile):
+        # not keeping empty shards around, so we don't have to visit them later on
+        if not self._shards[tile]:
+            del self._shards[tile]
+
+    def _split(self):
+        '''
+            Starts keeping free cars of every vehicle class in shards of their own as well
+        '''
+
+        self._classes = {}
+        for (tile, shard) in self._shards.items():
+            for car in shard.index:
+                self._class_shard(car.vehicle, tile).index.add(car)
+
+    def _class_shard(self, vehicle, tile):
+        shards = self._classes.setdefault(vehicle, {})
+        shard = shards.get(tile)
+        if shard is None:
+            # only free cars are kept there, busy ones wait in the heaps of the shards of the whole fleet
+            shard = shards[tile] = Shard(self.metric)
+
+        return shard
+
+    def _add_free(self, tile, car):
+        self._shard(tile).index.add(car)
+        if self._classes is not None:
+            self._class_shard(car.vehicle, tile).index.add(car)
+
+    def _remove_free(self, tile, car):
+        self._shards[tile].index.remove(car)
+        self._forget_if_empty(tile)
+
+        if self._classes is not None:
+            shards = self._classes[car.vehicle]
+            shards[tile].index.remove(car)
+            if not shards[tile]:
+                del shards[tile]
+
+    def release_finished(self, current_time):
+        '''
+            Moves all cars which have finished their trips by `current_time` back to the indexes
+            of their shards (shards are processed in parallel when there is a pool of threads)
+            Params:
+            - current_time (int): current time in the world
+
+            Returns:
+            - released (list): cars which became free (in order of `booked_until`)
+        '''
+
+        shards = [shard for shard in self._shards.values() if shard.busy and shard.busy[0][0] <= current_time]
+        if self._executor and len(shards) > 1:
+            results = self._executor.map(lambda shard: shard.release_finished(current_time), shards)
+        else:
+            results = (shard.release_finished(current_time) for shard in shards)
+
+        released = [car for cars in results for car in cars]
+        self._busy_count -= len(released)
+
+        if self._classes is not None:
+            # cars are released in the shards of their destinations, where they wait while busy
+            for car in released:
+                self._class_shard(car.vehicle, self._tiles[car.car_id]).index.add(car)
+
+        if len(shards) > 1:
+            released.sort(key=lambda car: car.booked_until)
+
+        return released
+
+    def next_release_time(self):
+        '''
+            Returns the earliest `booked_until` amongst the busy cars (or None if all cars are free).
+            Looks at the top of the heap of every shard, so it's O(number of shards)
+        '''
+
+        return min((shard.busy[0][0] for shard in self._shards.values() if shard.busy), default=None)
+
+    def fast_forward(self, units=1, until_free=False):
+        '''
+            Advances time by many units at once (see `models.time.fast_forward` for the details)
+        '''
+
+        return fast_forward(self, units, until_free=until_free)
+
+    def add_car(self, car):
+        '''
+            Adds a new car to our taxi park (into the shard of its current location)
+            Params:
+            - car (Car): instance of a Car which will be added to the Taxi Park
+        '''
+
+        if not isinstance(car, Car):
+            raise TypeError("Please pass an instance of Car class to .add_car()")
+
+        self._cars.append(car)
+        self._generation.add(car)
+        if self._classes is None and self._generation.mixed:
+            self._split()
+
+        tile = self._tile(car.location.x, car.location.y)
+        self._tiles[car.car_id] = tile
+
+        if car.free_now(self.time.time):
+            self._add_free(tile, car)
+        else:
+            heapq.heappush(self._shard(tile).busy, (car.booked_until, next(self._sequence), car))
+            self._busy_count += 1
+
+    def populate_with_n_cars(self, n=0, mix=None):
+        '''
+            Helper function to create N cars with consecutive IDs from 1 to N (inclusive)
+            and add them to the cars collection
+            Params:
+            - n (int): how many cars to create and add to the collections
+            - mix (dict): share of the cars of every vehicle type (`settings.fleet_mix` by default,
+              see `models.vehicle.fleet_blocks`)
+        '''
+
+        blocks = fleet_blocks(n, settings.fleet_mix if mix is None else mix)
+        if not self._cars and all(vehicle is SEDAN for (vehicle, _) in blocks):
+            # new cars are free at the origin, just like the untouched ones after a reset (see `models.generation`),
+            # so they don't go to the index, and a Car is created only when a search or a reader gets to it
+            self._cars.extend_lazily(n, first_id=1)
+            return
+
+        first_id = 1
+        for (vehicle, number) in blocks:
+            for car_id in range(first_id, first_id + number):
+                self.add_car(Car(car_id, vehicle=vehicle))
+            first_id += number
+
+    def _is_available(self, requirements):
+        '''
+            Returns predicate telling whether a car is free, and vehicle classes meeting the requirements
+            (None when any car will do)
+        '''
+
+        current_time = self.time.time
+        vehicles = eligible(self._generation.vehicles, requirements) if requirements is not None else None
+        return (lambda car: car.free_now(current_time), vehicles)
+
+    def _shard_maps(self, vehicles):
+        '''
+            Returns maps of tiles to shards to search for cars of the given vehicle classes (None for all cars)
+        '''
+
+        if vehicles is None:
+            return [self._shards]
+
+        # some classes meet the requirements and some don't, so the fleet is split by classes already
+        return [self._classes[vehicle] for vehicle in vehicles if vehicle in self._classes]
+
+    @metrics.timed(metrics.FIND_CLOSEST_SECONDS)
+    def find_closest(self, src, requirements=None):
+        '''
+            Finds the closest available car to the customer, visiting shards ring by ring
+            around the tile of the customer (see the class docstring)
+            Params:
+            - src (Location): current location of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - closest_car (Car): instance of Car which is the closest and has the lowest ID,
+                - min_dist (int): distance between location of the customer and closest car
+            ) or None (if there are no available cars at the moment)
+        '''
+
+        (is_free, vehicles) = self._is_available(requirements)
+        best = None  # tuple of (distance, car_id, car)
+        scanned = 0  # how many cars were looked at by the shards
+
+        # all untouched cars are free at the origin, so only the one with the smallest ID can win
+        untouched = self._generation.first_untouched(vehicles)
+        if untouched is not None:
+            best = (self.metric.distance(ORIGIN, src), untouched.car_id, untouched)
+            scanned += 1
+
+        for shards in self._shard_maps(vehicles):
+            (best, searched) = self._closest_in(shards, src, is_free, best)
+            scanned += searched
+
+        if metrics.enabled:
+            metrics.CARS_SCANNED.observe(scanned)
+
+        if not best:
+            return
+
+        return (best[2], best[0])
+
+    def _closest_in(self, shards, src, is_free, best):
+        '''
+            Searches the shards ring by ring for a car closer than the best one found so far
+            Params:
+            - shards (dict): tile -> Shard
+            - src (Location): current location of the customer
+            - is_free (callable): predicate telling whether a car is available
+            - best (tuple): (distance, car_id, car) of the best car found so far or None
+
+            Returns:
+            - best (tuple): (distance, car_id, car) or None
+            - scanned (int): how many cars were looked at
+        '''
+
+        metric = self.metric
+
+        (cx, cy) = self._tile(src.x, src.y)
+        scanned = 0
+        visited = 0  # how many shards we have already looked into
+        probed = 0  # how many tiles (including empty ones) we have already looked into
+
+        def search(candidates, best):
+            nonlocal scanned
+
+            # visiting shards from the closest tile on, so the further ones can be skipped altogether
+            for (bound, shard) in sorted(candidates, key=lambda item: item[0]):
+                if best and bound > best[0] + metric.tolerance:
+                    break
+
+                closest = shard.index.nearest(src, is_free)
+                scanned += shard.index.scanned
+                if closest:
+                    (car, dist) = closest
+                    if not best or metric.better(dist, car.car_id, best[0], best[1]):
+                        best = (dist, car.car_id, car)
+
+            return best
+
+        def candidates(tiles):
+            for (tile, shard) in tiles:
+                if len(shard.index):
+                    yield (self._tile_distance(tile, src), shard)
+
+        r = 0
+        while visited < len(shards):
+            lower_bound = metric.bound((r - 1) * self.tile_size + 1) if r else 0
+            if best and lower_bound > best[0] + metric.tolerance:
+                break
+
+            # when we have probed more tiles than there are shards (i.e. cars are far away),
+            # it's cheaper to look through the remaining shards directly
+            probed += 8 * r or 1
+            if probed > len(shards):
+                remaining = (
+                    ((x, y), shard) for ((x, y), shard) in shards.items()
+                    if max(abs(x - cx), abs(y - cy)) >= r
+                )
+                best = search(candidates(remaining), best)
+                break
+
+            tiles = [(tile, shards[tile]) for tile in ring(cx, cy, r) if tile in shards]
+            visited += len(tiles)
+            best = search(candidates(tiles), best)
+
+            r += 1
+
+        return (best, scanned)
+
+    @metrics.timed(metrics.FIND_NEAREST_SECONDS)
+    def find_nearest(self, src, k, requirements=None):
+        '''
+            Finds up to k nearest available cars to the customer, ordered by (distance, car ID).
+            Shards are visited ring by ring the same way as by `.find_closest`, every shard gives
+            its own k nearest cars and the search stops as soon as no tile further out can have a car
+            closer than the k-th best one
+            Params:
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - requirements (Requirements): what the cars have to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            - nearest (list): tuples (car, distance), fewer than k if there are not enough free cars
+        '''
+
+        (is_free, vehicles) = self._is_available(requirements)
+        nearest = TopK(k)
+
+        # untouched cars are all free at the origin, so only the k of them with the smallest IDs can make it
+        untouched = self._generation.untouched(k, vehicles)
+        if untouched:
+            dist = self.metric.distance(ORIGIN, src)
+            for car in untouched:
+                nearest.offer(car, dist)
+
+        for shards in self._shard_maps(vehicles):
+            self._nearest_in(shards, src, k, is_free, nearest)
+
+        nearest = nearest.result()
+
+        # whoever looks at the cars has to see the untouched ones reset (and back in the shard of the origin)
+        for (car, _) in nearest:
+            if self._generation.touch(car):
+                tile = self._tiles[car.car_id] = self._tile(0, 0)
+                self._add_free(tile, car)
+
+        return nearest
+
+    def _nearest_in(self, shards, src, k, is_free, nearest):
+        '''
+            Searches the shards ring by ring for cars closer than the k-th best one found so far
+            Params:
+            - shards (dict): tile -> Shard
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - is_free (callable): predicate telling whether a car is available
+            - nearest (TopK): the best cars found so far, which the found ones are offered to
+        '''
+
+        metric = self.metric
+
+        (cx, cy) = self._tile(src.x, src.y)
+        visited = 0  # how many shards we have already looked into
+        probed = 0  # how many tiles (including empty ones) we have already looked into
+
+        def search(tiles):
+            candidates = [(self._tile_distance(tile, src), shard) for (tile, shard) in tiles if len(shard.index)]
+            for (bound, shard) in sorted(candidates, key=lambda item: item[0]):
+                if nearest.full and bound > nearest.worst:
+                    break
+
+                # cars of the shard come ordered, so the first one which doesn't make it ends the shard
+                for (car, dist) in shard.index.k_nearest(src, k, is_free):
+                    if not nearest.offer(car, dist):
+                        break
+
+        r = 0
+        while visited < len(shards):
+            lower_bound = metric.bound((r - 1) * self.tile_size + 1) if r else 0
+            if nearest.full and lower_bound > nearest.worst:
+                break
+
+            probed += 8 * r or 1
+            if probed > len(shards):
+                search(
+                    ((x, y), shard) for ((x, y), shard) in shards.items()
+                    if max(abs(x - cx), abs(y - cy)) >= r
+                )
+                break
+
+            tiles = [(tile, shards[tile]) for tile in ring(cx, cy, r) if tile in shards]
+            visited += len(tiles)
+            search(tiles)
+
+            r += 1
+
+    def position(self, car):
+        '''
+            Returns where the car is right now: on the way of its trip while it's busy,
+            at its location once it's free (see `models.journey`)
+        '''
+
+        if self._generation.is_untouched(car):
+            return ORIGIN
+
+        return car.position(self.time.time, self.metric)
+
+    def states(self, start=0, stop=None, positions=False):
+        '''
+            Returns states of the cars from `start` to `stop` (positions in `.cars`) without touching them (see TaxiPark)
+        '''
+
+        states = []
+        for car in self._cars[start:stop]:
+            state = self._generation.state(car)
+            if positions:
+                state['position'] = self.position(car).dict()
+            states.append(state)
+
+        return states
+
+    def positions(self):
+        '''
+            Returns IDs and current positions of all cars (in order of `.cars`) as int64 NumPy arrays
+        '''
+
+        import numpy as np
+
+        cars = self.cars
+        current_time = self.time.time
+        positions = [car.position(current_time, self.metric) for car in cars]
+
+        n = len(cars)
+        ids = np.fromiter((car.car_id for car in cars), np.int64, n)
+        xs = np.fromiter((position.x for position in positions), np.int64, n)
+        ys = np.fromiter((position.y for position in positions), np.int64, n)
+
+        return (ids, xs, ys)
+
+    def free_cars(self):
+        '''
+            Returns iterator over all cars which are available right now
+        '''
+
+        self._touch_all()
+
+        current_time = self.time.time
+        return (car for shard in list(self._shards.values()) for car in shard.index if car.free_now(current_time))
+
+    def idle_cars(self, k=0):
+        '''
+            Returns the cars available right now without touching the whole fleet (see TaxiPark)
+            Returns:
+            tuple(
+                - cars (list): free cars (touched ones)
+                - untouched (int): how many more free cars there are at the origin
+            )
+        '''
+
+        for car in self._generation.untouched(k):
+            if self._generation.touch(car):
+                tile = self._tiles[car.car_id] = self._tile(0, 0)
+                self._add_free(tile, car)
+
+        current_time = self.time.time
+        cars = [car for shard in self._shards.values() for car in shard.index if car.free_now(current_time)]
+        return (cars, max(self.free_count - len(cars), 0))
+
+    def book(self, car, src, dst, dist_to_client=None):
+        '''
+            Books the trip on the given (free) car, moving it to the shard of the destination
+            Params:
+            - car (Car): car which will take the trip
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - dist_to_client (int): distance between the car and the customer (if already known)
+
+            Returns:
+            - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+        '''
+
+        # an untouched car gets reset first (it's in no shard, so there is nothing to remove)
+        untouched = self._generation.touch(car)
+
+        if dist_to_client is None:
+            dist_to_client = car.distance(src, self.metric)
+
+        total_time = car.book(src, dst, current_time=self.time.time, dist_to_client=dist_to_client, metric=self.metric)
+
+        if not untouched:
+            self._remove_free(self._tiles[car.car_id], car)
+
+        # the car will be free in the shard of its destination
+        tile = self._tiles[car.car_id] = self._tile(dst.x, dst.y)
+        if car.free_now(self.time.time):
+            # a trip of no length is over already, so the car stays free
+            self._add_free(tile, car)
+            return total_time
+
+        heapq.heappush(self._shard(tile).busy, (car.booked_until, next(self._sequence), car))
+        self._busy_count += 1
+
+        return total_time
+
+    @metrics.timed(metrics.BOOK_CLOSEST_SECONDS)
+    def book_closest(self, src, dst, requirements=None):
+        '''
+            Books the trip on the closest taxi car to the client and drives to the destination
+            Params:
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - car (Car): the car that accepted the trip
+                - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+            ) or None (if there are not available cars at the moment)
+        '''
+
+        closest = self.find_closest(src, requirements)
+        if not closest:
+            if metrics.enabled:
+                metrics.BOOKINGS_FAILED.inc()
+            return
+
+        (car, dist) = closest
+        total_time = self.book(car, src, dst, dist_to_client=dist)
+
+        if metrics.enabled:
+            metrics.BOOKINGS_SUCCEEDED.inc()
+
+        return (car, total_time)
+
+    def book_batch(self, trips, optimal=False):
+        '''
+            Books a batch of trips at once (see `models.dispatch.book_batch` for the details)
+        '''
+
+        return book_batch(self, trips, optimal=optimal)
+
+    def reset(self):
+        '''
+            Resets all cars to the default state
+            i.e. to the position (0, 0) on a grid and without passangers
+        '''
+
+        self._shards = {}
+        if self._classes is not None:
+            self._classes = {}
+        self._busy_count = 0
+
+        if self._generation.lazy:
+            self._generation.start()
+            return
+
+        # cars were added out of order of their IDs, so they have to be reset right away
+        # (and the untouched ones stop being untouched, since they all go to the index now)
+        self._generation.touch_all()
+        [car.reset() for car in self._cars]
+
+        # all cars are free and at the origin now, so they all go to the same shard
+        tile = self._tile(0, 0)
+        for car in self._cars:
+            self._tiles[car.car_id] = tile
+            self._add_free(tile, car)
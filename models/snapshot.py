@@ -0,0 +1,208 @@
+'''
+    Snapshots of the fleet for warm restarts: IDs, locations, `booked_until` and vehicle classes of all cars
+    and the current time, in a compact binary file which is memory-mapped on restore
+    (columns of the file are used as NumPy arrays as they are, nothing is parsed car by car).
+
+    Format (little-endian):
+    - header of 32 bytes: magic `TAXISNAP`, version (uint32), CRC32 of the payload (uint32),
+      number of cars N (uint64) and the current time (int64)
+    - payload: 5 columns of N int64 values each - car IDs, x, y, `booked_until`
+      (int64 minimum for the cars which have never been booked) and vehicle classes (`Vehicle.code`).
+      Snapshots of version 1 have no column of vehicle classes (all cars are sedans)
+    Snapshots are written into a temporary file first and then moved over the old one,
+    so a crash in the middle of writing never leaves a broken snapshot behind.
+'''
+import asyncio
+import gc
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from .car import Car
+from .data import Point
+from .time import Time
+from .array_taxi_park import ArrayTaxiPark, NEVER_BOOKED
+from .taxi_park import create_taxi_park
+from .vehicle import SEDAN, Vehicle
+
+
+MAGIC = b'TAXISNAP'
+VERSION = 2
+HEADER = struct.Struct('<8sIIQq')
+
+# number of columns of the snapshots of every supported version
+COLUMNS = {1: 4, 2: 5}
+
+
+class Snapshot(object):
+    '''
+        Snapshot read from a file: current time and columns of the cars (memory-mapped)
+    '''
+
+    def __init__(self, time, ids, xs, ys, booked_until, vehicles):
+        self.time = time
+        self.ids = ids
+        self.xs = xs
+        self.ys = ys
+        self.booked_until = booked_until
+        self.vehicles = vehicles
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def fleet_columns(taxi_park):
+    '''
+        Returns IDs, x, y, `booked_until` and vehicle classes of all cars of the park as int64 NumPy arrays
+    '''
+
+    if isinstance(taxi_park, ArrayTaxiPark):
+        n = taxi_park._size
+        return (
+            taxi_park._ids[:n], taxi_park._xs[:n], taxi_park._ys[:n], taxi_park._booked_until[:n],
+            taxi_park._vehicles[:n],
+        )
+
+    cars = taxi_park.cars
+    n = len(cars)
+    return (
+        np.fromiter((car.car_id for car in cars), np.int64, n),
+        np.fromiter((car.location.x for car in cars), np.int64, n),
+        np.fromiter((car.location.y for car in cars), np.int64, n),
+        np.fromiter((NEVER_BOOKED if car.booked_until is None else car.booked_until for car in cars), np.int64, n),
+        np.fromiter((car.vehicle.code for car in cars), np.int64, n),
+    )
+
+
+def save(taxi_park, path):
+    '''
+        Writes snapshot of the taxi park (and its time) into the file
+        Params:
+        - taxi_park (TaxiPark, ArrayTaxiPark or ShardedTaxiPark): park to take the snapshot of
+        - path (str): path of the snapshot file
+
+        Returns:
+        - cars (int): number of cars in the snapshot
+    '''
+
+    columns = [np.ascontiguousarray(column, dtype='<i8') for column in fleet_columns(taxi_park)]
+
+    checksum = 0
+    for column in columns:
+        checksum = zlib.crc32(column.data, checksum)
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, checksum, len(columns[0]), taxi_park.time.time))
+        for column in columns:
+            f.write(column.data)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temporary, path)
+
+    return len(columns[0])
+
+
+def load(path):
+    '''
+        Memory-maps the snapshot file and checks its integrity. The mapping is copy-on-write:
+        the columns can be changed in memory, but the file itself never is
+        Params:
+        - path (str): path of the snapshot file
+
+        Returns:
+        - snapshot (Snapshot)
+
+        Raises:
+        - ValueError: if the file is not a snapshot, has unsupported version or is corrupted
+    '''
+
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+
+    if len(header) < HEADER.size:
+        raise ValueError(f"{path} is too short to be a snapshot")
+
+    (magic, version, checksum, n, current_time) = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a snapshot of the fleet")
+    if version not in COLUMNS:
+        raise ValueError(
+            f"Snapshot {path} has version {version}, only versions {', '.join(map(str, COLUMNS))} are supported"
+        )
+    width = COLUMNS[version]
+    if os.path.getsize(path) != HEADER.size + width * 8 * n:
+        raise ValueError(f"Snapshot {path} is truncated")
+
+    if not n:
+        columns = [np.empty(0, dtype='<i8')] * width
+    else:
+        payload = np.memmap(path, dtype='<i8', mode='c', offset=HEADER.size, shape=(width, n))
+        if zlib.crc32(payload) != checksum:
+            raise ValueError(f"Snapshot {path} is corrupted (checksum doesn't match)")
+        columns = list(payload)
+
+    if width < COLUMNS[VERSION]:
+        # cars of the older snapshots are all sedans
+        columns.append(np.full(n, SEDAN.code, dtype='<i8'))
+
+    return Snapshot(current_time, *columns)
+
+
+def restore(path, fleet_store=None):
+    '''
+        Creates the taxi park (with the store engine from settings or the given one) and its time
+        from the snapshot file
+        Params:
+        - path (str): path of the snapshot file
+        - fleet_store (str): "objects", "arrays" or "sharded"
+
+        Returns:
+        tuple(
+            - taxi_park (TaxiPark, ConcurrentTaxiPark, ArrayTaxiPark or ShardedTaxiPark)
+            - time (Time)
+        )
+    '''
+
+    snapshot = load(path)
+    time = Time(snapshot.time)
+
+    taxi_park = create_taxi_park(time, fleet_store)
+    if isinstance(taxi_park, ArrayTaxiPark):
+        # columns are taken as they are (copied only when they are written to)
+        taxi_park.adopt(snapshot.ids, snapshot.xs, snapshot.ys, snapshot.booked_until, snapshot.vehicles)
+        return (taxi_park, time)
+
+    # millions of new objects would trigger many full passes of the garbage collector,
+    # none of which can free anything (cars don't have reference cycles)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        columns = (
+            snapshot.ids.tolist(), snapshot.xs.tolist(), snapshot.ys.tolist(), snapshot.booked_until.tolist(),
+            snapshot.vehicles.tolist(),
+        )
+        for (car_id, x, y, booked_until, code) in zip(*columns):
+            car = Car(car_id, location=Point(x, y), vehicle=Vehicle.from_code(code))
+            car.booked_until = None if booked_until == NEVER_BOOKED else booked_until
+            taxi_park.add_car(car)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return (taxi_park, time)
+
+
+async def save_periodically(save_snapshot, interval):
+    '''
+        Calls `save_snapshot` every `interval` seconds until cancelled. Snapshots are taken
+        right in the event loop, so the state doesn't change while it's being written
+    '''
+
+    while True:
+        await asyncio.sleep(interval)
+        save_snapshot()
@@ -0,0 +1,519 @@
+import heapq
+from bisect import bisect_left, insort
+
+from .distance import default as default_metric
+from settings import settings
+
+
+def ring(cx, cy, r):
+    '''
+        Yields all cells lying exactly `r` cells away (by Chebyshev distance) from (cx, cy)
+    '''
+
+    if r == 0:
+        yield (cx, cy)
+        return
+
+    for dx in range(-r, r + 1):
+        yield (cx + dx, cy - r)
+        yield (cx + dx, cy + r)
+    for dy in range(-r + 1, r):
+        yield (cx - r, cy + dy)
+        yield (cx + r, cy + dy)
+
+
+class TopK(object):
+    '''
+        The k best cars seen so far by (distance, car ID), kept in a bounded max-heap,
+        so offering a car costs O(log k) and the worst of the best is always at hand
+        (to stop a search as soon as nothing further out can make it). Car IDs are expected to be unique.
+        Distances are compared exactly, even for non-integral metrics (a ranking has no single winner
+        to pick with `settings.eps`).
+    '''
+
+    def __init__(self, k):
+        if k < 1:
+            raise ValueError("Number of the nearest cars to find must be positive")
+
+        self.k = k
+        # tuples (-distance, -car_id, car), so the worst car is on top of the heap
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def full(self):
+        return len(self._heap) == self.k
+
+    @property
+    def worst(self):
+        # distance of the worst car amongst the best ones (only when full)
+        return -self._heap[0][0]
+
+    def beats(self, dist, car_id):
+        '''
+            Whether a car at `dist` with `car_id` would make it into the k best cars
+        '''
+
+        return not self.full or (dist, car_id) < (-self._heap[0][0], -self._heap[0][1])
+
+    def offer(self, car, dist):
+        '''
+            Keeps the car if it's amongst the k best ones
+            Returns:
+            - kept (bool)
+        '''
+
+        if not self.beats(dist, car.car_id):
+            return False
+
+        if self.full:
+            heapq.heapreplace(self._heap, (-dist, -car.car_id, car))
+        else:
+            heapq.heappush(self._heap, (-dist, -car.car_id, car))
+
+        return True
+
+    def result(self):
+        '''
+            Returns the best cars as tuples (car, distance), ordered by (distance, car ID)
+        '''
+
+        best = sorted(self._heap, key=lambda item: (item[0], item[1]), reverse=True)
+        return [(car, -dist) for (dist, _, car) in best]
+
+
+class LinearIndex(object):
+    '''
+        The simplest possible "index" - just a collection of cars which we scan
+        completely on every query. Complexity of a query is O(N), but there is no
+        overhead on updates at all, so it is the best choice for small fleets
+        (like 3 cars from the problem statement). Supports any distance metric.
+    '''
+
+    def __init__(self, metric=None):
+        # how distances are measured (see models/distance.py)
+        self.metric = metric or default_metric
+        # dict is used as an ordered set, so we can remove cars in O(1)
+        self._cars = {}
+        # how many cars were looked at during the last search
+        self.scanned = 0
+
+    def __len__(self):
+        return len(self._cars)
+
+    def __iter__(self):
+        return iter(self._cars)
+
+    def __contains__(self, car):
+        return car in self._cars
+
+    def add(self, car):
+        self._cars[car] = None
+
+    def remove(self, car):
+        self._cars.pop(car, None)
+
+    def move(self, car):
+        # we don't store locations, so nothing to update here
+        pass
+
+    def clear(self):
+        self._cars = {}
+
+    def nearest(self, src, is_free):
+        '''
+            Finds the closest free car to the given location.
+            Works by iterating across all cars, ignoring busy ones and
+            finding all cars within the minimal distance. This method is used
+            since later we want the car with the smallest ID amongst those.
+            We could also sort by double key of (distance INCR, car_id INCR) and take
+            the first car, but it would make complexity O(N logN), while here we have O(N).
+            Distances of integral metrics are compared exactly, while for the others (e.g. Euclidean)
+            distances closer than `settings.eps` are considered the same
+            Params:
+            - src (Location): current location of the customer
+            - is_free (callable): predicate telling whether a car is available
+
+            Returns:
+            tuple(
+                - closest_car (Car): the closest car with the lowest ID,
+                - min_dist (int): distance between src and the closest car
+            ) or None (if there are no free cars)
+        '''
+
+        self.scanned = len(self._cars)
+
+        distance = self.metric.distance
+        if self.metric.integral:
+            # distances are exact, so a tie is an equality and a single pass keeps the best car
+            (closest, min_dist) = (None, None)
+            for car in self._cars:
+                if not is_free(car):
+                    continue
+
+                dist = distance(car.location, src)
+                if closest is None or dist < min_dist or (dist == min_dist and car.car_id < closest.car_id):
+                    (closest, min_dist) = (car, dist)
+
+            return (closest, min_dist) if closest is not None else None
+
+        min_dist = float('inf')  # current known minimal distance
+        closest_cars = []  # to store all cars at current known min distance
+        for car in self._cars:
+            # skip car if it's not available
+            if not is_free(car):
+                continue
+
+            dist = distance(car.location, src)  # distance between the client and current car
+            if abs(min_dist - dist) < settings.eps:  # if the same distance
+                closest_cars.append(car)  # add to the list of cars withing currently known min dist
+            elif dist < min_dist:  # if distance we just found is smaller than currently known
+                min_dist = dist  # update current minimal distance
+                closest_cars = [car]  # starting list of currently known closest cars from the start
+
+        if not closest_cars:  # if we didn't find any free cars at all
+            return
+
+        # finding car with the smallest ID amongst the closest ones (only the same distance)
+        closest_car = min(closest_cars, key=lambda car: car.car_id)
+
+        return (closest_car, min_dist)
+
+    def k_nearest(self, src, k, is_free):
+        '''
+            Finds up to k closest free cars to the given location, ordered by (distance, car ID).
+            All cars are still scanned, but only the best k of them are kept in a bounded heap,
+            so it's O(N logk) instead of O(N logN) of sorting them all
+            Params:
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - is_free (callable): predicate telling whether a car is available
+
+            Returns:
+            - nearest (list): tuples (car, distance)
+        '''
+
+        self.scanned = len(self._cars)
+
+        nearest = TopK(k)
+        worst = float('inf')  # distance of the k-th best car so far (further cars are skipped right away)
+        distance = self.metric.distance
+        for car in self._cars:
+            if not is_free(car):
+                continue
+
+            dist = distance(car.location, src)
+            if dist <= worst and nearest.offer(car, dist) and nearest.full:
+                worst = nearest.worst
+
+        return nearest.result()
+
+    def soonest(self, src, wait):
+        '''
+            Finds the car which can get to the given location the soonest, i.e. with the smallest
+            `wait(car) + distance` (and the smallest ID in case of a tie)
+            Params:
+            - src (Location): current location of the customer
+            - wait (callable): how long the car is busy for (before it can set off)
+
+            Returns:
+            tuple(
+                - car (Car): the car which gets to the location first,
+                - eta (int): how long it takes the car (waiting included)
+            ) or None (if the index is empty)
+        '''
+
+        self.scanned = len(self._cars)
+
+        (distance, better) = (self.metric.distance, self.metric.better)
+        best = None
+        for car in self._cars:
+            eta = wait(car) + distance(car.location, src)
+            if best is None or better(eta, car.car_id, best[1], best[0].car_id):
+                best = (car, eta)
+
+        return best
+
+    def empty_like(self):
+        '''
+            Returns a new empty index with the same metric
+        '''
+
+        return LinearIndex(self.metric)
+
+
+class GridIndex(object):
+    '''
+        Spatial index which splits the plane into square cells of `cell_size` units
+        (bucketing cars by the cell of their location) and finds the nearest car by
+        visiting cells ring by ring, starting from the cell of the customer.
+
+        Every cell at ring `r` (r > 0) is at least `(r - 1) * cell_size + 1` units away along one of the axes
+        from any point of the central cell. Metrics never decrease as the differences grow
+        (see models/distance.py), so distance to the cell is at least `metric.bound` of that,
+        and as soon as this lower bound exceeds the best known distance we can stop - no car further out
+        can be closer (or as close, but with smaller ID). Supports any distance metric.
+
+        Inside a cell cars are grouped by their exact point, and every point keeps car IDs sorted,
+        so cars piled up at the same spot (e.g. all of them at the origin after a reset)
+        cost a single distance computation instead of one per car.
+
+        Car IDs are expected to be unique inside the index.
+    '''
+
+    def __init__(self, cell_size=None, metric=None):
+        self.cell_size = cell_size or settings.grid_cell_size
+        if self.cell_size < 1:
+            raise ValueError("Cell size of the grid index must be a positive integer")
+
+        # how distances are measured (see models/distance.py)
+        self.metric = metric or default_metric
+
+        self.clear()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __iter__(self):
+        return iter(self._cars.values())
+
+    def __contains__(self, car):
+        return car.car_id in self._positions
+
+    def _cell(self, x, y):
+        return (x // self.cell_size, y // self.cell_size)
+
+    def add(self, car):
+        if car.car_id in self._positions:
+            raise ValueError(f"Car with ID {car.car_id} is already in the index")
+
+        point = (car.location.x, car.location.y)
+        self._positions[car.car_id] = point
+        self._cars[car.car_id] = car
+
+        points = self._cells.setdefault(self._cell(*point), {})
+        insort(points.setdefault(point, []), car.car_id)
+
+    def remove(self, car):
+        # we look up the point the car was indexed at (and not the current car location),
+        # since at this moment the car could have already moved somewhere else
+        point = self._positions.pop(car.car_id, None)
+        if point is None:
+            return
+
+        del self._cars[car.car_id]
+
+        cell = self._cell(*point)
+        points = self._cells[cell]
+        car_ids = points[point]
+        del car_ids[bisect_left(car_ids, car.car_id)]
+
+        # not keeping empty containers around, so we don't have to visit them later on
+        if not car_ids:
+            del points[point]
+            if not points:
+                del self._cells[cell]
+
+    def move(self, car):
+        '''
+            Updates position of the car in the index after the car changed its location
+        '''
+
+        self.remove(car)
+        self.add(car)
+
+    def clear(self):
+        self._cells = {}  # (cell_x, cell_y) -> {(x, y) -> [car_id, ...]}
+        self._positions = {}  # car_id -> (x, y) under which the car is indexed
+        self._cars = {}  # car_id -> Car
+        self.scanned = 0  # how many cars were looked at during the last search
+
+    def _scan_cell(self, points, src, is_free, best):
+        (measure, better, tolerance) = (self.metric.measure, self.metric.better, self.metric.tolerance)
+
+        for ((x, y), car_ids) in points.items():
+            dist = measure(abs(x - src.x), abs(y - src.y))
+            if best and dist > best[0] + tolerance:
+                continue
+
+            # IDs are sorted, so the first free car is the best one at this point
+            for car_id in car_ids:
+                if best and not better(dist, car_id, best[0], best[1]):
+                    break
+
+                self.scanned += 1
+                car = self._cars[car_id]
+                if is_free(car):
+                    best = (dist, car_id, car)
+                    break
+
+        return best
+
+    def _cells_around(self, src, done):
+        '''
+            Yields occupied cells (as dicts of their points) ring by ring around the cell of the location
+            until `done(lower_bound)` tells that no car of the next ring can beat the ones found so far
+            (`lower_bound` is the smallest distance from the location to any point of the ring)
+        '''
+
+        (cx, cy) = self._cell(src.x, src.y)
+        visited = 0  # how many non-empty cells we have already looked into
+        probed = 0  # how many cells (including empty ones) we have already looked into
+
+        r = 0
+        while visited < len(self._cells):
+            if done(self.metric.bound((r - 1) * self.cell_size + 1) if r else 0):
+                return
+
+            # when we have probed more cells than there are occupied ones (i.e. cars are far away
+            # or the fleet is sparse) it's cheaper to look through the occupied cells directly
+            probed += 8 * r or 1
+            if probed > len(self._cells):
+                for ((x, y), points) in self._cells.items():
+                    if max(abs(x - cx), abs(y - cy)) >= r:
+                        yield points
+                return
+
+            for cell in ring(cx, cy, r):
+                points = self._cells.get(cell)
+                if points:
+                    visited += 1
+                    yield points
+
+            r += 1
+
+    def nearest(self, src, is_free):
+        '''
+            Finds the closest free car to the given location (with the smallest ID in case of a tie)
+            Params:
+            - src (Location): current location of the customer
+            - is_free (callable): predicate telling whether a car is available
+
+            Returns:
+            tuple(
+                - closest_car (Car): the closest car with the lowest ID,
+                - min_dist (int): distance between src and the closest car
+            ) or None (if there are no free cars)
+        '''
+
+        self.scanned = 0
+        best = None  # tuple of (distance, car_id, car)
+        tolerance = self.metric.tolerance
+
+        for points in self._cells_around(src, lambda lower_bound: best and lower_bound > best[0] + tolerance):
+            best = self._scan_cell(points, src, is_free, best)
+
+        if not best:
+            return
+
+        return (best[2], best[0])
+
+    def _scan_cell_k(self, points, src, is_free, nearest):
+        measure = self.metric.measure
+
+        for ((x, y), car_ids) in points.items():
+            dist = measure(abs(x - src.x), abs(y - src.y))
+
+            # IDs are sorted, so as soon as a car of the point doesn't make it, the rest won't either
+            for car_id in car_ids:
+                if not nearest.beats(dist, car_id):
+                    break
+
+                self.scanned += 1
+                car = self._cars[car_id]
+                if is_free(car):
+                    nearest.offer(car, dist)
+
+    def k_nearest(self, src, k, is_free):
+        '''
+            Finds up to k closest free cars to the given location, ordered by (distance, car ID).
+            Visits cells ring by ring the same way as `.nearest` does, keeping the best k cars
+            in a bounded heap, and stops as soon as the lower bound of the ring exceeds
+            the distance of the k-th best car
+            Params:
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - is_free (callable): predicate telling whether a car is available
+
+            Returns:
+            - nearest (list): tuples (car, distance)
+        '''
+
+        self.scanned = 0
+        nearest = TopK(k)
+
+        for points in self._cells_around(src, lambda lower_bound: nearest.full and lower_bound > nearest.worst):
+            self._scan_cell_k(points, src, is_free, nearest)
+
+        return nearest.result()
+
+    def soonest(self, src, wait):
+        '''
+            Finds the car which can get to the given location the soonest, i.e. with the smallest
+            `wait(car) + distance` (and the smallest ID in case of a tie). Waiting is never negative,
+            so rings are pruned by the distance the same way as by `.nearest`
+            Params:
+            - src (Location): current location of the customer
+            - wait (callable): how long the car is busy for (before it can set off)
+
+            Returns:
+            tuple(
+                - car (Car): the car which gets to the location first,
+                - eta (int): how long it takes the car (waiting included)
+            ) or None (if the index is empty)
+        '''
+
+        (measure, better, tolerance) = (self.metric.measure, self.metric.better, self.metric.tolerance)
+        self.scanned = 0
+        best = None  # tuple of (eta, car_id, car)
+
+        for points in self._cells_around(src, lambda lower_bound: best and lower_bound > best[0] + tolerance):
+            for ((x, y), car_ids) in points.items():
+                dist = measure(abs(x - src.x), abs(y - src.y))
+                if best and dist > best[0] + tolerance:
+                    continue
+
+                for car_id in car_ids:
+                    self.scanned += 1
+                    car = self._cars[car_id]
+                    eta = wait(car) + dist
+                    if not best or better(eta, car_id, best[0], best[1]):
+                        best = (eta, car_id, car)
+
+        if not best:
+            return
+
+        return (best[2], best[0])
+
+    def empty_like(self):
+        '''
+            Returns a new empty index with the same cell size and metric
+        '''
+
+        return GridIndex(self.cell_size, self.metric)
+
+
+INDEXES = {
+    'linear': LinearIndex,
+    'grid': GridIndex,
+}
+
+
+def create_index(name=None, metric=None):
+    '''
+        Creates a spatial index by its name (taking the one from settings by default)
+        Params:
+        - name (str): one of the keys of INDEXES
+        - metric (Metric): distance metric of the index (the one from settings by default)
+
+        Returns:
+        - index (LinearIndex or GridIndex): empty spatial index
+    '''
+
+    name = name or settings.spatial_index
+    if name not in INDEXES:
+        raise ValueError(f"Unknown spatial index '{name}', choose one of: {', '.join(INDEXES)}")
+
+    return INDEXES[name](metric=metric)
@@ -1,30 +1,243 @@
-from .car import Car
-from .time import Time
+import heapq
+from collections import namedtuple
+from itertools import count
+
+from .car import Car, CarList
+from .data import ORIGIN
+from .time import Time, fast_forward
+from .spatial_index import TopK, create_index
+from .generation import Generation
+from .pooling import RidePool
+from .vehicle import SEDAN, eligible, fleet_blocks
+from .dispatch import book_batch
+from . import metrics
 from settings import settings
 
 
+# free cars (and busy ones with future dispatch) of a single vehicle class
+Partition = namedtuple('Partition', ['index', 'busy_index'])
+
+
 class TaxiPark(object):
     '''
         Represents our collection of taxi cars in our world.
-        We store a list of Car instances and a referrence to global Time object
+        We store a list of Car instances, a referrence to global Time object,
+        a spatial index with currently free cars to search for the closest one
+        and a min-heap of busy cars ordered by the time they finish their trips.
+        Taxi park subscribes to the time changes, so every tick releases cars which
+        have reached their destinations back to the index (in O(logN) per released car).
 
         NOTE
-        Here we could possible optimize our solution to be more efficient in finding the most nearby car
-        using kd-tree data structure. For example we could use implementation from scipy (scipy.spatial.KDTree),
-        however in case multiple cars are withing the same distance we want to find the one with lowest ID, so
-        in this case we might need to do 2 queries. Beyond that, updating position of cars and keeping track whether
-        a car is free or not will become not so trivial in this case (but still solveable), not to mention synchronisation,
-        if we want to support concurrency at some point.
-        In any case, usage of kd-trees (or other more sophisticated data structures) in case of 3 cars is definitely
-        an overkill (probably even when having 100 cars).
+        Which spatial index to use is configured by `settings.spatial_index`:
+        - "linear" (default) just scans all cars - there is no point in anything more
+          sophisticated when having 3 cars (probably even when having 100 cars)
+        - "grid" buckets cars into square cells and searches ring by ring around the customer,
+          which makes booking latency almost independent of the fleet size
+        We also considered kd-trees (e.g. scipy.spatial.KDTree), but they would have to be rebuilt
+        on every booking (since the booked car changes its position) and would need a second query
+        to find the car with the lowest ID amongst the equally close ones.
+        Cars should be booked through `.book_closest`, so the index is kept up to date.
+        Distances are measured by the metric of the index (`settings.distance_metric` by default,
+        see `models.distance`), which is the same for every search and booking of the park.
+
+        With future dispatch (`settings.future_dispatch`) busy cars compete for bookings as well:
+        the car which can get to the customer the soonest (`max(booked_until - now, 0) + distance`
+        from the point it drops off its current customer at) is booked, and the new trip starts
+        when the current one ends. Busy cars are kept in a second spatial index (of the same kind)
+        by their drop-off locations, so the search stays as quick as the one for free cars.
+
+        Customers can ask for room for more passengers or for a type of vehicle (see `models.vehicle`).
+        Once the fleet has cars of more than one vehicle class, free (and busy) cars of every class are kept
+        in indexes of their own as well, so such a search looks only through the classes meeting
+        the requirements and is as quick as an unfiltered one, however few cars are eligible.
+        A booked busy car keeps its place in the busy heap, and it's pushed further on
+        when it turns out there (see `.release_finished`).
+
+        With ride pooling (`settings.pool_rides`) a booking goes to the car which has to drive the least
+        extra for it: the closest free car (the whole trip is extra) or a busy car with a route passing by,
+        if neither the new customer nor the ones already on the way wait or ride more than `settings.pool_max_detour`
+        units longer because of it (see `models.pooling`). Routes of the busy cars are kept in a third spatial index.
+
+        Reset takes O(1): it only starts a new generation of the park (see `models.generation`)
+        and empties the index and the busy heap. Cars are reset one by one when they are touched next time:
+        the first untouched car competes with the index in every search, and looking through `.cars`
+        touches (and puts back to the index) all of them.
     '''
 
-    def __init__(self, time):
+    def __init__(self, time, index=None, metric=None, future_dispatch=None, pool_rides=None):
         if not isinstance(time, Time):
             raise TypeError("Please pass an instance of Time class to the class constructor")
 
-        self.cars = []
+        self._cars = CarList()
+        self._generation = Generation(self._cars)
         self.time = time
+        # spatial index used to look up the closest car (configured in settings by default)
+        self.index = index if index is not None else create_index(metric=metric)
+        if metric is not None and self.index.metric is not metric:
+            raise ValueError("Spatial index of the taxi park has to measure distances with the same metric")
+        self.metric = self.index.metric
+
+        # whether busy cars can be booked as well, and the index of them by their drop-off locations
+        self.future_dispatch = settings.future_dispatch if future_dispatch is None else future_dispatch
+        self._busy_index = self.index.empty_like() if self.future_dispatch else None
+
+        # routes of the busy cars customers can share (with ride pooling)
+        pool_rides = settings.pool_rides if pool_rides is None else pool_rides
+        if pool_rides and self.future_dispatch:
+            raise ValueError("Ride pooling and future dispatch can't be used together")
+        self._pool = (
+            RidePool(self.index.empty_like(), settings.pool_max_detour, settings.pool_candidates) if pool_rides else None
+        )
+
+        # heap of tuples (booked_until, sequence number, car) for all busy cars. Sequence number
+        # is only there to never compare cars themselves in case of equal booked_until
+        self._busy = []
+        self._sequence = count()
+
+        # Vehicle -> Partition (only once the fleet has cars of more than one class, see `.add_car`)
+        self._classes = None
+
+        self.time.subscribe(self.release_finished)
+
+    @property
+    def cars(self):
+        # whoever looks at the cars has to see the untouched ones reset
+        self._touch_all()
+        return self._cars
+
+    @property
+    def pool_rides(self):
+        return self._pool is not None
+
+    @property
+    def busy_count(self):
+        return len(self._busy)
+
+    @property
+    def free_count(self):
+        return len(self._cars) - len(self._busy)
+
+    def _touch_all(self):
+        for car in self._generation.touch_all():
+            self._add_free(car)
+
+    def _partition(self, vehicle):
+        if vehicle not in self._classes:
+            busy_index = self._busy_index.empty_like() if self._busy_index is not None else None
+            self._classes[vehicle] = Partition(self.index.empty_like(), busy_index)
+
+        return self._classes[vehicle]
+
+    def _split(self):
+        '''
+            Starts keeping cars of every vehicle class in indexes of their own
+        '''
+
+        self._classes = {}
+        for car in self.index:
+            self._partition(car.vehicle).index.add(car)
+        if self._busy_index is not None:
+            for car in self._busy_index:
+                self._partition(car.vehicle).busy_index.add(car)
+
+    def _add_free(self, car):
+        self.index.add(car)
+        if self._classes is not None:
+            self._partition(car.vehicle).index.add(car)
+
+    def _keep_free(self, car):
+        # (re)indexes a car whose trip is over as soon as it's booked (wherever it has been left)
+        self.index.remove(car)
+        if self._classes is not None:
+            self._partition(car.vehicle).index.remove(car)
+        self._add_free(car)
+
+    def _mark_busy(self, car):
+        self.index.remove(car)
+        heapq.heappush(self._busy, (car.booked_until, next(self._sequence), car))
+        if self._busy_index is not None:
+            self._busy_index.add(car)
+
+        if self._classes is not None:
+            partition = self._partition(car.vehicle)
+            partition.index.remove(car)
+            if partition.busy_index is not None:
+                partition.busy_index.add(car)
+
+    def _eligible(self, requirements):
+        # vehicle classes meeting the requirements (None when any car will do)
+        return eligible(self._generation.vehicles, requirements) if requirements is not None else None
+
+    def _indexes(self, vehicles, busy=False):
+        '''
+            Returns the indexes to search for cars of the given vehicle classes (None for all cars)
+        '''
+
+        if vehicles is None:
+            return [self._busy_index if busy else self.index]
+
+        # some classes meet the requirements and some don't, so the fleet is split by classes already
+        partitions = [self._classes[vehicle] for vehicle in vehicles if vehicle in self._classes]
+        return [partition.busy_index if busy else partition.index for partition in partitions]
+
+    def release_finished(self, current_time):
+        '''
+            Moves all cars which have finished their trips by `current_time` from the busy heap
+            back to the index of free cars. Called by Time on every tick (which might advance time
+            on many units at once).
+            Params:
+            - current_time (int): current time in the world
+
+            Returns:
+            - released (list): cars which became free
+        '''
+
+        if self._pool is not None:
+            # pooled cars have passed some of their stops, and the finished routes have to go before their cars
+            self._pool.advance(current_time)
+
+        released = []
+        while self._busy and self._busy[0][0] <= current_time:
+            (_, _, car) = heapq.heappop(self._busy)
+            if car.booked_until > current_time:
+                # the car has been booked for another trip meanwhile (future dispatch or pooling),
+                # so it's busy till its end
+                heapq.heappush(self._busy, (car.booked_until, next(self._sequence), car))
+                continue
+
+            if self._busy_index is not None:
+                self._busy_index.remove(car)
+                if self._classes is not None:
+                    self._partition(car.vehicle).busy_index.remove(car)
+            self._add_free(car)
+            released.append(car)
+
+        return released
+
+    def next_release_time(self):
+        '''
+            Returns the earliest `booked_until` amongst the busy cars (or None if all cars are free)
+        '''
+
+        # cars booked for another trip meanwhile (future dispatch) are pushed to the end of it first
+        while self._busy and self._busy[0][2].booked_until != self._busy[0][0]:
+            car = self._busy[0][2]
+            heapq.heapreplace(self._busy, (car.booked_until, next(self._sequence), car))
+
+        return self._busy[0][0] if self._busy else None
+
+    def fast_forward(self, units=1, until_free=False):
+        '''
+            Advances time by many units at once (see `models.time.fast_forward` for the details)
+            Params:
+            - units (int): how many units to skip
+            - until_free (bool): skip to the moment the next busy car gets free instead
+
+            Returns:
+            - released (list): cars which became free
+        '''
+
+        return fast_forward(self, units, until_free=until_free)
 
     def add_car(self, car):
         '''
@@ -36,35 +249,50 @@ class TaxiPark(object):
         if not isinstance(car, Car):
             raise TypeError("Please pass an instance of Car class to .add_car()")
 
-        self.cars.append(car)
+        self._cars.append(car)
+        self._generation.add(car)
+        if self._classes is None and self._generation.mixed:
+            self._split()
+
+        if car.free_now(self.time.time):
+            self._add_free(car)
+        else:
+            self._mark_busy(car)
 
-    def populate_with_n_cars(self, n=0):
+    def populate_with_n_cars(self, n=0, mix=None):
         '''
             Helper function to create N cars with consecutive IDs from 1 to N (inclusive)
             and add them to the cars collection
             Params:
             - n (int): how many cars to create and add to the collections
+            - mix (dict): share of the cars of every vehicle type (`settings.fleet_mix` by default,
+              see `models.vehicle.fleet_blocks`)
         '''
 
-        for i in range(1, n + 1):
-            car = Car(i)
-            self.add_car(car)
+        blocks = fleet_blocks(n, settings.fleet_mix if mix is None else mix)
+        if not self._cars and all(vehicle is SEDAN for (vehicle, _) in blocks):
+            # new cars are free at the origin, just like the untouched ones after a reset (see `models.generation`),
+            # so they don't go to the index, and a Car is created only when a search or a reader gets to it
+            self._cars.extend_lazily(n, first_id=1)
+            return
+
+        first_id = 1
+        for (vehicle, number) in blocks:
+            for car_id in range(first_id, first_id + number):
+                self.add_car(Car(car_id, vehicle=vehicle))
+            first_id += number
 
-    def find_closest(self, src):
+    @metrics.timed(metrics.FIND_CLOSEST_SECONDS)
+    def find_closest(self, src, requirements=None):
         '''
             Finds the closest available car to the customer.
-            Works by iterating across all cars, ignoring busy ones and
-            finding all cars within the minimal distance. This method is used
-            since later we want the car with the smallest ID amongst those.
-            And even though `.populate_with_n_cars` method will add cars in order
-            of increasing IDs - it's still possible to add cars in custom order.
-            So it's the most reliable way to do so. We could also sort by double
-            key of (distance INCR, car_id INCR) and take the first car, but it would
-            make complexity O(N logN), while here we have O(N) (which doesn't make any
-            difference when having 3 cars, but could be significant difference when having
-            way more cars available)
+            The search itself is delegated to the spatial index of the park
+            (see `models.spatial_index`), which contains only free cars and is responsible
+            for picking the car with the smallest ID amongst the ones within the same minimal distance.
+            We still double check that the car is free, in case somebody booked it bypassing the park.
             Params:
             - src (Location): current location of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
 
             Returns:
             tuple(
@@ -73,36 +301,251 @@ class TaxiPark(object):
             ) or None (if there are no available cars at the moment)
         '''
 
-        min_dist = float('inf')  # current known minimal distance
-        closest_cars = []  # to store all cars at current known min distance
-        for car in self.cars:
-            # skip car if it's not available
-            if not car.free_now(self.time.time):
-                continue
+        current_time = self.time.time
 
-            dist = car.distance(src) # distance between the client and current car
-            if abs(min_dist - dist) < settings.eps:  # if the same distance
-                closest_cars.append(car)  # add to the list of cars withing currently known min dist
-            elif dist < min_dist:  # if distance we just found is smaller than currently known
-                min_dist = dist  # update current minimal distance
-                closest_cars = [car]  # starting list of currently known closest cars from the start
+        def is_free(car):
+            return car.free_now(current_time)
 
-        if not closest_cars:  # if we didn't find any free cars at all
-            return
+        vehicles = self._eligible(requirements)
+
+        (closest, scanned) = (None, 0)
+        for index in self._indexes(vehicles):
+            found = index.nearest(src, is_free)
+            scanned += index.scanned
+            if found and (not closest or self.metric.better(found[1], found[0].car_id, closest[1], closest[0].car_id)):
+                closest = found
+
+        # all untouched cars are free at the origin, so only the one with the smallest ID can win
+        untouched = self._generation.first_untouched(vehicles)
+        if untouched is not None:
+            scanned += 1
+            dist = self.metric.distance(ORIGIN, src)
+            if not closest or self.metric.better(dist, untouched.car_id, closest[1], closest[0].car_id):
+                closest = (untouched, dist)
 
-        # finding car with the smallest ID amongst the closest ones (only the same distance)
-        closest_car = min(closest_cars, key=lambda car: car.car_id)
+        if metrics.enabled:
+            metrics.CARS_SCANNED.observe(scanned)
 
-        return (closest_car, min_dist)
+        return closest
 
-    def book_closest(self, src, dst):
+    @metrics.timed(metrics.FIND_SOONEST_SECONDS)
+    def find_soonest(self, src, requirements=None):
+        '''
+            Finds the car which can get to the customer the soonest, busy cars included (future dispatch):
+            the one with the smallest `max(booked_until - now, 0) + distance` (and the lowest ID in case of a tie),
+            where a busy car sets off from the location it drops off its current customer at.
+            The best free car (see `.find_closest`) competes with the best busy one
+            Params:
+            - src (Location): current location of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            tuple(
+                - car (Car): the car which gets to the customer first,
+                - eta (int): how long the customer waits for it
+            ) or None (if there are no cars at all)
+        '''
+
+        best = self.find_closest(src, requirements)
+
+        current_time = self.time.time
+
+        def wait(car):
+            return max(car.booked_until - current_time, 0)
+
+        for index in self._indexes(self._eligible(requirements), busy=True):
+            soonest = index.soonest(src, wait)
+            if soonest and (not best or self.metric.better(soonest[1], soonest[0].car_id, best[1], best[0].car_id)):
+                best = soonest
+
+        return best
+
+    def _nearest(self, src, k, requirements=None):
+        current_time = self.time.time
+
+        def is_free(car):
+            return car.free_now(current_time)
+
+        vehicles = self._eligible(requirements)
+
+        nearest = TopK(k)
+        for index in self._indexes(vehicles):
+            for (car, dist) in index.k_nearest(src, k, is_free):
+                nearest.offer(car, dist)
+
+        # untouched cars are all free at the origin, so only the k of them with the smallest IDs can make it
+        untouched = self._generation.untouched(k, vehicles)
+        if untouched:
+            dist = self.metric.distance(ORIGIN, src)
+            for car in untouched:
+                if not nearest.offer(car, dist):
+                    break
+
+        return nearest.result()
+
+    @metrics.timed(metrics.FIND_NEAREST_SECONDS)
+    def find_nearest(self, src, k, requirements=None):
+        '''
+            Finds up to k nearest available cars to the customer, ordered by (distance, car ID)
+            (e.g. to show them to the customer or to fall back to the next one).
+            The search is delegated to the spatial index the same way as for `.find_closest`,
+            and doesn't sort all free cars (see `.k_nearest` of the indexes)
+            Params:
+            - src (Location): current location of the customer
+            - k (int): how many cars to find
+            - requirements (Requirements): what the cars have to meet (see `models.vehicle`), any car by default
+
+            Returns:
+            - nearest (list): tuples (car, distance), fewer than k if there are not enough free cars
+        '''
+
+        nearest = self._nearest(src, k, requirements)
+
+        # whoever looks at the cars has to see the untouched ones reset (and back in the index)
+        for (car, _) in nearest:
+            if self._generation.touch(car):
+                self._add_free(car)
+
+        return nearest
+
+    def position(self, car):
+        '''
+            Returns where the car is right now: on the way of its trip (or of its route with ride pooling)
+            while it's busy, at its location once it's free (see `models.journey`). Takes O(1), nothing is tracked on ticks
+        '''
+
+        return self._position(car)
+
+    def _position(self, car):
+        if self._generation.is_untouched(car):
+            return ORIGIN
+
+        current_time = self.time.time
+        if self._pool is not None:
+            position = self._pool.position(car, current_time)
+            if position is not None:
+                return position
+
+        return car.position(current_time, self.metric)
+
+    def states(self, start=0, stop=None, positions=False):
+        '''
+            Returns states of the cars from `start` to `stop` (positions in `.cars`) as `Car.to_dict` does,
+            with the positions of the cars as well if asked for. Cars aren't touched, so it takes O(stop - start)
+            after a reset or a lazy populate too (untouched cars are free at the origin)
+        '''
+
+        states = []
+        for car in self._cars[start:stop]:
+            state = self._generation.state(car)
+            if positions:
+                state['position'] = self._position(car).dict()
+            states.append(state)
+
+        return states
+
+    def positions(self):
+        '''
+            Returns IDs and current positions of all cars (in order of `.cars`) as int64 NumPy arrays.
+            Free cars are at their locations, so only the busy ones are looked at along their trips
+            Returns:
+            tuple(
+                - ids (NumPy array)
+                - xs (NumPy array)
+                - ys (NumPy array)
+            )
+        '''
+
+        import numpy as np
+
+        cars = self.cars
+        current_time = self.time.time
+        positions = [car.location if car.free_now(current_time) else self.position(car) for car in cars]
+
+        n = len(cars)
+        ids = np.fromiter((car.car_id for car in cars), np.int64, n)
+        xs = np.fromiter((position.x for position in positions), np.int64, n)
+        ys = np.fromiter((position.y for position in positions), np.int64, n)
+
+        return (ids, xs, ys)
+
+    def free_cars(self):
+        '''
+            Returns iterator over all cars which are available right now
+        '''
+
+        self._touch_all()
+
+        current_time = self.time.time
+        return (car for car in self.index if car.free_now(current_time))
+
+    def idle_cars(self, k=0):
+        '''
+            Returns the cars available right now without touching the whole fleet (see `models.rebalancing`):
+            free cars are taken from the index, and only up to k untouched cars (the ones with the smallest IDs,
+            all of them free at the origin) are touched, the rest of them are only counted
+            Returns:
+            tuple(
+                - cars (list): free cars (touched ones)
+                - untouched (int): how many more free cars there are at the origin
+            )
+        '''
+
+        for car in self._generation.untouched(k):
+            if self._generation.touch(car):
+                self._add_free(car)
+
+        current_time = self.time.time
+        cars = [car for car in self.index if car.free_now(current_time)]
+        return (cars, max(self.free_count - len(cars), 0))
+
+    def book(self, car, src, dst, dist_to_client=None):
+        '''
+            Books the trip on the given (free) car
+            Params:
+            - car (Car): car which will take the trip
+            - src (Location): current location of the customer
+            - dst (Location): desired destination of the customer
+            - dist_to_client (int): distance between the car and the customer (if already known)
+
+            Returns:
+            - total_time (int): how long the whole trip will take the customer (waiting for taxi + the ride)
+        '''
+
+        # an untouched car gets reset first (it's not in the index, so there is nothing to remove)
+        self._generation.touch(car)
+        queued = not car.free_now(self.time.time)
+
+        if dist_to_client is None:
+            dist_to_client = car.distance(src, self.metric)
+
+        total_time = car.book(src, dst, current_time=self.time.time, dist_to_client=dist_to_client, metric=self.metric)
+
+        if car.free_now(self.time.time):
+            # a trip of no length (the customer is right at the car and goes nowhere) is over already,
+            # so the car stays free instead of waiting in the busy heap for the next tick
+            self._keep_free(car)
+        elif queued and self._busy_index is not None:
+            # the car is in the busy heap already, only its drop-off location has changed
+            self._busy_index.move(car)
+            if self._classes is not None:
+                self._partition(car.vehicle).busy_index.move(car)
+        else:
+            self._mark_busy(car)  # the car will be back in the index when it reaches the destination
+
+        return total_time
+
+    @metrics.timed(metrics.BOOK_CLOSEST_SECONDS)
+    def book_closest(self, src, dst, requirements=None):
         '''
             Books the trip on the closest taxi car to the client and drives to the destination
-            First we find the closest available car.
+            First we find the closest available car (or the one which gets to the client the soonest
+            with future dispatch, see `.find_soonest`).
             And then booking a trip on it.
             Params:
             - src (Location): current location of the customer
             - dst (Location): desired destination of the customer
+            - requirements (Requirements): what the car has to meet (see `models.vehicle`), any car by default
 
             Returns:
             - dict (
@@ -111,15 +554,96 @@ class TaxiPark(object):
             ) or None (if there are not available cars at the moment)
         '''
 
-        closest = self.find_closest(src)
+        if self._pool is not None:
+            booking = self._book_pooled(src, dst, requirements)
+            if metrics.enabled:
+                (metrics.BOOKINGS_SUCCEEDED if booking else metrics.BOOKINGS_FAILED).inc()
+            return booking
+
+        if self.future_dispatch:
+            closest = self.find_soonest(src, requirements)
+        else:
+            closest = self.find_closest(src, requirements)
+
+        if not closest:
+            if metrics.enabled:
+                metrics.BOOKINGS_FAILED.inc()
+            return
+
+        car = closest[0]
+        # with future dispatch the second value is the ETA, while the booking needs the distance itself
+        total_time = self.book(car, src, dst, dist_to_client=None if self.future_dispatch else closest[1])
+
+        if metrics.enabled:
+            metrics.BOOKINGS_SUCCEEDED.inc()
+
+        return (car, total_time)
+
+    def _book_pooled(self, src, dst, requirements=None):
+        '''
+            Books the trip on the car which has to drive the least extra for it (the smallest ID in case of a tie):
+            the closest free car or a busy one the customer shares with others (see `models.pooling`).
+            The customer isn't picked up more than `max_detour` units later than by the closest free car
+            (or than right now, when there are no free cars)
+            Returns:
+            - booking (tuple): the car and the total time of the trip or None
+        '''
+
+        current_time = self.time.time
+        passengers = requirements.passengers if requirements is not None and requirements.passengers else 1
+
+        closest = self.find_closest(src, requirements)
+        if closest:
+            cost = closest[1] + self.metric.distance(src, dst)
+        # without free cars the customer can only be picked up by a car passing by
+        max_pickup_time = current_time + (closest[1] if closest else 0) + self._pool.max_detour
+
+        def is_eligible(car):
+            return requirements is None or requirements.admits(car.vehicle)
+
+        pooled = self._pool.best_insertion(src, dst, passengers, current_time, max_pickup_time, is_eligible)
+        if pooled and (not closest or self.metric.better(pooled[1].cost, pooled[0].car_id, cost, closest[0].car_id)):
+            (route, insertion) = pooled
+            total_time = self._pool.insert(route, insertion, src, dst, passengers, current_time)
+            if metrics.enabled:
+                metrics.POOLED_BOOKINGS.inc()
+            return (route.car, total_time)
+
         if not closest:
             return
 
         (car, dist) = closest
-        total_time = car.book(src, dst, current_time=self.time.time, dist_to_client=dist)
+        total_time = self.book(car, src, dst, dist_to_client=dist)
+        if not car.free_now(current_time):
+            self._pool.start(car, src, dst, passengers, current_time + dist, current_time)
 
         return (car, total_time)
 
+    def book_batch(self, trips, optimal=False):
+        '''
+            Books a batch of trips at once (see `models.dispatch.book_batch` for the details)
+            Params:
+            - trips (list of tuples (src, dst)): source and destination locations of the customers
+            - optimal (bool): whether to minimize the total pickup distance across the batch
+
+            Returns:
+            - bookings (list): tuple (car, total_time) or None for every trip
+        '''
+
+        bookings = book_batch(self, trips, optimal=optimal)
+        if not optimal or self._pool is None:
+            return bookings
+
+        # cars assigned by the optimal mode are booked directly, so their routes are started here
+        # (the same way as by `._book_pooled`), for later customers to share them
+        current_time = self.time.time
+        for ((src, dst), booking) in zip(trips, bookings):
+            if booking and not booking[0].free_now(current_time):
+                car = booking[0]
+                pickup_time = current_time + self.metric.distance(car.journey.start, src)
+                self._pool.start(car, src, dst, 1, pickup_time, current_time)
+
+        return bookings
 
     def reset(self):
         '''
@@ -127,4 +651,70 @@ class TaxiPark(object):
             i.e. to the position (0, 0) on a grid and without passangers
         '''
 
-        [car.reset() for car in self.cars]
+        self._busy = []
+        self.index.clear()
+        if self._busy_index is not None:
+            self._busy_index.clear()
+        if self._pool is not None:
+            self._pool.clear()
+        for partition in (self._classes or {}).values():
+            partition.index.clear()
+            if partition.busy_index is not None:
+                partition.busy_index.clear()
+
+        if self._generation.lazy:
+            self._generation.start()
+            return
+
+        # cars were added out of order of their IDs, so they have to be reset right away
+        # (and the untouched ones stop being untouched, since they all go to the index now)
+        self._generation.touch_all()
+        [car.reset() for car in self._cars]
+
+        # all cars are free and at the origin now, so it's cheaper to rebuild the index from scratch
+        [self._add_free(car) for car in self._cars]
+
+
+def create_taxi_park(time, fleet_store=None, metric=None, future_dispatch=None):
+    '''
+        Creates an empty taxi park with the storage engine from settings (or the given one)
+        Params:
+        - time (Time): global Time object
+        - fleet_store (str): "objects", "arrays" or "sharded"
+        - metric (Metric): how distances are measured (the metric from settings by default)
+        - future_dispatch (bool): whether busy cars can be booked as well (as in settings by default)
+
+        Returns:
+        - taxi_park (TaxiPark, ConcurrentTaxiPark, ArrayTaxiPark or ShardedTaxiPark)
+    '''
+
+    fleet_store = fleet_store or settings.fleet_store
+    future_dispatch = settings.future_dispatch if future_dispatch is None else future_dispatch
+    if future_dispatch and (settings.concurrent_booking or fleet_store == 'sharded'):
+        raise ValueError(
+            "Future dispatch is supported only by 'objects' (without concurrent booking) and 'arrays' fleet stores"
+        )
+    if settings.pool_rides and (settings.concurrent_booking or fleet_store != 'objects'):
+        raise ValueError("Ride pooling is supported only by 'objects' fleet store without concurrent booking")
+
+    if fleet_store == 'objects' and settings.concurrent_booking:
+        # imported here, since it's a subclass of TaxiPark
+        from .concurrent_taxi_park import ConcurrentTaxiPark
+        return ConcurrentTaxiPark(time, metric=metric)
+
+    if fleet_store == 'objects':
+        return TaxiPark(time, metric=metric, future_dispatch=future_dispatch)
+
+    if settings.concurrent_booking:
+        raise ValueError("Concurrent booking is supported only by 'objects' fleet store")
+
+    if fleet_store == 'arrays':
+        # imported here, so NumPy is loaded only when it's actually used
+        from .array_taxi_park import ArrayTaxiPark
+        return ArrayTaxiPark(time, metric=metric, future_dispatch=future_dispatch)
+
+    if fleet_store == 'sharded':
+        from .sharded_taxi_park import ShardedTaxiPark
+        return ShardedTaxiPark(time, metric=metric)
+
+    raise ValueError(f"Unknown fleet store '{fleet_store}', choose one of: objects, arrays, sharded")
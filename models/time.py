@@ -1,19 +1,73 @@
+from . import metrics
+
+
 class Time(object):
     '''
         Represents time entity in our world.
         By default we start from timestamp 0
         By calling `.tick` method we increment time in our world (by default on 1 unit)
+        Other entities can subscribe to time changes (e.g. taxi park releasing cars
+        which have finished their trips) with `.subscribe` method.
+        A tick costs the same for any number of units: subscribers are called once, not per unit.
     '''
 
     def __init__(self, time=0):
         self._time = time
+        self._subscribers = []
 
     def __repr__(self):
         return self._time
 
+    def subscribe(self, callback):
+        '''
+            Registers a callback to be called after every tick
+            Params:
+            - callback (callable): function accepting the new current time
+              and returning a list of what it has released on this tick (or None)
+        '''
+
+        self._subscribers.append(callback)
+
+    @metrics.timed(metrics.TICK_SECONDS)
     def tick(self, i=1):
+        '''
+            Advances time by `i` units at once
+            Params:
+            - i (int): how many units to skip
+
+            Returns:
+            - released (list): everything released by the subscribers (e.g. cars which became free)
+        '''
+
         self._time += i
 
+        released = []
+        for callback in self._subscribers:
+            released.extend(callback(self._time) or ())
+
+        return released
+
     @property
     def time(self):
         return self._time
+
+
+def fast_forward(taxi_park, units=1, until_free=False):
+    '''
+        Advances time of the taxi park by many units in a single tick, so the cost depends only on
+        how many cars get free (O(k log n) with the busy heaps), not on how many units are skipped
+        Params:
+        - taxi_park (TaxiPark, ArrayTaxiPark or ShardedTaxiPark): park subscribed to its time
+        - units (int): how many units to skip
+        - until_free (bool): skip exactly to the moment the next busy car finishes its trip instead
+          (time doesn't move if no car is busy)
+
+        Returns:
+        - released (list): cars which became free, in order of `booked_until`
+    '''
+
+    if until_free:
+        next_release = taxi_park.next_release_time()
+        units = max(next_release - taxi_park.time.time, 0) if next_release is not None else 0
+
+    return taxi_park.time.tick(units)
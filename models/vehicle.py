@@ -0,0 +1,185 @@
+'''
+    Vehicle classes of a mixed fleet (sedans, vans, accessible vehicles) and requirements
+    of customers to the car they book (how many passengers, which type of vehicle).
+
+    A vehicle class is a pair (vehicle type, capacity). Classes are interned, so all cars of the same class
+    share a single object (a car pays one reference for it), and a fleet has only a handful of them.
+    That's what the parks rely on to keep free cars of every class in a separate index:
+    a customer with requirements is searched for only amongst the classes which meet them,
+    instead of scanning all cars and discarding the ones which don't.
+'''
+from collections import namedtuple
+from math import floor
+
+
+# types of vehicles with the number of passengers they take (unless a car says otherwise)
+VEHICLE_TYPES = {
+    'sedan': 4,
+    'van': 7,
+    'accessible': 4,
+}
+
+# codes of the types and bits of the capacity, which are packed together into a code of a class (see `Vehicle.code`)
+TYPE_CODES = {vehicle_type: code for (code, vehicle_type) in enumerate(VEHICLE_TYPES)}
+CAPACITY_BITS = 16
+
+
+class Vehicle(namedtuple('Vehicle', ('vehicle_type', 'capacity'))):
+    '''
+        Class of a vehicle: its type and how many passengers it takes.
+        Create them with `Vehicle.of`, which validates and interns them
+    '''
+
+    __slots__ = ()
+
+    _interned = {}
+    _by_code = {}
+
+    @classmethod
+    def of(cls, vehicle_type='sedan', capacity=None):
+        '''
+            Returns the (interned) vehicle class
+            Params:
+            - vehicle_type (str): one of the keys of VEHICLE_TYPES
+            - capacity (int): how many passengers it takes (the default one of the type if not given)
+
+            Returns:
+            - vehicle (Vehicle)
+
+            Raises:
+            - ValueError: if the type is unknown or the capacity is out of range
+        '''
+
+        if vehicle_type not in VEHICLE_TYPES:
+            raise ValueError(f"Unknown vehicle type '{vehicle_type}', choose one of: {', '.join(VEHICLE_TYPES)}")
+
+        capacity = VEHICLE_TYPES[vehicle_type] if capacity is None else capacity
+        if not 1 <= capacity < 2 ** CAPACITY_BITS:
+            raise ValueError(f"Capacity of a vehicle must be within [1, {2 ** CAPACITY_BITS - 1}]")
+
+        key = (vehicle_type, capacity)
+        if key not in cls._interned:
+            cls._interned[key] = cls(vehicle_type, capacity)
+
+        return cls._interned[key]
+
+    @property
+    def code(self):
+        '''
+            The class packed into a single integer (e.g. for a column of NumPy array or a snapshot)
+        '''
+
+        return (TYPE_CODES[self.vehicle_type] << CAPACITY_BITS) | self.capacity
+
+    @classmethod
+    def from_code(cls, code):
+        if code not in cls._by_code:
+            cls._by_code[code] = cls.of(list(VEHICLE_TYPES)[code >> CAPACITY_BITS], code & (2 ** CAPACITY_BITS - 1))
+
+        return cls._by_code[code]
+
+
+# class of the cars nobody has said anything about
+SEDAN = Vehicle.of('sedan')
+
+
+class Requirements(object):
+    '''
+        What the customer needs from the car: room for the given number of passengers
+        and/or the given type of vehicle (None means anything goes)
+    '''
+
+    __slots__ = ('passengers', 'vehicle_type')
+
+    def __init__(self, passengers=None, vehicle_type=None):
+        if passengers is not None and passengers < 1:
+            raise ValueError("Number of passengers must be positive")
+        if vehicle_type is not None and vehicle_type not in VEHICLE_TYPES:
+            raise ValueError(f"Unknown vehicle type '{vehicle_type}', choose one of: {', '.join(VEHICLE_TYPES)}")
+
+        self.passengers = passengers
+        self.vehicle_type = vehicle_type
+
+    def __repr__(self):
+        return f"Requirements(passengers={self.passengers}, vehicle_type={self.vehicle_type!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Requirements):
+            return NotImplemented
+
+        return (self.passengers, self.vehicle_type) == (other.passengers, other.vehicle_type)
+
+    @classmethod
+    def of(cls, passengers=None, vehicle_type=None):
+        '''
+            Returns requirements, or None when there are none (so the parks take the unfiltered path)
+        '''
+
+        if passengers is None and vehicle_type is None:
+            return None
+
+        return cls(passengers, vehicle_type)
+
+    def admits(self, vehicle):
+        '''
+            Whether a car of the vehicle class meets the requirements
+        '''
+
+        if self.passengers is not None and vehicle.capacity < self.passengers:
+            return False
+
+        return self.vehicle_type is None or vehicle.vehicle_type == self.vehicle_type
+
+
+def eligible(vehicles, requirements):
+    '''
+        Returns which of the vehicle classes of a fleet meet the requirements
+        Params:
+        - vehicles (iterable of Vehicle): classes of the cars of the fleet
+        - requirements (Requirements): what the customer needs (or None)
+
+        Returns:
+        - eligible (list of Vehicle or None): None when any car will do (all classes are eligible)
+    '''
+
+    vehicles = list(vehicles)
+    if requirements is None:
+        return None
+
+    admitted = [vehicle for vehicle in vehicles if requirements.admits(vehicle)]
+    return None if len(admitted) == len(vehicles) else admitted
+
+
+def fleet_blocks(n, mix=None):
+    '''
+        Splits a fleet of N cars with consecutive IDs into blocks of cars of the same vehicle type
+        Params:
+        - n (int): number of cars
+        - mix (dict): share of the fleet (from 0 to 1) of every vehicle type, the rest of the cars are sedans
+
+        Returns:
+        - blocks (list of tuples (Vehicle, int)): vehicle class and number of cars, sedans go first
+
+        Raises:
+        - ValueError: if a type is unknown or the shares add up to more than 1
+    '''
+
+    mix = mix or {}
+    for vehicle_type in mix:
+        if vehicle_type not in VEHICLE_TYPES:
+            raise ValueError(f"Unknown vehicle type '{vehicle_type}', choose one of: {', '.join(VEHICLE_TYPES)}")
+    if any(share < 0 for share in mix.values()) or sum(mix.values()) > 1:
+        raise ValueError("Shares of vehicle types must be non-negative and add up to at most 1")
+
+    # shares are apportioned by largest remainders (sedans first in case of a tie), so there are exactly N cars
+    shares = {vehicle_type: share for (vehicle_type, share) in mix.items() if vehicle_type != 'sedan'}
+    quotas = {'sedan': n * max(0, 1 - sum(shares.values())), **{t: n * share for (t, share) in shares.items()}}
+    counts = {vehicle_type: floor(quota) for (vehicle_type, quota) in quotas.items()}
+
+    left = n - sum(counts.values())
+    for vehicle_type in sorted(quotas, key=lambda t: counts[t] - quotas[t])[:left]:
+        counts[vehicle_type] += 1
+
+    blocks = [(Vehicle.of(vehicle_type), count) for (vehicle_type, count) in counts.items()]
+
+    return [(vehicle, count) for (vehicle, count) in blocks if count]
@@ -0,0 +1,341 @@
+'''
+    Append-only write-ahead log of everything that changes the fleet (bookings, ticks and resets),
+    so the state survives a crash between snapshots. Operations are logged (not their results):
+    the taxi park is deterministic, so replaying them in the same order on top of the same state
+    rebuilds exactly the same fleet and time.
+
+    Requests don't pay an fsync each. Records are appended to an in-memory buffer in the order
+    the operations are applied, and a background writer flushes the buffer with a single fsync
+    (group commit), waiting up to `commit_window` seconds for more records to arrive first.
+    Every request is answered only after the fsync covering its record, so the window is the
+    latency budget traded for throughput.
+
+    Format (little-endian):
+    - header: magic `TAXIWAL1` and the base the log starts from - the header of the snapshot
+      (see models/snapshot.py) or, for a newly populated fleet, a header with no magic,
+      a checksum of its mix of vehicle types and the number of cars, followed by a checksum (uint32) of the settings
+      changing the outcome of the operations (`REPLAY_SETTINGS`). A log is replayed only on top of the same base,
+      and refused when it has been written with other settings
+    - records of 33 bytes: op (uint8) and four int64 arguments
+      (coordinates of the source and destination for a booking, number of units for a tick,
+      number of trips and whether it's optimal for a batch, which is followed by its bookings).
+      A booking with requirements (see `models.vehicle`) is preceded by a record with the number
+      of passengers and the code of the vehicle type (both of them plus one, zero when not required)
+    A torn record at the end of the log (crash in the middle of a write) is never acknowledged,
+    so it is simply cut off on recovery.
+'''
+import asyncio
+import os
+import json
+import struct
+import threading
+import zlib
+
+from .data import Point
+from .snapshot import HEADER as SNAPSHOT_HEADER
+from .vehicle import TYPE_CODES, VEHICLE_TYPES, Requirements
+from settings import settings
+
+
+MAGIC = b'TAXIWAL1'
+RECORD = struct.Struct('<Bqqqq')
+SETTINGS = struct.Struct('<I')
+
+# settings which change which cars are booked and when they are free, so replaying the operations
+# with other values of them would rebuild another fleet
+REPLAY_SETTINGS = (
+    'spatial_index', 'distance_metric', 'distance_weights', 'future_dispatch', 'pool_rides',
+    'pool_max_detour', 'pool_candidates',
+)
+
+# op codes of the records
+BOOK = 0
+TICK = 1
+RESET = 2
+BATCH = 3
+REQUIRE = 4
+
+
+def settings_checksum(config=None):
+    '''
+        Checksum of the values of `REPLAY_SETTINGS` (of the application settings by default)
+    '''
+
+    values = {name: getattr(config or settings, name) for name in REPLAY_SETTINGS}
+    return zlib.crc32(json.dumps(values, sort_keys=True).encode())
+
+
+def fresh_base(num_cars, mix=None, config=None):
+    '''
+        Base of the log for a newly populated fleet of `num_cars` cars
+        with the given shares of vehicle types (see `models.vehicle.fleet_blocks`)
+        and the given settings (the application settings by default)
+    '''
+
+    checksum = zlib.crc32(json.dumps(mix, sort_keys=True).encode()) if mix else 0
+    return SNAPSHOT_HEADER.pack(b'\0' * len(MAGIC), 0, checksum, num_cars, 0) + SETTINGS.pack(settings_checksum(config))
+
+
+def snapshot_base(snapshot_path, config=None):
+    '''
+        Base of the log for the fleet restored from (or just saved into) the snapshot
+        with the given settings (the application settings by default)
+    '''
+
+    with open(snapshot_path, 'rb') as f:
+        return f.read(SNAPSHOT_HEADER.size) + SETTINGS.pack(settings_checksum(config))
+
+
+def read_records(f):
+    '''
+        Yields (position after the operation, operation) for all complete operations of the log
+        (the header is expected to be read already), e.g. (73, ("book", 3, 1, 8, 6)),
+        (106, ("tick", 5)), (139, ("reset",)), (238, ("batch", [(sx, sy, dx, dy), ...], optimal))
+        or (304, ("book", 3, 1, 8, 6, Requirements(passengers=5, vehicle_type=None)))
+    '''
+
+    position = f.tell()
+    while True:
+        record = f.read(RECORD.size)
+        if len(record) < RECORD.size:
+            return
+
+        (op, a, b, c, d) = RECORD.unpack(record)
+        position += RECORD.size
+        if op == BOOK:
+            yield (position, ('book', a, b, c, d))
+        elif op == TICK:
+            yield (position, ('tick', a))
+        elif op == RESET:
+            yield (position, ('reset',))
+        elif op == REQUIRE:
+            booking = f.read(RECORD.size)
+            if len(booking) < RECORD.size:
+                return  # the booking was never acknowledged
+
+            position += RECORD.size
+            requirements = Requirements.of(a - 1 if a else None, list(VEHICLE_TYPES)[b - 1] if b else None)
+            yield (position, ('book', *RECORD.unpack(booking)[1:], requirements))
+        elif op == BATCH:
+            data = f.read(RECORD.size * a)
+            if len(data) < RECORD.size * a:
+                return  # the batch was never acknowledged as a whole
+
+            position += len(data)
+            trips = [args for (_, *args) in RECORD.iter_unpack(data)]
+            yield (position, ('batch', trips, bool(b)))
+        else:
+            raise ValueError(f"Unknown op code {op} in the write-ahead log")
+
+
+def apply(taxi_park, operation):
+    '''
+        Applies an operation (as yielded by `read_records`) to the taxi park
+    '''
+
+    op = operation[0]
+    if op == 'book':
+        (_, sx, sy, dx, dy, *requirements) = operation
+        taxi_park.book_closest(Point(sx, sy), Point(dx, dy), *requirements)
+    elif op == 'tick':
+        taxi_park.fast_forward(operation[1])
+    elif op == 'reset':
+        taxi_park.reset()
+    elif op == 'batch':
+        (_, trips, optimal) = operation
+        taxi_park.book_batch([(Point(sx, sy), Point(dx, dy)) for (sx, sy, dx, dy) in trips], optimal=optimal)
+
+
+def recover(path, taxi_park, base):
+    '''
+        Replays the log on top of the taxi park, if the log starts from the same base as the park
+        Params:
+        - path (str): path of the log
+        - taxi_park (TaxiPark, ArrayTaxiPark or ShardedTaxiPark): park restored from the base
+        - base (bytes): base of the park (see `fresh_base` and `snapshot_base`)
+
+        Returns:
+        - end (int): position after the last complete operation (None if the log doesn't apply)
+        - replayed (int): number of replayed operations
+
+        Raises:
+        - ValueError: if the file is not a write-ahead log, or the log has been written with other settings
+    '''
+
+    if not os.path.exists(path):
+        return (None, 0)
+
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC) + len(base))
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a write-ahead log of the fleet")
+
+        (fleet, replay) = (header[len(MAGIC):-SETTINGS.size], header[-SETTINGS.size:])
+        if fleet != base[:-SETTINGS.size]:
+            # the log is older than the snapshot (which already has all of its operations) or of another fleet
+            return (None, 0)
+
+        if replay != base[-SETTINGS.size:]:
+            # operations would go to other cars than they did, so it's up to the operator to restore the settings
+            raise ValueError(f"{path} has been written with other settings ({', '.join(REPLAY_SETTINGS)})")
+
+        (end, replayed) = (len(header), 0)
+        for (end, operation) in read_records(f):
+            apply(taxi_park, operation)
+            replayed += 1
+
+    return (end, replayed)
+
+
+class WriteAheadLog(object):
+    '''
+        Writer of the log with group commit. Operations are logged with `.book`, `.batch`, `.tick`
+        and `.reset` right after they are applied (without awaiting anything in between, so records are
+        in the same order as the operations). Each of them returns a future resolved once the record
+        is durable. `.run` is the background writer, which has to be running in the event loop.
+    '''
+
+    def __init__(self, path, base, end=None, commit_window=0.0, fsync=True):
+        '''
+            Params:
+            - path (str): path of the log
+            - base (bytes): base of the fleet the log starts from (see `fresh_base` and `snapshot_base`)
+            - end (int): position to append from, if the log of the same base exists
+              (as returned by `recover`), otherwise a new log is started
+            - commit_window (float): how long (in seconds) to wait for more records before an fsync
+            - fsync (bool): whether to fsync the log (otherwise records are only handed over to the OS)
+        '''
+
+        self.path = path
+        self.commit_window = commit_window
+        self.fsync = fsync
+
+        self.commits = 0  # how many times the log has been flushed
+
+        self._buffer = []
+        self._waiters = []
+        self._pending = asyncio.Event()
+
+        # appends take only the buffer lock, so they never wait for an fsync in progress
+        self._buffer_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+        if end is None:
+            self._file = self._start(base)
+        else:
+            self._file = open(path, 'r+b')
+            self._file.truncate(end)  # cutting off a torn record, if any
+            self._file.seek(end)
+
+    def _start(self, base):
+        '''
+            Atomically replaces the log with a new one starting from the base
+        '''
+
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(MAGIC + base)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary, self.path)
+        return open(self.path, 'ab')
+
+    def _append(self, data):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        with self._buffer_lock:
+            self._buffer.append(data)
+            self._waiters.append(waiter)
+
+        self._pending.set()
+        return waiter
+
+    def book(self, src, dst, requirements=None):
+        record = RECORD.pack(BOOK, src.x, src.y, dst.x, dst.y)
+        if requirements is not None:
+            passengers = requirements.passengers + 1 if requirements.passengers else 0
+            vehicle_type = TYPE_CODES[requirements.vehicle_type] + 1 if requirements.vehicle_type else 0
+            record = RECORD.pack(REQUIRE, passengers, vehicle_type, 0, 0) + record
+
+        return self._append(record)
+
+    def batch(self, trips, optimal):
+        records = [RECORD.pack(BATCH, len(trips), int(optimal), 0, 0)]
+        records.extend(RECORD.pack(BOOK, src.x, src.y, dst.x, dst.y) for (src, dst) in trips)
+        return self._append(b''.join(records))
+
+    def tick(self, units):
+        return self._append(RECORD.pack(TICK, units, 0, 0, 0))
+
+    def reset(self):
+        return self._append(RECORD.pack(RESET, 0, 0, 0, 0))
+
+    def _flush(self):
+        '''
+            Writes out the buffer (runs in a thread, so the event loop keeps applying operations meanwhile)
+            Returns:
+            - waiters (list): futures of the records which have been written
+        '''
+
+        with self._file_lock:
+            with self._buffer_lock:
+                (data, waiters) = (b''.join(self._buffer), self._waiters)
+                (self._buffer, self._waiters) = ([], [])
+
+            if data:
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self.commits += 1
+
+        return waiters
+
+    async def run(self):
+        '''
+            Background writer: flushes the buffer whenever there is something in it, until cancelled
+        '''
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._pending.wait()
+            if self.commit_window:
+                await asyncio.sleep(self.commit_window)
+            self._pending.clear()
+
+            try:
+                waiters = await loop.run_in_executor(None, self._flush)
+            except OSError as e:
+                with self._buffer_lock:
+                    (waiters, self._waiters) = (self._waiters, [])
+                [waiter.set_exception(e) for waiter in waiters if not waiter.done()]
+                continue
+
+            [waiter.set_result(None) for waiter in waiters if not waiter.done()]
+
+    def rotate(self, base):
+        '''
+            Starts a new log from the base once a snapshot has been taken. Records still in the buffer
+            are durable as part of the snapshot now, so they are acknowledged right away
+        '''
+
+        with self._file_lock:
+            with self._buffer_lock:
+                (waiters, self._buffer, self._waiters) = (self._waiters, [], [])
+
+            self._file.close()
+            self._file = self._start(base)
+
+        [waiter.set_result(None) for waiter in waiters if not waiter.done()]
+
+    def close(self):
+        '''
+            Flushes whatever is left in the buffer and closes the log
+        '''
+
+        waiters = self._flush()
+        self._file.close()
+
+        [waiter.set_result(None) for waiter in waiters if not waiter.done()]
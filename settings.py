@@ -1,6 +1,7 @@
 from functools import lru_cache
+from typing import Dict, Tuple, Union
 
-from pydantic import BaseSettings
+from pydantic import BaseSettings, StrictInt
 
 
 class Settings(BaseSettings):
@@ -14,10 +15,115 @@ class Settings(BaseSettings):
     # how many cars we want to have in our world
     num_cars: int = 3
 
+    # share of the cars (from 0 to 1) of every vehicle type other than sedans, e.g. `{"van": 0.1, "accessible": 0.01}`
+    # (see models/vehicle.py). The rest of the fleet are sedans
+    fleet_mix: Dict[str, float] = {}
+
     # float number representation isn't accurate, so we have to introduce
     # margin epsilon of which error we can tolerate and assume it's the same float number
     eps = 10e-6
 
+    # whether `/api/book` should parse requests and render responses without pydantic (see fastpath.py)
+    fast_book: bool = False
+
+    # where the state of the fleet lives: "local" (in the process of the worker) or "shared"
+    # (in a separate state process, so the service can run with several workers, see fleet_server.py)
+    fleet_backend: str = 'local'
+
+    # Unix socket the shared fleet state process listens on
+    fleet_socket: str = '/tmp/taxi-fleet.sock'
+
+    # whether bookings can come from many threads at once (see models/concurrent_taxi_park.py).
+    # `/api/book` then searches for the closest car in a thread pool, not blocking the event loop
+    concurrent_booking: bool = False
+
+    # how cars are stored: "objects" (list of Car instances, see models/taxi_park.py),
+    # "arrays" (NumPy struct of arrays, see models/array_taxi_park.py)
+    # or "sharded" (cars split by square tiles of the plane, see models/sharded_taxi_park.py)
+    fleet_store: str = 'objects'
+
+    # size of a single tile (in grid units) for "sharded" fleet store. Works the best when
+    # a tile covers a neighbourhood of a city, so the closest car is found in a few nearby tiles
+    shard_tile_size: int = 100000
+
+    # how many threads release finished cars of different shards on a tick ("sharded" fleet store),
+    # 0 or 1 to do it in the calling thread
+    shard_threads: int = 0
+
+    # how distances between cars and customers are measured: "manhattan", "chebyshev", "euclidean"
+    # or "weighted" (see models/distance.py for the details about each of them)
+    distance_metric: str = 'manhattan'
+
+    # costs of driving a unit along x and along y for "weighted" distance metric
+    # (e.g. `[1, 3]`), integer weights keep distances integral
+    distance_weights: Tuple[Union[StrictInt, float], Union[StrictInt, float]] = (1, 1)
+
+    # spatial index used to search for the closest car: "linear" or "grid"
+    # (see models/spatial_index.py for the details about each of them)
+    spatial_index: str = 'linear'
+
+    # size of a single cell (in grid units) for "grid" spatial index. Works the best
+    # when a cell contains a few cars on average
+    grid_cell_size: int = 1000
+
+    # whether bookings may go to busy cars as well: the car which can get to the customer the soonest
+    # (finishing its current trip first) is booked, and the trip is queued after the current one.
+    # "objects" (without concurrent booking) and "arrays" fleet stores only
+    future_dispatch: bool = False
+
+    # whether customers can share cars (ride pooling, see models/pooling.py): a booking goes to a busy car
+    # passing by, when nobody waits or rides more than `pool_max_detour` units longer because of it.
+    # "objects" fleet store without concurrent booking or future dispatch only
+    pool_rides: bool = False
+
+    # how much longer (in units of time) a customer may wait and ride because of sharing the car
+    pool_max_detour: int = 10
+
+    # how many busy cars closest to the customer (by the next stops of their routes) are tried
+    pool_candidates: int = 8
+
+    # heatmap of demand (see models/demand.py): pickups are counted in square tiles of this size (in grid units)...
+    demand_tile_size: int = 1000
+
+    # ...and count half as much every this many units of time. Long enough for the heatmap to hold
+    # many pickups, otherwise idle cars chase the last few customers around the world
+    demand_half_life: int = 600
+
+    # the most tiles of the heatmap kept at once (the lighter half is dropped when there are more)
+    demand_max_tiles: int = 4096
+
+    # how often (in units of time) idle cars are moved toward underserved tiles of the heatmap
+    # (see models/rebalancing.py), 0 to move them only on demand (`POST /api/rebalance?apply=true`).
+    # Local fleet backend without concurrent booking or the write-ahead log only
+    rebalance_interval: int = 0
+
+    # the most idle cars moved at once
+    rebalance_max_moves: int = 20
+
+    # whether to record latencies and counters of the hot path and expose them on `/api/metrics`
+    # (see models/metrics.py). Cheap enough to be left on under load
+    metrics: bool = True
+
+    # file to snapshot the state of the fleet to (see models/snapshot.py). When it exists on startup,
+    # the fleet is restored from it instead of being populated with `num_cars` new cars.
+    # Empty to disable snapshots
+    snapshot_path: str = ''
+
+    # how often (in seconds) to take a snapshot in the background, 0 to take them only
+    # on demand (`POST /api/snapshot`) and on shutdown
+    snapshot_interval: int = 0
+
+    # write-ahead log of bookings, ticks and resets (see models/wal.py), replayed on startup
+    # on top of the latest snapshot (or of a newly populated fleet). Empty to disable it
+    wal_path: str = ''
+
+    # how long (in seconds) the log waits for more records before flushing them with a single fsync.
+    # Every logged request waits for the fsync, so it's the latency traded for throughput
+    wal_commit_window: float = 0.001
+
+    # whether to fsync the log (without it records survive a crash of the service, but not of the machine)
+    wal_fsync: bool = True
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,353 @@
+'''
+    Offline simulation for capacity planning: replays a log of bookings, ticks and resets
+    against an in-process taxi park (the same Time, Car and taxi park the service uses, configured
+    by the same settings), as fast as the CPU allows and without any HTTP in between.
+
+    The log is read lazily, event by event, and results are written as soon as they are known,
+    so memory depends only on the size of the fleet, not on the length of the log.
+    Replaying the same log with the same settings always gives the same results.
+
+    Logs are either JSONL (the format recorded by `benchmarks.workload`), one event per line:
+        {"op": "book", "source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}}
+        {"op": "tick"}                  (or {"op": "tick", "units": 60})
+        {"op": "reset"}
+    or a compact binary format (`--to-binary` converts JSONL into it), which is several times
+    quicker to read: `TAXILOG1` header followed by fixed-size little-endian records
+    (op: uint8, then four int32 - coordinates of the source and destination for a booking,
+    number of units for a tick, nothing for a reset).
+
+    Outputs:
+    - assignments (JSONL): result of every booking, e.g. {"event": 1, "time": 0, "car_id": 1, "total_time": 14}
+      (`car_id` and `total_time` are null when there were no free cars)
+    - utilisation (CSV): trips of every car and how much of the simulated time it was busy
+
+    With `--rebalance-every N` idle cars are moved toward the demand every N units of time
+    (see models/rebalancing.py), so the effect of rebalancing on pickups can be checked on a recorded log.
+
+    Run it with:
+        python -m simulate events.jsonl --cars 1000 --assignments assignments.jsonl --utilisation cars.csv
+        python -m simulate events.jsonl --cars 1000 --rebalance-every 10
+        python -m simulate events.jsonl --to-binary events.bin
+        METRICS=false python -m simulate events.bin --cars 100000 --fleet-store sharded
+'''
+import argparse
+import csv
+import json
+import resource
+import struct
+import time as timer
+
+from settings import settings
+from models.time import Time
+from models.data import Point
+from models.taxi_park import create_taxi_park
+from models.rebalancing import Rebalancer
+
+
+# header of the binary logs
+MAGIC = b'TAXILOG1'
+# record of the binary logs: op and 4 arguments
+RECORD = struct.Struct('<Biiii')
+# op codes of the binary logs (position in the tuple is the code)
+OPS = ('book', 'tick', 'reset')
+
+# how many records of the binary log are read at once
+CHUNK_RECORDS = 64 * 1024
+
+
+def parse_event(event):
+    '''
+        Turns an event of JSONL log into a tuple:
+        ("book", sx, sy, dx, dy), ("tick", units) or ("reset",)
+    '''
+
+    op = event.get('op')
+    if op == 'book':
+        (src, dst) = (event['source'], event['destination'])
+        return ('book', int(src['x']), int(src['y']), int(dst['x']), int(dst['y']))
+
+    if op == 'tick':
+        return ('tick', int(event.get('units', 1)))
+
+    if op == 'reset':
+        return ('reset',)
+
+    raise ValueError(f"Unknown event '{op}', choose one of: {', '.join(OPS)}")
+
+
+def read_jsonl(f):
+    '''
+        Yields events of the JSONL log (see `parse_event`)
+    '''
+
+    for (line_no, line) in enumerate(f, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            yield parse_event(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Line {line_no} of the log is not a valid event: {e}") from e
+
+
+def read_binary(f):
+    '''
+        Yields events of the binary log (the header is expected to be read already)
+    '''
+
+    while True:
+        chunk = f.read(RECORD.size * CHUNK_RECORDS)
+        if not chunk:
+            return
+
+        if len(chunk) % RECORD.size:
+            raise ValueError("Binary log is truncated (its size is not a multiple of the record size)")
+
+        for (code, a, b, c, d) in RECORD.iter_unpack(chunk):
+            if code == 0:
+                yield ('book', a, b, c, d)
+            elif code == 1:
+                yield ('tick', a)
+            elif code == 2:
+                yield ('reset',)
+            else:
+                raise ValueError(f"Unknown op code {code} in the binary log")
+
+
+def read_log(path):
+    '''
+        Yields events of the log (binary logs are recognized by their header, anything else is read as JSONL)
+    '''
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            yield from read_binary(f)
+            return
+
+    with open(path) as f:
+        yield from read_jsonl(f)
+
+
+def write_binary(path, events):
+    '''
+        Writes events (tuples as yielded by `read_log`) into the binary log
+        Returns:
+        - written (int): number of events
+    '''
+
+    written = 0
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        for event in events:
+            args = (event[1:] + (0, 0, 0, 0))[:4]
+            try:
+                f.write(RECORD.pack(OPS.index(event[0]), *args))
+            except struct.error as e:
+                raise ValueError(f"Event {written + 1} doesn't fit the binary log (values must fit int32): {e}") from e
+            written += 1
+
+    return written
+
+
+class Utilisation(object):
+    '''
+        Accumulates how many trips every car has taken and for how long it was busy
+        (driving to the customer and with the customer, or toward the demand when it's moved
+        by rebalancing, which isn't a trip), in memory proportional to the fleet size
+    '''
+
+    def __init__(self):
+        self.trips = {}  # car_id -> number of trips
+        self.busy = {}  # car_id -> units of time spent on trips
+        self._until = {}  # car_id -> booked_until of the last trip of the car
+
+    def booked(self, car_id, current_time, booked_until):
+        self.trips[car_id] = self.trips.get(car_id, 0) + 1
+        self._busy_until(car_id, current_time, booked_until)
+
+    def moved(self, car_id, current_time, booked_until):
+        # a drive toward the demand (see `models.rebalancing`) isn't a trip, but the car is busy all the same
+        self._busy_until(car_id, current_time, booked_until)
+
+    def _busy_until(self, car_id, current_time, booked_until):
+        # a busy car (future dispatch, ride pooling or moved by rebalancing) is busy for longer
+        # only past the end of what it's been busy with
+        until = max(self._until.get(car_id, current_time), current_time)
+        self.busy[car_id] = self.busy.get(car_id, 0) + max(booked_until - until, 0)
+        self._until[car_id] = max(booked_until, until)
+
+    def cut(self, current_time):
+        '''
+            Stops all trips at the given time (on reset or at the end of the simulation),
+            so the time after it isn't counted as busy
+        '''
+
+        for (car_id, until) in self._until.items():
+            if until > current_time:
+                self.busy[car_id] -= until - current_time
+
+        self._until = {}
+
+    def rows(self, car_ids, duration):
+        '''
+            Yields tuples (car_id, trips, busy_time, utilisation) for the given cars
+        '''
+
+        for car_id in car_ids:
+            busy = self.busy.get(car_id, 0)
+            yield (car_id, self.trips.get(car_id, 0), busy, round(busy / duration, 6) if duration else 0.0)
+
+
+def simulate(taxi_park, events, utilisation=None, rebalancer=None):
+    '''
+        Replays the events against the taxi park
+        Params:
+        - taxi_park (TaxiPark, ArrayTaxiPark or ShardedTaxiPark): park to book cars of
+        - events (iterable): events as yielded by `read_log`
+        - utilisation (Utilisation): where to accumulate utilisation of the cars (optional)
+        - rebalancer (Rebalancer): records the demand and moves idle cars toward it after ticks (optional)
+
+        Yields:
+        tuple(
+            - event_no (int): number of the booking event in the log (starting from 1)
+            - time (int): time of the booking
+            - car_id (int): ID of the booked car or None
+            - total_time (int): how long the whole trip will take the customer or None
+        ) for every booking
+    '''
+
+    time = taxi_park.time
+
+    for (event_no, event) in enumerate(events, start=1):
+        op = event[0]
+        if op == 'book':
+            src = Point(event[1], event[2])
+            dst = Point(event[3], event[4])
+
+            if rebalancer is not None:
+                rebalancer.record(src, time.time)
+
+            booking = taxi_park.book_closest(src, dst)
+            if not booking:
+                yield (event_no, time.time, None, None)
+                continue
+
+            (car, total_time) = booking
+            if utilisation is not None:
+                utilisation.booked(car.car_id, time.time, car.booked_until)
+
+            yield (event_no, time.time, car.car_id, total_time)
+        elif op == 'tick':
+            taxi_park.fast_forward(event[1])
+            if rebalancer is not None:
+                moved = rebalancer.tick(taxi_park)
+                if utilisation is not None:
+                    for move in moved:
+                        utilisation.moved(move.car.car_id, time.time, move.car.booked_until)
+        elif op == 'reset':
+            if utilisation is not None:
+                utilisation.cut(time.time)
+            taxi_park.reset()
+            if rebalancer is not None:
+                rebalancer.reset()
+        else:
+            raise ValueError(f"Unknown event '{op}', choose one of: {', '.join(OPS)}")
+
+
+def write_assignments(f, assignments):
+    '''
+        Writes the assignments (as yielded by `simulate`) as JSONL, passing them through
+    '''
+
+    for assignment in assignments:
+        (event_no, current_time, car_id, total_time) = assignment
+        f.write(
+            f'{{"event":{event_no},"time":{current_time},'
+            f'"car_id":{"null" if car_id is None else car_id},'
+            f'"total_time":{"null" if total_time is None else total_time}}}\n'
+        )
+        yield assignment
+
+
+def run(args):
+    '''
+        Runs the simulation as configured on the command line, returns the summary
+    '''
+
+    time = Time()
+    taxi_park = create_taxi_park(time, args.fleet_store)
+    taxi_park.populate_with_n_cars(args.cars)
+
+    utilisation = Utilisation() if args.utilisation else None
+    rebalance_every = getattr(args, 'rebalance_every', 0)
+    rebalancer = Rebalancer(interval=rebalance_every) if rebalance_every else None
+    assignments = simulate(taxi_park, read_log(args.log), utilisation, rebalancer)
+
+    (booked, failed) = (0, 0)
+    started = timer.perf_counter()
+
+    assignments_file = open(args.assignments, 'w') if args.assignments else None
+    try:
+        if assignments_file:
+            assignments = write_assignments(assignments_file, assignments)
+
+        for (_, _, car_id, _) in assignments:
+            if car_id is None:
+                failed += 1
+            else:
+                booked += 1
+    finally:
+        if assignments_file:
+            assignments_file.close()
+
+    elapsed = timer.perf_counter() - started
+
+    if utilisation is not None:
+        utilisation.cut(time.time)
+        with open(args.utilisation, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['car_id', 'trips', 'busy_time', 'utilisation'])
+            writer.writerows(utilisation.rows((car.car_id for car in taxi_park.cars), time.time))
+
+    summary = {
+        'bookings': booked + failed,
+        'booked': booked,
+        'failed': failed,
+        'time': time.time,
+        'elapsed_s': elapsed,
+        'bookings_per_s': (booked + failed) / elapsed if elapsed else 0.0,
+        # in kilobytes on Linux
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if rebalancer is not None:
+        summary['moves'] = rebalancer.moved
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help="path of the event log (JSONL or binary)")
+    parser.add_argument('--cars', type=int, default=settings.num_cars)
+    parser.add_argument('--fleet-store', default=settings.fleet_store, choices=['objects', 'arrays', 'sharded'])
+    parser.add_argument('--assignments', help="path of JSONL file to write results of the bookings to")
+    parser.add_argument('--utilisation', help="path of CSV file to write utilisation of the cars to")
+    parser.add_argument(
+        '--rebalance-every', type=int, default=0, metavar='UNITS',
+        help="move idle cars toward the demand every this many units of time (0 to never move them)",
+    )
+    parser.add_argument('--to-binary', metavar='PATH', help="only convert the log into the binary format")
+    args = parser.parse_args()
+
+    if args.to_binary:
+        written = write_binary(args.to_binary, read_log(args.log))
+        print(f"{written} events written to {args.to_binary}")
+        return
+
+    summary = run(args)
+    for (name, value) in summary.items():
+        print(f"{name:>15}: {value:.1f}" if isinstance(value, float) else f"{name:>15}: {value}")
+
+
+if __name__ == '__main__':
+    main()
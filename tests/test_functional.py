@@ -1,7 +1,10 @@
+import json
+
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from main import app, startup
+from main import app, startup, book_fast
 
 
 client = TestClient(app)
@@ -93,3 +96,286 @@ def test_reset(reset):
     # all cars should be reset and available
     resp = client.post('/api/book', json=body)
     assert resp.json() == {'car_id': 1, 'total_time': 2}
+
+
+def test_world_counts(reset):
+    body = {
+        "source": {
+            "x": 1,
+            "y": 0
+        },
+        "destination": {
+            "x": 1,
+            "y": 1
+        }
+    }
+
+    client.post('/api/book', json=body)
+
+    resp = client.get('/api/world')
+    assert resp.json()['free'] == 2
+    assert resp.json()['busy'] == 1
+
+    client.post('/api/tick')
+    client.post('/api/tick')
+
+    resp = client.get('/api/world')
+    assert resp.json()['free'] == 3
+    assert resp.json()['busy'] == 0
+
+
+def test_tick_many_units(reset):
+    body = {"source": {"x": 1, "y": 0}, "destination": {"x": 5, "y": 5}}
+    client.post('/api/book', json=body)  # car 1 is busy until 10
+    body = {"source": {"x": 1, "y": 0}, "destination": {"x": 1, "y": 1}}
+    client.post('/api/book', json=body)  # car 2 is busy until 2
+
+    started = client.get('/api/world').json()['time']
+
+    resp = client.post('/api/tick', params={'until_free': True})
+    assert resp.json() == {'time': started + 2, 'released': [2]}
+
+    resp = client.post('/api/tick', params={'units': 1000})
+    assert resp.json() == {'time': started + 1002, 'released': [1]}
+
+    resp = client.post('/api/tick')
+    assert resp.json() == {'time': started + 1003, 'released': []}
+
+    resp = client.post('/api/tick', params={'units': -1})
+    assert resp.status_code == 422
+
+
+def test_booking_batch(reset):
+    trip = {
+        "source": {
+            "x": 1,
+            "y": 0
+        },
+        "destination": {
+            "x": 1,
+            "y": 1
+        }
+    }
+
+    resp = client.post('/api/book/batch', json={"trips": [trip] * 4})
+    assert resp.status_code == 200
+
+    assert resp.json()['results'] == [
+        {'car_id': 1, 'total_time': 2},
+        {'car_id': 2, 'total_time': 2},
+        {'car_id': 3, 'total_time': 2},
+        {"status": "failed", "message": "No free cars available right now, please wait..."},
+    ]
+    assert resp.json()['elapsed_ms'] >= 0
+
+
+def test_booking_batch_optimal(reset):
+    body = {
+        "trips": [
+            {"source": {"x": 1, "y": 0}, "destination": {"x": 1, "y": 1}},
+            {"source": {"x": 2, "y": 0}, "destination": {"x": 2, "y": 2}},
+        ],
+        "optimal": True,
+    }
+
+    resp = client.post('/api/book/batch', json=body)
+    assert resp.json()['results'] == [
+        {'car_id': 1, 'total_time': 2},
+        {'car_id': 2, 'total_time': 4},
+    ]
+
+
+def test_booking_fast_path(reset):
+    # fast path is registered instead of the regular endpoint only with FAST_BOOK=true
+    fast_client = TestClient(FastAPI())
+    fast_client.app.post('/api/book')(book_fast)
+
+    body = {
+        "source": {
+            "x": 3,
+            "y": 1
+        },
+        "destination": {
+            "x": 8,
+            "y": 6
+        }
+    }
+
+    for car_id in range(1, 4):
+        resp = fast_client.post('/api/book', json=body)
+        assert resp.status_code == 200
+        assert resp.json() == {'car_id': car_id, 'total_time': 4 + 10}
+
+    resp = fast_client.post('/api/book', json=body)
+    assert resp.json() == {"status": "failed", "message": "No free cars available right now, please wait..."}
+
+    body['source']['x'] = 2 ** 31
+    resp = fast_client.post('/api/book', json=body)
+    assert resp.status_code == 422
+
+
+def test_booking_with_requirements(reset):
+    # all cars of the default fleet are sedans
+    body = {"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}, "passengers": 4, "vehicle_type": "sedan"}
+    resp = client.post('/api/book', json=body)
+    assert resp.json() == {'car_id': 1, 'total_time': 4 + 10}
+
+    for requirements in ({"passengers": 5}, {"vehicle_type": "van"}):
+        resp = client.post('/api/book', json={**body, "passengers": None, "vehicle_type": None, **requirements})
+        assert resp.json() == {"status": "failed", "message": "No free cars available right now, please wait..."}
+
+    for requirements in ({"passengers": 0}, {"vehicle_type": "bus"}):
+        assert client.post('/api/book', json={**body, **requirements}).status_code == 422
+
+    fast_client = TestClient(FastAPI())
+    fast_client.app.post('/api/book')(book_fast)
+    assert fast_client.post('/api/book', json=body).json() == {'car_id': 2, 'total_time': 4 + 10}
+    assert fast_client.post('/api/book', json={**body, "vehicle_type": "bus"}).status_code == 422
+
+    resp = client.post('/api/book/batch', json={"trips": [body]})
+    assert resp.status_code == 422
+
+
+def test_booking_out_of_grid(reset):
+    body = {
+        "source": {
+            "x": 2 ** 31,
+            "y": 1
+        },
+        "destination": {
+            "x": 8,
+            "y": 6
+        }
+    }
+
+    resp = client.post('/api/book', json=body)
+    assert resp.status_code == 422
+
+
+def test_nearest_cars(reset):
+    client.post('/api/book', json={'source': {'x': 1, 'y': 1}, 'destination': {'x': 5, 'y': 5}})
+
+    resp = client.get('/api/cars/nearest', params={'x': 3, 'y': 1, 'k': 5})
+
+    assert resp.status_code == 200
+    assert resp.json()['cars'] == [
+        {'car_id': 2, 'location': {'x': 0, 'y': 0}, 'distance': 4, 'eta': 4},
+        {'car_id': 3, 'location': {'x': 0, 'y': 0}, 'distance': 4, 'eta': 4},
+    ]
+
+    assert client.get('/api/cars/nearest', params={'x': 3, 'y': 1, 'k': 0}).status_code == 422
+    assert client.get('/api/cars/nearest', params={'x': 3}).status_code == 422
+
+    resp = client.get('/api/cars/nearest', params={'x': 3, 'y': 1, 'k': 5, 'passengers': 4, 'vehicle_type': 'sedan'})
+    assert [car['car_id'] for car in resp.json()['cars']] == [2, 3]
+    assert client.get('/api/cars/nearest', params={'x': 3, 'y': 1, 'k': 5, 'vehicle_type': 'van'}).json()['cars'] == []
+    assert client.get('/api/cars/nearest', params={'x': 3, 'y': 1, 'k': 5, 'vehicle_type': 'bus'}).status_code == 422
+
+
+def test_world_pages(reset):
+    body = {"source": {"x": 1, "y": 0}, "destination": {"x": 5, "y": 5}}
+    client.post('/api/book', json=body)
+
+    resp = client.get('/api/world', params={'limit': 2})
+    assert [car['car_id'] for car in resp.json()['cars']] == [1, 2]
+    assert resp.json()['next_cursor'] == 2
+
+    resp = client.get('/api/world', params={'limit': 2, 'cursor': 2})
+    assert [car['car_id'] for car in resp.json()['cars']] == [3]
+    assert resp.json()['next_cursor'] is None
+
+    resp = client.get('/api/world', params={'status': 'busy'})
+    assert resp.json()['cars'] == [{'car_id': 1, 'location': {'x': 5, 'y': 5}, 'booked_until': resp.json()['time'] + 10}]
+    assert 'next_cursor' not in resp.json()
+
+    resp = client.get('/api/world', params={'x_min': 1, 'y_min': 1})
+    assert [car['car_id'] for car in resp.json()['cars']] == [1]
+
+    resp = client.get('/api/world', params={'status': 'parked'})
+    assert resp.status_code == 422
+
+    resp = client.get('/api/world', params={'limit': 0})
+    assert resp.status_code == 422
+
+
+def test_world_positions(reset):
+    client.post('/api/book', json={"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}})
+    client.post('/api/tick', params={'units': 6})
+
+    resp = client.get('/api/world', params={'positions': True, 'status': 'busy'})
+    assert resp.json()['cars'] == [{
+        'car_id': 1,
+        'location': {'x': 8, 'y': 6},
+        'booked_until': resp.json()['time'] + 8,
+        'position': {'x': 5, 'y': 1},
+    }]
+
+    # the bounding box filters cars by where they are right now
+    resp = client.get('/api/world', params={'positions': True, 'x_min': 1})
+    assert [car['car_id'] for car in resp.json()['cars']] == [1]
+    resp = client.get('/api/world', params={'positions': True, 'x_min': 6})
+    assert resp.json()['cars'] == []
+
+    resp = client.get('/api/world', params={'positions': True, 'format': 'ndjson', 'status': 'free'})
+    assert [json.loads(line)['position'] for line in resp.text.splitlines()] == [{'x': 0, 'y': 0}] * 2
+
+
+def test_world_stream(reset):
+    resp = client.get('/api/world', params={'format': 'ndjson', 'status': 'free'})
+
+    assert resp.headers['content-type'] == 'application/x-ndjson'
+    assert int(resp.headers['x-world-time']) >= 0
+    assert [json.loads(line)['car_id'] for line in resp.text.splitlines()] == [1, 2, 3]
+
+
+def test_metrics(reset):
+    client.post('/api/book', json={"source": {"x": 1, "y": 0}, "destination": {"x": 1, "y": 1}})
+    client.post('/api/tick')
+    client.get('/api/unknown')
+
+    resp = client.get('/api/metrics')
+
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain')
+
+    lines = resp.text.splitlines()
+    assert 'taxi_busy_cars 1' in lines
+    assert 'taxi_free_cars 2' in lines
+    assert any(line.startswith('taxi_request_seconds_count{method="POST",route="/api/book"}') for line in lines)
+    assert any(line.startswith('taxi_request_seconds_count{method="GET",route="other"}') for line in lines)
+    assert any(line.startswith('taxi_bookings_total{result="success"}') for line in lines)
+    assert any(line.startswith('taxi_tick_seconds_count') for line in lines)
+
+
+def test_snapshot_disabled(reset):
+    resp = client.post('/api/snapshot')
+
+    assert resp.status_code == 400
+    assert 'SNAPSHOT_PATH' in resp.json()['detail']
+
+
+def test_demand_and_rebalancing(reset):
+    client.post('/api/book', json={"source": {"x": 1500, "y": 500}, "destination": {"x": 1500, "y": 501}})
+    client.post('/api/tick', params={'units': 2001})  # the car drops the customer off
+
+    resp = client.get('/api/demand')
+    assert resp.json()['tile_size'] == 1000
+    [tile] = resp.json()['tiles']
+    assert (tile['x'], tile['y'], tile['center']) == (1, 0, {'x': 1500, 'y': 500})
+    assert 0 < tile['weight'] < 1
+
+    # the cars left at the origin are planned to go where the customer was
+    resp = client.post('/api/rebalance')
+    assert resp.json()['applied'] is False
+    assert [(move['car_id'], move['from'], move['to']) for move in resp.json()['moves']] == [
+        (2, {'x': 0, 'y': 0}, {'x': 1500, 'y': 500}),
+        (3, {'x': 0, 'y': 0}, {'x': 1500, 'y': 500}),
+    ]
+    assert client.get('/api/world').json()['busy'] == 0
+
+    resp = client.post('/api/rebalance', params={'apply': True})
+    assert len(resp.json()['moves']) == 2
+    assert client.get('/api/world').json()['busy'] == 2
+
+    client.put('/api/reset')
+    assert client.get('/api/demand').json()['tiles'] == []
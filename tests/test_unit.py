@@ -1,10 +1,42 @@
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import pickle
+import random
+import sys
+import threading
+import time as timer
+import zlib
+from math import ceil, inf
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import pydantic
 
 from models.time import Time
-from models.data import Location, Trip
-from models.car import Car
-from models.taxi_park import TaxiPark
+from models.data import Location, Point, Trip, ORIGIN
+from models.car import Car, CarList
+from models.taxi_park import TaxiPark, create_taxi_park
+from models.array_taxi_park import ArrayTaxiPark
+from models.dispatch import hungarian, book_batch
+import fastpath
+from fastpath import parse_trip, encode_booking
+from models.spatial_index import LinearIndex, GridIndex, TopK, create_index
+from models import metrics
+from models.concurrent_taxi_park import ConcurrentTaxiPark, ReadWriteLock
+from models.sharded_taxi_park import ShardedTaxiPark
+from fleet_server import FleetState, serve, connect
+from settings import settings
+import simulate
+import world
+from models import snapshot, wal
+from models.distance import Manhattan, Chebyshev, Euclidean, Weighted, create_metric
+from models.vehicle import SEDAN, Vehicle, Requirements, eligible, fleet_blocks
+from models.pooling import Route, Stop
+from models.demand import DemandMap
+from models.rebalancing import CANDIDATES_PER_SLOT, Rebalancer, apportion
 
 
 class TestTime:
@@ -155,6 +187,52 @@ class TestCar:
         assert car.location == Location(x=0, y=0)
         assert not car.booked_until
 
+    def test_compact_location(self):
+        car = Car(car_id=1, location=Location(x=5, y=3))
+        assert type(car.location) is Point
+
+        car.book(Location(x=6, y=3), Location(x=8, y=7), 0, 1)
+        assert type(car.location) is Point
+        assert car.to_dict() == {'car_id': 1, 'location': {'x': 8, 'y': 7}, 'booked_until': 1 + 6}
+
+        # all cars share the same point after a reset
+        car.reset()
+        assert car.location is ORIGIN
+
+        with pytest.raises(AttributeError):
+            car.color = 'yellow'
+
+
+class TestPoint:
+    def test_equality(self):
+        assert Point(1, 2) == Point(1, 2)
+        assert Point(1, 2) == Location(x=1, y=2)
+        assert Location(x=1, y=2) == Point(1, 2)
+        assert Point(1, 2) != Point(2, 1)
+        assert Point(1, 2) != (1, 2)
+        assert len({Point(1, 2), Point(1, 2)}) == 1
+
+    def test_distance(self):
+        assert Point(1, 2).distance(Point(4, -2)) == 3 + 4
+        assert Point(1, 2).distance(Location(x=4, y=-2)) == 3 + 4
+
+    def test_of(self):
+        point = Point(1, 2)
+        assert Point.of(point) is point
+        assert Point.of(Location(x=1, y=2)) == point
+
+    def test_immutable(self):
+        car = Car(car_id=1)
+
+        with pytest.raises(AttributeError):
+            car.location.x = 5
+        with pytest.raises(AttributeError):
+            del ORIGIN.y
+
+        # all cars share the origin, so it stays where it is
+        assert ORIGIN == Point(0, 0) == Car(car_id=2).location
+        assert copy.copy(Point(1, 2)) == pickle.loads(pickle.dumps(Point(1, 2))) == Point(1, 2)
+
 
 class TestTaxiPark:
     def test_try_adding_not_a_car(self):
@@ -186,6 +264,27 @@ class TestTaxiPark:
         for i in range(1, N + 1):
             assert taxi_park.cars[i - 1].car_id == i
 
+    @pytest.mark.parametrize('make', [
+        lambda: TaxiPark(Time()),
+        lambda: TaxiPark(Time(), index=GridIndex(cell_size=5)),
+        lambda: TaxiPark(Time(), pool_rides=True),
+        lambda: ConcurrentTaxiPark(Time()),
+        lambda: ArrayTaxiPark(Time()),
+        lambda: ShardedTaxiPark(Time(), tile_size=5),
+    ], ids=['linear', 'grid', 'pooling', 'concurrent', 'arrays', 'sharded'])
+    def test_zero_length_booking(self, make):
+        taxi_park = make()
+        taxi_park.populate_with_n_cars(3)
+
+        # the customer is right at the car and goes nowhere, so the car is free again right away
+        for _ in range(5):
+            (car, total_time) = taxi_park.book_closest(Point(0, 0), Point(0, 0))
+            assert (car.car_id, total_time) == (1, 0)
+            assert (taxi_park.free_count, taxi_park.busy_count) == (3, 0)
+
+        assert taxi_park.book_closest(Point(0, 1), Point(0, 2))[0].car_id == 1
+        assert (taxi_park.free_count, taxi_park.busy_count) == (2, 1)
+
     def test_find_closest(self):
         time = Time()
         taxi_park = TaxiPark(time)
@@ -310,3 +409,2482 @@ class TestTaxiPark:
         for car in taxi_park.cars:
             assert car.location == Location(x=0, y=0)
             assert not car.booked_until
+
+
+class TestGridIndex:
+    def make_park(self, index):
+        time = Time()
+        taxi_park = TaxiPark(time, index=index)
+
+        for (car_id, x, y) in [(1, 3, 3), (2, 5, 5), (3, 6, 4), (4, -2500, 7000)]:
+            taxi_park.add_car(Car(car_id=car_id, location=Location(x=x, y=y)))
+
+        return taxi_park
+
+    def test_unknown_index(self):
+        with pytest.raises(ValueError):
+            create_index('kd-tree')
+
+    def test_wrong_cell_size(self):
+        with pytest.raises(ValueError):
+            GridIndex(cell_size=-1)
+
+    def test_find_closest_same_distance(self):
+        taxi_park = self.make_park(GridIndex(cell_size=2))
+
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=4, y=4))
+
+        assert closest_car.car_id == 1
+        assert min_dist == 2
+
+    def test_find_closest_far_away(self):
+        taxi_park = self.make_park(GridIndex(cell_size=2))
+
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=-2 ** 31, y=2 ** 31 - 1))
+
+        assert closest_car.car_id == 4
+        assert min_dist == (2 ** 31 - 2500) + (2 ** 31 - 1 - 7000)
+
+    def test_duplicate_car_id(self):
+        index = GridIndex()
+        index.add(Car(car_id=1))
+
+        with pytest.raises(ValueError):
+            index.add(Car(car_id=1))
+
+    def test_book_moves_car(self):
+        taxi_park = self.make_park(GridIndex(cell_size=2))
+
+        (car, total_time) = taxi_park.book_closest(Location(x=3, y=3), Location(x=100, y=100))
+        assert car.car_id == 1
+        assert total_time == 0 + 194
+
+        # car 1 is busy now
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=100, y=100))
+        assert closest_car.car_id == 2
+
+        taxi_park.time.tick(194)
+
+        # and after finishing the trip it waits for the next customer at the destination
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=100, y=100))
+        assert closest_car.car_id == 1
+        assert min_dist == 0
+
+    def test_reset(self):
+        taxi_park = self.make_park(GridIndex(cell_size=2))
+        taxi_park.book_closest(Location(x=3, y=3), Location(x=100, y=100))
+
+        taxi_park.reset()
+
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=100, y=100))
+        assert closest_car.car_id == 1
+        assert min_dist == 200
+
+        # the index is rebuilt lazily, when the cars are looked at
+        assert len(taxi_park.index) == 0
+        taxi_park.cars
+        assert len(taxi_park.index) == 4
+
+    def test_same_as_linear(self):
+        random.seed(42)
+
+        linear_park = TaxiPark(Time(), index=LinearIndex())
+        grid_park = TaxiPark(Time(), index=GridIndex(cell_size=7))
+
+        # small world, so there are plenty of ties between the cars
+        for car_id in random.sample(range(1, 1000), 200):
+            x, y = random.randint(-50, 50), random.randint(-50, 50)
+            linear_park.add_car(Car(car_id=car_id, location=Location(x=x, y=y)))
+            grid_park.add_car(Car(car_id=car_id, location=Location(x=x, y=y)))
+
+        for _ in range(300):
+            src = Location(x=random.randint(-80, 80), y=random.randint(-80, 80))
+            dst = Location(x=random.randint(-80, 80), y=random.randint(-80, 80))
+
+            linear_booking = linear_park.book_closest(src, dst)
+            grid_booking = grid_park.book_closest(src, dst)
+
+            if linear_booking is None:
+                assert grid_booking is None
+            else:
+                assert linear_booking[0].car_id == grid_booking[0].car_id
+                assert linear_booking[1] == grid_booking[1]
+
+            units = random.randint(0, 5)
+            linear_park.time.tick(units)
+            grid_park.time.tick(units)
+
+
+class TestDistance:
+    METRICS = [Manhattan(), Chebyshev(), Euclidean(), Weighted(1, 3), Weighted(1.5, 1)]
+
+    def test_distance(self):
+        (a, b) = (Point(1, -2), Location(x=4, y=2))
+
+        assert Manhattan().distance(a, b) == a.distance(b) == 7
+        assert Chebyshev().distance(a, b) == 4
+        assert Euclidean().distance(a, b) == 5.0
+        assert Weighted(1, 3).distance(a, b) == 3 + 12
+        assert Car(1, location=a).distance(b, Chebyshev()) == 4
+
+    def test_integral(self):
+        assert [metric.integral for metric in self.METRICS] == [True, True, False, True, False]
+
+    def test_scores(self):
+        import numpy as np
+
+        random.seed(3)
+        points = [Point(random.randint(-2 ** 31, 2 ** 31 - 1), random.randint(-2 ** 31, 2 ** 31 - 1)) for _ in range(100)]
+        (xs, ys) = (np.array([p.x for p in points]), np.array([p.y for p in points]))
+        src = Point(2 ** 31 - 1, -2 ** 31)
+
+        for metric in self.METRICS:
+            assert metric.scores(xs, ys, src).tolist() == pytest.approx([metric.distance(p, src) for p in points])
+
+        # integral metrics are exact even at the edges of the grid
+        assert Manhattan().scores(xs, ys, src).tolist() == [Manhattan().distance(p, src) for p in points]
+
+    def test_bound(self):
+        for metric in self.METRICS:
+            assert metric.bound(10) == min(metric.measure(10, 0), metric.measure(0, 10))
+            assert all(
+                metric.bound(10) <= metric.measure(dx, dy) for dx in range(12) for dy in range(12) if max(dx, dy) >= 10
+            )
+
+    def test_create_metric(self, monkeypatch):
+        assert isinstance(create_metric(), Manhattan)
+        assert isinstance(create_metric('euclidean'), Euclidean)
+
+        monkeypatch.setattr(settings, 'distance_weights', (2, 1))
+        assert create_metric('weighted').measure(1, 1) == 3
+
+        with pytest.raises(ValueError):
+            create_metric('haversine')
+        with pytest.raises(ValueError):
+            Weighted(0, 1)
+
+    def test_index_with_another_metric(self):
+        with pytest.raises(ValueError):
+            TaxiPark(Time(), index=LinearIndex(Chebyshev()), metric=Euclidean())
+
+    def test_trip_time_rounded_up(self):
+        taxi_park = TaxiPark(Time(), metric=Euclidean())
+        taxi_park.add_car(Car(1, location=Point(3, 4)))
+
+        (car, total_time) = taxi_park.book_closest(Point(0, 0), Point(1, 1))
+        assert total_time == 7  # 5 + 1.41.. units
+        assert car.booked_until == 7
+
+    @pytest.mark.parametrize('metric', METRICS, ids=repr)
+    def test_all_parks_agree(self, metric):
+        random.seed(11)
+
+        parks = [
+            TaxiPark(Time(), index=LinearIndex(metric)),
+            TaxiPark(Time(), index=GridIndex(cell_size=7, metric=metric)),
+            ArrayTaxiPark(Time(), metric=metric),
+            ShardedTaxiPark(Time(), tile_size=16, metric=metric),
+        ]
+
+        # small world, so there are plenty of ties between the cars
+        for car_id in random.sample(range(1, 1000), 200):
+            (x, y) = (random.randint(-50, 50), random.randint(-50, 50))
+            for taxi_park in parks:
+                taxi_park.add_car(Car(car_id=car_id, location=Point(x, y)))
+
+        for _ in range(300):
+            src = Point(random.randint(-80, 80), random.randint(-80, 80))
+            dst = Point(random.randint(-80, 80), random.randint(-80, 80))
+
+            # the closest free car by brute force
+            free = [car for car in parks[0].cars if car.free_now(parks[0].time.time)]
+            expected = min(free, key=lambda car: (metric.distance(car.location, src), car.car_id), default=None)
+
+            bookings = [taxi_park.book_closest(src, dst) for taxi_park in parks]
+            if expected is None:
+                assert bookings == [None] * len(parks)
+            else:
+                assert [car.car_id for (car, _) in bookings] == [expected.car_id] * len(parks)
+                assert len({total_time for (_, total_time) in bookings}) == 1
+
+            units = random.randint(0, 5)
+            for taxi_park in parks:
+                taxi_park.time.tick(units)
+
+    @pytest.mark.parametrize('metric', METRICS, ids=repr)
+    def test_optimal_batch(self, metric):
+        random.seed(5)
+
+        taxi_park = TaxiPark(Time(), metric=metric)
+        for car_id in range(1, 11):
+            taxi_park.add_car(Car(car_id=car_id, location=Point(random.randint(-20, 20), random.randint(-20, 20))))
+
+        # the best assignment by brute force
+        trips = [(Point(random.randint(-20, 20), random.randint(-20, 20)), Point(0, 0)) for _ in range(4)]
+        free_cars = list(taxi_park.free_cars())
+        best = min(
+            sum(metric.distance(car.location, src) for (car, (src, _)) in zip(cars, trips))
+            for cars in itertools.permutations(free_cars, len(trips))
+        )
+
+        locations = {car.car_id: car.location for car in free_cars}
+        bookings = taxi_park.book_batch(trips, optimal=True)
+        total = sum(metric.distance(locations[car.car_id], src) for ((car, _), (src, _)) in zip(bookings, trips))
+
+        assert total == pytest.approx(best)
+
+
+class TestNearest:
+    def test_top_k(self):
+        nearest = TopK(2)
+        assert nearest.offer(Car(3), 5)
+        assert nearest.offer(Car(2), 7)
+        assert nearest.offer(Car(1), 7)  # as far, but with a smaller ID
+        assert not nearest.offer(Car(4), 7)
+        assert not nearest.beats(8, 1)
+        assert (nearest.full, nearest.worst) == (True, 7)
+
+        assert [(car.car_id, dist) for (car, dist) in nearest.result()] == [(3, 5), (1, 7)]
+
+        with pytest.raises(ValueError):
+            TopK(0)
+
+    @pytest.mark.parametrize('metric', [Manhattan(), Euclidean(), Weighted(1, 3)], ids=repr)
+    def test_all_parks_agree(self, metric):
+        random.seed(13)
+
+        parks = [
+            TaxiPark(Time(), index=LinearIndex(metric)),
+            TaxiPark(Time(), index=GridIndex(cell_size=7, metric=metric)),
+            ConcurrentTaxiPark(Time(), index=GridIndex(cell_size=3, metric=metric)),
+            ArrayTaxiPark(Time(), metric=metric),
+            ShardedTaxiPark(Time(), tile_size=16, metric=metric),
+        ]
+
+        # IDs are increasing, so resets are lazy and untouched cars take part in the searches
+        for car_id in sorted(random.sample(range(1, 1000), 100)):
+            (x, y) = (random.randint(-50, 50), random.randint(-50, 50))
+            for taxi_park in parks:
+                taxi_park.add_car(Car(car_id=car_id, location=Point(x, y)))
+
+        for i in range(300):
+            src = Point(random.randint(-80, 80), random.randint(-80, 80))
+            k = random.randint(1, 15)
+
+            # the nearest free cars by brute force
+            free = list(parks[0].free_cars())
+            expected = sorted((metric.distance(car.location, src), car.car_id) for car in free)[:k]
+
+            for taxi_park in parks:
+                nearest = taxi_park.find_nearest(src, k)
+                assert [car.car_id for (car, _) in nearest] == [car_id for (_, car_id) in expected]
+                assert [dist for (_, dist) in nearest] == pytest.approx([dist for (dist, _) in expected])
+                assert all(car.free_now(taxi_park.time.time) for (car, _) in nearest)
+
+            dst = Point(random.randint(-80, 80), random.randint(-80, 80))
+            for taxi_park in parks:
+                taxi_park.book_closest(src, dst)
+                taxi_park.time.tick(random.Random(i).randint(0, 3))
+
+            if i % 100 == 50:
+                [taxi_park.reset() for taxi_park in parks]
+
+    def test_same_as_closest(self):
+        taxi_park = TaxiPark(Time(), index=GridIndex(cell_size=5))
+        for (car_id, (x, y)) in enumerate([(4, 4), (0, 3), (-3, 0), (3, 0), (10, 10)], start=1):
+            taxi_park.add_car(Car(car_id, location=Point(x, y)))
+
+        (closest, dist) = taxi_park.find_closest(Point(0, 0))
+        nearest = taxi_park.find_nearest(Point(0, 0), 3)
+
+        assert (nearest[0][0], nearest[0][1]) == (closest, dist)
+        assert [(car.car_id, dist) for (car, dist) in nearest] == [(2, 3), (3, 3), (4, 3)]
+
+    def test_not_enough_free_cars(self):
+        for taxi_park in [TaxiPark(Time()), ArrayTaxiPark(Time()), ShardedTaxiPark(Time())]:
+            taxi_park.populate_with_n_cars(3)
+            taxi_park.book_closest(Point(1, 1), Point(5, 5))
+
+            assert [car.car_id for (car, _) in taxi_park.find_nearest(Point(1, 1), 10)] == [2, 3]
+
+            with pytest.raises(ValueError):
+                taxi_park.find_nearest(Point(1, 1), 0)
+
+    def test_untouched_cars_are_reset(self):
+        for taxi_park in [TaxiPark(Time()), ShardedTaxiPark(Time(), tile_size=4)]:
+            taxi_park.populate_with_n_cars(3)
+            taxi_park.book_closest(Point(0, 0), Point(9, 9))
+            taxi_park.time.tick(100)
+            taxi_park.reset()
+
+            # car 1 is still at (9, 9) in memory, but it's at the origin after the reset
+            nearest = taxi_park.find_nearest(Point(9, 9), 2)
+            assert [(car.car_id, car.location, dist) for (car, dist) in nearest] == [(1, ORIGIN, 18), (2, ORIGIN, 18)]
+
+            # touched cars are searched as usual from now on
+            assert [car.car_id for (car, _) in taxi_park.find_nearest(Point(9, 9), 3)] == [1, 2, 3]
+            assert taxi_park.book_closest(Point(0, 0), Point(1, 1))[0].car_id == 1
+
+
+class TestAvailability:
+    def test_subscribe_to_tick(self):
+        current_time = Time()
+        ticks = []
+        current_time.subscribe(ticks.append)
+
+        current_time.tick()
+        current_time.tick(10)
+
+        assert ticks == [1, 11]
+
+    def test_booking_marks_busy(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(3)
+
+        assert (taxi_park.free_count, taxi_park.busy_count) == (3, 0)
+
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))
+
+        assert (taxi_park.free_count, taxi_park.busy_count) == (1, 2)
+        # the car which hasn't been booked yet is untouched (see `models.generation`) until somebody looks at it
+        assert len(taxi_park.cars) == 3
+        assert len(taxi_park.index) == 1
+
+    def test_tick_releases_finished(self):
+        time = Time()
+        taxi_park = TaxiPark(time)
+        taxi_park.populate_with_n_cars(3)
+
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))  # busy until 2
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))  # busy until 10
+
+        time.tick(2)
+        assert (taxi_park.free_count, taxi_park.busy_count) == (2, 1)
+
+        # car 1 is free again at its destination (1, 1)
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=1, y=1))
+        assert closest_car.car_id == 1
+        assert min_dist == 0
+
+        # large jump releases everything at once
+        assert [car.car_id for car in taxi_park.release_finished(100)] == [2]
+        assert (taxi_park.free_count, taxi_park.busy_count) == (3, 0)
+
+    def test_add_busy_car(self):
+        taxi_park = TaxiPark(Time(20))
+
+        car = Car(car_id=1)
+        car.booked_until = 42
+        taxi_park.add_car(car)
+
+        assert (taxi_park.free_count, taxi_park.busy_count) == (0, 1)
+        assert not taxi_park.find_closest(Location(x=0, y=0))
+
+        taxi_park.time.tick(22)
+        assert taxi_park.find_closest(Location(x=0, y=0))[0].car_id == 1
+
+    def test_reset_frees_everything(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(2)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+
+        taxi_park.reset()
+
+        assert (taxi_park.free_count, taxi_park.busy_count) == (2, 0)
+        assert len(taxi_park.index) == 0  # until the cars are touched
+
+        assert len(list(taxi_park.free_cars())) == 2
+        assert len(taxi_park.index) == 2
+
+
+class TestFastForward:
+    @pytest.fixture(params=['objects', 'concurrent', 'arrays', 'sharded'])
+    def taxi_park(self, request):
+        time = Time()
+        if request.param == 'concurrent':
+            taxi_park = ConcurrentTaxiPark(time)
+        elif request.param == 'sharded':
+            taxi_park = ShardedTaxiPark(time, tile_size=4)
+        else:
+            taxi_park = create_taxi_park(time, request.param)
+
+        taxi_park.populate_with_n_cars(3)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))  # car 1 is busy until 10
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))  # car 2 is busy until 2
+
+        return taxi_park
+
+    def test_tick_returns_released(self):
+        time = Time()
+        taxi_park = TaxiPark(time)
+        taxi_park.populate_with_n_cars(1)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+
+        assert time.tick() == []
+        assert [car.car_id for car in time.tick()] == [1]
+
+    def test_many_units(self, taxi_park):
+        assert taxi_park.next_release_time() == 2
+
+        assert taxi_park.fast_forward(1) == []
+        assert [car.car_id for car in taxi_park.fast_forward(1000)] == [2, 1]
+        assert taxi_park.time.time == 1001
+
+        assert taxi_park.next_release_time() is None
+        assert (taxi_park.free_count, taxi_park.busy_count) == (3, 0)
+
+    def test_until_free(self, taxi_park):
+        assert [car.car_id for car in taxi_park.fast_forward(until_free=True)] == [2]
+        assert taxi_park.time.time == 2
+
+        assert [car.car_id for car in taxi_park.fast_forward(until_free=True)] == [1]
+        assert taxi_park.time.time == 10
+
+        # nothing is busy, so time stays where it is
+        assert taxi_park.fast_forward(until_free=True) == []
+        assert taxi_park.time.time == 10
+
+    def test_released_cars_are_bookable(self, taxi_park):
+        taxi_park.fast_forward(until_free=True)
+
+        (car, dist) = taxi_park.find_closest(Location(x=1, y=1))
+        assert (car.car_id, dist) == (2, 0)
+
+    def test_reset(self, taxi_park):
+        taxi_park.reset()
+
+        assert taxi_park.next_release_time() is None
+        assert taxi_park.fast_forward(100) == []
+
+
+class TestFutureDispatch:
+    @pytest.fixture(params=['linear', 'grid', 'arrays'])
+    def taxi_park(self, request):
+        if request.param == 'arrays':
+            taxi_park = ArrayTaxiPark(Time(), future_dispatch=True)
+        else:
+            taxi_park = TaxiPark(Time(), index=create_index(request.param), future_dispatch=True)
+
+        taxi_park.add_car(Car(1, location=Point(0, 0)))
+        taxi_park.add_car(Car(2, location=Point(100, 0)))
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))  # car 1 is busy until 10
+
+        return taxi_park
+
+    def test_queues_onto_busy_car(self, taxi_park):
+        # car 1 drops off its customer right here in 10 units, while car 2 needs 90 to get here
+        (car, total_time) = taxi_park.book_closest(Point(10, 0), Point(10, 5))
+        assert (car.car_id, total_time) == (1, 10 + 5)
+        assert (car.booked_until, car.location) == (15, Point(10, 5))
+        assert (taxi_park.free_count, taxi_park.busy_count) == (1, 1)
+
+        # the car isn't released at the end of its first trip, but at the end of the queued one
+        assert taxi_park.next_release_time() == 15
+        assert taxi_park.fast_forward(10) == []
+        assert [car.car_id for car in taxi_park.fast_forward(until_free=True)] == [1]
+        assert taxi_park.time.time == 15
+
+    def test_free_car_when_it_is_sooner(self, taxi_park):
+        (car, total_time) = taxi_park.book_closest(Point(80, 0), Point(80, 1))
+        assert (car.car_id, total_time) == (2, 20 + 1)
+
+    def test_no_free_cars(self, taxi_park):
+        taxi_park.book_closest(Point(100, 0), Point(100, 5))
+
+        # all cars are busy, but the booking still goes through
+        (car, total_time) = taxi_park.book_closest(Point(20, 0), Point(20, 0))
+        assert (car.car_id, total_time) == (1, 10 + 10)
+
+    @pytest.mark.parametrize('metric', [Manhattan(), Euclidean()], ids=repr)
+    def test_same_as_brute_force(self, metric):
+        random.seed(17)
+
+        parks = [
+            TaxiPark(Time(), index=LinearIndex(metric), future_dispatch=True),
+            TaxiPark(Time(), index=GridIndex(cell_size=6, metric=metric), future_dispatch=True),
+            ArrayTaxiPark(Time(), metric=metric, future_dispatch=True),
+        ]
+        for car_id in range(1, 31):
+            (x, y) = (random.randint(-40, 40), random.randint(-40, 40))
+            for taxi_park in parks:
+                taxi_park.add_car(Car(car_id, location=Point(x, y)))
+
+        for i in range(400):
+            src = Point(random.randint(-50, 50), random.randint(-50, 50))
+            dst = Point(random.randint(-50, 50), random.randint(-50, 50))
+
+            # the car which gets to the customer the soonest by brute force
+            now = parks[0].time.time
+            expected = min(
+                (max((car.booked_until or 0) - now, 0) + metric.distance(car.location, src), car.car_id)
+                for car in parks[0].cars
+            )
+
+            bookings = [taxi_park.book_closest(src, dst) for taxi_park in parks]
+            assert [car.car_id for (car, _) in bookings] == [expected[1]] * len(parks)
+            assert len({total_time for (_, total_time) in bookings}) == 1
+
+            if i % 3 == 0:
+                units = random.randint(0, 30)
+                # cars released at the same time can come in any order
+                released = [sorted(car.car_id for car in taxi_park.fast_forward(units)) for taxi_park in parks]
+                assert released[1:] == released[:1] * 2
+                assert len({taxi_park.busy_count for taxi_park in parks}) == 1
+
+            if i == 200:
+                [taxi_park.reset() for taxi_park in parks]
+
+    def test_not_supported(self, monkeypatch):
+        monkeypatch.setattr(settings, 'future_dispatch', True)
+
+        assert TaxiPark(Time()).future_dispatch
+        with pytest.raises(ValueError):
+            create_taxi_park(Time(), 'sharded')
+
+
+class TestLazyReset:
+    @pytest.fixture(params=['objects', 'concurrent', 'sharded'])
+    def make_park(self, request):
+        def make_park(n):
+            time = Time()
+            if request.param == 'concurrent':
+                taxi_park = ConcurrentTaxiPark(time, index=GridIndex(cell_size=5))
+            elif request.param == 'sharded':
+                taxi_park = ShardedTaxiPark(time, tile_size=5)
+            else:
+                taxi_park = TaxiPark(time, index=GridIndex(cell_size=5))
+
+            taxi_park.populate_with_n_cars(n)
+            return taxi_park
+
+        return make_park
+
+    def test_same_as_eager_reset(self, make_park):
+        random.seed(14)
+
+        (lazy_park, eager_park) = (make_park(30), make_park(30))
+        eager_park._generation.lazy = False
+
+        for i in range(1, 500):
+            src = Location(x=random.randint(-20, 20), y=random.randint(-20, 20))
+            dst = Location(x=random.randint(-20, 20), y=random.randint(-20, 20))
+
+            bookings = [taxi_park.book_closest(src, dst) for taxi_park in (lazy_park, eager_park)]
+            assert [booking and (booking[0].car_id, booking[1]) for booking in bookings] == \
+                [bookings[1] and (bookings[1][0].car_id, bookings[1][1])] * 2
+
+            if i % 7 == 0:
+                trips = [(src, dst), (dst, src)]
+                batches = [taxi_park.book_batch(trips, optimal=True) for taxi_park in (lazy_park, eager_park)]
+                assert [[booking and booking[0].car_id for booking in batch] for batch in batches] == \
+                    [[booking and booking[0].car_id for booking in batches[1]]] * 2
+
+            if i % 5 == 0:
+                units = random.randint(1, 30)
+                [taxi_park.time.tick(units) for taxi_park in (lazy_park, eager_park)]
+
+            if i % 40 == 0:
+                [taxi_park.reset() for taxi_park in (lazy_park, eager_park)]
+                assert (lazy_park.free_count, lazy_park.busy_count) == (30, 0)
+
+            if i % 90 == 0:
+                assert [car.to_dict() for car in lazy_park.cars] == [car.to_dict() for car in eager_park.cars]
+
+    def test_reset_is_lazy(self, make_park):
+        taxi_park = make_park(3)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))
+
+        taxi_park.reset()
+
+        # the car isn't reset until it's touched
+        car = taxi_park._cars[0]
+        assert car.booked_until is not None
+
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=2, y=2))
+        assert (closest_car.car_id, min_dist) == (1, 4)
+
+        assert taxi_park.cars[0].to_dict() == {'car_id': 1, 'location': {'x': 0, 'y': 0}, 'booked_until': None}
+
+    def test_cars_added_out_of_order(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.add_car(Car(2))
+        taxi_park.add_car(Car(1))
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))
+
+        # smallest untouched ID is not the first car, so reset has to be done right away
+        taxi_park.reset()
+        assert all(car.booked_until is None for car in taxi_park._cars)
+
+        (closest_car, _) = taxi_park.find_closest(Location(x=0, y=0))
+        assert closest_car.car_id == 1
+
+    def test_populate_creates_cars_lazily(self, make_park):
+        taxi_park = make_park(100000)
+        assert (taxi_park.free_count, taxi_park._cars._missing) == (100000, 100000)
+
+        taxi_park.book_closest(Location(x=5, y=5), Location(x=6, y=6))
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=-3, y=0))
+        assert (closest_car.car_id, min_dist) == (2, 3)
+        assert taxi_park._cars._missing == 100000 - 2
+
+        cars = taxi_park.cars
+        assert [car.car_id for car in cars] == list(range(1, 100001))
+        assert cars[0].to_dict() == {'car_id': 1, 'location': {'x': 6, 'y': 6}, 'booked_until': 12}
+        assert taxi_park._cars._missing == 0
+
+    def test_populate_non_empty_park(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.add_car(Car(7, Location(x=1, y=1)))
+        taxi_park.populate_with_n_cars(2)
+
+        assert [car.car_id for car in taxi_park._cars] == [7, 1, 2]
+        assert len(taxi_park.index) == 3
+
+
+class TestCarList:
+    def test_sequence(self):
+        cars = CarList()
+        cars.append(Car(10))
+        cars.extend_lazily(3, first_id=1)
+        cars.append(Car(20))
+        cars.extend_lazily(2, first_id=100)
+        cars.extend_lazily(0, first_id=200)
+
+        assert len(cars) == 7
+        assert [car.car_id for car in cars] == [10, 1, 2, 3, 20, 100, 101]
+        assert [car.car_id for car in cars[2:6:2]] == [2, 20]
+        assert cars[-1].car_id == 101
+        with pytest.raises(IndexError):
+            cars[7]
+
+        # created cars are untouched by any generation of a park and always the same objects
+        assert (cars[1].generation, cars[0].generation) == (CarList.UNTOUCHED, 0)
+        assert cars[3] is cars[3]
+        assert cars[3].to_dict() == {'car_id': 3, 'location': {'x': 0, 'y': 0}, 'booked_until': None}
+
+    def test_created_once_from_many_threads(self):
+        cars = CarList()
+        cars.extend_lazily(1000, first_id=1)
+
+        with ThreadPoolExecutor(8) as executor:
+            seen = list(executor.map(lambda _: [id(car) for car in cars], range(8)))
+
+        assert all(ids == seen[0] for ids in seen)
+        assert cars._missing == 0
+
+
+class TestVehicles:
+    VAN = Vehicle.of('van')
+    ACCESSIBLE = Vehicle.of('accessible')
+
+    @pytest.fixture(params=['linear', 'grid', 'concurrent', 'arrays', 'sharded'])
+    def make_park(self, request):
+        def make_park(**kwargs):
+            if request.param == 'concurrent':
+                return ConcurrentTaxiPark(Time(), index=GridIndex(cell_size=5))
+            elif request.param == 'arrays':
+                return ArrayTaxiPark(Time(), **kwargs)
+            elif request.param == 'sharded':
+                return ShardedTaxiPark(Time(), tile_size=5)
+
+            return TaxiPark(Time(), index=create_index(request.param), **kwargs)
+
+        return make_park
+
+    def test_vehicle_classes(self):
+        assert Vehicle.of() is SEDAN
+        assert Vehicle.of('van') is self.VAN
+        assert Vehicle.of('van', 9) is Vehicle.of('van', 9)
+        assert tuple(Vehicle.of('van', 9)) == ('van', 9)
+
+        for vehicle in (SEDAN, self.VAN, Vehicle.of('accessible', 2)):
+            assert Vehicle.from_code(vehicle.code) is vehicle
+
+        with pytest.raises(ValueError):
+            Vehicle.of('bus')
+        with pytest.raises(ValueError):
+            Vehicle.of('van', 0)
+
+    def test_requirements(self):
+        assert Requirements.of() is None
+        assert Requirements.of(passengers=5) == Requirements(5, None)
+
+        assert Requirements(passengers=5).admits(self.VAN)
+        assert not Requirements(passengers=5).admits(SEDAN)
+        assert Requirements(vehicle_type='accessible').admits(self.ACCESSIBLE)
+        assert not Requirements(passengers=2, vehicle_type='accessible').admits(SEDAN)
+
+        vehicles = [SEDAN, self.VAN, self.ACCESSIBLE]
+        assert eligible(vehicles, None) is None
+        assert eligible(vehicles, Requirements(passengers=1)) is None
+        assert eligible(vehicles, Requirements(passengers=7)) == [self.VAN]
+        assert eligible(vehicles, Requirements(passengers=8)) == []
+
+        with pytest.raises(ValueError):
+            Requirements(passengers=0)
+        with pytest.raises(ValueError):
+            Requirements(vehicle_type='bus')
+
+    def test_fleet_blocks(self):
+        assert fleet_blocks(10) == [(SEDAN, 10)]
+        assert fleet_blocks(10, {'van': 0.2, 'accessible': 0.1}) == [(SEDAN, 7), (self.VAN, 2), (self.ACCESSIBLE, 1)]
+        assert fleet_blocks(10, {'van': 1}) == [(self.VAN, 10)]
+        assert fleet_blocks(0, {'van': 0.5}) == []
+
+        # both classes would round up on their own, while there are only 3 cars
+        assert fleet_blocks(3, {'van': 0.5, 'accessible': 0.5}) == [(self.VAN, 2), (self.ACCESSIBLE, 1)]
+        assert fleet_blocks(5, {'van': 0.3, 'accessible': 0.3}) == [(SEDAN, 2), (self.VAN, 2), (self.ACCESSIBLE, 1)]
+
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(3, mix={'van': 0.5, 'accessible': 0.5})
+        assert [car.car_id for car in taxi_park.cars] == [1, 2, 3]
+
+        with pytest.raises(ValueError):
+            fleet_blocks(10, {'bus': 0.1})
+        with pytest.raises(ValueError):
+            fleet_blocks(10, {'van': 0.6, 'accessible': 0.6})
+
+    def test_populate_mixed_fleet(self, make_park):
+        taxi_park = make_park()
+        taxi_park.populate_with_n_cars(10, {'van': 0.2, 'accessible': 0.1})
+        assert [car.vehicle.vehicle_type for car in taxi_park.cars] == ['sedan'] * 7 + ['van'] * 2 + ['accessible']
+
+        (src, dst) = (Point(1, 1), Point(2, 2))
+        assert taxi_park.find_closest(src, Requirements(vehicle_type='accessible'))[0].car_id == 10
+        assert [car.car_id for (car, _) in taxi_park.find_nearest(src, 3, Requirements(passengers=5))] == [8, 9]
+
+        bookings = [taxi_park.book_closest(src, dst, Requirements(passengers=5)) for _ in range(3)]
+        assert [booking and booking[0].car_id for booking in bookings] == [8, 9, None]
+        assert taxi_park.book_closest(src, dst)[0].car_id == 1
+
+        # untouched cars after a reset are searched for by their classes as well
+        taxi_park.time.tick(100)
+        taxi_park.reset()
+        assert taxi_park.book_closest(src, dst, Requirements(passengers=6))[0].car_id == 8
+        assert taxi_park.find_closest(src, Requirements(vehicle_type='accessible'))[0].car_id == 10
+        assert taxi_park.find_closest(src)[0].car_id == 1
+
+    def test_add_car_to_lazy_fleet(self, make_park):
+        taxi_park = make_park()
+        taxi_park.populate_with_n_cars(5)
+        assert taxi_park.find_closest(Point(1, 1), Requirements(vehicle_type='van')) is None
+
+        taxi_park.add_car(Car(6, location=Point(3, 3), vehicle=self.VAN))
+        assert taxi_park.find_closest(Point(1, 1), Requirements(vehicle_type='van'))[0].car_id == 6
+        assert taxi_park.find_closest(Point(3, 3))[0].car_id == 6
+        assert taxi_park.find_closest(Point(1, 1), Requirements(vehicle_type='sedan'))[0].car_id == 1
+        assert taxi_park.free_count == 6
+
+    def test_same_as_brute_force(self, make_park):
+        random.seed(22)
+
+        taxi_park = make_park()
+        classes = [SEDAN] * 8 + [self.VAN, self.ACCESSIBLE]
+        for car_id in range(1, 101):
+            location = Point(random.randint(-30, 30), random.randint(-30, 30))
+            taxi_park.add_car(Car(car_id, location=location, vehicle=random.choice(classes)))
+
+        all_requirements = [
+            None, Requirements(passengers=3), Requirements(passengers=5), Requirements(vehicle_type='accessible'),
+            Requirements(passengers=5, vehicle_type='sedan'),
+        ]
+
+        for i in range(400):
+            src = Point(random.randint(-40, 40), random.randint(-40, 40))
+            dst = Point(random.randint(-40, 40), random.randint(-40, 40))
+            requirements = random.choice(all_requirements)
+
+            # the nearest free eligible cars by brute force
+            expected = sorted(
+                (taxi_park.metric.distance(car.location, src), car.car_id)
+                for car in taxi_park.free_cars()
+                if requirements is None or requirements.admits(car.vehicle)
+            )
+
+            nearest = taxi_park.find_nearest(src, 3, requirements)
+            assert [car.car_id for (car, _) in nearest] == [car_id for (_, car_id) in expected[:3]]
+
+            booking = taxi_park.book_closest(src, dst, requirements)
+            assert (booking and booking[0].car_id) == (expected[0][1] if expected else None)
+
+            if i % 4 == 0:
+                taxi_park.time.tick(random.randint(0, 40))
+            if i % 150 == 100:
+                taxi_park.reset()
+
+    @pytest.mark.parametrize('fleet_store', ['objects', 'arrays'])
+    def test_future_dispatch(self, fleet_store):
+        if fleet_store == 'arrays':
+            taxi_park = ArrayTaxiPark(Time(), future_dispatch=True)
+        else:
+            taxi_park = TaxiPark(Time(), future_dispatch=True)
+
+        taxi_park.add_car(Car(1, location=Point(0, 0)))
+        taxi_park.add_car(Car(2, location=Point(50, 0), vehicle=self.VAN))
+
+        (src, dst) = (Point(0, 0), Point(10, 0))
+        assert taxi_park.book_closest(src, dst, Requirements(passengers=6))[0].car_id == 2
+
+        # the van is queued onto, even though the sedan is free and right here
+        (car, total_time) = taxi_park.book_closest(src, dst, Requirements(passengers=6))
+        assert (car.car_id, total_time) == (2, 60 + 10 + 10)
+        assert taxi_park.book_closest(src, dst, Requirements(vehicle_type='accessible')) is None
+        assert taxi_park.book_closest(src, dst)[0].car_id == 1
+
+    def test_snapshot_keeps_vehicles(self, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(4, {'van': 0.5})
+        snapshot.save(taxi_park, path)
+
+        for fleet_store in ('objects', 'arrays', 'sharded'):
+            (restored, _) = snapshot.restore(path, fleet_store)
+            assert [car.vehicle for car in restored.cars] == [SEDAN, SEDAN, self.VAN, self.VAN]
+            assert restored.find_closest(Point(1, 1), Requirements(passengers=5))[0].car_id == 3
+
+    def test_snapshot_of_version_1(self, tmp_path):
+        path = tmp_path / 'fleet.snap'
+        taxi_park = TaxiPark(Time())
+        taxi_park.add_car(Car(1, location=Point(2, 3), vehicle=self.VAN))
+        snapshot.save(taxi_park, str(path))
+
+        # the same snapshot without the column of vehicle classes
+        data = path.read_bytes()[:snapshot.HEADER.size + 4 * 8]
+        (magic, _, _, n, current_time) = snapshot.HEADER.unpack(data[:snapshot.HEADER.size])
+        checksum = zlib.crc32(data[snapshot.HEADER.size:])
+        path.write_bytes(snapshot.HEADER.pack(magic, 1, checksum, n, current_time) + data[snapshot.HEADER.size:])
+
+        (restored, _) = snapshot.restore(str(path), 'objects')
+        assert [(car.car_id, car.location, car.vehicle) for car in restored.cars] == [(1, Point(2, 3), SEDAN)]
+
+    def test_write_ahead_log(self, tmp_path):
+        path = str(tmp_path / 'fleet.wal')
+        base = wal.fresh_base(10, {'van': 0.2})
+        assert base != wal.fresh_base(10) != wal.fresh_base(10, {'van': 0.3})
+
+        def new_park(fleet_store):
+            taxi_park = create_taxi_park(Time(), fleet_store)
+            taxi_park.populate_with_n_cars(10, {'van': 0.2})
+            return taxi_park
+
+        async def operate(taxi_park, log):
+            writer = asyncio.create_task(log.run())
+            for requirements in (Requirements(passengers=5), None, Requirements(vehicle_type='van')):
+                (src, dst) = (Point(1, 0), Point(5, 5))
+                taxi_park.book_closest(src, dst, requirements)
+                await log.book(src, dst, requirements)
+            writer.cancel()
+
+        for fleet_store in ('objects', 'arrays', 'sharded'):
+            taxi_park = new_park(fleet_store)
+            log = wal.WriteAheadLog(path, base, fsync=False)
+            asyncio.new_event_loop().run_until_complete(operate(taxi_park, log))
+            log.close()
+
+            replayed = new_park(fleet_store)
+            assert wal.recover(path, replayed, base)[1] == 3
+            assert [car.to_dict() for car in replayed.cars] == [car.to_dict() for car in taxi_park.cars]
+            assert taxi_park.busy_count == 3
+
+    def test_fleet_server(self, monkeypatch):
+        monkeypatch.setattr(settings, 'fleet_mix', {'van': 0.4})
+        state = FleetState(5)
+
+        assert state.execute(['book', 0, 0, 1, 1, 6, None]) == ['ok', [4, 2]]
+        assert state.execute(['book', 0, 0, 1, 1, None, 'van']) == ['ok', [5, 2]]
+        assert state.execute(['book', 0, 0, 1, 1, 6, None]) == ['ok', None]
+        assert state.execute(['nearest', 0, 0, 5, None, 'sedan'])[1] == [[1, 0, 0, 0], [2, 0, 0, 0], [3, 0, 0, 0]]
+        assert state.execute(['book', 0, 0, 1, 1, None, 'bus'])[0] == 'error'
+
+
+class TestPooling:
+    @pytest.fixture(params=['linear', 'grid'])
+    def taxi_park(self, request, monkeypatch):
+        monkeypatch.setattr(settings, 'pool_max_detour', 10)
+
+        taxi_park = TaxiPark(Time(), index=create_index(request.param), pool_rides=True)
+        taxi_park.add_car(Car(1, location=Point(0, 0)))
+        taxi_park.add_car(Car(2, location=Point(100, 100)))
+        return taxi_park
+
+    def test_shares_car_on_the_way(self, taxi_park):
+        assert taxi_park.book_closest(Point(0, 0), Point(10, 0))[0].car_id == 1
+
+        # picked up and dropped off on the way of the first customer, who isn't delayed at all
+        (car, total_time) = taxi_park.book_closest(Point(2, 0), Point(8, 0))
+        assert (car.car_id, total_time) == (1, 8)
+        assert (car.booked_until, car.location) == (10, Point(10, 0))
+        assert (taxi_park.free_count, taxi_park.busy_count) == (1, 1)
+
+        # the car drops the first customer off, and picks up the third one on the way back
+        (car, total_time) = taxi_park.book_closest(Point(12, 0), Point(12, 5))
+        assert (car.car_id, total_time) == (1, 12 + 5)
+        assert car.booked_until == 17
+
+        assert taxi_park.fast_forward(10) == []
+        assert [car.car_id for car in taxi_park.fast_forward(until_free=True)] == [1]
+        assert len(taxi_park._pool) == 0
+
+    def test_shares_car_of_optimal_batch(self, taxi_park):
+        [(car, total_time)] = taxi_park.book_batch([(Point(0, 0), Point(10, 0))], optimal=True)
+        assert (car.car_id, total_time) == (1, 10)
+
+        # the car booked by the batch has a route, so the next customer shares it the same way
+        (car, total_time) = taxi_park.book_closest(Point(2, 0), Point(8, 0))
+        assert (car.car_id, total_time) == (1, 8)
+        assert (taxi_park.free_count, taxi_park.busy_count) == (1, 1)
+
+    def test_detour_limit(self, taxi_park):
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))
+
+        # picking the customer up on the way would delay the first one by 12 units,
+        # so the car takes the customer only after dropping the first one off
+        (car, total_time) = taxi_park.book_closest(Point(5, 6), Point(5, 7))
+        assert (car.car_id, total_time) == (1, 10 + 11 + 1)
+        assert [stop.location for stop in taxi_park._pool._routes[1].stops] == [Point(10, 0), Point(5, 6), Point(5, 7)]
+
+    def test_pickup_limit(self, taxi_park):
+        taxi_park.add_car(Car(3, location=Point(30, 0)))
+        taxi_park.book_closest(Point(0, 0), Point(25, 0))
+
+        # car 1 passes by, but only after 25 units, while car 3 gets here in 5
+        assert taxi_park.book_closest(Point(25, 0), Point(45, 0))[0].car_id == 3
+        # car 1 is 5 units closer than car 2 would be, so it takes the detour
+        assert taxi_park.book_closest(Point(20, 2), Point(25, 0))[0].car_id == 1
+
+    def test_capacity(self, taxi_park):
+        taxi_park.book_closest(Point(0, 0), Point(10, 0), Requirements(passengers=2))
+
+        # 4 seats of the sedan aren't enough for 2 + 3 passengers at once, but are for 2 + 2
+        (car, total_time) = taxi_park.book_closest(Point(2, 0), Point(8, 0), Requirements(passengers=3))
+        assert (car.car_id, total_time) == (1, 10 + 8 + 6)
+        (car, total_time) = taxi_park.book_closest(Point(2, 0), Point(8, 0), Requirements(passengers=2))
+        assert (car.car_id, total_time) == (1, 8)
+
+    def test_requirements(self, taxi_park):
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))
+
+        assert taxi_park.book_closest(Point(2, 0), Point(8, 0), Requirements(vehicle_type='van')) is None
+        assert taxi_park.book_closest(Point(2, 0), Point(8, 0), Requirements(vehicle_type='sedan'))[0].car_id == 1
+
+    def test_no_free_cars(self, taxi_park):
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))
+        taxi_park.book_closest(Point(100, 100), Point(90, 100))
+
+        # without free cars only a car passing by within the max detour can take the customer
+        (car, total_time) = taxi_park.book_closest(Point(10, 0), Point(30, 0))
+        assert (car.car_id, total_time) == (1, 10 + 20)
+        assert taxi_park.book_closest(Point(50, 0), Point(60, 0)) is None
+
+    def test_reset(self, taxi_park):
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))
+        taxi_park.reset()
+
+        assert len(taxi_park._pool) == 0
+        assert taxi_park.book_closest(Point(2, 0), Point(8, 0))[0].car_id == 1
+
+    def test_not_supported(self, monkeypatch):
+        with pytest.raises(ValueError):
+            TaxiPark(Time(), future_dispatch=True, pool_rides=True)
+
+        monkeypatch.setattr(settings, 'pool_rides', True)
+        assert TaxiPark(Time()).pool_rides
+        assert not ConcurrentTaxiPark(Time()).pool_rides
+        for fleet_store in ('arrays', 'sharded'):
+            with pytest.raises(ValueError):
+                create_taxi_park(Time(), fleet_store)
+
+    @staticmethod
+    def brute_force(route, src, dst, passengers, current_time, max_pickup_time, max_detour, metric):
+        '''
+            The smallest added time of the route over all positions of the pickup and the drop-off
+        '''
+
+        direct = metric.distance(src, dst)
+        first = 0 if route.since >= current_time else 1
+        costs = []
+        for i in range(first, len(route.stops) + 1):
+            for j in range(i, len(route.stops) + 1):
+                stops = list(route.stops)
+                stops.insert(j, Stop(dst, -passengers, None))
+                stops.insert(i, Stop(src, passengers, None))
+                (location, time, onboard, valid) = (route.origin, route.since, route.onboard, True)
+                for (k, stop) in enumerate(stops):
+                    time += metric.distance(location, stop.location)
+                    (location, onboard) = (stop.location, onboard + stop.passengers)
+                    if k == i:
+                        pickup_time = time
+                        valid &= time <= max_pickup_time
+                    deadline = pickup_time + direct + max_detour if k == j + 1 else stop.deadline
+                    valid &= (deadline is None or time <= deadline) and onboard <= route.car.vehicle.capacity
+                if valid:
+                    costs.append(time - route.end)
+
+        return min(costs, default=None)
+
+    @pytest.mark.parametrize('metric', [Manhattan(), Euclidean()], ids=repr)
+    def test_insertion_same_as_brute_force(self, metric):
+        random.seed(23)
+
+        def point():
+            return Point(random.randint(-20, 20), random.randint(-20, 20))
+
+        compared = 0
+        for _ in range(1000):
+            # drop-offs of the ones on board, then pickups and drop-offs of the ones picked up on the way
+            onboard = random.randint(0, 2)
+            stops = [Stop(point(), -1, random.randint(30, 120)) for _ in range(onboard)]
+            random.shuffle(stops)
+            for _ in range(random.randint(0, 2)):
+                pickup = random.randint(0, len(stops))
+                stops.insert(pickup, Stop(point(), 1, None))
+                stops.insert(random.randint(pickup + 1, len(stops)), Stop(point(), -1, random.randint(30, 120)))
+            if not stops:
+                continue
+
+            since = random.choice([0, 3])
+            route = Route(Car(1, vehicle=Vehicle.of('van', 3)), point(), since, onboard, stops, metric)
+            # only routes which meet their deadlines as they are
+            if any(
+                stop.deadline is not None and arrival > stop.deadline for (stop, arrival) in zip(stops, route.arrivals)
+            ):
+                continue
+
+            (src, dst) = (point(), point())
+            current_time = random.choice([0, 2, 3])
+            passengers = random.randint(1, 2)
+            max_pickup_time = random.choice([inf, 30])
+
+            insertion = route.best_insertion(src, dst, passengers, current_time, max_pickup_time, 7, metric)
+            expected = self.brute_force(route, src, dst, passengers, current_time, max_pickup_time, 7, metric)
+            assert (insertion and insertion.cost) == pytest.approx(expected)
+            compared += expected is not None
+
+        assert compared > 200
+
+    def test_simulation_keeps_promises(self, monkeypatch):
+        random.seed(24)
+        monkeypatch.setattr(settings, 'pool_max_detour', 8)
+
+        taxi_park = TaxiPark(Time(), index=GridIndex(cell_size=10), pool_rides=True)
+        for car_id in range(1, 11):
+            taxi_park.add_car(Car(car_id, location=Point(random.randint(-30, 30), random.randint(-30, 30))))
+
+        pooled = 0
+        for i in range(500):
+            src = Point(random.randint(-30, 30), random.randint(-30, 30))
+            dst = Point(random.randint(-30, 30), random.randint(-30, 30))
+            closest = taxi_park.find_closest(src)
+
+            booking = taxi_park.book_closest(src, dst, Requirements.of(passengers=random.choice([None, 2])))
+            if booking and closest:
+                # nobody gets there more than 2 * max_detour later than with the closest free car
+                assert booking[1] <= closest[1] + src.distance(dst) + 2 * 8
+
+            for route in taxi_park._pool._routes.values():
+                car = route.car
+                pooled += len(route.stops) > 1
+                assert car.booked_until == ceil(route.end)
+                assert car.location == route.stops[-1].location
+                assert all(
+                    stop.deadline is None or arrival <= stop.deadline
+                    for (stop, arrival) in zip(route.stops, route.arrivals)
+                )
+                seats = route.onboard
+                for stop in route.stops:
+                    seats += stop.passengers
+                    assert 0 <= seats <= car.vehicle.capacity
+
+            if i % 3 == 0:
+                taxi_park.fast_forward(random.randint(1, 5))
+
+        assert pooled
+
+
+class TestJourney:
+    @pytest.fixture(params=['objects', 'arrays', 'sharded'])
+    def taxi_park(self, request):
+        taxi_park = create_taxi_park(Time(), request.param)
+        taxi_park.populate_with_n_cars(2)
+        return taxi_park
+
+    def test_position_along_the_route(self, taxi_park):
+        (car, _) = taxi_park.book_closest(Point(3, 1), Point(8, 6))  # busy until 4 + 10
+        assert taxi_park.position(car) == Point(0, 0)
+
+        # along x and then along y to the customer, and the same way to the destination
+        expected = [(2, 0), (3, 0), (3, 1), (4, 1), (8, 1), (8, 2), (8, 6), (8, 6)]
+        positions = []
+        for units in [2, 1, 1, 1, 4, 1, 4, 10]:
+            taxi_park.fast_forward(units)
+            position = taxi_park.position(taxi_park.cars[0])
+            positions.append((position.x, position.y))
+        assert positions == expected
+
+        assert taxi_park.cars[0].location == Point(8, 6)
+        assert taxi_park.position(taxi_park.cars[1]) == Point(0, 0)
+
+    def test_positions_of_fleet(self, taxi_park):
+        taxi_park.book_closest(Point(-3, 0), Point(-3, -4))
+        taxi_park.book_closest(Point(0, 2), Point(5, 2))
+        taxi_park.fast_forward(4)
+
+        (ids, xs, ys) = taxi_park.positions()
+        assert (ids.tolist(), xs.tolist(), ys.tolist()) == ([1, 2], [-3, 2], [-1, 2])
+
+        taxi_park.reset()
+        (ids, xs, ys) = taxi_park.positions()
+        assert (ids.tolist(), xs.tolist(), ys.tolist()) == ([1, 2], [0, 0], [0, 0])
+        assert taxi_park.position(taxi_park.cars[1]) == Point(0, 0)
+
+    @pytest.mark.parametrize('metric', [Manhattan(), Chebyshev(), Euclidean(), Weighted(2, 3)], ids=repr)
+    def test_progress(self, metric):
+        for (dx, dy) in [(0, 0), (7, 0), (0, 5), (7, 5), (3, 11)]:
+            dist = metric.measure(dx, dy)
+            assert metric.progress(dx, dy, 0) == (0, 0)
+            assert metric.progress(dx, dy, dist) == (dx, dy)
+            assert metric.progress(dx, dy, dist + 10) == (dx, dy)
+
+            # the car never gets further from the start on the way (and not beyond the end)
+            steps = [metric.progress(dx, dy, travelled) for travelled in range(ceil(dist) + 1)]
+            assert all(a[0] <= b[0] and a[1] <= b[1] for (a, b) in zip(steps, steps[1:]))
+            # and it takes exactly the time of the trip to get anywhere along it
+            assert all(metric.measure(*step) <= travelled + settings.eps for (travelled, step) in enumerate(steps))
+
+        assert Manhattan().progress(7, 5, 9) == (7, 2)
+        assert Chebyshev().progress(7, 5, 6) == (6, 5)
+        assert Euclidean().progress(6, 8, 5) == (3, 4)
+        assert Weighted(2, 3).progress(7, 5, 17) == (7, 1)
+
+    def test_queued_trip(self):
+        taxi_park = TaxiPark(Time(), future_dispatch=True)
+        taxi_park.add_car(Car(1, location=Point(0, 0)))
+
+        (car, _) = taxi_park.book_closest(Point(0, 0), Point(10, 0))
+        taxi_park.fast_forward(2)
+        # the car sets off from the first drop-off once it's there (at 10)
+        taxi_park.book_closest(Point(10, 3), Point(0, 3))
+
+        positions = []
+        for units in [0, 7, 1, 1, 7, 100]:
+            taxi_park.fast_forward(units)
+            positions.append(taxi_park.position(car))
+        assert positions == [Point(2, 0), Point(9, 0), Point(10, 0), Point(10, 1), Point(5, 3), Point(0, 3)]
+
+        # once the car is on the queued trip, the first one is forgotten on the next booking
+        taxi_park.reset()
+        (car, _) = taxi_park.book_closest(Point(0, 0), Point(4, 0))
+        taxi_park.book_closest(Point(4, 0), Point(8, 0))
+        taxi_park.fast_forward(5)
+        taxi_park.book_closest(Point(8, 0), Point(9, 0))
+        assert car.journey.previous.previous is None
+        assert taxi_park.position(car) == Point(5, 0)
+
+    def test_pooled_car(self, monkeypatch):
+        monkeypatch.setattr(settings, 'pool_max_detour', 10)
+        taxi_park = TaxiPark(Time(), pool_rides=True)
+        taxi_park.add_car(Car(1, location=Point(-2, 0)))
+
+        (car, _) = taxi_park.book_closest(Point(0, 0), Point(10, 0))
+        taxi_park.fast_forward(1)
+        taxi_park.book_closest(Point(4, 0), Point(6, 4))
+
+        positions = []
+        for units in [0, 1, 4, 6, 4, 4, 100]:
+            taxi_park.fast_forward(units)
+            positions.append(taxi_park.position(car))
+        # to the first customer, to the second one, to the destination of the second one and then of the first one
+        assert positions == [Point(-1, 0), Point(0, 0), Point(4, 0), Point(6, 4), Point(10, 4), Point(10, 0), Point(10, 0)]
+
+    @pytest.mark.parametrize('metric', [Manhattan(), Chebyshev(), Euclidean(), Weighted(2, 3)], ids=repr)
+    def test_vectorized_same_as_one_by_one(self, metric):
+        random.seed(23)
+
+        parks = [
+            TaxiPark(Time(), index=LinearIndex(metric), future_dispatch=True),
+            ArrayTaxiPark(Time(), metric=metric, future_dispatch=True),
+        ]
+        for car_id in range(1, 21):
+            (x, y) = (random.randint(-40, 40), random.randint(-40, 40))
+            for taxi_park in parks:
+                taxi_park.add_car(Car(car_id, location=Point(x, y)))
+
+        for i in range(300):
+            src = Point(random.randint(-50, 50), random.randint(-50, 50))
+            dst = Point(random.randint(-50, 50), random.randint(-50, 50))
+            [taxi_park.book_closest(src, dst) for taxi_park in parks]
+
+            if i % 2 == 0:
+                units = random.randint(0, 20)
+                [taxi_park.fast_forward(units) for taxi_park in parks]
+
+            (objects, arrays) = [taxi_park.positions() for taxi_park in parks]
+            one_by_one = [parks[1].position(car) for car in parks[1].cars]
+            assert [array.tolist() for array in arrays] == [array.tolist() for array in objects]
+            assert arrays[1].tolist() == [position.x for position in one_by_one]
+            assert arrays[2].tolist() == [position.y for position in one_by_one]
+
+            if i == 150:
+                [taxi_park.reset() for taxi_park in parks]
+
+    def test_ticks_dont_move_cars(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(3)
+        (car, _) = taxi_park.book_closest(Point(3, 1), Point(8, 6))
+        journey = car.journey
+
+        taxi_park.fast_forward(5)
+        assert (car.journey, car.location) == (journey, Point(8, 6))
+        assert taxi_park.position(car) == Point(4, 1)
+
+
+class TestDemand:
+    def test_decay(self):
+        demand = DemandMap(tile_size=100, half_life=60, max_tiles=16)
+        demand.record(Point(10, 10), 0)
+        demand.record(Point(99, 0), 60)
+        demand.record(Point(-1, 0), 60)
+
+        assert demand.weights(60) == {(0, 0): 1.5, (-1, 0): 1.0}
+        assert demand.weights(120) == {(0, 0): 0.75, (-1, 0): 0.5}
+        assert demand.top(1, 120) == [((0, 0), 0.75)]
+        assert demand.center((-1, 0)) == Point(-50, 50)
+
+    def test_rebase(self):
+        demand = DemandMap(tile_size=10, half_life=1, max_tiles=16)
+        demand.record(Point(0, 0), 0)
+        demand.record(Point(10, 0), 100)  # 2 ** 100 is too much, so weights are rebased to 100
+
+        assert demand.weights(100) == {(0, 0): 2.0 ** -100, (1, 0): 1.0}
+        assert demand.weights(101) == {(0, 0): 2.0 ** -101, (1, 0): 0.5}
+
+    def test_bounded(self):
+        demand = DemandMap(tile_size=1, half_life=1000, max_tiles=8)
+        for x in range(100):
+            demand.record(Point(x, 0), 0, weight=x)
+            assert len(demand) <= 8
+
+        # the heaviest tiles are kept
+        assert [tile for (tile, _) in demand.top(4, 0)] == [(99, 0), (98, 0), (97, 0), (96, 0)]
+
+        demand.clear()
+        assert demand.weights(0) == {}
+
+    def test_wrong_parameters(self):
+        with pytest.raises(ValueError):
+            DemandMap(tile_size=0, half_life=1, max_tiles=8)
+        with pytest.raises(ValueError):
+            DemandMap(tile_size=1, half_life=0, max_tiles=8)
+
+
+class TestRebalancing:
+    @pytest.fixture(params=['objects', 'arrays', 'sharded'])
+    def taxi_park(self, request):
+        taxi_park = create_taxi_park(Time(), request.param)
+        taxi_park.populate_with_n_cars(4)
+        return taxi_park
+
+    @staticmethod
+    def rebalancer(**kwargs):
+        return Rebalancer(DemandMap(tile_size=100, half_life=600, max_tiles=64), **kwargs)
+
+    def test_apportion(self):
+        assert apportion(10, {'a': 2, 'b': 1}) == {'a': 7, 'b': 3}
+        assert apportion(2, {'a': 1, 'b': 1, 'c': 1}) == {'a': 1, 'b': 1}
+        assert apportion(0, {'a': 1}) == apportion(5, {}) == {}
+
+    def test_moves_toward_demand(self, taxi_park):
+        rebalancer = self.rebalancer(interval=0, max_moves=3)
+        for _ in range(3):
+            rebalancer.record(Point(560, 540), 0)
+
+        moves = rebalancer.plan(taxi_park)
+        assert [(move.car.car_id, move.target, move.distance) for move in moves] == [
+            (1, Point(550, 550), 1100), (2, Point(550, 550), 1100), (3, Point(550, 550), 1100),
+        ]
+        assert taxi_park.busy_count == 0  # nothing is moved by planning
+
+        assert rebalancer.apply(taxi_park, moves) == moves
+        assert taxi_park.busy_count == 3
+        assert taxi_park.position(taxi_park.cars[0]) == Point(0, 0)
+
+        # cars on the way count, so only the one left is sent
+        moves = rebalancer.plan(taxi_park)
+        assert [(move.car.car_id, move.target) for move in moves] == [(4, Point(550, 550))]
+
+        taxi_park.fast_forward(1100)
+        assert sorted(car.location.x for car in taxi_park.free_cars()) == [0, 550, 550, 550]
+        assert rebalancer.moved == 3
+
+    def test_cars_with_demand_stay(self, taxi_park):
+        rebalancer = self.rebalancer(interval=0)
+        rebalancer.record(Point(0, 0), 0)
+        rebalancer.record(Point(550, 550), 0)
+
+        # the other tile lacks cars, but the cars at the origin have demand around them
+        assert rebalancer.plan(taxi_park) == []
+
+        rebalancer.record(Point(550, 550), 0)
+        rebalancer.record(Point(550, 550), 0)
+        assert rebalancer.plan(taxi_park) == []
+
+    def test_booked_cars_stay(self, taxi_park):
+        rebalancer = self.rebalancer(interval=0)
+        rebalancer.record(Point(550, 550), 0)
+
+        moves = rebalancer.plan(taxi_park)
+        assert len(moves) == 4
+
+        taxi_park.book_closest(Point(0, 0), Point(0, 1))
+        assert [move.car.car_id for move in rebalancer.apply(taxi_park, moves)] == [2, 3, 4]
+
+    def test_smallest_total_distance(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.add_car(Car(1, location=Point(15, 5)))
+        taxi_park.add_car(Car(2, location=Point(-100, 5)))
+
+        rebalancer = Rebalancer(DemandMap(tile_size=10, half_life=600, max_tiles=64), interval=0)
+        rebalancer.record(Point(5, 5), 0)
+        rebalancer.record(Point(25, 5), 0)
+
+        # the closest car to the first tile would leave the other tile with the far one (10 + 125)
+        moves = rebalancer.plan(taxi_park)
+        assert [(move.car.car_id, move.target, move.distance) for move in moves] == [
+            (2, Point(5, 5), 105), (1, Point(25, 5), 10),
+        ]
+
+    def test_tick(self, taxi_park):
+        rebalancer = self.rebalancer(interval=10, max_moves=1)
+        rebalancer.record(Point(550, 550), 0)
+
+        assert len(rebalancer.tick(taxi_park)) == 1
+        taxi_park.fast_forward(5)
+        assert rebalancer.tick(taxi_park) == []
+        taxi_park.fast_forward(5)
+        assert len(rebalancer.tick(taxi_park)) == 1
+
+        rebalancer.reset()
+        assert rebalancer.tick(taxi_park) == []
+        assert rebalancer.moved == 2
+
+    @pytest.mark.parametrize('fleet_store', ['objects', 'sharded'])
+    def test_plan_after_reset(self, fleet_store):
+        taxi_park = create_taxi_park(Time(), fleet_store)
+        taxi_park.populate_with_n_cars(100000)
+        taxi_park.book_closest(Point(0, 0), Point(10, 0))
+        taxi_park.reset()
+
+        rebalancer = self.rebalancer(interval=0, max_moves=2)
+        rebalancer.record(Point(550, 550), 0)
+
+        # untouched cars are free at the origin, and only the few which can be moved are touched
+        moves = rebalancer.plan(taxi_park)
+        assert [(move.car.car_id, move.car.location, move.distance) for move in moves] == [
+            (1, ORIGIN, 1100), (2, ORIGIN, 1100),
+        ]
+        assert taxi_park._cars._missing >= 100000 - CANDIDATES_PER_SLOT * 2
+        assert taxi_park._generation.first_untouched().car_id == CANDIDATES_PER_SLOT * 2 + 1
+
+    def test_simulate(self, tmp_path):
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(2)
+        rebalancer = self.rebalancer(interval=10)
+        utilisation = simulate.Utilisation()
+        (moves, bookings) = (list(metrics.REBALANCING_MOVES.samples())[0][2], metrics.BOOKINGS_SUCCEEDED.value)
+
+        events = [('book', 550, 550, 0, 0), ('tick', 10), ('tick', 1100), ('book', 550, 550, 560, 550)]
+        assignments = list(simulate.simulate(taxi_park, events, utilisation, rebalancer=rebalancer))
+
+        # car 2 went to the demand after the first tick, so the next customer there doesn't wait for it
+        assert assignments == [(1, 0, 1, 1100 + 1100), (4, 1110, 2, 0 + 10)]
+        assert rebalancer.moved == 1
+
+        # the move isn't a booking or a trip, but the car is busy while it drives
+        assert list(metrics.REBALANCING_MOVES.samples())[0][2] == moves + 1
+        assert metrics.BOOKINGS_SUCCEEDED.value == bookings + 2
+        assert (utilisation.trips, utilisation.busy) == ({1: 1, 2: 1}, {1: 2200, 2: 1100 + 10})
+
+        log = str(tmp_path / 'events.bin')
+        simulate.write_binary(log, events)
+        args = argparse.Namespace(
+            log=log, cars=2, fleet_store='objects', assignments=None, utilisation=None, rebalance_every=10,
+        )
+        assert 'moves' in simulate.run(args)
+
+
+class TestArrayTaxiPark:
+    def test_populating_with_n_cars(self):
+        taxi_park = ArrayTaxiPark(Time())
+        taxi_park.populate_with_n_cars(20)
+
+        assert len(taxi_park.cars) == 20
+        assert [car.car_id for car in taxi_park.cars] == list(range(1, 21))
+        assert taxi_park.cars[-1].location == Location(x=0, y=0)
+        assert not taxi_park.cars[0].booked_until
+
+    def test_try_adding_not_a_car(self):
+        taxi_park = ArrayTaxiPark(Time())
+
+        with pytest.raises(TypeError):
+            taxi_park.add_car('car 1')
+
+    def test_find_closest_same_distance_unsorted(self):
+        taxi_park = ArrayTaxiPark(Time())
+
+        taxi_park.add_car(Car(car_id=3, location=Location(x=6, y=4)))
+        taxi_park.add_car(Car(car_id=2, location=Location(x=5, y=5)))
+        taxi_park.add_car(Car(car_id=1, location=Location(x=3, y=3)))
+
+        (closest_car, min_dist) = taxi_park.find_closest(Location(x=4, y=4))
+
+        assert closest_car.car_id == 1
+        assert min_dist == 2
+
+    def test_find_closest_no_available(self):
+        taxi_park = ArrayTaxiPark(Time(20))
+        taxi_park.populate_with_n_cars(3)
+
+        for car in taxi_park.cars:
+            car.booked_until = 42
+
+        assert not taxi_park.find_closest(Location(x=5, y=5))
+        assert not ArrayTaxiPark(Time()).find_closest(Location(x=5, y=5))
+
+    def test_book_and_reset(self):
+        taxi_park = ArrayTaxiPark(Time())
+        taxi_park.populate_with_n_cars(2)
+
+        (car, total_time) = taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+        assert car.car_id == 1
+        assert total_time == 2
+        assert car.to_dict() == {'car_id': 1, 'location': {'x': 1, 'y': 1}, 'booked_until': 2}
+        assert (taxi_park.free_count, taxi_park.busy_count) == (1, 1)
+
+        taxi_park.reset()
+
+        assert taxi_park.cars[0].to_dict() == Car(car_id=1).to_dict()
+        assert (taxi_park.free_count, taxi_park.busy_count) == (2, 0)
+
+    def test_booked_until_zero(self):
+        # a trip of no length booked at time 0 ends at 0, the same as in the objects store
+        for fleet_store in ('objects', 'arrays'):
+            taxi_park = create_taxi_park(Time(), fleet_store)
+            taxi_park.populate_with_n_cars(1)
+            taxi_park.book_closest(Location(x=0, y=0), Location(x=0, y=0))
+            assert taxi_park.cars[0].to_dict() == {'car_id': 1, 'location': {'x': 0, 'y': 0}, 'booked_until': 0}
+
+        taxi_park = ArrayTaxiPark(Time())
+        taxi_park.add_car(Car(car_id=1))
+        taxi_park.cars[0].booked_until = 0
+        assert taxi_park.cars[0].booked_until == 0
+
+    def test_busy_count_kept_up(self):
+        random.seed(11)
+
+        time = Time()
+        taxi_park = ArrayTaxiPark(time, future_dispatch=True)
+        taxi_park.populate_with_n_cars(5)
+
+        for _ in range(100):
+            src = Location(x=random.randint(-10, 10), y=random.randint(-10, 10))
+            dst = Location(x=random.randint(-10, 10), y=random.randint(-10, 10))
+            taxi_park.book_closest(src, dst)
+            time.tick(random.randint(0, 3))
+
+            # busy cars booked for the next trips (future dispatch) are counted once
+            busy = sum(not car.free_now(time.time) for car in taxi_park.cars)
+            assert (taxi_park.free_count, taxi_park.busy_count) == (5 - busy, busy)
+
+    def test_same_as_objects(self):
+        random.seed(73)
+
+        time = Time()
+        taxi_park = TaxiPark(time)
+        array_taxi_park = ArrayTaxiPark(time, capacity=1)
+
+        for car_id in random.sample(range(1, 1000), 100):
+            location = Location(x=random.randint(-30, 30), y=random.randint(-30, 30))
+            taxi_park.add_car(Car(car_id=car_id, location=location))
+            array_taxi_park.add_car(Car(car_id=car_id, location=location))
+
+        for _ in range(200):
+            src = Location(x=random.randint(-50, 50), y=random.randint(-50, 50))
+            dst = Location(x=random.randint(-50, 50), y=random.randint(-50, 50))
+
+            booking = taxi_park.book_closest(src, dst)
+            array_booking = array_taxi_park.book_closest(src, dst)
+
+            if booking is None:
+                assert array_booking is None
+            else:
+                assert booking[0].to_dict() == array_booking[0].to_dict()
+                assert booking[1] == array_booking[1]
+
+            time.tick(random.randint(0, 5))
+
+    def test_unknown_fleet_store(self):
+        with pytest.raises(ValueError):
+            create_taxi_park(Time(), 'database')
+
+        assert isinstance(create_taxi_park(Time(), 'arrays'), ArrayTaxiPark)
+
+
+class TestDispatch:
+    def test_hungarian_same_as_brute_force(self):
+        random.seed(7)
+
+        for (rows, columns) in [(1, 1), (3, 3), (3, 5), (5, 3), (4, 6)]:
+            cost = [[random.randint(0, 20) for _ in range(columns)] for _ in range(rows)]
+
+            assignment = hungarian(cost)
+            assert len(assignment) == min(rows, columns)
+            assert len({j for (_, j) in assignment}) == len(assignment)
+
+            if rows <= columns:
+                best = min(
+                    sum(cost[i][j] for (i, j) in enumerate(perm))
+                    for perm in itertools.permutations(range(columns), rows)
+                )
+            else:
+                best = min(
+                    sum(cost[i][j] for (j, i) in enumerate(perm))
+                    for perm in itertools.permutations(range(rows), columns)
+                )
+
+            assert sum(cost[i][j] for (i, j) in assignment) == best
+
+    def test_hungarian_empty(self):
+        assert hungarian([]) == []
+
+    def make_park(self):
+        taxi_park = TaxiPark(Time())
+        taxi_park.add_car(Car(car_id=1, location=Location(x=0, y=0)))
+        taxi_park.add_car(Car(car_id=2, location=Location(x=10, y=0)))
+
+        return taxi_park
+
+    def test_sequential_same_as_book_closest(self):
+        trips = [
+            (Location(x=1, y=0), Location(x=1, y=1)),
+            (Location(x=-5, y=0), Location(x=-5, y=5)),
+            (Location(x=3, y=3), Location(x=4, y=4)),
+        ]
+
+        bookings = book_batch(self.make_park(), trips)
+
+        taxi_park = self.make_park()
+        expected = [taxi_park.book_closest(src, dst) for (src, dst) in trips]
+
+        assert [(car.car_id, total_time) for (car, total_time) in bookings[:2]] == \
+            [(car.car_id, total_time) for (car, total_time) in expected[:2]] == [(1, 2), (2, 20)]
+        assert bookings[2] is None and expected[2] is None
+
+    def test_optimal(self):
+        trips = [
+            (Location(x=1, y=0), Location(x=1, y=1)),
+            (Location(x=-5, y=0), Location(x=-5, y=5)),
+            (Location(x=3, y=3), Location(x=4, y=4)),
+        ]
+
+        taxi_park = self.make_park()
+        bookings = book_batch(taxi_park, trips[:2], optimal=True)
+
+        # total pickup distance is 9 + 5 instead of 1 + 15 in the sequential mode
+        assert [(car.car_id, total_time) for (car, total_time) in bookings] == [(2, 9 + 1), (1, 5 + 5)]
+        assert (taxi_park.free_count, taxi_park.busy_count) == (0, 2)
+
+    def test_optimal_not_enough_cars(self):
+        trips = [
+            (Location(x=1, y=0), Location(x=1, y=1)),
+            (Location(x=-5, y=0), Location(x=-5, y=5)),
+            (Location(x=3, y=3), Location(x=4, y=4)),
+        ]
+
+        bookings = book_batch(self.make_park(), trips, optimal=True)
+
+        # cars go to the trips with the smallest total pickup distance (1 + 10)
+        assert (bookings[0][0].car_id, bookings[0][1]) == (1, 1 + 1)
+        assert bookings[1] is None
+        assert (bookings[2][0].car_id, bookings[2][1]) == (2, 10 + 2)
+
+    def test_optimal_arrays(self):
+        taxi_park = ArrayTaxiPark(Time())
+        taxi_park.add_car(Car(car_id=1, location=Location(x=0, y=0)))
+        taxi_park.add_car(Car(car_id=2, location=Location(x=10, y=0)))
+
+        trips = [
+            (Location(x=1, y=0), Location(x=1, y=1)),
+            (Location(x=-5, y=0), Location(x=-5, y=5)),
+        ]
+        bookings = book_batch(taxi_park, trips, optimal=True)
+
+        assert [(car.car_id, total_time) for (car, total_time) in bookings] == [(2, 9 + 1), (1, 5 + 5)]
+
+
+class TestFastPath:
+    def test_parse_trip(self):
+        (src, dst, requirements) = parse_trip(b'{"source": {"x": 3, "y": 1}, "destination": {"x": -8, "y": 6.7}}')
+
+        assert src == Location(x=3, y=1)
+        assert dst == Location(x=-8, y=6)
+        assert requirements is None
+
+    def test_parse_requirements(self):
+        (_, _, requirements) = parse_trip(
+            b'{"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}, "passengers": 5.5, "vehicle_type": "van"}'
+        )
+        assert requirements == Requirements(passengers=5, vehicle_type='van')
+
+        for extra in [b'"passengers": 0', b'"passengers": 0.5', b'"passengers": "0"', b'"vehicle_type": "bus"']:
+            with pytest.raises(ValueError):
+                parse_trip(b'{"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}, ' + extra + b'}')
+
+    def test_parse_wrong_trip(self):
+        for body in [
+            b'', b'[]', b'{"source": {"x": 3, "y": 1}}', b'{"source": {"x": 3}, "destination": {"x": 8, "y": 6}}',
+        ]:
+            with pytest.raises(ValueError):
+                parse_trip(body)
+
+    def test_parse_out_of_grid(self):
+        with pytest.raises(ValueError):
+            parse_trip(b'{"source": {"x": 2147483648, "y": 1}, "destination": {"x": 8, "y": 6}}')
+
+        with pytest.raises(ValueError):
+            parse_trip(b'{"source": {"x": "2147483648", "y": 1}, "destination": {"x": 8, "y": 6}}')
+
+    @pytest.mark.parametrize('value', [
+        '3', '-3', ' 4 ', '3.5', '1e3', 3.7, -0.5, True, False, None, [1], {}, 2 ** 31, 1e400, 'x',
+    ], ids=repr)
+    def test_same_as_model(self, value):
+        # the fast path accepts (and casts) exactly the same payloads as Trip model, wherever the value goes
+        for (key, payload) in [
+            ('x', {'source': {'x': value, 'y': 1}, 'destination': {'x': 8, 'y': 6}}),
+            ('passengers', {'source': {'x': 3, 'y': 1}, 'destination': {'x': 8, 'y': 6}, 'passengers': value}),
+            ('vehicle_type', {'source': {'x': 3, 'y': 1}, 'destination': {'x': 8, 'y': 6}, 'vehicle_type': value}),
+        ]:
+            body = json.dumps(payload).encode()
+            try:
+                trip = Trip.parse_raw(body)
+            except pydantic.ValidationError:
+                with pytest.raises(ValueError):
+                    parse_trip(body)
+                continue
+
+            assert parse_trip(body) == (trip.source, trip.destination, trip.requirements()), key
+
+    def test_parse_infinite(self, monkeypatch):
+        # the standard library (used when orjson isn't installed) decodes these into infinite floats
+        monkeypatch.setattr(fastpath, 'loads', json.loads)
+
+        for value in [b'Infinity', b'-Infinity', b'NaN', b'1e400']:
+            with pytest.raises(ValueError):
+                parse_trip(b'{"source": {"x": ' + value + b', "y": 1}, "destination": {"x": 8, "y": 6}}')
+
+            with pytest.raises(ValueError):
+                parse_trip(b'{"source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}, "passengers": ' + value + b'}')
+
+    def test_encode_booking(self):
+        assert json.loads(encode_booking((Car(car_id=3), 42))) == {'car_id': 3, 'total_time': 42}
+        assert json.loads(encode_booking(None)) == \
+            {"status": "failed", "message": "No free cars available right now, please wait..."}
+
+    def test_location_out_of_grid(self):
+        with pytest.raises(pydantic.error_wrappers.ValidationError):
+            Location(x=-2 ** 31 - 1, y=0)
+
+
+class TestMetrics:
+    def test_counter(self):
+        counter = metrics.Counter('test_events', 'Events', labelnames=('result', ))
+        counter.labels('ok').inc()
+        counter.labels('ok').inc(2)
+        counter.labels('failed').inc()
+
+        assert counter.render() == '\n'.join([
+            '# HELP test_events Events',
+            '# TYPE test_events counter',
+            'test_events_total{result="ok"} 3',
+            'test_events_total{result="failed"} 1',
+        ])
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Latency', buckets=(1, 5))
+        for value in [0.5, 1, 3, 10]:
+            histogram.observe(value)
+
+        assert list(histogram.samples()) == [
+            ('test_seconds_bucket', '{le="1"}', 2),
+            ('test_seconds_bucket', '{le="5"}', 3),
+            ('test_seconds_bucket', '{le="+Inf"}', 4),
+            ('test_seconds_sum', '', 14.5),
+            ('test_seconds_count', '', 4),
+        ]
+
+    def test_timed(self):
+        histogram = metrics.Histogram('test_seconds', 'Latency')
+
+        @metrics.timed(histogram)
+        def add(a, b):
+            return a + b
+
+        assert add(1, b=2) == 3
+        assert list(histogram.samples())[-1] == ('test_seconds_count', '', 1)
+
+    def test_updates_from_threads(self, monkeypatch):
+        # as with concurrent booking
+        monkeypatch.setattr(metrics, '_lock', threading.Lock())
+        counter = metrics.Counter('test_events', 'Events')
+        histogram = metrics.Histogram('test_seconds', 'Latency', buckets=(1, 5))
+
+        def update(_):
+            for _ in range(10000):
+                counter.inc()
+                histogram.observe(3)
+
+        # threads switch as often as possible (unguarded `+=` can lose updates, e.g. on free-threaded builds)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(4) as executor:
+                list(executor.map(update, range(4)))
+        finally:
+            sys.setswitchinterval(interval)
+
+        assert counter.render().endswith('test_events_total 40000')
+        assert list(histogram.samples())[-2:] == [('test_seconds_sum', '', 120000), ('test_seconds_count', '', 40000)]
+
+    # the object park looks for the closest free car as a part of the search (and the arrays one doesn't)
+    @pytest.mark.parametrize('store, closest_searches', [('objects', 1), ('arrays', 0)])
+    def test_find_soonest_timed(self, store, closest_searches):
+        def count(histogram):
+            return list(histogram.samples())[-1][2]
+
+        (closest, soonest) = (count(metrics.FIND_CLOSEST_SECONDS), count(metrics.FIND_SOONEST_SECONDS))
+
+        taxi_park = create_taxi_park(Time(), store, future_dispatch=True)
+        taxi_park.populate_with_n_cars(1)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+
+        assert count(metrics.FIND_SOONEST_SECONDS) == soonest + 1
+        assert count(metrics.FIND_CLOSEST_SECONDS) == closest + closest_searches
+
+    def test_scanned_cars(self):
+        for index in [LinearIndex(), GridIndex(cell_size=10)]:
+            taxi_park = TaxiPark(Time(), index=index)
+            for (car_id, x) in enumerate([0, 1, 1000, 1001], start=1):
+                taxi_park.add_car(Car(car_id, location=Location(x=x, y=0)))
+
+            taxi_park.find_closest(Location(x=0, y=0))
+            # grid index doesn't have to look at the far away cars at all
+            assert index.scanned == (4 if isinstance(index, LinearIndex) else 1)
+
+    def test_bookings_counted(self):
+        (succeeded, failed) = (metrics.BOOKINGS_SUCCEEDED.value, metrics.BOOKINGS_FAILED.value)
+
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(1)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=1, y=1))
+
+        assert metrics.BOOKINGS_SUCCEEDED.value == succeeded + 1
+        assert metrics.BOOKINGS_FAILED.value == failed + 1
+
+
+@pytest.fixture()
+def fleet_socket(tmp_path):
+    '''
+        Runs the fleet state process (with 3 cars) in a background thread
+    '''
+
+    path = str(tmp_path / 'fleet.sock')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(serve(path, FleetState(3)))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    deadline = timer.monotonic() + 5
+    while not (tmp_path / 'fleet.sock').exists() and timer.monotonic() < deadline:
+        timer.sleep(0.01)
+
+    yield path
+
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join()
+
+
+class TestFleetServer:
+    def test_execute(self):
+        state = FleetState(3)
+
+        assert state.execute(['book', 3, 1, 8, 6]) == ['ok', [1, 4 + 10]]
+        assert state.execute(['tick', 2]) == ['ok', 2]
+        assert state.execute(['counts']) == ['ok', [2, 1]]
+        assert state.execute(['fast_forward', 100, False]) == ['ok', [2, 102, [1]]]
+        assert state.execute(['fast_forward', 1, True]) == ['ok', [102, 102, []]]
+        assert state.execute(['time']) == ['ok', 102]
+        assert state.execute(['reset']) == ['ok', None]
+        assert state.execute(['counts']) == ['ok', [3, 0]]
+
+    def test_execute_wrong_command(self):
+        state = FleetState(3)
+
+        assert state.execute(['fly', 1])[0] == 'error'
+        assert state.execute(['tick', 1, 2])[0] == 'error'
+
+    def test_remote_park(self, fleet_socket):
+        (taxi_park, time) = connect(fleet_socket)
+
+        (car, total_time) = taxi_park.book_closest(Location(x=3, y=1), Location(x=8, y=6))
+        assert (car.car_id, total_time) == (1, 4 + 10)
+
+        assert time.tick() == 1
+        assert time.time == 1
+        assert (taxi_park.free_count, taxi_park.busy_count) == (2, 1)
+        assert taxi_park.cars[0].to_dict() == {'car_id': 1, 'location': {'x': 8, 'y': 6}, 'booked_until': 14}
+        assert taxi_park.position(taxi_park.cars[0]) == Point(1, 0)
+
+        bookings = taxi_park.book_batch([(Location(x=1, y=0), Location(x=1, y=1))] * 3)
+        assert [booking and booking[0].car_id for booking in bookings] == [2, 3, None]
+
+        assert taxi_park.find_nearest(Location(x=8, y=6), 2) == []
+
+        (started, current_time, released) = taxi_park.advance(2)
+        assert (started, current_time, [car.car_id for car in released]) == (1, 3, [2, 3])
+
+        taxi_park.reset()
+        assert taxi_park.busy_count == 0
+
+        nearest = taxi_park.find_nearest(Location(x=8, y=6), 2)
+        assert [(car.car_id, car.location, dist) for (car, dist) in nearest] == [(1, ORIGIN, 14), (2, ORIGIN, 14)]
+
+    def test_remote_cars(self, fleet_socket):
+        (taxi_park, _) = connect(fleet_socket)
+        cars = taxi_park.cars
+
+        assert len(cars) == 3
+        assert [car['car_id'] for car in cars] == [1, 2, 3]
+        assert [car['car_id'] for car in cars[1:]] == [2, 3]
+        assert cars[-1]['car_id'] == 3
+        with pytest.raises(IndexError):
+            cars[3]
+
+        # pages of the world are read the same way as from a local park
+        (states, next_cursor) = world.page(taxi_park, 0, cursor=1, limit=1)
+        assert (states, next_cursor) == ([{'car_id': 2, 'location': {'x': 0, 'y': 0}, 'booked_until': None}], 2)
+        assert world.page(taxi_park, 0, limit=1, positions=True)[0][0]['position'] == {'x': 0, 'y': 0}
+
+    def test_calls_from_threads(self, fleet_socket):
+        (taxi_park, _) = connect(fleet_socket)
+
+        # every thread gets the answer to its own command
+        with ThreadPoolExecutor(8) as executor:
+            nearest = list(executor.map(lambda k: len(taxi_park.find_nearest(Location(x=0, y=0), k)), [1, 2, 3] * 50))
+        assert nearest == [1, 2, 3] * 50
+
+    def test_shared_between_clients(self, fleet_socket):
+        (first, _) = connect(fleet_socket)
+        (second, _) = connect(fleet_socket)
+
+        # both clients see the same fleet, so no car is booked twice
+        car_ids = [park.book_closest(Location(x=0, y=0), Location(x=1, y=1))[0].car_id for park in [first, second, first]]
+        assert car_ids == [1, 2, 3]
+        assert second.book_closest(Location(x=0, y=0), Location(x=1, y=1)) is None
+
+
+class TestConcurrentTaxiPark:
+    def test_same_as_serial(self):
+        random.seed(7)
+        trips = [
+            (Location(x=random.randint(-20, 20), y=random.randint(-20, 20)),
+             Location(x=random.randint(-20, 20), y=random.randint(-20, 20)))
+            for _ in range(300)
+        ]
+
+        parks = [TaxiPark(Time(), index=GridIndex(cell_size=5)), ConcurrentTaxiPark(Time(), index=GridIndex(cell_size=5))]
+        results = []
+        for taxi_park in parks:
+            taxi_park.populate_with_n_cars(10)
+
+            bookings = []
+            for (i, (src, dst)) in enumerate(trips):
+                booking = taxi_park.book_closest(src, dst)
+                bookings.append(booking and (booking[0].car_id, booking[1]))
+                if i % 3 == 0:
+                    taxi_park.time.tick(7)
+
+            results.append(bookings)
+
+        assert results[0] == results[1]
+
+    def test_claim_after_closer_car_released(self):
+        taxi_park = ConcurrentTaxiPark(Time())
+        taxi_park.add_car(Car(car_id=1, location=Location(x=10, y=0)))
+        busy = Car(car_id=2, location=Location(x=1, y=0))
+        busy.booked_until = 5
+        taxi_park.add_car(busy)
+
+        src = Location(x=0, y=0)
+        version = taxi_park._version
+        (car, dist) = taxi_park.find_closest(src)
+        assert car.car_id == 1
+
+        # car 2 gets free between the search and the claim, so the search has to be repeated
+        taxi_park.time.tick(5)
+        assert not taxi_park._is_still_closest(src, car, dist, version)
+
+        (car, _) = taxi_park.book_closest(src, Location(x=0, y=1))
+        assert car.car_id == 2
+
+    def test_claim_after_car_taken(self):
+        taxi_park = ConcurrentTaxiPark(Time())
+        taxi_park.populate_with_n_cars(2)
+
+        src = Location(x=0, y=0)
+        version = taxi_park._version
+        (car, dist) = taxi_park.find_closest(src)
+
+        taxi_park.book_closest(src, Location(x=5, y=5))  # somebody else books car 1
+        assert not taxi_park._is_still_closest(src, car, dist, version)
+
+    def test_reentrant_write_lock(self):
+        lock = ReadWriteLock()
+
+        with lock.writing():
+            with lock.reading():
+                with lock.writing():
+                    pass
+
+        with lock.reading():
+            pass
+
+    @pytest.mark.parametrize('index', [LinearIndex, lambda: GridIndex(cell_size=10)])
+    def test_no_double_booking(self, index):
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(10 ** -6)  # switching threads as often as possible to provoke races
+
+        try:
+            taxi_park = ConcurrentTaxiPark(Time(), index=index())
+            random.seed(1)
+            for car_id in range(1, 301):
+                taxi_park.add_car(Car(car_id, location=Location(x=random.randint(-50, 50), y=random.randint(-50, 50))))
+
+            trips = [
+                (Location(x=random.randint(-50, 50), y=random.randint(-50, 50)), Location(x=0, y=0))
+                for _ in range(2000)
+            ]
+            with ThreadPoolExecutor(16) as executor:
+                bookings = list(executor.map(lambda trip: taxi_park.book_closest(*trip), trips))
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        car_ids = [car.car_id for (car, _) in filter(None, bookings)]
+        assert len(car_ids) == len(set(car_ids)) == 300
+        assert (taxi_park.free_count, taxi_park.busy_count, len(taxi_park.index)) == (0, 300, 0)
+
+
+class TestShardedTaxiPark:
+    @pytest.mark.parametrize('tile_size,threads', [(1, 0), (7, 0), (30, 4), (1000, 0)])
+    def test_same_as_taxi_park(self, tile_size, threads):
+        random.seed(tile_size)
+        locations = [Location(x=random.randint(-50, 50), y=random.randint(-50, 50)) for _ in range(40)]
+
+        parks = [TaxiPark(Time()), ShardedTaxiPark(Time(), tile_size=tile_size, threads=threads)]
+        for taxi_park in parks:
+            for (car_id, location) in enumerate(locations, start=1):
+                taxi_park.add_car(Car(car_id, location=location))
+
+        for i in range(500):
+            src = Location(x=random.randint(-60, 60), y=random.randint(-60, 60))
+            dst = Location(x=random.randint(-60, 60), y=random.randint(-60, 60))
+
+            bookings = [taxi_park.book_closest(src, dst) for taxi_park in parks]
+            assert [booking and (booking[0].car_id, booking[1]) for booking in bookings] == \
+                [bookings[0] and (bookings[0][0].car_id, bookings[0][1])] * 2
+
+            if i % 5 == 0:
+                units = random.randint(1, 60)
+                [taxi_park.time.tick(units) for taxi_park in parks]
+                assert parks[0].busy_count == parks[1].busy_count
+
+            if i == 250:
+                [taxi_park.reset() for taxi_park in parks]
+
+    def test_car_moves_between_shards(self):
+        taxi_park = ShardedTaxiPark(Time(), tile_size=10)
+        taxi_park.add_car(Car(1, location=Location(x=1, y=1)))
+
+        assert list(taxi_park._shards) == [(0, 0)]
+
+        taxi_park.book_closest(Location(x=2, y=2), Location(x=25, y=-5))
+
+        # the car waits for the end of the trip in the shard of the destination
+        assert list(taxi_park._shards) == [(2, -1)]
+        assert (taxi_park.free_count, taxi_park.busy_count) == (0, 1)
+        assert not taxi_park.find_closest(Location(x=25, y=-5))
+
+        taxi_park.time.tick(2 + 30)
+        (car, dist) = taxi_park.find_closest(Location(x=25, y=-5))
+        assert (car.car_id, dist) == (1, 0)
+
+    def test_far_away_shards(self):
+        taxi_park = ShardedTaxiPark(Time(), tile_size=10)
+        taxi_park.add_car(Car(2, location=Location(x=10 ** 9, y=0)))
+        taxi_park.add_car(Car(1, location=Location(x=0, y=10 ** 9)))
+
+        (car, dist) = taxi_park.find_closest(Location(x=0, y=0))
+        assert (car.car_id, dist) == (1, 10 ** 9)
+
+    def test_create_taxi_park(self):
+        assert isinstance(create_taxi_park(Time(), 'sharded'), ShardedTaxiPark)
+
+
+class TestSimulation:
+    EVENTS = [
+        {"op": "book", "source": {"x": 3, "y": 1}, "destination": {"x": 8, "y": 6}},
+        {"op": "book", "source": {"x": 1, "y": 0}, "destination": {"x": 1, "y": 1}},
+        {"op": "tick", "units": 2},
+        {"op": "book", "source": {"x": 1, "y": 1}, "destination": {"x": 1, "y": 2}},
+        {"op": "book", "source": {"x": 0, "y": 0}, "destination": {"x": 0, "y": 1}},
+        {"op": "tick"},
+        {"op": "reset"},
+        {"op": "book", "source": {"x": 0, "y": 0}, "destination": {"x": 0, "y": 5}},
+    ]
+
+    @pytest.fixture()
+    def log(self, tmp_path):
+        path = tmp_path / 'events.jsonl'
+        path.write_text(''.join(json.dumps(event) + '\n' for event in self.EVENTS))
+        return str(path)
+
+    def test_simulate(self, log):
+        taxi_park = TaxiPark(Time())
+        taxi_park.populate_with_n_cars(2)
+        utilisation = simulate.Utilisation()
+
+        assignments = list(simulate.simulate(taxi_park, simulate.read_log(log), utilisation))
+        assert assignments == [
+            (1, 0, 1, 4 + 10),
+            (2, 0, 2, 1 + 1),
+            (4, 2, 2, 0 + 1),
+            (5, 2, None, None),
+            (8, 3, 1, 0 + 5),
+        ]
+
+        utilisation.cut(taxi_park.time.time)
+        # trip of car 1 booked at 0 was cut by the reset at 3
+        assert list(utilisation.rows([1, 2], 3)) == [(1, 2, 3, 1.0), (2, 2, 3, 1.0)]
+
+    @pytest.mark.parametrize('taxi_park', [
+        lambda: TaxiPark(Time(), future_dispatch=True),
+        lambda: TaxiPark(Time(), pool_rides=True),
+    ], ids=['future_dispatch', 'pooling'])
+    def test_utilisation_of_busy_car(self, taxi_park):
+        taxi_park = taxi_park()
+        taxi_park.populate_with_n_cars(1)
+        utilisation = simulate.Utilisation()
+
+        # the second customer gets the busy car, which is busy 8 units in total (not 5 + 8)
+        events = [('book', 0, 0, 0, 5), ('book', 0, 5, 0, 8)]
+        assignments = list(simulate.simulate(taxi_park, events, utilisation))
+        assert [car_id for (_, _, car_id, _) in assignments] == [1, 1]
+
+        assert list(utilisation.rows([1], 8)) == [(1, 2, 8, 1.0)]
+
+    def test_binary_log(self, log, tmp_path):
+        path = str(tmp_path / 'events.bin')
+
+        assert simulate.write_binary(path, simulate.read_log(log)) == len(self.EVENTS)
+        assert list(simulate.read_log(path)) == list(simulate.read_log(log))
+
+    def test_binary_log_out_of_range(self, tmp_path):
+        with pytest.raises(ValueError):
+            simulate.write_binary(str(tmp_path / 'events.bin'), [('book', 2 ** 40, 0, 0, 0)])
+
+    def test_wrong_event(self, tmp_path):
+        path = tmp_path / 'events.jsonl'
+        path.write_text('{"op": "tick"}\n{"op": "fly"}\n')
+
+        with pytest.raises(ValueError, match='Line 2'):
+            list(simulate.read_log(str(path)))
+
+    def test_run(self, log, tmp_path):
+        args = argparse.Namespace(
+            log=log, cars=2, fleet_store='objects',
+            assignments=str(tmp_path / 'assignments.jsonl'), utilisation=str(tmp_path / 'cars.csv'),
+        )
+
+        summary = simulate.run(args)
+        assert (summary['bookings'], summary['booked'], summary['failed'], summary['time']) == (5, 4, 1, 3)
+
+        with open(args.assignments) as f:
+            assignments = [json.loads(line) for line in f]
+        assert assignments[3] == {'event': 5, 'time': 2, 'car_id': None, 'total_time': None}
+        assert len(assignments) == 5
+
+        with open(args.utilisation) as f:
+            assert f.read().splitlines() == ['car_id,trips,busy_time,utilisation', '1,2,3,1.0', '2,2,3,1.0']
+
+
+class TestWorld:
+    @pytest.fixture(params=['objects', 'arrays'])
+    def taxi_park(self, request):
+        taxi_park = create_taxi_park(Time(), request.param)
+        taxi_park.populate_with_n_cars(5)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))  # car 1 is busy until 10
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=-1, y=1))  # car 2 is busy until 4
+
+        return taxi_park
+
+    def test_page(self, taxi_park):
+        (cars, next_cursor) = world.page(taxi_park, 0)
+        assert [car['car_id'] for car in cars] == [1, 2, 3, 4, 5]
+        assert next_cursor is None
+
+        (cars, next_cursor) = world.page(taxi_park, 0, limit=2)
+        assert [car['car_id'] for car in cars] == [1, 2]
+        assert next_cursor == 2
+
+        (cars, next_cursor) = world.page(taxi_park, 0, cursor=next_cursor, limit=3)
+        assert [car['car_id'] for car in cars] == [3, 4, 5]
+        assert next_cursor is None
+
+    def test_filters(self, taxi_park):
+        (cars, _) = world.page(taxi_park, 0, status='busy')
+        assert [car['car_id'] for car in cars] == [1, 2]
+
+        (cars, _) = world.page(taxi_park, 4, status='free')
+        assert [car['car_id'] for car in cars] == [2, 3, 4, 5]
+
+        (cars, _) = world.page(taxi_park, 0, bbox=(-1, 1, None, None))
+        assert [car['car_id'] for car in cars] == [1, 2]
+
+        (cars, next_cursor) = world.page(taxi_park, 0, limit=1, status='free', bbox=(0, 0, 0, 0))
+        assert ([car['car_id'] for car in cars], next_cursor) == ([3], 3)
+
+    def test_chunks(self, taxi_park, monkeypatch):
+        monkeypatch.setattr(world, 'CHUNK_SIZE', 2)
+
+        chunks = list(world.scan(taxi_park, 0, status='free'))
+        assert [[position for (position, _) in chunk] for chunk in chunks] == [[], [3, 4], [5]]
+
+    def test_stream(self, taxi_park, monkeypatch):
+        monkeypatch.setattr(world, 'CHUNK_SIZE', 2)
+
+        async def collect():
+            return [chunk async for chunk in world.stream(taxi_park, 0, cursor=1)]
+
+        chunks = asyncio.new_event_loop().run_until_complete(collect())
+        lines = b''.join(chunks).splitlines()
+
+        assert len(chunks) == 2
+        assert [json.loads(line)['car_id'] for line in lines] == [2, 3, 4, 5]
+        assert json.loads(lines[0]) == {'car_id': 2, 'location': {'x': -1, 'y': 1}, 'booked_until': 4}
+
+    @pytest.mark.parametrize('fleet_store', ['objects', 'sharded', 'concurrent'])
+    def test_page_after_reset(self, fleet_store):
+        if fleet_store == 'concurrent':
+            taxi_park = ConcurrentTaxiPark(Time())
+        else:
+            taxi_park = create_taxi_park(Time(), fleet_store)
+        taxi_park.populate_with_n_cars(100000)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))
+        taxi_park.reset()
+
+        (cars, next_cursor) = world.page(taxi_park, 0, limit=2, positions=True)
+        assert cars == [
+            {'car_id': car_id, 'location': {'x': 0, 'y': 0}, 'booked_until': None, 'position': {'x': 0, 'y': 0}}
+            for car_id in (1, 2)
+        ]
+        assert next_cursor == 2
+
+        # the page is read without touching (resetting and indexing) the cars, and only the first chunk is created
+        assert taxi_park._cars[0].generation != taxi_park._generation.number
+        assert taxi_park._cars._missing == 100000 - world.CHUNK_SIZE
+        assert taxi_park._generation.first_untouched() is taxi_park._cars[0]
+
+
+class TestSnapshot:
+    @pytest.fixture(params=['objects', 'arrays', 'sharded'])
+    def fleet_store(self, request):
+        return request.param
+
+    @staticmethod
+    def busy_park(fleet_store):
+        time = Time()
+        taxi_park = create_taxi_park(time, fleet_store)
+        taxi_park.populate_with_n_cars(4)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=5, y=5))  # car 1 is busy until 11
+        time.tick(2)
+        taxi_park.book_closest(Location(x=1, y=0), Location(x=-1, y=1))  # car 2 is busy until 6
+
+        return taxi_park
+
+    def test_round_trip(self, fleet_store, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        taxi_park = self.busy_park(fleet_store)
+
+        assert snapshot.save(taxi_park, path) == 4
+
+        (restored, time) = snapshot.restore(path, fleet_store)
+        assert time.time == 2
+        assert [car.to_dict() for car in restored.cars] == [car.to_dict() for car in taxi_park.cars]
+        assert (restored.free_count, restored.busy_count) == (2, 2)
+
+        # restored park carries on exactly like the original one
+        assert [car.car_id for car in restored.fast_forward(until_free=True)] == [2]
+        assert restored.book_closest(Location(x=0, y=1), Location(x=0, y=0))[0].car_id == 2
+        assert [car.car_id for car in restored.fast_forward(100)] == [2, 1]
+        assert restored.busy_count == 0
+
+    def test_restore_into_another_store(self, fleet_store, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        taxi_park = self.busy_park(fleet_store)
+        snapshot.save(taxi_park, path)
+
+        for other in ('objects', 'arrays', 'sharded'):
+            (restored, _) = snapshot.restore(path, other)
+            assert [car.to_dict() for car in restored.cars] == [car.to_dict() for car in taxi_park.cars]
+
+    def test_after_reset(self, fleet_store, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        taxi_park = self.busy_park(fleet_store)
+        taxi_park.reset()
+        snapshot.save(taxi_park, path)
+
+        (restored, _) = snapshot.restore(path, fleet_store)
+        assert all(car.to_dict()['booked_until'] is None for car in restored.cars)
+        assert restored.book_closest(Location(x=1, y=0), Location(x=1, y=1))[0].car_id == 1
+
+    def test_empty(self, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        snapshot.save(TaxiPark(Time(5)), path)
+
+        (restored, time) = snapshot.restore(path, 'arrays')
+        assert (len(restored.cars), time.time) == (0, 5)
+        assert restored.find_closest(Location(x=0, y=0)) is None
+
+    def test_columns_are_mapped(self, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+        snapshot.save(self.busy_park('arrays'), path)
+
+        (restored, _) = snapshot.restore(path, 'arrays')
+        restored.reset()
+
+        # changes stay in memory, the snapshot itself is never written to
+        assert [car.location.x for car in snapshot.restore(path, 'arrays')[0].cars] == [5, -1, 0, 0]
+
+    def test_corrupted(self, tmp_path):
+        path = tmp_path / 'fleet.snap'
+        snapshot.save(self.busy_park('objects'), str(path))
+        data = bytearray(path.read_bytes())
+
+        data[-1] ^= 1
+        path.write_bytes(data)
+        with pytest.raises(ValueError, match='checksum'):
+            snapshot.load(str(path))
+
+        path.write_bytes(data[:-8])
+        with pytest.raises(ValueError, match='truncated'):
+            snapshot.load(str(path))
+
+    def test_wrong_format(self, tmp_path):
+        path = tmp_path / 'fleet.snap'
+
+        path.write_bytes(b'TAXI')
+        with pytest.raises(ValueError, match='too short'):
+            snapshot.load(str(path))
+
+        path.write_bytes(snapshot.HEADER.pack(b'TAXILOG1', 1, 0, 0, 0))
+        with pytest.raises(ValueError, match='not a snapshot'):
+            snapshot.load(str(path))
+
+        path.write_bytes(snapshot.HEADER.pack(snapshot.MAGIC, 99, 0, 0, 0))
+        with pytest.raises(ValueError, match='version 99'):
+            snapshot.load(str(path))
+
+    def test_fleet_state(self, tmp_path):
+        path = str(tmp_path / 'fleet.snap')
+
+        state = FleetState(3, path)
+        state.execute(['book', 3, 1, 8, 6])
+        state.execute(['tick', 2])
+        assert state.execute(['snapshot']) == ['ok', 3]
+
+        # the state process is restarted with the same fleet
+        restored = FleetState(3, path)
+        assert restored.execute(['time']) == ['ok', 2]
+        assert restored.execute(['counts']) == ['ok', [2, 1]]
+
+        assert FleetState(3).execute(['snapshot'])[0] == 'error'
+
+
+class TestWriteAheadLog:
+    @staticmethod
+    def run(coroutine):
+        return asyncio.new_event_loop().run_until_complete(coroutine)
+
+    @staticmethod
+    def new_park(fleet_store='objects'):
+        taxi_park = create_taxi_park(Time(), fleet_store)
+        taxi_park.populate_with_n_cars(5)
+        return taxi_park
+
+    @staticmethod
+    async def operate(taxi_park, log):
+        '''
+            Applies a few operations to the park, logging them the same way the routes do
+        '''
+
+        writer = asyncio.create_task(log.run())
+
+        (src, dst) = (Point(1, 0), Point(5, 5))
+        taxi_park.book_closest(src, dst)
+        acknowledged = [log.book(src, dst)]
+
+        taxi_park.fast_forward(3)
+        acknowledged.append(log.tick(3))
+
+        trips = [(Point(0, 1), Point(-2, 2)), (Point(4, 4), Point(0, 0))]
+        taxi_park.book_batch(trips, optimal=True)
+        acknowledged.append(log.batch(trips, True))
+
+        await asyncio.gather(*acknowledged)
+        writer.cancel()
+
+    @staticmethod
+    async def tick(log):
+        writer = asyncio.create_task(log.run())
+        await log.tick(1)
+        writer.cancel()
+
+    def test_replay(self, tmp_path):
+        path = str(tmp_path / 'fleet.wal')
+        base = wal.fresh_base(5)
+
+        for fleet_store in ('objects', 'arrays', 'sharded'):
+            taxi_park = self.new_park(fleet_store)
+            log = wal.WriteAheadLog(path, base)
+            self.run(self.operate(taxi_park, log))
+            log.close()
+
+            replayed = self.new_park(fleet_store)
+            assert wal.recover(path, replayed, base)[1] == 3
+            assert replayed.time.time == 3
+            assert [car.to_dict() for car in replayed.cars] == [car.to_dict() for car in taxi_park.cars]
+
+    def test_group_commit(self, tmp_path):
+        log = wal.WriteAheadLog(str(tmp_path / 'fleet.wal'), wal.fresh_base(5), commit_window=0.01)
+
+        async def book_many():
+            writer = asyncio.create_task(log.run())
+            await asyncio.gather(*[log.book(Point(i, 0), Point(0, i)) for i in range(100)])
+            writer.cancel()
+
+        self.run(book_many())
+
+        # all 100 records are made durable by a single fsync
+        assert log.commits == 1
+
+    def test_reset(self, tmp_path):
+        path = str(tmp_path / 'fleet.wal')
+        log = wal.WriteAheadLog(path, wal.fresh_base(5))
+
+        async def operate():
+            writer = asyncio.create_task(log.run())
+            await asyncio.gather(log.book(Point(1, 0), Point(5, 5)), log.reset())
+            writer.cancel()
+
+        self.run(operate())
+        log.close()
+
+        replayed = self.new_park()
+        assert wal.recover(path, replayed, wal.fresh_base(5)) == (len(wal.MAGIC) + 36 + 2 * wal.RECORD.size, 2)
+        assert replayed.busy_count == 0
+
+    def test_torn_tail(self, tmp_path):
+        path = tmp_path / 'fleet.wal'
+        base = wal.fresh_base(5)
+
+        taxi_park = self.new_park()
+        log = wal.WriteAheadLog(str(path), base)
+        self.run(self.operate(taxi_park, log))
+        log.close()
+
+        # the process crashed in the middle of writing a batch
+        complete = path.read_bytes()
+        path.write_bytes(complete + wal.RECORD.pack(wal.BATCH, 2, 0, 0, 0) + wal.RECORD.pack(wal.BOOK, 0, 0, 1, 1)[:20])
+
+        replayed = self.new_park()
+        (end, replayed_count) = wal.recover(str(path), replayed, base)
+        assert (end, replayed_count) == (len(complete), 3)
+
+        # appending goes on right after the last complete operation
+        log = wal.WriteAheadLog(str(path), base, end)
+        self.run(self.tick(log))
+        log.close()
+
+        again = self.new_park()
+        assert wal.recover(str(path), again, base)[1] == 4
+        assert again.time.time == 4
+
+    def test_other_base(self, tmp_path):
+        path = str(tmp_path / 'fleet.wal')
+
+        log = wal.WriteAheadLog(path, wal.fresh_base(5))
+        self.run(self.operate(self.new_park(), log))
+        log.close()
+
+        # the log of another fleet (or older than the snapshot) is not replayed
+        taxi_park = self.new_park()
+        assert wal.recover(path, taxi_park, wal.fresh_base(6)) == (None, 0)
+        assert taxi_park.time.time == 0
+
+        with open(path, 'wb') as f:
+            f.write(b'TAXISNAP')
+        with pytest.raises(ValueError, match='not a write-ahead log'):
+            wal.recover(path, taxi_park, wal.fresh_base(5))
+
+    def test_other_settings(self, tmp_path):
+        path = str(tmp_path / 'fleet.wal')
+
+        log = wal.WriteAheadLog(path, wal.fresh_base(5))
+        self.run(self.operate(self.new_park(), log))
+        log.close()
+
+        # the same operations would book other cars, so the log is neither replayed nor started over
+        for update in [{'future_dispatch': True}, {'distance_metric': 'chebyshev'}, {'spatial_index': 'grid'}]:
+            base = wal.fresh_base(5, config=settings.copy(update=update))
+            with pytest.raises(ValueError, match='other settings'):
+                wal.recover(path, self.new_park(), base)
+
+        assert wal.recover(path, self.new_park(), wal.fresh_base(5, config=settings.copy()))[1] == 3
+
+    def test_rotate(self, tmp_path):
+        (path, snapshot_path) = (str(tmp_path / 'fleet.wal'), str(tmp_path / 'fleet.snap'))
+        taxi_park = self.new_park()
+        log = wal.WriteAheadLog(path, wal.fresh_base(5), commit_window=10)
+
+        async def operate():
+            taxi_park.book_closest(Point(1, 0), Point(5, 5))
+            booked = log.book(Point(1, 0), Point(5, 5))
+
+            # the booking is durable as part of the snapshot, long before the commit window is over
+            snapshot.save(taxi_park, snapshot_path)
+            log.rotate(wal.snapshot_base(snapshot_path))
+            await booked
+
+        self.run(operate())
+        log.close()
+
+        (restored, _) = snapshot.restore(snapshot_path)
+        assert wal.recover(path, restored, wal.snapshot_base(snapshot_path)) == (len(wal.MAGIC) + 36, 0)
+        assert restored.busy_count == 1
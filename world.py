@@ -0,0 +1,133 @@
+'''
+    State of the world for `GET /api/world` on big fleets.
+
+    Cars are read chunk by chunk by their position in `taxi_park.cars`, already rendered
+    (with `taxi_park.states`). Cars are never removed from a taxi park, so positions are stable
+    and serve as pagination cursors. Every car is filtered and handed out right away, so memory
+    is bounded by the size of a page (or of a chunk, when the world is streamed as NDJSON)
+    however many cars there are. Cars untouched since a reset or a lazy populate (see `models.generation`)
+    are rendered as free at the origin without touching them, so reading a page costs the same right after a reset.
+
+    Cars can be rendered with their positions as well (where they are right now on the way of their trips,
+    see `models.journey`), which are computed only for the cars being rendered.
+'''
+import asyncio
+
+try:
+    from orjson import dumps
+except ImportError:  # orjson is optional, standard library is just slower
+    from json import dumps as dumps_str
+
+    def dumps(value):
+        return dumps_str(value, separators=(',', ':')).encode()
+
+
+# how many cars are read from the taxi park at once
+CHUNK_SIZE = 1000
+
+# the biggest page of cars which can be asked for
+MAX_PAGE_SIZE = 10000
+
+STATUSES = ('free', 'busy')
+
+
+def matches(state, current_time, status=None, bbox=None):
+    '''
+        Checks whether the car (rendered as `.to_dict()`) passes the filters
+        Params:
+        - state (dict): state of the car
+        - current_time (int): current time in the world
+        - status (str): "free" or "busy" (or None for any)
+        - bbox (tuple): (x_min, y_min, x_max, y_max) the car has to be inside of (inclusive),
+          any of the bounds can be None. Position of the car is checked if it's rendered, location otherwise
+    '''
+
+    if status is not None:
+        booked_until = state['booked_until']
+        free = booked_until is None or booked_until <= current_time
+        if free != (status == 'free'):
+            return False
+
+    if bbox is not None:
+        (x_min, y_min, x_max, y_max) = bbox
+        point = state.get('position', state['location'])
+        (x, y) = (point['x'], point['y'])
+        if (
+            (x_min is not None and x < x_min) or (x_max is not None and x > x_max)
+            or (y_min is not None and y < y_min) or (y_max is not None and y > y_max)
+        ):
+            return False
+
+    return True
+
+
+def size(taxi_park):
+    # number of cars, without looking at them
+    return taxi_park.free_count + taxi_park.busy_count
+
+
+def scan(taxi_park, current_time, cursor=0, status=None, bbox=None, positions=False):
+    '''
+        Reads the cars from position `cursor` on, chunk by chunk
+        Params:
+        - taxi_park (TaxiPark, ArrayTaxiPark, ShardedTaxiPark or RemoteTaxiPark): park to read the cars of
+        - current_time (int): current time in the world
+        - cursor (int): position of the first car to look at
+        - status, bbox: filters (see `matches`)
+        - positions (bool): whether to render cars with their positions (see `taxi_park.position`)
+
+        Yields:
+        - states (list): tuples (position after the car, state of the car) for the matching cars of every chunk
+    '''
+
+    (position, n) = (cursor, size(taxi_park))
+    while position < n:
+        chunk = taxi_park.states(position, position + CHUNK_SIZE, positions)
+        if not chunk:
+            return
+
+        states = []
+        for state in chunk:
+            position += 1
+            if matches(state, current_time, status, bbox):
+                states.append((position, state))
+
+        yield states
+
+
+def page(taxi_park, current_time, cursor=0, limit=None, status=None, bbox=None, positions=False):
+    '''
+        Returns a page of the cars passing the filters
+        Params:
+        - limit (int): the biggest number of cars to return (all of them if None)
+        - the rest are the same as for `scan`
+
+        Returns:
+        tuple(
+            - states (list): states of the cars
+            - next_cursor (int): position to continue from or None if there are no cars left
+        )
+    '''
+
+    states = []
+    for chunk in scan(taxi_park, current_time, cursor, status, bbox, positions):
+        for (position, state) in chunk:
+            states.append(state)
+            if len(states) == limit:
+                return (states, position if position < size(taxi_park) else None)
+
+    return (states, None)
+
+
+async def stream(taxi_park, current_time, cursor=0, status=None, bbox=None, positions=False):
+    '''
+        Yields the cars passing the filters as NDJSON (one car per line), a chunk at a time.
+        Control goes back to the event loop after every chunk, so requests running alongside
+        (e.g. bookings) are not stalled by a big fleet.
+    '''
+
+    for chunk in scan(taxi_park, current_time, cursor, status, bbox, positions):
+        if chunk:
+            yield b''.join(dumps(state) + b'\n' for (_, state) in chunk)
+
+        await asyncio.sleep(0)